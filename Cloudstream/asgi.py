@@ -11,6 +11,10 @@ import os
 
 from django.core.asgi import get_asgi_application
 
+from UserLogin import warmup
+
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Cloudstream.settings')
 
+# A server process: DashboardConfig.ready() starts the warm-up (UserLogin/warmup.py)
+warmup.mark_server()
 application = get_asgi_application()
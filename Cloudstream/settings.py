@@ -34,8 +34,191 @@ AWS_SECRET_ACCESS_KEY = os.getenv("aws_secret_access_key")
 AWS_SESSION_TOKEN = os.getenv("aws_session_token")
 AWS_REGION = 'us-east-1' # Check your actual region
 DYNAMO_TABLE = 'CloudStreamData'
+DYNAMO_VIDEO_ID_INDEX = 'video_id-index'  # GSI: video_id -> video item (manage.py ensure_indexes)
+DYNAMO_FEED_INDEX = 'status-created_at-index'  # GSI: status + created_at -> newest-first feed
+DYNAMO_CREATOR_FEED_INDEX = 'creator_feed-created_at-index'  # GSI: a creator's READY videos, newest first
+FEED_PAGE_SIZE = 24
 AWS_RAW_BUCKET = 'vinayrawvidscloudstream'      # The bucket you upload to
 AWS_PROCESSED_BUCKET = 'vinayfinalvidscloudstream' # The bucket you watch from
+AWS_PROCESSED_BUCKET_PUBLIC = True # False once the bucket is private: pages then hand out presigned GET URLs
+MULTIPART_PART_SIZE = 16 * 1024 * 1024  # Browser uploads videos in parts of this size (grown automatically past 10,000 parts)
+# NOTE: the raw bucket's CORS rule must list ETag under ExposeHeaders so the uploader can read part ETags,
+# and it should have an AbortIncompleteMultipartUpload lifecycle rule for abandoned uploads (see s3_utils.py)
+
+# Presigned URL memoization (UserLogin/presign.py)
+# URLs signed within one window share an expiry of window end + MIN_REMAINING_SECONDS
+PRESIGN = {
+    'WINDOW_SECONDS': 3600,
+    'MIN_REMAINING_SECONDS': 900,  # Keep above HLS['MANIFEST_MAX_AGE'] and any page cache lifetime
+    'MAX_ENTRIES': 50000,
+}
+
+# Transcoding worker (manage.py transcode_worker, UserLogin/transcoding.py)
+TRANSCODE = {
+    'BACKEND': 'ffmpeg',         # 'ffmpeg', 'stub' (copies the upload; tests/local runs) or a dotted path
+    'FFMPEG_BINARY': 'ffmpeg',
+    'FFPROBE_BINARY': 'ffprobe',
+    'WORKERS': None,             # Processes per box; None = one per CPU core
+    'LEASE_SECONDS': 300,        # A job whose worker stops heartbeating is re-claimed after this
+    'HEARTBEAT_SECONDS': 60,
+    'MAX_ATTEMPTS': 3,           # Then the video is marked FAILED
+    'POLL_SECONDS': 5,           # Idle wait between looks for new jobs
+    'OUTPUT_PREFIX': 'processed/',  # Outputs go to <prefix><video_id>/ in AWS_PROCESSED_BUCKET
+}
+
+# HLS adaptive-bitrate playback (UserLogin/hls.py)
+# The processed bucket's CORS rule must allow GET from the site's origin: hls.js fetches segments with XHR
+HLS = {
+    'ENABLED': True,             # Package HLS renditions next to the MP4 when transcoding
+    'SEGMENT_SECONDS': 6,
+    'MANIFEST_MAX_AGE': 300,     # Cache-Control max-age of the master playlist view
+}
+
+# Responsive thumbnails (UserLogin/thumbnails.py), cut by the transcoding worker
+THUMBNAILS = {
+    'ENABLED': True,
+    'WIDTHS': [160, 320, 480, 640, 960, 1280],  # 168px sidebar cards up to full-width cards on high-DPI phones
+}
+
+# Sharded like/dislike/subscriber counters for hot items (see db_utils, "Sharded counters")
+# Shard counts are set per item: manage.py shard_counters --video <id> --shards 8
+COUNTERS = {
+    'AGGREGATE_MAX_AGE': 0,      # Read sharded counts from the refresh_counters aggregate while it is
+                                 # at most this old (seconds); 0 always sums the shards
+    'REFRESH_SECONDS': 10,       # How often refresh_counters recomputes the aggregates
+}
+
+# Write-behind likes/subscriptions (UserLogin/write_behind.py): clicks are queued in a local
+# SQLite file and answered with optimistic counts; `manage.py flush_engagement` writes them out
+WRITE_BEHIND = {
+    'ENABLED': False,
+    'PATH': BASE_DIR / 'engagement_queue.sqlite3',  # One per box, with one flusher each
+    'BATCH_SIZE': 500,           # Events per flush
+    'FLUSH_SECONDS': 1.0,        # flush_engagement's poll interval while the queue is empty
+}
+
+# View counting (UserLogin/view_counts.py): buffered per process, flushed in batches
+VIEW_COUNTS = {
+    'ENABLED': True,
+    'FLUSH_SECONDS': 10,         # Window length; 0 disables the background flusher
+    'MAX_PENDING_VIDEOS': 1000,  # Flush early once this many videos are waiting
+    'HLL_PRECISION': 12,         # Unique-viewer sketch: 2**12 bytes per video, ~1.6% error
+}
+
+# Search (UserLogin/search_index.py): an in-memory index per process
+SEARCH = {
+    'PAGE_SIZE': 20,
+    'LOAD_SEGMENTS': 8,          # Parallel Scan segments for a full build
+    'REFRESH_SECONDS': 60,       # Catch up with videos other processes made READY
+    'CATCHUP_SECONDS': 6 * 3600, # How far back a catch-up looks (longest expected transcode)
+    'SNAPSHOT_PATH': BASE_DIR / 'search_index.json',  # None: always build from DynamoDB
+}
+
+# Related videos (UserLogin/related.py), precomputed by `manage.py build_related`
+RELATED = {
+    'TOP_K': 10,                 # Videos per "Up next" list
+    'WEIGHTS': {                 # score = sum of weight * cosine similarity
+        'likes': 1.0,            # Liked by the same users
+        'subscriptions': 0.5,    # Creators with overlapping audiences (or the same creator)
+        'title': 0.3,            # Shared title words
+    },
+    'MAX_ROW_ITEMS': 500,        # Users/words on more videos than this are skipped: pairs grow with the square
+    'RELATED_CREATORS': 5,       # Closest creators by audience, per creator
+    'CREATOR_VIDEOS': 20,        # Newest videos per creator taken into another creator's lists
+    'SCAN_SEGMENTS': 8,
+    'REFRESH_SECONDS': 3600,     # build_related's interval when it runs as a loop
+}
+
+# Subscriptions feed (UserLogin/subscription_feed.py); pages are FEED_PAGE_SIZE
+SUBSCRIPTION_FEED = {
+    'CONCURRENCY': 16,           # Per-creator Queries in flight at once, per process
+    'MIN_CHUNK': 3,              # Fewest videos asked of a creator per Query
+    'INBOX_THRESHOLD': 100,      # Following this many creators switches a user to inbox (fan-out on write)
+    'INBOX_BACKFILL': 20,        # Newest videos per creator copied into an inbox when they're added
+}
+
+# Conditional GET + fragment caching for pages (UserLogin/page_cache.py)
+PAGE_CACHE = {
+    'ENABLED': True,
+    'WINDOW_SECONDS': 60,        # Fragment lifetime, and how stale view counts on cached pages may get
+    'FRAGMENT_CACHE': 'default', # CACHES alias for shared fragments (use a shared one, e.g. Redis, with several workers)
+}
+
+# Password hashing off the request thread (UserLogin/passwords.py)
+PASSWORD_HASHING = {
+    'WORKERS': None,             # Hashing processes; None = one per CPU core, 0 = hash on the calling thread
+    'MAX_PENDING': 32,           # Hashes queued or running at once (admission control)
+    'QUEUE_WAIT_SECONDS': 0.5,   # A login waiting longer than this for a slot gets a 503
+    'TIMEOUT_SECONDS': 10,
+    'PBKDF2_ITERATIONS': None,   # Cost of new hashes; None = Django's default. Older hashes are upgraded at login
+}
+
+# Request and AWS call metrics (UserLogin/metrics.py), scraped from /metrics
+METRICS = {
+    'ENABLED': True,
+    'CONSUMED_CAPACITY': True,   # Ask DynamoDB for ReturnConsumedCapacity=TOTAL on every call
+    'SLOW_REQUEST_MS': None,     # Log slower requests with their AWS calls (logger 'cloudstream.metrics'), e.g. 500
+    'TOKEN': os.getenv("metrics_token") or None, # If set, /metrics wants "Authorization: Bearer <token>"
+}
+
+# Boot-time warm-up and the readiness probe (UserLogin/warmup.py)
+WARMUP = {
+    'ENABLED': os.getenv("warmup", "1") == "1", # Warm up in the background when a server process starts
+    'READY_PATH': '/ready',      # 503 until warm, then 200: the load balancer's readiness check
+    'CONNECTIONS': 8,            # DynamoDB connections (and async view threads) opened ahead of traffic
+    'TEMPLATES': ['home.html', 'watch.html', 'dashboard.html', 'subscriptions.html', 'search.html', 'login.html'],
+    'PASSWORD_POOL': True,       # Start the password hashing processes
+    'SEARCH_INDEX': False,       # Load the search index as well (a snapshot load, or a full Scan without one)
+    'RETRY_SECONDS': 5,          # How often failed steps (AWS unreachable, ...) are retried
+}
+
+# Catalogue imports (UserLogin/bulk_import.py, manage.py import_videos)
+BULK_IMPORT = {
+    'WORKERS': 16,               # Rows (their media copies) in flight at once
+    'COPY_THREADS': 32,          # UploadPartCopy calls in flight, shared by all rows
+    'WRITE_THREADS': 4,          # BatchWriteItem calls in flight
+    'MULTIPART_COPY_THRESHOLD': 256 * 1024 * 1024, # Bigger objects are copied in parallel parts
+    'COPY_PART_SIZE': 64 * 1024 * 1024,
+    'CHECKPOINT_SECONDS': 5,
+    'TRANSCODE_PRIORITY': -1,    # Imported PROCESSING videos queue behind fresh uploads (priority 0)
+}
+
+# Shared boto3 clients (UserLogin/aws_clients.py)
+# Point these at DynamoDB Local / LocalStack for local runs and benchmarks
+AWS_DYNAMODB_ENDPOINT_URL = os.getenv("aws_dynamodb_endpoint_url") or os.getenv("aws_endpoint_url")
+AWS_S3_ENDPOINT_URL = os.getenv("aws_s3_endpoint_url") or os.getenv("aws_endpoint_url")
+AWS_MAX_POOL_CONNECTIONS = 50     # Shared low-level clients; keep >= number of request threads
+AWS_RESOURCE_POOL_CONNECTIONS = 2 # Per-thread resources/Tables (one request in flight per thread)
+AWS_TCP_KEEPALIVE = True
+AWS_CONNECT_TIMEOUT = 3
+AWS_READ_TIMEOUT = 10
+AWS_MAX_ATTEMPTS = 5
+AWS_RETRY_MODE = 'standard'       # 'standard' or 'adaptive' (client-side rate limiting)
+AWS_CREDENTIALS_CHECK_INTERVAL = 30  # Seconds between checks of cred.env for rotated keys
+ASYNC_DB_THREADS = 32  # Threads async views use for blocking boto3 calls (UserLogin/async_db_utils.py)
+
+# Read-through cache for hot DynamoDB lookups (UserLogin/db_cache.py)
+# 'lru' is per process; use 'django' (any CACHES alias, e.g. Redis) when running several workers
+DB_CACHE = {
+    'BACKEND': 'lru',
+    'ALIAS': 'default',          # Only used by the 'django' backend
+    'MAX_ENTRIES': 10000,        # Only used by the 'lru' backend
+    'NEGATIVE_TIMEOUT': 30,      # Cap for caching "not found" results
+    'TIMEOUTS': {                # Seconds per kind of lookup; 0 disables caching for it
+        'profile': 60,           # Subscriber counts
+        'sub': 300,              # "Is X subscribed to Y"
+        'reaction': 300,         # A user's LIKE/DISLIKE on a video
+        'video': 30,             # Video item by id (watch page)
+        'stats': 10,             # Like/dislike counters
+        'manifest': 3600,        # HLS master playlists (never change once written)
+        'shards': 300,           # Shard count of an item's counters
+        'related': 300,          # A video's "Up next" list (rebuilt by build_related)
+        'subscriptions': 60,     # Creators a user subscribes to (Subscriptions feed)
+        'feed_mode': 300,        # Whether a user's Subscriptions feed is in inbox mode
+        'version': 5,            # Page version counters (UserLogin/page_cache.py)
+        'feed_page': 60,         # A page of the home feed, per feed version
+    },
+}
 
 # settings.py
 
@@ -52,6 +235,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'UserLogin.warmup.ReadinessMiddleware', # First: the probe skips everything else
+    'UserLogin.metrics.MetricsMiddleware', # Times everything below it
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -111,6 +296,17 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# The first one hashes new passwords (and upgrades old hashes at login); the
+# rest can still verify. Ours reads its cost from PASSWORD_HASHING, and must
+# be the only pbkdf2_sha256 entry
+PASSWORD_HASHERS = [
+    'UserLogin.hashers.PBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/4.2/topics/i18n/
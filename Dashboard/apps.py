@@ -1,6 +1,13 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class DashboardConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'Dashboard'
+
+    def ready(self):
+        # Nothing heavy here: the warm-up imports the views and builds the AWS clients on its own thread
+        from UserLogin import warmup
+        if settings.WARMUP['ENABLED'] and warmup.serving():
+            warmup.start()
@@ -0,0 +1,194 @@
+"""
+A synthetic, reproducible data set for `manage.py benchmark`: users (the first
+`creators` of them upload), READY videos, likes/dislikes and subscriptions.
+The counters on the video and profile items match the REACTION#/SUB# items,
+as db_utils would have left them.
+
+Everything is a function of the parameters and the seed, so a run finds its
+users and videos again without reading the table, and a data set that is
+already there isn't written twice (its parameters are kept on a DATASET item).
+"""
+import hashlib
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from django.conf import settings
+
+from UserLogin import db_cache, db_utils, page_cache
+
+MANIFEST_KEY = {'PK': 'BENCH', 'SK': 'DATASET'}
+CHUNK = 5000           # Items per write task
+LIKE_SHARE = 0.9       # The rest of the reactions are dislikes
+EPOCH = 1_700_000_000  # created_at of video 0; video i is i minutes newer
+WORDS = (
+    'cloud', 'stream', 'music', 'live', 'gaming', 'tutorial', 'python', 'django', 'travel', 'vlog',
+    'review', 'unboxing', 'cooking', 'recipe', 'guitar', 'piano', 'lecture', 'physics', 'news', 'podcast',
+    'highlights', 'trailer', 'speedrun', 'workout', 'yoga', 'interview', 'documentary', 'drone', 'city', 'night',
+)
+
+
+class Dataset:
+    def __init__(self, users=1000, videos=1000, reactions=10000, subscriptions=5000, creators=None, seed=0):
+        if users < 1 or videos < 0 or reactions < 0 or subscriptions < 0:
+            raise ValueError("Data set sizes must be positive")
+        self.users = users
+        self.creators = creators or max(1, users // 20)
+        if not 1 <= self.creators <= users:
+            raise ValueError("creators must be between 1 and users")
+        self.videos = videos
+        self.reactions = min(reactions, users * videos)
+        self.subscriptions = min(subscriptions, (users - 1) * self.creators)
+        self.seed = seed
+
+    def params(self):
+        return {
+            'users': self.users, 'creators': self.creators, 'videos': self.videos,
+            'reactions': self.reactions, 'subscriptions': self.subscriptions, 'seed': self.seed,
+        }
+
+    # --- Who and what ---
+
+    def user_email(self, user):
+        return f"user{user}@bench.local"
+
+    def channel_name(self, user):
+        return f"Bench channel {user}"
+
+    def video_creator(self, video):
+        return video % self.creators
+
+    def video_id(self, video):
+        digest = hashlib.blake2b(f"{self.seed}:video:{video}".encode('utf-8'), digest_size=16).digest()
+        return str(uuid.UUID(bytes=digest, version=4))
+
+    def video_key(self, video):
+        return {'PK': f"USER#{self.user_email(self.video_creator(video))}", 'SK': f"VIDEO#{self.video_id(video)}"}
+
+    # --- The generated relations (numpy arrays, deterministic per seed) ---
+
+    def _pairs(self, purpose, population, size):
+        rng = np.random.default_rng([self.seed, purpose])
+        return rng.choice(population, size=size, replace=False) if size else np.zeros(0, dtype=np.int64)
+
+    def reaction_pairs(self):
+        """(user, video, is_like) arrays."""
+        keys = self._pairs(1, self.users * self.videos, self.reactions)
+        is_like = np.random.default_rng([self.seed, 2]).random(len(keys)) < LIKE_SHARE
+        return keys // max(self.videos, 1), keys % max(self.videos, 1), is_like
+
+    def subscription_pairs(self):
+        """(subscriber, creator) arrays; nobody subscribes to themselves."""
+        keys = self._pairs(3, self.users * self.creators, self.subscriptions)
+        subscriber, creator = keys // self.creators, keys % self.creators
+        own = subscriber == creator
+        return subscriber[~own], creator[~own]
+
+    # --- Items ---
+
+    def _profiles(self, start, stop, subscribers):
+        for user in range(start, stop):
+            email = self.user_email(user)
+            yield {
+                'PK': f"USER#{email}", 'SK': 'PROFILE',
+                'channel_name': self.channel_name(user),
+                'password': '!', # Nobody logs in with a password: sessions are made directly
+                'joined_at': EPOCH,
+                'subscribers': int(subscribers[user]) if user < self.creators else 0,
+            }
+
+    def _videos(self, start, stop, likes, dislikes):
+        rng = np.random.default_rng([self.seed, 4, start])
+        words = rng.integers(0, len(WORDS), size=(stop - start, 4))
+        views = rng.integers(0, 1000, size=stop - start)
+        for n, video in enumerate(range(start, stop)):
+            creator = self.video_creator(video)
+            email = self.user_email(creator)
+            video_id = self.video_id(video)
+            yield {
+                'PK': f"USER#{email}", 'SK': f"VIDEO#{video_id}",
+                'title': ' '.join(WORDS[w] for w in words[n]).capitalize(),
+                'description': '',
+                'raw_s3_key': f"bench/{video_id}.mp4",
+                'channel_name': self.channel_name(creator),
+                'thumbnail_key': f"thumbnails/{video_id}.jpg",
+                'status': 'READY',
+                'video_id': video_id,
+                'created_at': EPOCH + 60 * video,
+                'creator_feed': f"USER#{email}",
+                'processed_bucket': settings.AWS_PROCESSED_BUCKET,
+                'processed_s3_key': f"processed/{video_id}/video.mp4",
+                'likes': int(likes[video]),
+                'dislikes': int(dislikes[video]),
+                'views': int(likes[video]) * 20 + int(views[n]),
+            }
+
+    def _reactions(self, users, videos, is_like):
+        for user, video, like in zip(users.tolist(), videos.tolist(), is_like.tolist()):
+            yield {
+                'PK': f"USER#{self.user_email(user)}", 'SK': f"REACTION#{self.video_id(video)}",
+                'type': 'LIKE' if like else 'DISLIKE',
+            }
+
+    def _subscriptions(self, subscribers, creators):
+        for subscriber, creator in zip(subscribers.tolist(), creators.tolist()):
+            yield {'PK': f"USER#{self.user_email(subscriber)}", 'SK': f"SUB#{self.user_email(creator)}"}
+
+    def _tasks(self):
+        # (kind, item generator factory) per CHUNK items
+        users, videos, is_like = self.reaction_pairs()
+        likes = np.bincount(videos[is_like], minlength=self.videos)
+        dislikes = np.bincount(videos[~is_like], minlength=self.videos)
+        subscribers, creators = self.subscription_pairs()
+        subscriber_counts = np.bincount(creators, minlength=self.creators)
+
+        for start in range(0, self.users, CHUNK):
+            stop = min(start + CHUNK, self.users)
+            yield 'users', lambda start=start, stop=stop: self._profiles(start, stop, subscriber_counts)
+        for start in range(0, self.videos, CHUNK):
+            stop = min(start + CHUNK, self.videos)
+            yield 'videos', lambda start=start, stop=stop: self._videos(start, stop, likes, dislikes)
+        for start in range(0, len(users), CHUNK):
+            chunk = slice(start, start + CHUNK)
+            yield 'reactions', lambda chunk=chunk: self._reactions(users[chunk], videos[chunk], is_like[chunk])
+        for start in range(0, len(subscribers), CHUNK):
+            chunk = slice(start, start + CHUNK)
+            yield 'subscriptions', lambda chunk=chunk: self._subscriptions(subscribers[chunk], creators[chunk])
+
+    # --- Writing it ---
+
+    def stored_params(self):
+        """The parameters of the data set already in the table, or None."""
+        item = db_utils.get_table().get_item(Key=MANIFEST_KEY).get('Item')
+        return {k: int(v) for k, v in item['params'].items()} if item else None
+
+    def write(self, workers=8, progress=None):
+        """
+        Write every item with BatchWriteItem, `workers` chunks at a time.
+        Returns {kind: items written, 'seconds': ...}.
+        """
+        started = time.perf_counter()
+        counts = {'users': 0, 'videos': 0, 'reactions': 0, 'subscriptions': 0}
+
+        def write_chunk(task):
+            kind, items = task
+            written = 0
+            with db_utils.get_table().batch_writer() as batch:
+                for item in items():
+                    batch.put_item(Item=item)
+                    written += 1
+            return kind, written
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='seed') as executor:
+            for kind, written in executor.map(write_chunk, self._tasks()):
+                counts[kind] += written
+                if progress:
+                    progress(kind, counts[kind])
+
+        db_utils.get_table().put_item(Item=dict(MANIFEST_KEY, params=self.params(), written_at=int(time.time())))
+        # Whatever this process cached about the table is stale now
+        db_cache.get_backend().clear()
+        page_cache.bump(page_cache.FEED)
+        counts['seconds'] = time.perf_counter() - started
+        return counts
@@ -0,0 +1,199 @@
+"""
+Helpers shared by the benchmark commands for talking to a local AWS stand-in
+(DynamoDB Local, LocalStack, moto_server, ...).
+
+Never point these at the real account: they create tables and buckets.
+"""
+import io
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.core.management import call_command
+
+from UserLogin import aws_clients
+
+
+def use_endpoint(endpoint_url):
+    """Route every pooled client at `endpoint_url` (both DynamoDB and S3)."""
+    if endpoint_url:
+        settings.AWS_DYNAMODB_ENDPOINT_URL = endpoint_url
+        settings.AWS_S3_ENDPOINT_URL = endpoint_url
+    if not settings.AWS_DYNAMODB_ENDPOINT_URL:
+        raise SystemExit(
+            "Refusing to benchmark against real AWS: pass --endpoint-url "
+            "or set aws_endpoint_url in cred.env"
+        )
+    # Dummy credentials are fine for every stand-in
+    settings.AWS_ACCESS_KEY_ID = settings.AWS_ACCESS_KEY_ID or 'local'
+    settings.AWS_SECRET_ACCESS_KEY = settings.AWS_SECRET_ACCESS_KEY or 'local'
+    aws_clients.reset_clients()
+
+
+def ensure_table():
+    """Create the app table on the stand-in, plus every GSI in db_utils.TABLE_INDEXES."""
+    client = aws_clients.get_client('dynamodb')
+    existing = client.list_tables().get('TableNames', [])
+    if settings.DYNAMO_TABLE not in existing:
+        _create_table(client)
+    call_command('ensure_indexes', skip_backfill=True, stdout=io.StringIO())
+
+
+def drop_table():
+    client = aws_clients.get_client('dynamodb')
+    if settings.DYNAMO_TABLE in client.list_tables().get('TableNames', []):
+        client.delete_table(TableName=settings.DYNAMO_TABLE)
+        client.get_waiter('table_not_exists').wait(TableName=settings.DYNAMO_TABLE)
+
+
+def _create_table(client):
+    client.create_table(
+        TableName=settings.DYNAMO_TABLE,
+        KeySchema=[
+            {'AttributeName': 'PK', 'KeyType': 'HASH'},
+            {'AttributeName': 'SK', 'KeyType': 'RANGE'},
+        ],
+        AttributeDefinitions=[
+            {'AttributeName': 'PK', 'AttributeType': 'S'},
+            {'AttributeName': 'SK', 'AttributeType': 'S'},
+        ],
+        BillingMode='PAY_PER_REQUEST',
+    )
+    client.get_waiter('table_exists').wait(TableName=settings.DYNAMO_TABLE)
+
+
+def ensure_buckets():
+    s3 = aws_clients.get_client('s3')
+    existing = {b['Name'] for b in s3.list_buckets().get('Buckets', [])}
+    for bucket in (settings.AWS_RAW_BUCKET, settings.AWS_PROCESSED_BUCKET):
+        if bucket not in existing:
+            s3.create_bucket(Bucket=bucket)
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def seed_watch_fixture(creator='creator@bench.local', viewer='viewer@bench.local'):
+    """One READY video with a creator profile and a viewer who liked it and subscribed."""
+    from UserLogin import db_utils
+
+    table = db_utils.get_table()
+    table.put_item(Item={
+        'PK': f"USER#{creator}", 'SK': 'PROFILE',
+        'channel_name': 'Bench Channel', 'password': '!', 'subscribers': 1,
+    })
+    video_id = db_utils.create_video_entry(creator, 'Bench video', 'bench.mp4', 'thumbnails/bench.jpg', 'Bench Channel')
+    table.update_item(
+        Key={'PK': f"USER#{creator}", 'SK': f"VIDEO#{video_id}"},
+        UpdateExpression="SET #s = :ready, processed_bucket = :bucket, processed_s3_key = :key, likes = :one",
+        ExpressionAttributeNames={'#s': 'status'},
+        ExpressionAttributeValues={
+            ':ready': 'READY', ':bucket': settings.AWS_PROCESSED_BUCKET,
+            ':key': 'processed/bench.mp4', ':one': 1,
+        },
+    )
+    table.put_item(Item={'PK': f"USER#{viewer}", 'SK': f"SUB#{creator}"})
+    table.put_item(Item={'PK': f"USER#{viewer}", 'SK': f"REACTION#{video_id}", 'type': 'LIKE'})
+    return video_id, viewer
+
+
+def allow_test_client():
+    """Let django.test's clients (Host: testserver) through ALLOWED_HOSTS."""
+    if 'testserver' not in settings.ALLOWED_HOSTS:
+        settings.ALLOWED_HOSTS = [*settings.ALLOWED_HOSTS, 'testserver']
+
+
+def disable_db_cache():
+    """Benchmarks measure DynamoDB round-trips, not cache hits."""
+    settings.DB_CACHE = dict(settings.DB_CACHE, TIMEOUTS={})
+
+
+def add_network_latency(ms):
+    """
+    Local stand-ins answer in well under a millisecond of network time, which
+    hides exactly what async/batching is meant to save. Delay every HTTP send by
+    `ms` to model the real round-trip to the AWS region.
+    """
+    if not ms:
+        return
+    import time
+    from botocore.httpsession import URLLib3Session
+
+    original_send = URLLib3Session.send
+
+    def send(self, request):
+        time.sleep(ms / 1000.0)
+        return original_send(self, request)
+
+    URLLib3Session.send = send
+
+
+CAPACITY_OPERATIONS = {
+    'GetItem', 'BatchGetItem', 'Query', 'Scan', 'TransactGetItems',
+    'PutItem', 'UpdateItem', 'DeleteItem', 'BatchWriteItem', 'TransactWriteItems',
+}
+READ_OPERATIONS = {'GetItem', 'BatchGetItem', 'Query', 'Scan', 'TransactGetItems'}
+
+
+class AwsMeter:
+    """
+    Counts every AWS call made in this process ('dynamodb.Query', 's3.HeadObject',
+    ...) and the DynamoDB capacity units they consumed (each call asks for
+    ReturnConsumedCapacity=TOTAL). Use as a context manager; snapshot() gives
+    the running totals, so a stretch of work is the difference of two.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = Counter()
+        self.units = Counter() # 'read' / 'write'
+        self._original = None
+
+    def __enter__(self):
+        from botocore.client import BaseClient
+
+        meter = self
+        original = self._original = BaseClient._make_api_call
+
+        def _make_api_call(client, operation_name, api_params):
+            service = client.meta.service_model.service_name
+            if service == 'dynamodb' and operation_name in CAPACITY_OPERATIONS:
+                api_params = dict(api_params)
+                api_params.setdefault('ReturnConsumedCapacity', 'TOTAL')
+            response = original(client, operation_name, api_params)
+            meter._record(service, operation_name, response)
+            return response
+
+        BaseClient._make_api_call = _make_api_call
+        return self
+
+    def __exit__(self, *exc_info):
+        from botocore.client import BaseClient
+        BaseClient._make_api_call = self._original
+
+    def _record(self, service, operation_name, response):
+        consumed = response.get('ConsumedCapacity') or []
+        if isinstance(consumed, dict):
+            consumed = [consumed]
+        read = write = 0.0
+        for entry in consumed:
+            if 'ReadCapacityUnits' in entry or 'WriteCapacityUnits' in entry:
+                read += entry.get('ReadCapacityUnits', 0)
+                write += entry.get('WriteCapacityUnits', 0)
+            elif operation_name in READ_OPERATIONS:
+                read += entry.get('CapacityUnits', 0)
+            else:
+                write += entry.get('CapacityUnits', 0)
+        with self._lock:
+            self.calls[f"{service}.{operation_name}"] += 1
+            self.units['read'] += read
+            self.units['write'] += write
+
+    def snapshot(self):
+        with self._lock:
+            return Counter(self.calls), Counter(self.units)
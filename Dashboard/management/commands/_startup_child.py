@@ -0,0 +1,68 @@
+"""
+One fresh worker process for `manage.py bench_startup`: boots Django the way
+Cloudstream/asgi.py does, warms up or not, then times its first requests and
+prints the results as one JSON line.
+
+Run as a module (python -m ...), not through manage.py: the command modules
+import boto3, and nothing but the standard library may be loaded before the
+boot is timed.
+"""
+import json
+import os
+import sys
+import time
+
+
+def _slow_connects(ms):
+    # Every new TCP connection (not request) waits `ms`: the TCP + TLS
+    # handshakes to the region that a local stand-in doesn't have
+    def hook(event, args):
+        if event == 'socket.connect':
+            time.sleep(ms / 1000.0)
+    sys.addaudithook(hook)
+
+
+def main(mode, path, session_cookie, connect_ms, steps):
+    if connect_ms:
+        _slow_connects(connect_ms)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Cloudstream.settings')
+    os.environ['warmup'] = '0' # Started below (or not), not by DashboardConfig.ready()
+
+    from django.core.asgi import get_asgi_application
+    get_asgi_application()
+    result = {'booted_at': time.time(), 'loaded_at_boot': sorted(m for m in ('boto3', 'botocore', 'numpy') if m in sys.modules)}
+
+    from django.conf import settings
+    from django.test import Client
+    settings.ALLOWED_HOSTS = [*settings.ALLOWED_HOSTS, 'testserver']
+    # Both requests make the same AWS calls: the second one is the steady state
+    settings.DB_CACHE = dict(settings.DB_CACHE, TIMEOUTS={})
+
+    if mode == 'imports':
+        from django.urls import get_resolver
+        started = time.perf_counter()
+        get_resolver().url_patterns
+        result['urlconf_ms'] = (time.perf_counter() - started) * 1000
+        print(json.dumps(result))
+        return
+
+    result['ready_at'] = result['booted_at']
+    if mode == 'warm':
+        from UserLogin import warmup
+        warmup.start(steps or None).join()
+        result['ready_at'] = time.time()
+        result['steps'] = {name: step.get('seconds') for name, step in warmup.status()['steps'].items()}
+
+    client = Client()
+    client.cookies[settings.SESSION_COOKIE_NAME] = session_cookie
+    for n in ('first', 'second'):
+        started = time.perf_counter()
+        response = client.get(path)
+        result[f'{n}_ms'] = (time.perf_counter() - started) * 1000
+        result['status'] = response.status_code
+    print(json.dumps(result))
+
+
+if __name__ == '__main__':
+    mode, path, session_cookie, connect_ms, steps = sys.argv[1:6]
+    main(mode, path, session_cookie, float(connect_ms), [s for s in steps.split(',') if s])
@@ -0,0 +1,83 @@
+import asyncio
+import time
+
+from django.conf import settings
+from django.contrib.sessions.backends.signed_cookies import SessionStore
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient
+from django.urls import reverse
+
+from ._standin import (
+    add_network_latency, allow_test_client, disable_db_cache, ensure_buckets, ensure_table, percentile, seed_watch_fixture, use_endpoint,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Load test: how many in-flight watch_video/home requests one ASGI worker "
+        "(one event loop thread) sustains against a local AWS stand-in."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--endpoint-url', help="Local DynamoDB/S3 stand-in, e.g. http://localhost:8000")
+        parser.add_argument('--requests', type=int, default=400, help="Requests per concurrency level")
+        parser.add_argument('--concurrency', default='1,8,32,64', help="Comma-separated in-flight request levels")
+        parser.add_argument('--path', default='watch', choices=['watch', 'home', 'dashboard'])
+        parser.add_argument('--latency-ms', type=float, default=5.0, help="Simulated network RTT per AWS call")
+        parser.add_argument('--with-cache', action='store_true', help="Keep the db_cache on (default: every lookup hits DynamoDB)")
+
+    def handle(self, *args, **options):
+        use_endpoint(options['endpoint_url'])
+        ensure_table()
+        ensure_buckets()
+        allow_test_client()
+        add_network_latency(options['latency_ms'])
+        if not options['with_cache']:
+            disable_db_cache()
+
+        video_id, viewer = seed_watch_fixture()
+        url = {
+            'watch': reverse('watch_video', args=[video_id]),
+            'home': reverse('home'),
+            'dashboard': reverse('dashboard'),
+        }[options['path']]
+
+        session = SessionStore()
+        session['user_email'] = viewer
+        session['channel_name'] = 'Viewer'
+        session.save()
+
+        levels = [int(level) for level in options['concurrency'].split(',')]
+        asyncio.run(self.run_levels(url, session.session_key, levels, options['requests']))
+
+    async def run_levels(self, url, session_cookie, levels, total):
+        client = AsyncClient()
+        client.cookies[settings.SESSION_COOKIE_NAME] = session_cookie
+
+        # Warm-up: clients, connection pool, template loading
+        response = await client.get(url)
+        if response.status_code != 200:
+            raise SystemExit(f"GET {url} returned {response.status_code}")
+
+        baseline = None
+        for concurrency in levels:
+            semaphore = asyncio.Semaphore(concurrency)
+            latencies = []
+
+            async def one():
+                async with semaphore:
+                    start = time.perf_counter()
+                    await client.get(url)
+                    latencies.append((time.perf_counter() - start) * 1000)
+
+            start = time.perf_counter()
+            await asyncio.gather(*(one() for _ in range(total)))
+            elapsed = time.perf_counter() - start
+
+            throughput = total / elapsed
+            baseline = baseline or throughput
+            self.stdout.write(
+                f"in-flight {concurrency:>4}: {throughput:8.1f} req/s "
+                f"({throughput / baseline:4.1f}x)  "
+                f"p50 {percentile(latencies, 50):7.1f} ms  p99 {percentile(latencies, 99):7.1f} ms"
+            )
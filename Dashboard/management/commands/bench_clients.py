@@ -0,0 +1,87 @@
+import time
+
+import boto3
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from UserLogin import aws_clients
+from UserLogin.db_utils import get_table
+from UserLogin.s3_utils import generate_presigned_url
+
+from ._standin import ensure_buckets, ensure_table, percentile, use_endpoint
+
+
+def legacy_table():
+    # What every db_utils helper used to do before the shared registry
+    dynamodb = boto3.resource(
+        'dynamodb',
+        aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
+        aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
+        aws_session_token=settings.AWS_SESSION_TOKEN,
+        region_name=settings.AWS_REGION,
+        endpoint_url=settings.AWS_DYNAMODB_ENDPOINT_URL,
+    )
+    return dynamodb.Table(settings.DYNAMO_TABLE)
+
+
+def legacy_presign(key, file_type, bucket):
+    s3 = boto3.client(
+        's3',
+        aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
+        aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
+        aws_session_token=settings.AWS_SESSION_TOKEN,
+        region_name=settings.AWS_REGION,
+        endpoint_url=settings.AWS_S3_ENDPOINT_URL,
+    )
+    return s3.generate_presigned_url(
+        'put_object',
+        Params={'Bucket': bucket, 'Key': key, 'ContentType': file_type},
+        ExpiresIn=3600,
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        "Micro-benchmark: per-request AWS overhead with a fresh boto3 client per "
+        "call (old behaviour) vs. the pooled client registry."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--endpoint-url', help="Local DynamoDB/S3 stand-in, e.g. http://localhost:4566")
+        parser.add_argument('--requests', type=int, default=200, help="Simulated requests per mode")
+        parser.add_argument('--lookups', type=int, default=4, help="GetItem calls per request (watch_video does ~4)")
+
+    def handle(self, *args, **options):
+        use_endpoint(options['endpoint_url'])
+        ensure_table()
+        ensure_buckets()
+
+        key = {'PK': 'USER#bench@example.com', 'SK': 'PROFILE'}
+        get_table().put_item(Item=dict(key, channel_name='bench', subscribers=0))
+
+        def legacy_request():
+            for _ in range(options['lookups']):
+                legacy_table().get_item(Key=key)
+            legacy_presign('bench.mp4', 'video/mp4', settings.AWS_RAW_BUCKET)
+
+        def pooled_request():
+            for _ in range(options['lookups']):
+                get_table().get_item(Key=key)
+            generate_presigned_url('bench.mp4', 'video/mp4', settings.AWS_RAW_BUCKET)
+
+        for label, fn in (('per-call clients', legacy_request), ('pooled registry', pooled_request)):
+            aws_clients.reset_clients()
+            fn()  # Warm-up: the registry is meant to pay this once per process
+
+            samples = []
+            for _ in range(options['requests']):
+                start = time.perf_counter()
+                fn()
+                samples.append((time.perf_counter() - start) * 1000)
+
+            self.stdout.write(
+                f"{label:>17}: mean {sum(samples) / len(samples):7.2f} ms  "
+                f"p50 {percentile(samples, 50):7.2f} ms  "
+                f"p95 {percentile(samples, 95):7.2f} ms  "
+                f"({options['requests']} requests, {options['lookups']} GetItem + 1 presign each)"
+            )
@@ -0,0 +1,111 @@
+import asyncio
+import os
+import time
+
+from django.conf import settings
+from django.contrib.sessions.backends.signed_cookies import SessionStore
+from django.core.management.base import BaseCommand, CommandError
+from django.test import AsyncClient
+from django.urls import reverse
+
+from UserLogin import db_utils, passwords
+
+from ._standin import (
+    add_network_latency, allow_test_client, ensure_buckets, ensure_table, percentile, seed_watch_fixture, use_endpoint,
+)
+
+PASSWORD = 'bench-password'
+
+
+class Command(BaseCommand):
+    help = (
+        "Login throughput of one ASGI worker under mixed traffic: a burst of logins "
+        "alongside watch page requests, with hashing inline (the old behaviour) and "
+        "on the hashing process pool. Runs against a local AWS stand-in."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--endpoint-url', help="Local DynamoDB/S3 stand-in, e.g. http://localhost:8000")
+        parser.add_argument('--users', type=int, default=200, help="Accounts to log in as (round robin)")
+        parser.add_argument('--logins', type=int, default=200, help="Logins per mode")
+        parser.add_argument('--login-concurrency', type=int, default=16, help="Logins in flight at once")
+        parser.add_argument('--page-concurrency', type=int, default=8, help="Watch page requests in flight meanwhile")
+        parser.add_argument('--modes', default='inline,pool', help="Comma-separated: inline, pool")
+        parser.add_argument('--workers', type=int, default=None, help="Hashing processes in pool mode (default: one per core)")
+        parser.add_argument('--latency-ms', type=float, default=5.0, help="Simulated network RTT per AWS call")
+
+    def handle(self, *args, **options):
+        modes = [mode.strip() for mode in options['modes'].split(',')]
+        if set(modes) - {'inline', 'pool'}:
+            raise CommandError("--modes takes inline and/or pool")
+        use_endpoint(options['endpoint_url'])
+        ensure_table()
+        ensure_buckets()
+        allow_test_client()
+
+        # Every account gets the same hash: made once here instead of once per user
+        settings.PASSWORD_HASHING = dict(settings.PASSWORD_HASHING, WORKERS=0)
+        encoded = passwords.make(PASSWORD)
+        emails = [f"login{i}@bench.local" for i in range(options['users'])]
+        with db_utils.get_table().batch_writer() as batch:
+            for email in emails:
+                batch.put_item(Item={
+                    'PK': f"USER#{email}", 'SK': 'PROFILE',
+                    'channel_name': email.split('@')[0], 'password': encoded, 'subscribers': 0,
+                })
+        video_id, viewer = seed_watch_fixture()
+        add_network_latency(options['latency_ms'])
+
+        session = SessionStore()
+        session['user_email'] = viewer
+        session.save()
+        page_url = reverse('watch_video', args=[video_id])
+
+        for mode in modes:
+            workers = 0 if mode == 'inline' else options['workers']
+            settings.PASSWORD_HASHING = dict(settings.PASSWORD_HASHING, WORKERS=workers)
+            passwords.shutdown()
+            passwords.warm_up() # Process start-up isn't what's measured
+            asyncio.run(self.run_mode(mode, emails, page_url, session.session_key, options))
+        passwords.shutdown()
+
+    async def run_mode(self, mode, emails, page_url, session_cookie, options):
+        page_client = AsyncClient()
+        page_client.cookies[settings.SESSION_COOKIE_NAME] = session_cookie
+        await page_client.get(page_url) # Warm-up
+
+        login_latencies, page_latencies, statuses = [], [], {}
+        login_slots = asyncio.Semaphore(options['login_concurrency'])
+        done = asyncio.Event()
+
+        async def login(n):
+            async with login_slots:
+                client = AsyncClient() # Fresh session per login
+                started = time.perf_counter()
+                response = await client.post(reverse('login'), {'email': emails[n % len(emails)], 'password': PASSWORD})
+                login_latencies.append((time.perf_counter() - started) * 1000)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+        async def pages():
+            while not done.is_set():
+                started = time.perf_counter()
+                await page_client.get(page_url)
+                page_latencies.append((time.perf_counter() - started) * 1000)
+
+        page_tasks = [asyncio.create_task(pages()) for _ in range(options['page_concurrency'])]
+        started = time.perf_counter()
+        await asyncio.gather(*(login(n) for n in range(options['logins'])))
+        elapsed = time.perf_counter() - started
+        done.set()
+        await asyncio.gather(*page_tasks)
+
+        logged_in = statuses.get(302, 0)
+        workers = settings.PASSWORD_HASHING['WORKERS']
+        label = 'inline' if mode == 'inline' else f"pool x{workers or os.cpu_count()}"
+        self.stdout.write(
+            f"{label:>12}: {logged_in / elapsed:7.1f} logins/s  "
+            f"login p50 {percentile(login_latencies, 50):7.1f} ms  p99 {percentile(login_latencies, 99):7.1f} ms  "
+            f"{statuses.get(503, 0)} rejected (503)  |  "
+            f"pages {len(page_latencies) / elapsed:7.1f} req/s  "
+            f"p50 {percentile(page_latencies, 50):7.1f} ms  p99 {percentile(page_latencies, 99):7.1f} ms"
+        )
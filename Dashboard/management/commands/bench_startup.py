@@ -0,0 +1,97 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.contrib.sessions.backends.signed_cookies import SessionStore
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+
+from ._standin import ensure_buckets, ensure_table, seed_watch_fixture, use_endpoint
+
+CHILD = 'Dashboard.management.commands._startup_child'
+
+
+class Command(BaseCommand):
+    help = (
+        "Cold start of a worker: boot time, the URLconf's import time, and the "
+        "first watch page requests of fresh processes, served cold and after the "
+        "boot-time warm-up (UserLogin/warmup.py). Runs against a local AWS stand-in."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--endpoint-url', help="Local DynamoDB/S3 stand-in, e.g. http://localhost:8000")
+        parser.add_argument('--runs', type=int, default=5, help="Fresh processes per mode (medians are reported)")
+        parser.add_argument('--modes', default='cold,warm', help="Comma-separated: cold, warm")
+        parser.add_argument('--steps', default='', help="Warm-up steps in warm mode (default: the enabled ones)")
+        parser.add_argument('--connect-ms', type=float, default=30.0,
+                            help="Simulated cost of opening a connection (TCP + TLS handshakes to the region)")
+
+    def handle(self, *args, **options):
+        modes = [mode.strip() for mode in options['modes'].split(',')]
+        if set(modes) - {'cold', 'warm'}:
+            raise CommandError("--modes takes cold and/or warm")
+        use_endpoint(options['endpoint_url'])
+        ensure_table()
+        ensure_buckets()
+        video_id, viewer = seed_watch_fixture()
+        session = SessionStore()
+        session['user_email'] = viewer
+        session.save()
+        args = [reverse('watch_video', args=[video_id]), session.session_key, str(options['connect_ms']), options['steps']]
+
+        imports = [self.spawn('imports', args) for _ in range(options['runs'])]
+        self.stdout.write(
+            f"{'imports':>8}: boot {self.median(imports, 'boot_ms'):7.1f} ms  "
+            f"URLconf {self.median(imports, 'urlconf_ms'):7.1f} ms  "
+            f"loaded at boot: {', '.join(imports[0]['loaded_at_boot']) or 'none of boto3/botocore/numpy'}"
+        )
+        for mode in modes:
+            runs = [self.spawn(mode, args) for _ in range(options['runs'])]
+            bad = {run['status'] for run in runs} - {200}
+            if bad:
+                raise CommandError(f"{mode}: the watch page answered {sorted(bad)}")
+            line = (
+                f"{mode:>8}: boot {self.median(runs, 'boot_ms'):7.1f} ms  "
+                f"ready {self.median(runs, 'ready_ms'):7.1f} ms  "
+                f"1st request {self.median(runs, 'first_ms'):7.1f} ms  "
+                f"2nd {self.median(runs, 'second_ms'):7.1f} ms  "
+                f"cold-start overhead {self.median(runs, 'overhead_ms'):7.1f} ms  "
+                f"spawn to 1st response {self.median(runs, 'first_response_ms'):7.1f} ms"
+            )
+            if mode == 'warm':
+                steps = {name: statistics.median(run['steps'][name] for run in runs) * 1000 for name in runs[0]['steps']}
+                line += '  (' + ', '.join(f"{name} {ms:.0f}" for name, ms in steps.items()) + ')'
+            self.stdout.write(line)
+
+    def spawn(self, mode, args):
+        env = dict(
+            os.environ,
+            DJANGO_SETTINGS_MODULE='Cloudstream.settings',
+            aws_dynamodb_endpoint_url=settings.AWS_DYNAMODB_ENDPOINT_URL,
+            aws_s3_endpoint_url=settings.AWS_S3_ENDPOINT_URL,
+            aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
+            aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
+        )
+        spawned = time.time()
+        process = subprocess.run(
+            [sys.executable, '-m', CHILD, mode, *args],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+        )
+        if process.returncode:
+            raise CommandError(f"{mode} process failed:\n{process.stderr}")
+        run = json.loads(process.stdout.strip().splitlines()[-1])
+        # Wall clock across processes: fine on one machine, at millisecond resolution
+        run['boot_ms'] = (run['booted_at'] - spawned) * 1000
+        if 'ready_at' in run:
+            run['ready_ms'] = (run['ready_at'] - spawned) * 1000
+            run['first_response_ms'] = run['ready_ms'] + run['first_ms']
+            run['overhead_ms'] = run['first_ms'] - run['second_ms']
+        return run
+
+    @staticmethod
+    def median(runs, key):
+        return statistics.median(run[key] for run in runs)
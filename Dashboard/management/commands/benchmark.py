@@ -0,0 +1,321 @@
+import asyncio
+import datetime
+import json
+import platform
+import random
+import subprocess
+import time
+
+from django.conf import settings
+from django.contrib.sessions.backends.signed_cookies import SessionStore
+from django.core.management.base import BaseCommand, CommandError
+from django.test import AsyncClient
+from django.urls import reverse
+
+from UserLogin import view_counts
+
+from ._dataset import Dataset
+from ._standin import (
+    AwsMeter, add_network_latency, allow_test_client, disable_db_cache, drop_table, ensure_buckets, ensure_table,
+    percentile, use_endpoint,
+)
+
+RESULTS_VERSION = 1
+PERCENTILES = (50, 90, 95, 99)
+
+
+# A scenario turns (data set, rng) into one request: (user index or None, method, url, JSON body)
+
+def _home(dataset, rng):
+    return None, 'get', reverse('home'), None
+
+
+def _watch(dataset, rng):
+    video = rng.randrange(dataset.videos)
+    return rng.randrange(dataset.users), 'get', reverse('watch_video', args=[dataset.video_id(video)]), None
+
+
+def _dashboard(dataset, rng):
+    return rng.randrange(dataset.creators), 'get', reverse('dashboard'), None
+
+
+def _reaction(dataset, rng):
+    video = rng.randrange(dataset.videos)
+    body = {
+        'video_id': dataset.video_id(video),
+        'creator_email': dataset.user_email(dataset.video_creator(video)),
+        'action': rng.choice(['LIKE', 'DISLIKE', 'NONE']),
+    }
+    return rng.randrange(dataset.users), 'post', reverse('reaction'), body
+
+
+def _subscribe(dataset, rng):
+    user = rng.randrange(dataset.users)
+    creator = rng.randrange(dataset.creators)
+    if creator == user:
+        creator = (creator + 1) % dataset.creators if dataset.creators > 1 else creator
+    return user, 'post', reverse('subscribe'), {'creator_email': dataset.user_email(creator)}
+
+
+def _upload_url(dataset, rng):
+    body = {'title': 'Bench upload', 'filename': 'bench upload.mp4', 'file_type': 'video/mp4'}
+    return rng.randrange(dataset.creators), 'post', reverse('get_upload_url'), body
+
+
+SCENARIOS = {
+    'home': _home,
+    'watch': _watch,
+    'dashboard': _dashboard,
+    'reaction': _reaction,
+    'subscribe': _subscribe,
+    'upload_url': _upload_url,
+}
+NEEDS_VIDEOS = {'watch', 'reaction'}
+
+
+def _git_commit():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'],
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ('-dirty' if dirty else '')
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark suite: seed a local AWS stand-in with a synthetic data set, drive "
+        "the home, watch, Dashboard, reaction, subscribe and upload-URL views at set "
+        "concurrency through the ASGI handler, and report latency percentiles, "
+        "throughput and AWS calls / DynamoDB capacity units per request. --output "
+        "writes the results as JSON; --compare checks them against an earlier run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--endpoint-url', help="Local DynamoDB/S3 stand-in, e.g. http://localhost:8000")
+        data = parser.add_argument_group('data set')
+        data.add_argument('--users', type=int, default=1000)
+        data.add_argument('--creators', type=int, default=None, help="Users who upload (default: users / 20)")
+        data.add_argument('--videos', type=int, default=1000)
+        data.add_argument('--reactions', type=int, default=10000)
+        data.add_argument('--subscriptions', type=int, default=5000)
+        data.add_argument('--seed', type=int, default=0, help="Same seed and sizes, same data set and request mix")
+        data.add_argument('--seed-workers', type=int, default=8, help="Chunks written in parallel")
+        data.add_argument('--reset', action='store_true', help="Drop the table first (another data set is in it)")
+        run = parser.add_argument_group('run')
+        run.add_argument('--scenarios', default=','.join(SCENARIOS), help=f"Comma-separated, from: {', '.join(SCENARIOS)}")
+        run.add_argument('--requests', type=int, default=200, help="Requests per scenario and concurrency level")
+        run.add_argument('--concurrency', default='1,16', help="Comma-separated in-flight request levels")
+        run.add_argument('--warmup', type=int, default=10, help="Unmeasured requests before each scenario")
+        run.add_argument('--latency-ms', type=float, default=5.0, help="Simulated network RTT per AWS call")
+        run.add_argument('--with-cache', action='store_true', help="Keep the db_cache on (default: every lookup hits DynamoDB)")
+        report = parser.add_argument_group('report')
+        report.add_argument('--output', help="Write the results to this JSON file")
+        report.add_argument('--compare', help="Results JSON of an earlier run to compare against")
+        report.add_argument('--max-regression', type=float, default=None,
+                            help="With --compare: fail if p95 or throughput got worse by more than this many percent, "
+                                 "or if any scenario makes more DynamoDB calls per request")
+
+    def handle(self, *args, **options):
+        scenarios = [name.strip() for name in options['scenarios'].split(',') if name.strip()]
+        unknown = set(scenarios) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f"Unknown scenario(s): {', '.join(sorted(unknown))}")
+        levels = [int(level) for level in options['concurrency'].split(',')]
+        try:
+            dataset = Dataset(
+                users=options['users'], videos=options['videos'], reactions=options['reactions'],
+                subscriptions=options['subscriptions'], creators=options['creators'], seed=options['seed'],
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+        if not dataset.videos and NEEDS_VIDEOS & set(scenarios):
+            raise CommandError("The watch and reaction scenarios need --videos > 0")
+        baseline = self.load_results(options['compare']) if options['compare'] else None
+
+        use_endpoint(options['endpoint_url'])
+        if options['reset']:
+            drop_table()
+        ensure_table()
+        ensure_buckets()
+        allow_test_client()
+        self.seed(dataset, options)
+
+        add_network_latency(options['latency_ms'])
+        if not options['with_cache']:
+            disable_db_cache()
+
+        with AwsMeter() as meter:
+            results = asyncio.run(self.run_scenarios(dataset, scenarios, levels, options, meter))
+
+        report = {
+            'version': RESULTS_VERSION,
+            'commit': _git_commit(),
+            'started_at': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'dataset': dataset.params(),
+            'options': {
+                'requests': options['requests'], 'warmup': options['warmup'],
+                'latency_ms': options['latency_ms'], 'with_cache': options['with_cache'],
+            },
+            'results': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+        if baseline is not None:
+            self.compare(baseline, report, options['max_regression'])
+
+    def load_results(self, path):
+        try:
+            with open(path, encoding='utf-8') as f:
+                baseline = json.load(f)
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Can't read {path}: {e}")
+        if baseline.get('version') != RESULTS_VERSION:
+            raise CommandError(f"{path} is not a version {RESULTS_VERSION} results file")
+        return baseline
+
+    # --- Seeding ---
+
+    def seed(self, dataset, options):
+        stored = dataset.stored_params()
+        if stored == dataset.params():
+            self.stdout.write(f"Data set already in place: {stored}")
+            return
+        if stored is not None:
+            raise CommandError(f"The table holds another data set ({stored}): pass --reset to replace it")
+
+        self.stdout.write(f"Seeding {dataset.params()} with {options['seed_workers']} writer(s)...")
+
+        def progress(kind, written):
+            if written % 50000 < 5000: # Roughly every 50k items of a kind
+                self.stdout.write(f"  {kind}: {written}")
+
+        counts = dataset.write(workers=options['seed_workers'], progress=progress)
+        items = sum(v for k, v in counts.items() if k != 'seconds')
+        self.stdout.write(
+            f"Seeded {items} items in {counts['seconds']:.1f}s ({items / max(counts['seconds'], 1e-9):.0f} items/s): "
+            + ', '.join(f"{v} {k}" for k, v in counts.items() if k != 'seconds')
+        )
+
+    # --- Driving the views ---
+
+    async def run_scenarios(self, dataset, scenarios, levels, options, meter):
+        clients = {}
+
+        def client_for(user):
+            # One client (session cookie) per user; anonymous requests share one
+            if user not in clients:
+                client = clients[user] = AsyncClient()
+                if user is not None:
+                    session = SessionStore()
+                    session['user_email'] = dataset.user_email(user)
+                    session['channel_name'] = dataset.channel_name(user)
+                    session.save()
+                    client.cookies[settings.SESSION_COOKIE_NAME] = session.session_key
+            return clients[user]
+
+        async def send(request):
+            user, method, url, body = request
+            client = client_for(user)
+            if method == 'get':
+                return await client.get(url)
+            return await client.post(url, data=json.dumps(body), content_type='application/json')
+
+        results = []
+        for name in scenarios:
+            rng = random.Random(f"{dataset.seed}:{name}")
+            for _ in range(options['warmup']):
+                await send(SCENARIOS[name](dataset, rng))
+            for concurrency in levels:
+                requests = [SCENARIOS[name](dataset, rng) for _ in range(options['requests'])]
+                result = await self.run_level(name, concurrency, requests, send, meter)
+                results.append(result)
+                self.print_result(result)
+        return results
+
+    async def run_level(self, name, concurrency, requests, send, meter):
+        await asyncio.to_thread(view_counts.flush) # Views queued by earlier levels don't land on this one
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies = []
+        statuses = {}
+
+        async def one(request):
+            async with semaphore:
+                started = time.perf_counter()
+                response = await send(request)
+                latencies.append((time.perf_counter() - started) * 1000)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+        calls_before, units_before = meter.snapshot()
+        started = time.perf_counter()
+        await asyncio.gather(*(one(request) for request in requests))
+        elapsed = time.perf_counter() - started
+        calls_after, units_after = meter.snapshot()
+
+        count = len(requests)
+        calls = calls_after - calls_before
+        dynamodb_calls = sum(v for k, v in calls.items() if k.startswith('dynamodb.'))
+        return {
+            'scenario': name,
+            'concurrency': concurrency,
+            'requests': count,
+            'errors': sum(n for status, n in statuses.items() if status >= 400),
+            'status_codes': {str(status): n for status, n in sorted(statuses.items())},
+            'seconds': round(elapsed, 4),
+            'throughput_rps': round(count / elapsed, 2),
+            'latency_ms': dict(
+                {f"p{pct}": round(percentile(latencies, pct), 3) for pct in PERCENTILES},
+                mean=round(sum(latencies) / count, 3),
+                max=round(max(latencies), 3),
+            ),
+            # Per request: everything the process called during the level, divided evenly
+            'dynamodb_calls': round(dynamodb_calls / count, 3),
+            'read_units': round((units_after['read'] - units_before['read']) / count, 3),
+            'write_units': round((units_after['write'] - units_before['write']) / count, 3),
+            'aws_calls': {operation: round(n / count, 3) for operation, n in sorted(calls.items())},
+        }
+
+    def print_result(self, result):
+        latency = result['latency_ms']
+        self.stdout.write(
+            f"{result['scenario']:>10} x{result['concurrency']:<4} {result['throughput_rps']:8.1f} req/s  "
+            f"p50 {latency['p50']:7.1f} ms  p95 {latency['p95']:7.1f} ms  p99 {latency['p99']:7.1f} ms  "
+            f"{result['dynamodb_calls']:5.2f} DynamoDB calls, {result['read_units']:6.2f} RCU, "
+            f"{result['write_units']:6.2f} WCU per request"
+            + (f"  {result['errors']} error(s)" if result['errors'] else '')
+        )
+
+    # --- Comparing runs ---
+
+    def compare(self, baseline, report, max_regression):
+        if baseline['dataset'] != report['dataset'] or baseline['options'] != report['options']:
+            self.stdout.write(self.style.WARNING("Baseline was run with another data set or options: deltas are indicative"))
+        previous = {(r['scenario'], r['concurrency']): r for r in baseline['results']}
+        regressions = []
+        self.stdout.write(f"Compared with {baseline.get('commit') or 'the baseline'}:")
+        for result in report['results']:
+            before = previous.get((result['scenario'], result['concurrency']))
+            if before is None:
+                continue
+            p95 = _change(before['latency_ms']['p95'], result['latency_ms']['p95'])
+            rps = _change(before['throughput_rps'], result['throughput_rps'])
+            calls = result['dynamodb_calls'] - before['dynamodb_calls']
+            label = f"{result['scenario']} x{result['concurrency']}"
+            self.stdout.write(f"{label:>16}: p95 {p95:+6.1f}%  throughput {rps:+6.1f}%  DynamoDB calls {calls:+.2f}/request")
+            if max_regression is not None:
+                if p95 > max_regression:
+                    regressions.append(f"{label}: p95 {p95:+.1f}%")
+                if -rps > max_regression:
+                    regressions.append(f"{label}: throughput {rps:+.1f}%")
+                if calls > 0.01:
+                    regressions.append(f"{label}: {calls:+.2f} DynamoDB calls per request")
+        if regressions:
+            raise CommandError("Regressions: " + '; '.join(regressions))
+
+
+def _change(before, after):
+    return (after - before) / before * 100 if before else 0.0
@@ -0,0 +1,31 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from UserLogin import related
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the related videos (\"Up next\") list of every READY video from "
+        "likes, subscriptions and titles, and write the lists that changed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--segments', type=int, default=settings.RELATED['SCAN_SEGMENTS'],
+                            help="Scan segments read in parallel")
+        parser.add_argument('--interval', type=float, default=settings.RELATED['REFRESH_SECONDS'])
+        parser.add_argument('--once', action='store_true', help="One pass, then exit")
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.monotonic()
+            stats = related.refresh(options['segments'])
+            self.stdout.write(
+                f"{stats['videos']} video(s): {stats['written']} list(s) written, "
+                f"{stats['unchanged']} unchanged, {stats['deleted']} deleted in {stats['seconds']:.2f}s"
+            )
+            if options['once']:
+                return
+            time.sleep(max(0, options['interval'] - (time.monotonic() - started)))
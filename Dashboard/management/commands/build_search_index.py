@@ -0,0 +1,32 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from UserLogin import search_index
+
+
+class Command(BaseCommand):
+    help = (
+        "Build the search index from DynamoDB (a parallel Scan of the feed index) "
+        "and write it to SEARCH['SNAPSHOT_PATH'], so web processes start from the "
+        "snapshot instead of scanning the table."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--segments', type=int, default=settings.SEARCH['LOAD_SEGMENTS'],
+                            help="Scan segments read in parallel")
+        parser.add_argument('--output', default=settings.SEARCH['SNAPSHOT_PATH'], help="Snapshot file")
+
+    def handle(self, *args, **options):
+        if not options['output']:
+            raise CommandError("No snapshot path: set SEARCH['SNAPSHOT_PATH'] or pass --output")
+        started = time.perf_counter()
+        index = search_index.build(options['segments'])
+        built = time.perf_counter()
+        index.save(options['output'])
+        self.stdout.write(
+            f"Indexed {len(index)} video(s), {len(index.postings)} term(s) in {built - started:.2f}s "
+            f"({options['segments']} segments); snapshot written to {options['output']} "
+            f"in {time.perf_counter() - built:.2f}s"
+        )
@@ -0,0 +1,117 @@
+import time
+
+from boto3.dynamodb.conditions import Attr
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from UserLogin import aws_clients
+from UserLogin.db_utils import TABLE_INDEXES, get_table, video_index_attributes
+
+
+class Command(BaseCommand):
+    help = (
+        "Create the GSIs listed in db_utils.TABLE_INDEXES if they are missing, wait "
+        "for them to go ACTIVE, and backfill index attributes on old video rows."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--skip-backfill', action='store_true')
+        parser.add_argument('--read-capacity', type=int, default=5, help="Only used for PROVISIONED tables")
+        parser.add_argument('--write-capacity', type=int, default=5, help="Only used for PROVISIONED tables")
+        parser.add_argument('--timeout', type=int, default=1800, help="Seconds to wait for each index to go ACTIVE")
+        parser.add_argument('--poll-interval', type=float, default=5.0)
+
+    def handle(self, *args, **options):
+        client = aws_clients.get_client('dynamodb')
+
+        for index in TABLE_INDEXES:
+            table = client.describe_table(TableName=settings.DYNAMO_TABLE)['Table']
+            existing = {gsi['IndexName'] for gsi in table.get('GlobalSecondaryIndexes', [])}
+            if index['IndexName'] in existing:
+                self.stdout.write(f"{index['IndexName']}: already exists")
+                continue
+
+            create = {
+                'IndexName': index['IndexName'],
+                'KeySchema': index['KeySchema'],
+                'Projection': index['Projection'],
+            }
+            billing = table.get('BillingModeSummary', {}).get('BillingMode', 'PROVISIONED')
+            if billing == 'PROVISIONED':
+                create['ProvisionedThroughput'] = {
+                    'ReadCapacityUnits': options['read_capacity'],
+                    'WriteCapacityUnits': options['write_capacity'],
+                }
+
+            # DynamoDB only allows one GSI to be created per UpdateTable call
+            client.update_table(
+                TableName=settings.DYNAMO_TABLE,
+                AttributeDefinitions=index['AttributeDefinitions'],
+                GlobalSecondaryIndexUpdates=[{'Create': create}],
+            )
+            self.stdout.write(f"{index['IndexName']}: creating...")
+            self.wait_until_active(client, index['IndexName'], options['timeout'], options['poll_interval'])
+            self.stdout.write(self.style.SUCCESS(f"{index['IndexName']}: ACTIVE"))
+
+        if not options['skip_backfill']:
+            self.backfill()
+
+    def wait_until_active(self, client, index_name, timeout, poll_interval):
+        # Backfilling a big table can take a while, but not forever: a stuck or
+        # failed index (e.g. missing permissions on the table) should end the run
+        deadline = time.monotonic() + timeout
+        while True:
+            table = client.describe_table(TableName=settings.DYNAMO_TABLE)['Table']
+            statuses = {gsi['IndexName']: gsi['IndexStatus'] for gsi in table.get('GlobalSecondaryIndexes', [])}
+            status = statuses.get(index_name)
+            if status == 'ACTIVE':
+                return
+            if status is None:
+                raise CommandError(f"{index_name}: disappeared while waiting for it (creation failed?)")
+            if time.monotonic() >= deadline:
+                raise CommandError(
+                    f"{index_name}: still {status} after {timeout}s. It keeps building in the "
+                    f"background; re-run this command later to backfill."
+                )
+            time.sleep(poll_interval)
+
+    def backfill(self):
+        # A GSI only contains items that carry its key attributes, so older video
+        # rows written before the attribute existed have to be patched once.
+        # Inbox entries from before they dropped video_id are taken back out of
+        # the video_id index the same way.
+        table = get_table()
+        scan_kwargs = {
+            'FilterExpression': Attr('SK').begins_with('VIDEO#')
+            | (Attr('SK').begins_with('INBOX#') & Attr('video_id').exists()),
+        }
+        patched = scanned = stripped = 0
+
+        while True:
+            response = table.scan(**scan_kwargs)
+            for item in response.get('Items', []):
+                if item['SK'].startswith('INBOX#'):
+                    table.update_item(Key={'PK': item['PK'], 'SK': item['SK']}, UpdateExpression="REMOVE video_id")
+                    stripped += 1
+                    continue
+                scanned += 1
+                missing = video_index_attributes(item)
+                if not missing:
+                    continue
+                names = {f"#a{i}": name for i, name in enumerate(missing)}
+                values = {f":v{i}": value for i, value in enumerate(missing.values())}
+                table.update_item(
+                    Key={'PK': item['PK'], 'SK': item['SK']},
+                    UpdateExpression="SET " + ", ".join(f"#a{i} = :v{i}" for i in range(len(missing))),
+                    ExpressionAttributeNames=names,
+                    ExpressionAttributeValues=values,
+                )
+                patched += 1
+
+            if 'LastEvaluatedKey' not in response:
+                break
+            scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Backfill done: {patched} of {scanned} video items patched, video_id removed from {stripped} inbox entries"
+        ))
@@ -0,0 +1,39 @@
+import fcntl
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from UserLogin import write_behind
+
+
+class Command(BaseCommand):
+    help = (
+        "Drain the write-behind engagement queue (settings.WRITE_BEHIND) into "
+        "DynamoDB: relationship items with BatchWriteItem, one merged counter "
+        "update per video/creator."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Exit once the queue is empty instead of polling")
+        parser.add_argument('--batch-size', type=int, default=settings.WRITE_BEHIND['BATCH_SIZE'])
+
+    def handle(self, *args, **options):
+        # One flusher per queue file: a second one would flush the same inflight batch twice
+        lock = open(f"{settings.WRITE_BEHIND['PATH']}.lock", 'w')
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise CommandError(f"Another flush_engagement is running on {settings.WRITE_BEHIND['PATH']}")
+
+        try:
+            while True:
+                events, targets = write_behind.flush(options['batch_size'])
+                if events or targets:
+                    self.stdout.write(f"Flushed {events} event(s), {targets} counter update(s)")
+                    continue # More may be waiting: no sleep while there is a backlog
+                if options['once']:
+                    return
+                time.sleep(settings.WRITE_BEHIND['FLUSH_SECONDS'])
+        finally:
+            lock.close()
@@ -0,0 +1,72 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from UserLogin.bulk_import import Checkpoint, Importer
+
+GB = 1024 ** 3
+
+
+class Command(BaseCommand):
+    help = (
+        "Import an existing catalogue from a CSV or JSON Lines manifest (see "
+        "UserLogin/bulk_import.py for the columns): copies the media into the "
+        "raw/processed buckets and writes the video items. Resumes from its "
+        "checkpoint after an interruption."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('manifest')
+        parser.add_argument('--checkpoint', help="Checkpoint file (default: <manifest>.checkpoint.json)")
+        parser.add_argument('--restart', action='store_true', help="Ignore the checkpoint and import every row")
+        parser.add_argument('--workers', type=int, help="Rows in flight at once")
+        parser.add_argument('--copy-threads', type=int, help="UploadPartCopy calls in flight")
+        parser.add_argument('--write-threads', type=int, help="BatchWriteItem calls in flight")
+
+    def handle(self, *args, **options):
+        manifest = options['manifest']
+        if not os.path.exists(manifest):
+            raise CommandError(f"No such manifest: {manifest}")
+        path = options['checkpoint'] or f"{manifest}.checkpoint.json"
+        if options['restart'] and os.path.exists(path):
+            os.remove(path)
+        try:
+            checkpoint = Checkpoint(path, manifest)
+        except ValueError as e:
+            raise CommandError(str(e))
+        if checkpoint.done_through:
+            self.stdout.write(f"Resuming after row {checkpoint.done_through} ({path})")
+
+        importer = Importer(
+            manifest, checkpoint,
+            workers=options['workers'], write_threads=options['write_threads'], copy_threads=options['copy_threads'],
+            progress=self.progress,
+        )
+        stats = importer.run()
+
+        seconds = max(stats['seconds'], 1e-9)
+        self.stdout.write(
+            f"Imported {stats['imported']} of {stats['rows']} row(s) ({stats['ready']} READY, "
+            f"{stats['processing']} PROCESSING), {stats['failed']} failed, "
+            f"{stats['skipped']} skipped (done before) in {stats['seconds']:.1f}s"
+        )
+        self.stdout.write(
+            f"  {stats['rows'] / seconds:.1f} rows/s | copied {stats['objects_copied']} object(s), "
+            f"{stats['bytes_copied'] / GB:.2f} GB ({stats['bytes_copied'] / GB / seconds:.2f} GB/s server-side) | "
+            f"BatchWriteItem: {stats['write_calls']} call(s), {stats['unprocessed_retries']} retried for UnprocessedItems"
+        )
+        if checkpoint.failed:
+            failed = sorted(checkpoint.failed.items(), key=lambda entry: int(entry[0]))
+            for number, error in failed[:10]:
+                self.stderr.write(f"  row {number}: {error}")
+            if len(failed) > 10:
+                self.stderr.write(f"  ... {len(failed) - 10} more in {path}")
+        if stats['imported']:
+            self.stdout.write("Run build_search_index and build_related to add them to search and \"Up next\".")
+
+    def progress(self, stats):
+        self.stdout.write(
+            f"  ... {stats['imported']} imported, {stats['failed']} failed, "
+            f"{stats['bytes_copied'] / GB:.2f} GB copied"
+        )
+        self.stdout.flush()
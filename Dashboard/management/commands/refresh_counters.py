@@ -0,0 +1,29 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from UserLogin import db_utils
+
+
+class Command(BaseCommand):
+    help = (
+        "Keep the counter_totals aggregate on every sharded item up to date, so "
+        "readers (with COUNTERS['AGGREGATE_MAX_AGE'] set) don't have to sum the shards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=settings.COUNTERS['REFRESH_SECONDS'])
+        parser.add_argument('--once', action='store_true', help="One pass, then exit")
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.monotonic()
+            keys = db_utils.sharded_counter_keys()
+            for key in keys:
+                db_utils.refresh_counter_totals(key)
+            if options['once'] or options['verbosity'] > 1:
+                self.stdout.write(f"Refreshed {len(keys)} sharded item(s)")
+            if options['once']:
+                return
+            time.sleep(max(0, options['interval'] - (time.monotonic() - started)))
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from UserLogin import db_utils
+
+
+class Command(BaseCommand):
+    help = (
+        "Spread a hot video's like/dislike counters (or a creator's subscriber "
+        "count) over N shard items. Counts so far stay where they are, so this "
+        "is safe to run on a live item. Shard counts can only grow."
+    )
+
+    def add_arguments(self, parser):
+        target = parser.add_mutually_exclusive_group(required=True)
+        target.add_argument('--video', help="video_id")
+        target.add_argument('--creator', help="Creator's email (subscriber count)")
+        parser.add_argument('--shards', type=int, required=True)
+
+    def handle(self, *args, **options):
+        if options['shards'] < 1:
+            raise CommandError("--shards must be at least 1")
+
+        if options['video']:
+            video = db_utils.get_video_by_id(options['video'])
+            if video is None:
+                raise CommandError(f"No video {options['video']}")
+            key = {'PK': video['PK'], 'SK': video['SK']}
+        else:
+            key = {'PK': f"USER#{options['creator']}", 'SK': 'PROFILE'}
+
+        try:
+            previous = db_utils.set_counter_shards(key, options['shards'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(f"{key['PK']} {key['SK']}: {previous} -> {options['shards']} shards"))
@@ -0,0 +1,107 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from boto3.dynamodb.conditions import Attr
+from django.core.management.base import BaseCommand, CommandError
+
+from UserLogin import db_utils
+
+from ._standin import disable_db_cache, ensure_table, percentile, seed_watch_fixture, use_endpoint
+
+
+class Command(BaseCommand):
+    help = (
+        "Concurrency stress test for likes and subscriptions against a local "
+        "stand-in: many threads click on the same video and channel at once, "
+        "then the counters are checked against the REACTION#/SUB# items. Use "
+        "DynamoDB Local: moto_server's transactions aren't atomic under concurrent "
+        "requests (a failed one restores a snapshot of the whole table)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--endpoint-url', help="Local DynamoDB stand-in, e.g. http://localhost:8000")
+        parser.add_argument('--threads', type=int, default=32)
+        parser.add_argument('--clicks', type=int, default=2000, help="Total clicks (votes + subscription toggles)")
+        parser.add_argument('--voters', type=int, default=20, help="Few voters means many clicks race on the same items")
+        parser.add_argument('--shards', type=int, default=0, help="Shard the video's and creator's counters")
+        parser.add_argument('--seed', type=int, default=None)
+
+    def handle(self, *args, **options):
+        use_endpoint(options['endpoint_url'])
+        ensure_table()
+        # Every click starts from a cold (or someone else's stale) guess
+        disable_db_cache()
+        creator = f"creator-{int(time.time())}@stress.local"
+        video_id, _ = seed_watch_fixture(creator=creator, viewer=f"seed-{creator}")
+        video_key = {'PK': f"USER#{creator}", 'SK': f"VIDEO#{video_id}"}
+        profile_key = {'PK': f"USER#{creator}", 'SK': 'PROFILE'}
+        if options['shards']:
+            db_utils.set_counter_shards(video_key, options['shards'])
+            db_utils.set_counter_shards(profile_key, options['shards'])
+
+        rng = random.Random(options['seed'])
+        voters = [f"voter{i}@stress.local" for i in range(options['voters'])]
+        clicks = [(rng.choice(voters), rng.choice(['LIKE', 'DISLIKE', 'NONE', 'SUB'])) for _ in range(options['clicks'])]
+        latencies = []
+        errors = []
+        lock = threading.Lock()
+
+        def click(voter, action):
+            started = time.perf_counter()
+            try:
+                if action == 'SUB':
+                    db_utils.toggle_subscription(voter, creator)
+                else:
+                    db_utils.update_reaction(voter, video_key['PK'], video_key['SK'], video_id, action)
+            except Exception as e:
+                with lock:
+                    errors.append(repr(e))
+                return
+            with lock:
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['threads']) as pool:
+            list(pool.map(lambda c: click(*c), clicks))
+        elapsed = time.perf_counter() - started
+
+        expected = self.count_relationships(creator, video_id)
+        stats = db_utils.get_video_stats(video_key['PK'], video_key['SK'])
+        subscribers = int(db_utils.get_public_profile(creator)['subscribers'])
+        actual = {'likes': stats['likes'], 'dislikes': stats['dislikes'], 'subscribers': subscribers}
+
+        ms = [latency * 1000 for latency in latencies]
+        self.stdout.write(
+            f"{len(clicks)} clicks on {options['threads']} threads in {elapsed:.2f}s "
+            f"({len(clicks) / elapsed:.0f}/s), p50 {percentile(ms, 50):.1f}ms, p99 {percentile(ms, 99):.1f}ms"
+        )
+        for name in expected:
+            self.stdout.write(f"  {name:12} counter {actual[name]:6}   items {expected[name]:6}")
+        if errors:
+            self.stderr.write(f"{len(errors)} click(s) failed, e.g. {errors[0]}")
+        if actual != expected:
+            raise CommandError("Counters drifted from the relationship items")
+        self.stdout.write(self.style.SUCCESS("Counters match"))
+
+    def count_relationships(self, creator, video_id):
+        # Ground truth: what the counters should say, from the items themselves
+        table = db_utils.get_table()
+        scan_kwargs = {
+            'FilterExpression': Attr('SK').is_in([f"REACTION#{video_id}", f"SUB#{creator}"]),
+            'ConsistentRead': True,
+        }
+        counts = {'likes': 0, 'dislikes': 0, 'subscribers': 0}
+        while True:
+            response = table.scan(**scan_kwargs)
+            for item in response.get('Items', []):
+                if item['SK'].startswith('SUB#'):
+                    counts['subscribers'] += 1
+                elif item.get('type') == 'LIKE':
+                    counts['likes'] += 1
+                elif item.get('type') == 'DISLIKE':
+                    counts['dislikes'] += 1
+            if 'LastEvaluatedKey' not in response:
+                return counts
+            scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from UserLogin import subscription_feed
+
+
+class Command(BaseCommand):
+    help = (
+        "Switch users' Subscriptions feed to inbox mode (fan-out on write: one Query "
+        "per page however many channels they follow) or back to pull mode. Users "
+        "following SUBSCRIPTION_FEED['INBOX_THRESHOLD'] creators are switched "
+        "automatically the first time they open the feed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('emails', nargs='+')
+        parser.add_argument('--disable', action='store_true', help="Back to pull mode, deleting the inboxes")
+
+    def handle(self, *args, **options):
+        switch = subscription_feed.disable_inbox if options['disable'] else subscription_feed.enable_inbox
+        for email in options['emails']:
+            try:
+                switch(email)
+            except LookupError as e:
+                raise CommandError(str(e))
+            mode = 'pull' if options['disable'] else 'inbox'
+            self.stdout.write(f"{email}: {mode} mode ({len(subscription_feed.subscribed_creators(email))} subscriptions)")
@@ -0,0 +1,119 @@
+import os
+import socket
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from UserLogin import db_utils, transcoding
+
+
+class InlineExecutor:
+    """--workers 0: run jobs in this process, one at a time (debugging, tests)."""
+
+    def submit(self, fn, *args):
+        future = Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def shutdown(self, wait=True):
+        pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Transcode PROCESSING videos and flip them to READY. Claims jobs with a "
+        "leased conditional update, so any number of workers (on any number of boxes) "
+        "can run side by side; each one spreads its jobs over a process pool."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=settings.TRANSCODE['WORKERS'],
+                            help="Pool processes (default: one per CPU core; 0 = inline)")
+        parser.add_argument('--backend', default=settings.TRANSCODE['BACKEND'])
+        parser.add_argument('--once', action='store_true', help="Exit once no job is left instead of polling")
+
+    def handle(self, *args, **options):
+        config = settings.TRANSCODE
+        self.lease_seconds = config['LEASE_SECONDS']
+        self.max_attempts = config['MAX_ATTEMPTS']
+        self.backend = options['backend']
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+        workers = options['workers']
+        if workers is None:
+            workers = os.cpu_count() or 1
+        if workers:
+            pool = ProcessPoolExecutor(max_workers=workers, initializer=transcoding.init_worker_process)
+        else:
+            pool = InlineExecutor()
+        slots = max(1, workers)
+
+        self.stdout.write(f"{self.worker_id}: {slots} slot(s), backend {self.backend}")
+        self.running = {} # future -> claimed job
+        last_heartbeat = time.monotonic()
+        try:
+            while True:
+                if len(self.running) < slots:
+                    self.claim_jobs(pool, slots - len(self.running))
+
+                if not self.running:
+                    if options['once']:
+                        break
+                    time.sleep(config['POLL_SECONDS'])
+                    continue
+
+                # Wake up for finished jobs, the next heartbeat, or (with a free slot) new work
+                timeout = config['HEARTBEAT_SECONDS']
+                if len(self.running) < slots:
+                    timeout = min(timeout, config['POLL_SECONDS'])
+                done, _ = wait(self.running, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    self.finish(future, self.running.pop(future))
+
+                if time.monotonic() - last_heartbeat >= config['HEARTBEAT_SECONDS']:
+                    self.heartbeat()
+                    last_heartbeat = time.monotonic()
+        finally:
+            # Ctrl-C / SIGTERM: jobs still running are not finished here; their
+            # leases run out and another worker picks them up
+            pool.shutdown(wait=False)
+
+    def claim_jobs(self, pool, free):
+        for job in db_utils.find_transcode_jobs(limit=free * 2):
+            claimed = db_utils.claim_transcode_job(job, self.worker_id, self.lease_seconds)
+            if claimed is None:
+                continue # Another worker was faster
+            self.stdout.write(f"{claimed['video_id']}: claimed (attempt {claimed['attempts']})")
+            self.running[pool.submit(transcoding.process_job, claimed, self.backend)] = claimed
+            free -= 1
+            if not free:
+                return
+
+    def finish(self, future, job):
+        video_id = job['video_id']
+        try:
+            processed = future.result()
+        except Exception as e:
+            failed_for_good = int(job.get('attempts', 1)) >= self.max_attempts
+            db_utils.fail_transcode_job(job, self.worker_id, repr(e), self.max_attempts)
+            state = "FAILED" if failed_for_good else "will retry"
+            self.stderr.write(f"{video_id}: {e!r} ({state})")
+            return
+
+        if db_utils.finish_transcode_job(job, self.worker_id, processed):
+            self.stdout.write(self.style.SUCCESS(f"{video_id}: READY"))
+        else:
+            # Lease lost while transcoding (e.g. the box stalled past LEASE_SECONDS):
+            # whoever holds it now writes the result
+            self.stderr.write(f"{video_id}: lease lost, result discarded")
+
+    def heartbeat(self):
+        for job in self.running.values():
+            if not db_utils.heartbeat_transcode_job(job, self.worker_id, self.lease_seconds):
+                self.stderr.write(f"{job['video_id']}: lease lost")
@@ -1,8 +1,55 @@
 from django import template
+from django.conf import settings
+from django.utils.html import format_html, format_html_join
 import time
 
+from UserLogin import thumbnails
+from UserLogin.presign import media_url as _media_url
+
 register = template.Library()
 
+@register.filter
+def media_url(key, bucket=None):
+    # {{ video.thumbnail_key|media_url }}: URL of a processed-bucket object
+    # (presigned and memoized when the bucket is private)
+    return _media_url(bucket or settings.AWS_PROCESSED_BUCKET, key)
+
+@register.simple_tag
+def thumbnail(video, sizes, css_class=''):
+    # {% thumbnail video "(max-width: 640px) 100vw, 360px" "thumb-img" %}
+    # A <picture> with WebP/JPEG srcsets, so the browser fetches the variant
+    # that fits the card. `sizes` is how wide the image is laid out.
+    srcsets = thumbnails.srcsets(video)
+    fallback = thumbnails.fallback_url(video)
+    if not srcsets:
+        # Transcoded before thumbnail variants existed: the one full-size image
+        return format_html(
+            '<img src="{}" alt="{}" class="{}" loading="lazy" decoding="async">',
+            fallback, video.get('title', ''), css_class
+        )
+    sources = format_html_join(
+        '', '<source type="{}" srcset="{}" sizes="{}">',
+        ((thumbnails.FORMATS[f]['content_type'], srcsets[f], sizes) for f in srcsets if f != thumbnails.FALLBACK_FORMAT)
+    )
+    return format_html(
+        # display: contents keeps the <img> laid out by the card's own CSS
+        '<picture style="display: contents">{}<img src="{}" srcset="{}" sizes="{}" alt="{}" class="{}" loading="lazy" decoding="async"></picture>',
+        sources, fallback, srcsets.get(thumbnails.FALLBACK_FORMAT, ''), sizes, video.get('title', ''), css_class
+    )
+
+@register.filter
+def compact_count(value):
+    # 950 -> "950", 1234 -> "1.2K", 5600000 -> "5.6M"
+    try:
+        value = int(value or 0)
+    except (ValueError, TypeError):
+        return value
+    for size, suffix in ((10 ** 9, 'B'), (10 ** 6, 'M'), (10 ** 3, 'K')):
+        if value >= size:
+            number = f"{value / size:.1f}".rstrip('0').rstrip('.')
+            return f"{number}{suffix}"
+    return str(value)
+
 @register.filter
 def time_ago(timestamp):
     if not timestamp:
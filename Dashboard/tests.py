@@ -1,3 +1,914 @@
-from django.test import TestCase
+import asyncio
+import csv
+import hashlib
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from unittest import mock
 
-# Create your tests here.
+from botocore.client import BaseClient
+from django.conf import settings
+from django.contrib.sessions.backends.signed_cookies import SessionStore
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import override_settings
+from django.urls import reverse
+
+from UserLogin import aws_clients, db_cache, db_utils, metrics, related, s3_utils, search_index, view_counts, warmup
+from UserLogin.batch_loader import ItemLoader
+from UserLogin.tests import DynamoTestCase
+
+
+@override_settings(FEED_PAGE_SIZE=2)
+class HomeFeedTests(DynamoTestCase):
+    def test_first_page_empty_state(self):
+        response = self.client.get(reverse('home'))
+        self.assertContains(response, "No videos yet")
+        self.assertNotContains(response, 'id="feedSentinel"')
+
+    def test_view_counts_on_cards(self):
+        self.create_video(views=1234)
+        self.assertContains(self.client.get(reverse('home')), '<span>1.2K views</span>')
+
+    def test_next_cursor_and_load_more(self):
+        oldest, middle, newest = [self.create_video(created_at=1000 + i) for i in range(3)]
+
+        response = self.client.get(reverse('home'))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'id="feedSentinel"')
+        cursor = response.context['next_cursor']
+        self.assertTrue(cursor)
+
+        self.assertContains(response, newest)
+        self.assertNotContains(response, oldest)
+
+        page = self.client.get(reverse('feed_api'), {'cursor': cursor}).json()
+        self.assertIn(oldest, page['html'])
+        self.assertNotIn(newest, page['html'])
+        self.assertIsNone(page['next_cursor'])
+
+    def test_past_the_last_page_is_not_the_empty_state(self):
+        # DynamoDB hands out a LastEvaluatedKey when the last page is exactly
+        # full, so the cursor after the oldest video leads to an empty page
+        self.create_video(created_at=1000)
+        oldest = db_utils.get_videos_page()[0][-1]
+        cursor = db_utils.encode_cursor({k: oldest[k] for k in ('PK', 'SK', 'status', 'created_at')})
+
+        response = self.client.get(reverse('home'), {'cursor': cursor})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, "No videos yet")
+        self.assertContains(response, "all caught up")
+
+    def test_bad_cursor(self):
+        response = self.client.get(reverse('home'), {'cursor': 'forged'})
+        self.assertRedirects(response, reverse('home'), fetch_redirect_response=False)
+
+        response = self.client.get(reverse('feed_api'), {'cursor': 'forged'})
+        self.assertEqual(response.status_code, 400)
+
+
+class SearchViewTests(DynamoTestCase):
+    def test_results_and_paging(self):
+        videos = [self.create_video(created_at=1000 + i) for i in range(3)]
+        with override_settings(SEARCH=dict(settings.SEARCH, PAGE_SIZE=2)):
+            response = self.client.get(reverse('search'), {'q': 'vid'})
+            self.assertContains(response, "3 results for")
+            self.assertEqual([v['video_id'] for v in response.context['videos']], videos[:0:-1])
+            self.assertEqual(response.context['next_page'], 2)
+            self.assertContains(response, 'href="?q=vid&page=2"')
+
+            response = self.client.get(reverse('search'), {'q': 'vid', 'page': 2})
+            self.assertEqual([v['video_id'] for v in response.context['videos']], videos[:1])
+            self.assertIsNone(response.context['next_page'])
+
+    def test_no_query_and_no_match(self):
+        self.assertContains(self.client.get(reverse('search')), "Search for videos")
+        self.assertContains(self.client.get(reverse('search'), {'q': 'zebra'}), "No videos match")
+
+    def test_drops_videos_deleted_elsewhere(self):
+        video_id = self.create_video()
+        search_index.get_index()
+        # Deleted straight in the table, as another process would: no hook ran here
+        self.table.delete_item(Key={'PK': 'USER#creator@test.local', 'SK': f"VIDEO#{video_id}"})
+        response = self.client.get(reverse('search'), {'q': 'video'})
+        self.assertEqual(response.context['videos'], [])
+        self.assertNotIn(video_id, search_index.get_index().docs)
+
+
+class SubscriptionsViewTests(DynamoTestCase):
+    def test_login_required(self):
+        response = self.client.get(reverse('subscriptions'))
+        self.assertRedirects(response, reverse('login'), fetch_redirect_response=False)
+
+    def test_shows_subscribed_channels_only(self):
+        db_utils.create_user('creator@test.local', 'pw', 'Creator')
+        subscribed = self.create_video('creator@test.local')
+        other = self.create_video('other@test.local')
+        db_utils.toggle_subscription('viewer@test.local', 'creator@test.local')
+        session = SessionStore()
+        session['user_email'] = 'viewer@test.local'
+        session.save()
+        self.client.cookies[settings.SESSION_COOKIE_NAME] = session.session_key
+
+        response = self.client.get(reverse('subscriptions'))
+        self.assertContains(response, subscribed)
+        self.assertNotContains(response, other)
+        self.assertRedirects(self.client.get(reverse('subscriptions'), {'cursor': 'forged'}),
+                             reverse('subscriptions'), fetch_redirect_response=False)
+
+
+class WatchVideoTests(DynamoTestCase):
+    creator = 'creator@test.local'
+    viewer = 'viewer@test.local'
+
+    def login(self, email):
+        session = SessionStore()
+        session['user_email'] = email
+        session['channel_name'] = 'Viewer'
+        session.save()
+        self.client.cookies[settings.SESSION_COOKIE_NAME] = session.session_key
+
+    def setUp(self):
+        super().setUp()
+        db_utils.create_user(self.creator, 'pw', 'Creator')
+        self.video_id = self.create_video(
+            self.creator, processed_bucket=settings.AWS_PROCESSED_BUCKET, processed_s3_key='processed/a.mp4',
+        )
+
+    def test_views_are_counted(self):
+        self.login(self.viewer)
+        self.client.get(reverse('watch_video', args=[self.video_id]))
+        self.client.get(reverse('watch_video', args=[self.video_id]))
+        self.assertEqual(view_counts.flush(), 1)
+        db_cache.get_backend().clear()
+
+        response = self.client.get(reverse('watch_video', args=[self.video_id]))
+        self.assertContains(response, '<strong>2 views</strong>')
+        video = db_utils.get_user_video(self.creator, self.video_id)
+        self.assertEqual((video['views'], video['unique_viewers']), (2, 1))
+
+    def test_viewer_state_comes_from_one_batch(self):
+        video_pk, video_sk = f"USER#{self.creator}", f"VIDEO#{self.video_id}"
+        db_utils.toggle_subscription(self.viewer, self.creator)
+        db_utils.update_reaction(self.viewer, video_pk, video_sk, self.video_id, 'LIKE')
+        db_cache.get_backend().clear()
+
+        self.login(self.viewer)
+        with mock.patch.object(ItemLoader, '_batch_get', autospec=True, side_effect=ItemLoader._batch_get) as batch_get:
+            response = self.client.get(reverse('watch_video', args=[self.video_id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(batch_get.call_count, 1)
+        self.assertEqual(response.context['sub_count'], 1)
+        self.assertTrue(response.context['is_subscribed'])
+        self.assertEqual(response.context['user_reaction'], 'LIKE')
+
+    def test_related_videos_sidebar(self):
+        other = self.create_video(self.creator, title='Second video')
+        related.refresh()
+        response = self.client.get(reverse('watch_video', args=[self.video_id]))
+        self.assertEqual([video['video_id'] for video in response.context['videos']], [other])
+        self.assertContains(response, '<span class="sidebar-title">Second video</span>')
+
+    def test_anonymous_viewer(self):
+        response = self.client.get(reverse('watch_video', args=[self.video_id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.context['is_subscribed'])
+        self.assertIsNone(response.context['user_reaction'])
+
+    def test_unknown_video_is_404(self):
+        response = self.client.get(reverse('watch_video', args=['missing']))
+        self.assertEqual(response.status_code, 404)
+
+    def test_invalid_reaction_is_rejected(self):
+        self.login(self.viewer)
+        body = {'video_id': self.video_id, 'creator_email': self.creator}
+        for action in ('LOVE', '', None, ['LIKE']):
+            response = self.client.post(reverse('reaction'), dict(body, action=action), content_type='application/json')
+            self.assertEqual(response.status_code, 400, action)
+        self.assertIsNone(db_utils.get_user_reaction(self.viewer, self.video_id))
+
+        response = self.client.post(reverse('reaction'), dict(body, action='LIKE'), content_type='application/json')
+        self.assertEqual(response.json()['likes'], 1)
+
+
+class AsyncViewTests(DynamoTestCase):
+    """The async views under AsyncClient: on the event loop, with boto3 on async_db_utils' thread pool."""
+    creator = 'creator@test.local'
+    viewer = 'viewer@test.local'
+
+    def setUp(self):
+        super().setUp()
+        db_utils.create_user(self.creator, 'pw', 'Creator')
+        self.video_id = self.create_video(
+            self.creator, processed_bucket=settings.AWS_PROCESSED_BUCKET, processed_s3_key='processed/a.mp4',
+        )
+        session = SessionStore()
+        session['user_email'], session['channel_name'] = self.viewer, 'Viewer'
+        session.save()
+        self.async_client.cookies[settings.SESSION_COOKIE_NAME] = session.session_key
+
+    def record_calls(self, delay=0):
+        # (operation, thread name) of every AWS call, each taking `delay` seconds
+        calls = []
+        real = BaseClient._make_api_call
+
+        def call(client, operation, params):
+            calls.append((operation, threading.current_thread().name))
+            time.sleep(delay)
+            return real(client, operation, params)
+
+        patcher = mock.patch.object(BaseClient, '_make_api_call', autospec=True, side_effect=call)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return calls
+
+    async def test_watch_video(self):
+        calls = self.record_calls()
+        response = await self.async_client.get(reverse('watch_video', args=[self.video_id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.context['title'], response.context['creator_email']), ('A video', self.creator))
+        self.assertFalse(response.context['is_subscribed'])
+        self.assertEqual([operation for operation, _ in calls], ['Query', 'BatchGetItem'])
+        self.assertTrue(all(thread.startswith('dynamodb') for _, thread in calls), calls)
+
+        missing = await self.async_client.get(reverse('watch_video', args=['missing']))
+        self.assertEqual(missing.status_code, 404)
+
+    async def test_requests_wait_on_dynamodb_together(self):
+        self.record_calls(delay=0.2)
+        url = reverse('watch_video', args=[self.video_id])
+        started = time.perf_counter()
+        responses = await asyncio.gather(*(self.async_client.get(url) for _ in range(4)))
+        elapsed = time.perf_counter() - started
+        self.assertEqual({response.status_code for response in responses}, {200})
+        # One after the other that is 4 x (Query + BatchGetItem) x 0.2s at least
+        self.assertLess(elapsed, 1.2)
+
+    async def test_home_view(self):
+        calls = self.record_calls()
+        response = await self.async_client.get(reverse('home'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([video['video_id'] for video in response.context['videos']], [self.video_id])
+        self.assertEqual(response.context['user_email'], self.viewer)
+        self.assertTrue(calls)
+        self.assertTrue(all(thread.startswith('dynamodb') for _, thread in calls), calls)
+
+        again = await self.async_client.get(reverse('home'), headers={'if-none-match': response['ETag']})
+        self.assertEqual(again.status_code, 304)
+        bad = await self.async_client.get(reverse('home'), {'cursor': 'forged'})
+        self.assertEqual((bad.status_code, bad['Location']), (302, reverse('home')))
+
+    async def test_dashboard_and_subscribe(self):
+        response = await self.async_client.get(reverse('dashboard'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['email'], self.viewer)
+
+        url = reverse('subscribe')
+        response = await self.async_client.post(url, {'creator_email': self.creator}, content_type='application/json')
+        self.assertEqual(response.json(), {'subscribed': True, 'new_count': 1})
+        response = await self.async_client.post(url, {'creator_email': self.viewer}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertTrue(await asyncio.to_thread(db_utils.is_subscribed, self.viewer, self.creator))
+
+
+class PageCacheTests(DynamoTestCase):
+    creator = 'creator@test.local'
+    viewer = 'viewer@test.local'
+
+    def login(self, email):
+        session = SessionStore()
+        session['user_email'] = email
+        session['channel_name'] = 'Viewer'
+        session.save()
+        self.client.cookies[settings.SESSION_COOKIE_NAME] = session.session_key
+
+    def revalidate(self, url, response):
+        return self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+
+    def test_home_is_not_modified_until_the_feed_changes(self):
+        self.create_video(self.creator)
+        url = reverse('home')
+        first = self.client.get(url)
+        self.assertEqual(first.status_code, 200)
+        self.assertIn('public', first['Cache-Control'])
+        self.assertIn('Last-Modified', first)
+
+        with mock.patch.object(db_utils, 'get_videos_page') as get_videos_page:
+            again = self.revalidate(url, first)
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(again.content, b'')
+        get_videos_page.assert_not_called()
+
+        newer = self.create_video(self.creator, created_at=2 ** 40) # Bumps the feed version
+        changed = self.revalidate(url, first)
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed['ETag'], first['ETag'])
+        self.assertContains(changed, newer)
+
+    def test_per_user_pages_are_private(self):
+        self.login(self.viewer)
+        response = self.client.get(reverse('home'))
+        self.assertIn('private', response['Cache-Control'])
+        self.assertNotEqual(response['ETag'], self.client_class().get(reverse('home'))['ETag'])
+
+    def test_dashboard_changes_with_the_users_videos(self):
+        self.login(self.creator)
+        url = reverse('dashboard')
+        first = self.client.get(url)
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(self.revalidate(url, first).status_code, 304)
+
+        self.create_video(self.creator, status='PENDING_UPLOAD')
+        self.assertEqual(self.revalidate(url, first).status_code, 200)
+
+    def test_watch_page_changes_with_the_viewers_reaction(self):
+        db_utils.create_user(self.creator, 'pw', 'Creator')
+        video_id = self.create_video(
+            self.creator, processed_bucket=settings.AWS_PROCESSED_BUCKET, processed_s3_key='processed/a.mp4',
+        )
+        self.login(self.viewer)
+        url = reverse('watch_video', args=[video_id])
+        first = self.client.get(url)
+        self.assertNotIn('Last-Modified', first)
+        again = self.revalidate(url, first)
+        self.assertEqual(again.status_code, 304)
+
+        db_utils.update_reaction(self.viewer, f"USER#{self.creator}", f"VIDEO#{video_id}", video_id, 'LIKE')
+        changed = self.revalidate(url, first)
+        self.assertEqual(changed.status_code, 200)
+        self.assertEqual(changed.context['user_reaction'], 'LIKE')
+        self.assertEqual(view_counts.flush(), 1) # The 304s were views too
+
+    @override_settings(PAGE_CACHE=dict(settings.PAGE_CACHE, ENABLED=False))
+    def test_disabled(self):
+        first = self.client.get(reverse('home'))
+        self.assertNotIn('ETag', first)
+        self.assertEqual(self.client.get(reverse('home'), HTTP_IF_NONE_MATCH='*').status_code, 200)
+
+
+@override_settings(MULTIPART_PART_SIZE=5 * 1024 * 1024)
+class MultipartUploadTests(DynamoTestCase):
+    user = 'uploader@test.local'
+
+    def setUp(self):
+        super().setUp()
+        session = SessionStore()
+        session['user_email'] = self.user
+        session['channel_name'] = 'Uploader'
+        session.save()
+        self.client.cookies[settings.SESSION_COOKIE_NAME] = session.session_key
+        self.s3 = aws_clients.get_client('s3')
+
+    def post(self, name, body):
+        payload = body if isinstance(body, str) else json.dumps(body)
+        return self.client.post(reverse(name), payload, content_type='application/json')
+
+    def initiate(self, size=6 * 1024 * 1024, **extra):
+        response = self.post('multipart_initiate', dict({'title': 'Big', 'filename': 'big movie.mp4', 'file_type': 'video/mp4', 'size': size}, **extra))
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def content_hash(self, data):
+        # What the browser sends (dashboard.html): SHA-256 of the chunks' SHA-256 digests
+        chunk = db_utils.CONTENT_HASH_CHUNK
+        return hashlib.sha256(b''.join(hashlib.sha256(data[i:i + chunk]).digest() for i in range(0, len(data), chunk))).hexdigest()
+
+    def upload_parts(self, video_id, size=6 * 1024 * 1024):
+        video = db_utils.get_user_video(self.user, video_id)
+        part_size = int(video['part_size'])
+        parts = []
+        for number, start in enumerate(range(0, size, part_size), start=1):
+            response = self.s3.upload_part(
+                Bucket=settings.AWS_RAW_BUCKET, Key=video['raw_s3_key'], UploadId=video['upload_id'],
+                PartNumber=number, Body=b'x' * min(part_size, size - start),
+            )
+            parts.append({'PartNumber': number, 'ETag': response['ETag']})
+        return parts
+
+    def test_full_upload(self):
+        session = self.initiate()
+        self.assertEqual(session['part_count'], 2)
+        video_id = session['video_id']
+        self.assertEqual(db_utils.get_user_video(self.user, video_id)['status'], 'UPLOADING')
+
+        urls = self.post('multipart_sign_parts', {'video_id': video_id, 'part_numbers': [1, 2]}).json()['urls']
+        self.assertEqual(set(urls), {'1', '2'})
+
+        parts = self.upload_parts(video_id)
+        listed = self.post('multipart_list_parts', {'video_id': video_id}).json()
+        self.assertEqual([p['PartNumber'] for p in listed['parts']], [1, 2])
+
+        response = self.post('multipart_complete', {'video_id': video_id, 'parts': parts})
+        self.assertEqual(response.json(), {'video_id': video_id, 'status': 'PROCESSING'})
+        video = db_utils.get_user_video(self.user, video_id)
+        self.assertEqual(video['status'], 'PROCESSING')
+        self.assertNotIn('upload_id', video)
+        head = self.s3.head_object(Bucket=settings.AWS_RAW_BUCKET, Key=video['raw_s3_key'])
+        self.assertEqual(head['ContentLength'], 6 * 1024 * 1024)
+
+        # A retried complete (lost response, double click) is answered, not a 404/500
+        response = self.post('multipart_complete', {'video_id': video_id, 'parts': parts})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['status'], 'PROCESSING')
+
+    def test_reupload_of_the_same_file_is_skipped(self):
+        content = self.content_hash(b'x' * 6 * 1024 * 1024)
+        video_id = self.initiate(content_hash=content)['video_id']
+        self.post('multipart_complete', {'video_id': video_id, 'parts': self.upload_parts(video_id)})
+        registered = self.table.get_item(Key=db_utils.content_key(self.user, content))['Item']
+        self.assertEqual(registered['target_video'], video_id)
+
+        # Still transcoding: nothing to reuse yet
+        second = self.initiate(content_hash=content)
+        self.assertNotIn('duplicate_of', second)
+        self.post('multipart_abort', {'video_id': second['video_id']})
+
+        self.table.update_item(
+            Key={'PK': f"USER#{self.user}", 'SK': f"VIDEO#{video_id}"},
+            UpdateExpression="SET #s = :ready, processed_bucket = :bucket, processed_s3_key = :key, creator_feed = :pk",
+            ExpressionAttributeNames={'#s': 'status'},
+            ExpressionAttributeValues={':ready': 'READY', ':bucket': settings.AWS_PROCESSED_BUCKET,
+                                       ':key': f"processed/{video_id}/video.mp4", ':pk': f"USER#{self.user}"},
+        )
+        response = self.initiate(content_hash=content, title='Again')
+        self.assertEqual((response['duplicate_of'], response['status']), (video_id, 'READY'))
+        original = db_utils.get_user_video(self.user, video_id)
+        copy = db_utils.get_user_video(self.user, response['video_id'])
+        self.assertEqual((copy['title'], copy['status'], copy['creator_feed']), ('Again', 'READY', f"USER#{self.user}"))
+        for field in ('raw_s3_key', 'thumbnail_key', 'processed_bucket', 'processed_s3_key'):
+            self.assertEqual(copy[field], original[field], field)
+        self.assertNotIn('upload_id', copy)
+        self.assertEqual(self.s3.list_multipart_uploads(Bucket=settings.AWS_RAW_BUCKET).get('Uploads', []), [])
+        self.assertEqual(db_utils.get_video_by_id(video_id)['SK'], f"VIDEO#{video_id}") # The CONTENT# item isn't in the video_id index
+
+        # Someone else's hash never matches
+        session = SessionStore()
+        session['user_email'], session['channel_name'] = 'other@test.local', 'Other'
+        session.save()
+        self.client.cookies[settings.SESSION_COOKIE_NAME] = session.session_key
+        self.assertNotIn('duplicate_of', self.initiate(content_hash=content))
+
+        for bad in ('ABC', content.upper(), 42, content + '0'):
+            self.assertEqual(self.post('multipart_initiate', {'filename': 'a.mp4', 'size': 10, 'content_hash': bad}).status_code, 400, bad)
+
+    def test_finish_is_idempotent(self):
+        video_id = self.initiate()['video_id']
+        self.assertTrue(db_utils.finish_video_upload(self.user, video_id))
+        self.assertFalse(db_utils.finish_video_upload(self.user, video_id))
+
+    def test_bad_input_is_400(self):
+        video_id = self.initiate()['video_id']
+        for name in ('multipart_initiate', 'multipart_sign_parts', 'multipart_list_parts', 'multipart_complete', 'multipart_abort'):
+            self.assertEqual(self.post(name, '{not json').status_code, 400, name)
+            self.assertEqual(self.post(name, '[1, 2]').status_code, 400, name)
+
+        for part_numbers in (['one'], [None], [1.5], [0], 'all', [], list(range(1, 102))):
+            response = self.post('multipart_sign_parts', {'video_id': video_id, 'part_numbers': part_numbers})
+            self.assertEqual(response.status_code, 400, part_numbers)
+
+        for parts in (None, [], [{'PartNumber': 'x', 'ETag': '"a"'}], [{'PartNumber': 1}]):
+            response = self.post('multipart_complete', {'video_id': video_id, 'parts': parts})
+            self.assertEqual(response.status_code, 400, parts)
+
+        for size in (0, -1, 'big', None):
+            response = self.post('multipart_initiate', {'filename': 'a.mp4', 'size': size})
+            self.assertEqual(response.status_code, 400, size)
+
+    def test_other_users_upload_is_not_found(self):
+        video_id = self.initiate()['video_id']
+        db_utils.create_user('other@test.local', 'pw', 'Other')
+        session = SessionStore()
+        session['user_email'] = 'other@test.local'
+        session['channel_name'] = 'Other'
+        session.save()
+        self.client.cookies[settings.SESSION_COOKIE_NAME] = session.session_key
+        response = self.post('multipart_sign_parts', {'video_id': video_id, 'part_numbers': [1]})
+        self.assertEqual(response.status_code, 404)
+
+    def test_abort(self):
+        video_id = self.initiate()['video_id']
+        self.upload_parts(video_id)
+        self.assertEqual(self.post('multipart_abort', {'video_id': video_id}).json(), {'aborted': True})
+        self.assertIsNone(db_utils.get_user_video(self.user, video_id))
+        self.assertEqual(self.s3.list_multipart_uploads(Bucket=settings.AWS_RAW_BUCKET).get('Uploads', []), [])
+
+    def test_initiate_aborts_the_s3_upload_if_the_db_write_fails(self):
+        with mock.patch('Dashboard.views.create_video_entry', side_effect=RuntimeError("DynamoDB down")):
+            response = self.post('multipart_initiate', {'filename': 'a.mp4', 'size': 1024})
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(self.s3.list_multipart_uploads(Bucket=settings.AWS_RAW_BUCKET).get('Uploads', []), [])
+
+
+@override_settings(TRANSCODE=dict(settings.TRANSCODE, BACKEND='stub'))
+class TranscodeWorkerTests(DynamoTestCase):
+    creator = 'creator@test.local'
+
+    def test_processing_video_becomes_watchable(self):
+        video_id = self.create_video(self.creator, status='PROCESSING')
+        raw_key = db_utils.get_user_video(self.creator, video_id)['raw_s3_key']
+        s3 = aws_clients.get_client('s3')
+        s3.put_object(Bucket=settings.AWS_RAW_BUCKET, Key=raw_key, Body=b'raw video bytes')
+        broken = self.create_video(self.creator, status='PROCESSING', raw_s3_key='raw/missing.mp4')
+
+        out = io.StringIO()
+        call_command('transcode_worker', once=True, workers=0, stdout=out, stderr=io.StringIO())
+
+        video = db_utils.get_user_video(self.creator, video_id)
+        self.assertEqual(video['status'], 'READY')
+        self.assertEqual(video['processed_s3_key'], f"processed/{video_id}/video.mp4")
+        body = s3.get_object(Bucket=video['processed_bucket'], Key=video['processed_s3_key'])['Body'].read()
+        self.assertEqual(body, b'raw video bytes')
+
+        # The missing upload failed its attempt and waits for a retry
+        failed = db_utils.get_user_video(self.creator, broken)
+        self.assertEqual(failed['status'], 'PROCESSING')
+        self.assertIn('last_error', failed)
+        self.assertNotIn('lease_owner', failed)
+
+        response = self.client.get(reverse('watch_video', args=[video_id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['hls_url'], reverse('hls_manifest', args=[video_id]))
+
+    def test_hls_manifest(self):
+        video_id = self.create_video(self.creator, status='PROCESSING')
+        raw_key = db_utils.get_user_video(self.creator, video_id)['raw_s3_key']
+        aws_clients.get_client('s3').put_object(Bucket=settings.AWS_RAW_BUCKET, Key=raw_key, Body=b'raw')
+        call_command('transcode_worker', once=True, workers=0, stdout=io.StringIO())
+
+        video = db_utils.get_user_video(self.creator, video_id)
+        self.assertEqual(video['hls_master_key'], f"processed/{video_id}/master.m3u8")
+
+        response = self.client.get(reverse('hls_manifest', args=[video_id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/vnd.apple.mpegurl')
+        self.assertIn('public', response['Cache-Control'])
+        self.assertIn(f"max-age={settings.HLS['MANIFEST_MAX_AGE']}", response['Cache-Control'])
+        playlist = response.content.decode()
+        self.assertTrue(playlist.startswith('#EXTM3U'))
+        # Rendition URIs are absolute (the playlist is served from our domain, the renditions from S3)
+        uris = [line for line in playlist.splitlines() if line and not line.startswith('#')]
+        self.assertEqual(uris, [
+            f"https://{settings.AWS_PROCESSED_BUCKET}.s3.amazonaws.com/processed/{video_id}/hls/360p/index.m3u8"
+        ])
+
+    @override_settings(THUMBNAILS={'ENABLED': True, 'WIDTHS': [320, 640]}, AWS_PROCESSED_BUCKET_PUBLIC=True)
+    def test_thumbnail_variants(self):
+        video_id = self.create_video(self.creator, status='PROCESSING')
+        video = db_utils.get_user_video(self.creator, video_id)
+        s3 = aws_clients.get_client('s3')
+        s3.put_object(Bucket=settings.AWS_RAW_BUCKET, Key=video['raw_s3_key'], Body=b'raw')
+        s3.put_object(Bucket=settings.AWS_PROCESSED_BUCKET, Key=video['thumbnail_key'], Body=b'jpeg bytes')
+        no_thumbnail = self.create_video(self.creator, status='PROCESSING', raw_s3_key='raw/b.mp4', thumbnail_key='thumbnails/b.jpg')
+        s3.put_object(Bucket=settings.AWS_RAW_BUCKET, Key='raw/b.mp4', Body=b'raw')
+        call_command('transcode_worker', once=True, workers=0, stdout=io.StringIO())
+
+        variants = db_utils.get_user_video(self.creator, video_id)['thumbnail_variants']
+        self.assertEqual([(v['format'], v['width']) for v in variants], [('webp', 320), ('webp', 640), ('jpeg', 320), ('jpeg', 640)])
+        self.assertEqual(variants[0]['key'], f"processed/{video_id}/thumbs/320.webp")
+        head = s3.head_object(Bucket=settings.AWS_PROCESSED_BUCKET, Key=variants[0]['key'])
+        self.assertEqual(head['ContentType'], 'image/webp')
+        # The stub backend can't grab a frame: the video is READY with its single image
+        other = db_utils.get_user_video(self.creator, no_thumbnail)
+        self.assertEqual(other['status'], 'READY')
+        self.assertNotIn('thumbnail_variants', other)
+
+        response = self.client.get(reverse('home'))
+        base = f"https://{settings.AWS_PROCESSED_BUCKET}.s3.amazonaws.com/processed/{video_id}/thumbs"
+        self.assertContains(response, f'<source type="image/webp" srcset="{base}/320.webp 320w, {base}/640.webp 640w"', html=False)
+        self.assertContains(response, f'src="{base}/640.jpg" srcset="{base}/320.jpg 320w, {base}/640.jpg 640w"')
+        self.assertContains(response, 'thumbnails/b.jpg" alt="A video" class="thumb-img" loading="lazy"')
+
+    @override_settings(HLS=dict(settings.HLS, ENABLED=False))
+    def test_mp4_only_video_has_no_manifest(self):
+        video_id = self.create_video(self.creator, status='PROCESSING')
+        raw_key = db_utils.get_user_video(self.creator, video_id)['raw_s3_key']
+        aws_clients.get_client('s3').put_object(Bucket=settings.AWS_RAW_BUCKET, Key=raw_key, Body=b'raw')
+        call_command('transcode_worker', once=True, workers=0, stdout=io.StringIO())
+
+        self.assertEqual(self.client.get(reverse('hls_manifest', args=[video_id])).status_code, 404)
+        response = self.client.get(reverse('watch_video', args=[video_id]))
+        self.assertIsNone(response.context['hls_url'])
+        self.assertContains(response, 'type="video/mp4"')
+
+
+class MetricsTests(DynamoTestCase):
+    creator = 'creator@test.local'
+
+    def setUp(self):
+        super().setUp()
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+        db_utils.create_user(self.creator, 'pw', 'Creator')
+        self.video_id = self.create_video(
+            self.creator, processed_bucket=settings.AWS_PROCESSED_BUCKET, processed_s3_key='processed/a.mp4',
+        )
+        db_cache.get_backend().clear()
+
+    def test_calls_are_counted_per_view(self):
+        self.assertEqual(self.client.get(reverse('watch_video', args=[self.video_id])).status_code, 200)
+        self.assertEqual(metrics.requests_total.value(('watch_video', 'GET', '200')), 1)
+        self.assertEqual(metrics.request_seconds.count(('watch_video',)), 1)
+        self.assertEqual(metrics.aws_calls_total.value(('watch_video', 'dynamodb', 'BatchGetItem')), 1)
+        self.assertGreaterEqual(metrics.aws_call_seconds.count(('dynamodb', 'BatchGetItem')), 1)
+
+        text = self.client.get(reverse('metrics')).content.decode()
+        self.assertIn('cloudstream_aws_calls_total{view="watch_video",service="dynamodb",operation="BatchGetItem"} 1', text)
+        self.assertIn('cloudstream_http_request_duration_seconds_bucket{view="watch_video",le="+Inf"} 1', text)
+
+    def test_capacity_is_counted_per_db_utils_function(self):
+        db_utils.get_user_video(self.creator, self.video_id)
+        self.assertGreater(metrics.capacity_total.value(('get_user_video', 'GetItem', 'read')), 0)
+
+    def test_presign_timings(self):
+        session = SessionStore()
+        session['user_email'] = self.creator
+        session['channel_name'] = 'Creator'
+        session.save()
+        self.client.cookies[settings.SESSION_COOKIE_NAME] = session.session_key
+        body = {'title': 'T', 'filename': 'a.mp4', 'file_type': 'video/mp4'}
+        self.client.post(reverse('get_upload_url'), json.dumps(body), content_type='application/json')
+        self.assertEqual(metrics.presign_seconds.count(('put_object',)), 2) # Video and thumbnail
+        self.assertEqual(metrics.aws_calls_total.value(('get_upload_url', 's3', 'presign.put_object')), 2)
+
+    @override_settings(METRICS=dict(settings.METRICS, SLOW_REQUEST_MS=0))
+    def test_slow_requests_are_logged_with_their_calls(self):
+        with self.assertLogs('cloudstream.metrics', 'WARNING') as logs:
+            self.client.get(reverse('watch_video', args=[self.video_id]))
+        self.assertIn('(watch_video) 200', logs.output[0])
+        self.assertIn('dynamodb.BatchGetItem x1', logs.output[0])
+
+    @override_settings(METRICS=dict(settings.METRICS, TOKEN='secret'))
+    def test_token(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+
+
+class WarmupTests(DynamoTestCase):
+    def setUp(self):
+        super().setUp()
+        warmup.reset()
+        self.addCleanup(warmup.reset)
+
+    def test_probe_is_503_until_warm(self):
+        self.assertEqual(self.client.get('/ready').status_code, 200) # Never started: nothing to wait for
+        release = threading.Event()
+        with mock.patch.dict(warmup.STEPS, {'slow': release.wait}):
+            thread = warmup.start(['slow'])
+            # Answered ahead of ALLOWED_HOSTS: probes come to the pod's IP
+            response = self.client.get('/ready', HTTP_HOST='10.0.0.7')
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response.json()['steps'], {'slow': {'status': 'pending'}})
+            release.set()
+            thread.join(timeout=5)
+        response = self.client.get('/ready')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['steps']['slow']['status'], 'ok')
+
+    def test_steps_build_clients_and_open_connections(self):
+        aws_clients.reset_clients()
+        warmup.run(['views', 'dynamodb', 's3'])
+        state = warmup.status()
+        self.assertTrue(state['ready'])
+        self.assertEqual({name: step['status'] for name, step in state['steps'].items()},
+                         {'views': 'ok', 'dynamodb': 'ok', 's3': 'ok'})
+        self.assertEqual(set(aws_clients._state['clients']), {'dynamodb', 's3'})
+        self.assertIsNone(self.table.get_item(Key=warmup.PROBE_KEY).get('Item'))
+
+    @override_settings(WARMUP=dict(settings.WARMUP, RETRY_SECONDS=0))
+    def test_failed_steps_are_retried(self):
+        flaky = mock.Mock(side_effect=[ConnectionError('unreachable'), None])
+        with mock.patch.dict(warmup.STEPS, {'flaky': flaky}):
+            warmup.run(['flaky'])
+        self.assertEqual(flaky.call_count, 2)
+        self.assertTrue(warmup.is_ready())
+
+    def test_only_server_processes_warm_up(self):
+        for argv, environ, serving in [
+            (['uvicorn', 'Cloudstream.asgi:application'], {}, False), # Until asgi.py marks it
+            (['manage.py', 'test'], {}, False),
+            (['manage.py', 'runserver'], {}, False), # The autoreloader
+            (['manage.py', 'runserver'], {'RUN_MAIN': 'true'}, True),
+            (['manage.py', 'runserver', '--noreload'], {}, True),
+        ]:
+            with mock.patch.object(sys, 'argv', argv), mock.patch.dict(os.environ, environ):
+                self.assertEqual(warmup.serving(), serving, argv)
+        with mock.patch.object(warmup, '_server', True):
+            self.assertTrue(warmup.serving())
+            with mock.patch('multiprocessing.parent_process', return_value=object()): # A hashing process
+                self.assertFalse(warmup.serving())
+
+
+@override_settings(BULK_IMPORT=dict(settings.BULK_IMPORT, MULTIPART_COPY_THRESHOLD=5 * 1024 * 1024, COPY_PART_SIZE=5 * 1024 * 1024))
+class ImportVideosTests(DynamoTestCase):
+    creator = 'creator@test.local'
+
+    def setUp(self):
+        super().setUp()
+        db_utils.create_user(self.creator, 'pw', 'Creator')
+        self.s3 = aws_clients.get_client('s3')
+        self.s3.create_bucket(Bucket='legacy')
+        self.s3.put_object(Bucket='legacy', Key='originals/a b.mov', Body=b'a' * 1000, ContentType='video/quicktime')
+        self.s3.put_object(Bucket='legacy', Key='web/a.mp4', Body=b'p' * 1000)
+        self.s3.put_object(Bucket='legacy', Key='thumbs/a.jpg', Body=b'jpeg')
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def write_manifest(self, rows, name='manifest.jsonl'):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as f:
+            f.writelines(json.dumps(row) + '\n' for row in rows)
+        return path
+
+    def import_videos(self, *args):
+        out = io.StringIO()
+        call_command('import_videos', *args, stdout=out, stderr=out)
+        return out.getvalue()
+
+    def videos(self):
+        return {item['video_id']: item for item in self.table.scan()['Items'] if item['SK'].startswith('VIDEO#')}
+
+    def test_imports_rows_with_their_media(self):
+        path = self.write_manifest([
+            {'email': self.creator, 'title': 'Old talk', 'source': 's3://legacy/originals/a b.mov',
+             'processed_source': 's3://legacy/web/a.mp4', 'thumbnail': 's3://legacy/thumbs/a.jpg',
+             'created_at': '2019-05-01T12:00:00'},
+            {'email': self.creator, 'title': 'Raw only', 'source': 's3://legacy/originals/a b.mov', 'video_id': 'v2'},
+            {'email': 'nobody@test.local', 'title': 'Orphan', 'source': 's3://legacy/originals/a b.mov'},
+            {'email': self.creator, 'title': 'No source'},
+        ])
+        output = self.import_videos(path)
+        self.assertIn("Imported 2 of 4 row(s) (1 READY, 1 PROCESSING), 2 failed", output)
+        self.assertIn("row 3: ManifestError: No account for nobody@test.local", output)
+
+        videos = self.videos()
+        self.assertEqual(len(videos), 2)
+        raw_only = videos.pop('v2')
+        self.assertEqual((raw_only['status'], raw_only['priority']), ('PROCESSING', -1))
+        self.assertEqual(raw_only['raw_s3_key'], 'v2_a_b.mov')
+        [(video_id, ready)] = videos.items()
+        self.assertEqual((ready['status'], ready['channel_name'], ready['created_at']), ('READY', 'Creator', 1556712000))
+        self.assertEqual(ready['creator_feed'], f"USER#{self.creator}")
+        processed = self.s3.get_object(Bucket=settings.AWS_PROCESSED_BUCKET, Key=ready['processed_s3_key'])
+        self.assertEqual(processed['Body'].read(), b'p' * 1000)
+        raw = self.s3.head_object(Bucket=settings.AWS_RAW_BUCKET, Key=ready['raw_s3_key'])
+        self.assertEqual(raw['ContentType'], 'video/quicktime')
+        self.s3.head_object(Bucket=settings.AWS_PROCESSED_BUCKET, Key=ready['thumbnail_key'])
+        # On the home page straight away
+        self.assertContains(self.client.get(reverse('home')), 'Old talk')
+
+        # Same manifest again: nothing left to do; from scratch: the same items, no duplicates
+        self.assertIn("0 of 0 row(s)", self.import_videos(path))
+        self.import_videos(path, '--restart')
+        self.assertEqual(set(self.videos()), {video_id, 'v2'})
+
+    def test_resumes_after_the_checkpoint(self):
+        rows = [{'email': self.creator, 'title': f"Video {n}", 'source': 's3://legacy/originals/a b.mov', 'video_id': f"v{n}"}
+                for n in range(1, 31)]
+        path = self.write_manifest(rows)
+        with open(f"{path}.checkpoint.json", 'w') as f:
+            json.dump({'manifest': os.path.abspath(path), 'done_through': 27, 'failed': {}}, f)
+        output = self.import_videos(path)
+        self.assertIn("Resuming after row 27", output)
+        self.assertIn("Imported 3 of 3 row(s)", output)
+        self.assertEqual(set(self.videos()), {'v28', 'v29', 'v30'})
+        with open(f"{path}.checkpoint.json") as f:
+            self.assertEqual(json.load(f)['done_through'], 30)
+
+    def test_csv_manifest_and_unprocessed_items(self):
+        path = os.path.join(self.directory, 'manifest.csv')
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, ['email', 'title', 'source', 'video_id', 'description'])
+            writer.writeheader()
+            for n in range(30):
+                writer.writerow({'email': self.creator, 'title': f"Video {n}", 'source': 's3://legacy/web/a.mp4', 'video_id': f"c{n}"})
+        original = BaseClient._make_api_call
+        throttled = []
+
+        def make_api_call(client, operation_name, params):
+            # The first BatchWriteItem only gets its first item through
+            if operation_name == 'BatchWriteItem' and not throttled:
+                throttled.append(True)
+                table, requests = next(iter(params['RequestItems'].items()))
+                original(client, operation_name, {'RequestItems': {table: requests[:1]}})
+                return {'UnprocessedItems': {table: requests[1:]}}
+            return original(client, operation_name, params)
+
+        with mock.patch.object(BaseClient, '_make_api_call', make_api_call), \
+                mock.patch('UserLogin.bulk_import.time.sleep'):
+            output = self.import_videos(path, '--write-threads', '1')
+        self.assertIn("Imported 30 of 30 row(s)", output)
+        self.assertIn("BatchWriteItem: 3 call(s), 1 retried for UnprocessedItems", output)
+        self.assertEqual(len(self.videos()), 30)
+
+    def test_large_objects_are_copied_in_parts(self):
+        body = os.urandom(11 * 1024 * 1024)
+        self.s3.put_object(Bucket='legacy', Key='big.mp4', Body=body, ContentType='video/mp4')
+        calls = []
+        original = self.s3.upload_part_copy
+        with mock.patch.object(self.s3, 'upload_part_copy', side_effect=lambda **kw: calls.append(kw) or original(**kw)):
+            size = s3_utils.copy_object('legacy', 'big.mp4', settings.AWS_RAW_BUCKET, 'big.mp4',
+                                        threshold=5 * 1024 * 1024, part_size=5 * 1024 * 1024)
+        self.assertEqual(size, len(body))
+        self.assertEqual([call['CopySourceRange'] for call in calls],
+                         ['bytes=0-5242879', 'bytes=5242880-10485759', 'bytes=10485760-11534335'])
+        copied = self.s3.get_object(Bucket=settings.AWS_RAW_BUCKET, Key='big.mp4')
+        self.assertEqual((copied['Body'].read() == body, copied['ContentType']), (True, 'video/mp4'))
+
+
+class EnsureIndexesTests(DynamoTestCase):
+    def setUp(self):
+        from Dashboard.management.commands._standin import _create_table, drop_table
+        super().setUp()
+        drop_table()
+        _create_table(aws_clients.get_client('dynamodb')) # A table from before the indexes
+        self.dynamodb = aws_clients.get_client('dynamodb')
+
+    def indexes(self):
+        table = self.dynamodb.describe_table(TableName=settings.DYNAMO_TABLE)['Table']
+        return {gsi['IndexName']: gsi['IndexStatus'] for gsi in table.get('GlobalSecondaryIndexes', [])}
+
+    def test_creates_missing_indexes_and_backfills(self):
+        self.table.put_item(Item={'PK': 'USER#old@test.local', 'SK': 'VIDEO#v1', 'status': 'READY', 'title': 'Old'})
+        self.table.put_item(Item={'PK': 'USER#old@test.local', 'SK': 'VIDEO#v2', 'status': 'PROCESSING', 'created_at': 5})
+        self.table.put_item(Item={'PK': 'USER#fan@test.local', 'SK': 'INBOX#000000000000#v1', 'video_id': 'v1',
+                                  'video_pk': 'USER#old@test.local', 'video_sk': 'VIDEO#v1'})
+        self.assertEqual(self.indexes(), {})
+
+        out = io.StringIO()
+        call_command('ensure_indexes', poll_interval=0, stdout=out)
+        self.assertEqual(self.indexes(), {index['IndexName']: 'ACTIVE' for index in db_utils.TABLE_INDEXES})
+        self.assertIn('2 of 2 video items patched, video_id removed from 1 inbox entries', out.getvalue())
+
+        ready = db_utils.get_user_video('old@test.local', 'v1')
+        self.assertEqual((ready['video_id'], ready['created_at'], ready['creator_feed']), ('v1', 0, 'USER#old@test.local'))
+        processing = db_utils.get_user_video('old@test.local', 'v2')
+        self.assertEqual((processing['video_id'], processing['created_at']), ('v2', 5))
+        self.assertNotIn('creator_feed', processing) # Only READY videos are in the creator feed
+        self.assertEqual(db_utils.get_video_by_id('v1')['title'], 'Old')
+
+        # Idempotent: nothing left to create or patch
+        out = io.StringIO()
+        call_command('ensure_indexes', poll_interval=0, stdout=out)
+        self.assertEqual(out.getvalue().count('already exists'), len(db_utils.TABLE_INDEXES))
+        self.assertIn('0 of 2 video items patched, video_id removed from 0 inbox entries', out.getvalue())
+
+    def test_gives_up_on_an_index_that_never_goes_active(self):
+        describe = self.dynamodb.describe_table
+
+        def creating(**kwargs):
+            response = describe(**kwargs)
+            for gsi in response['Table'].get('GlobalSecondaryIndexes', []):
+                gsi['IndexStatus'] = 'CREATING'
+            return response
+
+        with mock.patch.object(self.dynamodb, 'describe_table', side_effect=creating):
+            with self.assertRaisesMessage(CommandError, 'still CREATING after 0s'):
+                call_command('ensure_indexes', timeout=0, poll_interval=0, stdout=io.StringIO())
+        self.assertEqual(list(self.indexes()), [db_utils.TABLE_INDEXES[0]['IndexName']]) # One at a time
+
+
+class BenchmarkDatasetTests(DynamoTestCase):
+    def test_counters_match_the_items(self):
+        from Dashboard.management.commands._dataset import Dataset
+
+        dataset = Dataset(users=30, videos=40, reactions=200, subscriptions=60, creators=5, seed=7)
+        counts = dataset.write(workers=2)
+        self.assertEqual((counts['users'], counts['videos'], counts['reactions']), (30, 40, 200))
+        self.assertEqual(dataset.stored_params(), dataset.params())
+
+        items = self.table.scan()['Items']
+        reactions = [item for item in items if item['SK'].startswith('REACTION#')]
+        for video in range(dataset.videos):
+            key = dataset.video_key(video)
+            stored = db_utils.get_user_video(key['PK'][len('USER#'):], dataset.video_id(video))
+            mine = [r['type'] for r in reactions if r['SK'] == f"REACTION#{dataset.video_id(video)}"]
+            self.assertEqual((stored['likes'], stored['dislikes']), (mine.count('LIKE'), mine.count('DISLIKE')))
+        subscriptions = [item for item in items if item['SK'].startswith('SUB#')]
+        self.assertEqual(len(subscriptions), counts['subscriptions'])
+        self.assertEqual(
+            sum(int(db_utils.get_subscriber_count(dataset.user_email(c))) for c in range(dataset.creators)),
+            len(subscriptions),
+        )
+        # Same parameters, same data set
+        self.assertEqual(Dataset(users=30, videos=40, reactions=200, subscriptions=60, creators=5, seed=7).video_id(3),
+                         dataset.video_id(3))
+
+    def test_meter_counts_calls_per_operation(self):
+        from Dashboard.management.commands._standin import AwsMeter
+
+        video_id = self.create_video()
+        with AwsMeter() as meter:
+            before, _ = meter.snapshot()
+            db_utils.get_user_video('creator@test.local', video_id)
+            calls, units = meter.snapshot()
+        self.assertEqual(calls - before, {'dynamodb.GetItem': 1})
+        self.assertGreaterEqual(units['read'], 0)
+        db_utils.get_user_video('creator@test.local', 'other') # Uninstalled: not counted
+        self.assertEqual(meter.snapshot()[0]['dynamodb.GetItem'], 1)
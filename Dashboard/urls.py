@@ -4,9 +4,19 @@ from . import views
 urlpatterns = [
     # Core
     path('', views.home_view, name='home'),
+    path('search/', views.search_view, name='search'),
+    path('subscriptions/', views.subscriptions_view, name='subscriptions'),
     path('/Dashboard',views.Dashboard,name='dashboard'),
     path('get-upload-url/', views.get_upload_url, name='get_upload_url'),
+    path('api/upload/multipart/initiate/', views.multipart_initiate, name='multipart_initiate'),
+    path('api/upload/multipart/sign-parts/', views.multipart_sign_parts, name='multipart_sign_parts'),
+    path('api/upload/multipart/parts/', views.multipart_list_parts, name='multipart_list_parts'),
+    path('api/upload/multipart/complete/', views.multipart_complete, name='multipart_complete'),
+    path('api/upload/multipart/abort/', views.multipart_abort, name='multipart_abort'),
     path('watch/<str:video_id>/', views.watch_video, name='watch_video'),
+    path('watch/<str:video_id>/master.m3u8', views.hls_manifest, name='hls_manifest'),
     path('api/subscribe/', views.subscribe_view, name='subscribe'),
     path('api/reaction/', views.reaction_view, name='reaction'),
+    path('api/feed/', views.feed_api, name='feed_api'),
+    path('metrics', views.metrics_view, name='metrics'),
 ]
\ No newline at end of file
@@ -1,11 +1,19 @@
-import json,boto3,uuid,re
+import asyncio,hmac,json,uuid,re,time
 from django.shortcuts import render,redirect
-from django.http import JsonResponse,Http404
+from django.http import HttpResponse,JsonResponse,Http404
+from django.urls import reverse
+from django.utils.cache import patch_cache_control
+from django.template.loader import render_to_string
 from django.views.decorators.csrf import csrf_exempt
 from django.conf import settings
-from UserLogin.db_utils import create_video_entry,get_video_by_id,get_user_videos,get_table,get_all_videos,toggle_subscription, get_subscriber_count, is_subscribed,update_reaction, get_user_reaction, get_video_stats
+from UserLogin.db_utils import create_video_entry,get_video_by_id,get_user_videos,get_table,get_videos_page,toggle_subscription, get_subscriber_count, is_subscribed,update_reaction, get_user_reaction, get_video_stats
+from UserLogin.db_utils import ItemLoader, load_public_profile, load_is_subscribed, load_user_reaction, load_video_stats, load_related_videos
+from UserLogin import async_db_utils as adb
+from UserLogin.db_utils import get_user_video, finish_video_upload, delete_video_entry, find_duplicate, create_duplicate_entry, CONTENT_HASH_CHUNK
 from UserLogin.s3_utils import generate_presigned_url
-from boto3.dynamodb.conditions import Key
+from UserLogin.presign import media_url
+from UserLogin.hls import PLAYLIST_TYPE
+from UserLogin import s3_utils, view_counts, search_index, page_cache, metrics
 
 
 # 1. View to render the HTML page
@@ -70,88 +78,421 @@ def get_upload_url(request):
             
     return JsonResponse({'error': 'POST method required'}, status=400)
 
-def watch_video(request, video_id):
+# 3. Multipart upload API (large videos, parallel parts, resumable)
+# initiate -> sign-parts (in batches) -> PUT parts straight to S3 -> complete
+# parts lets the browser resume an interrupted upload; abort throws it away.
+
+MAX_SIGN_BATCH = 100
+REACTION_ACTIONS = ('LIKE', 'DISLIKE', 'NONE')
+CONTENT_HASH = re.compile(r'[0-9a-f]{64}') # SHA-256 tree hash of the file (db_utils.CONTENT_HASH_CHUNK)
+
+def _json_body(request):
+    # Parsed JSON object from the request body, or None if it isn't one
+    try:
+        data = json.loads(request.body)
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+def _part_numbers(values):
+    # [1, 2, ...] from the client, or None if any of them isn't a whole number
+    if not isinstance(values, list):
+        return None
+    try:
+        numbers = [int(n) for n in values]
+    except (TypeError, ValueError):
+        return None
+    if any(isinstance(n, float) and n != int(n) for n in values):
+        return None
+    return numbers
+
+def _multipart_video(request, data, in_progress=True):
+    # The video must belong to the logged-in user (and by default still be mid-upload)
+    video_id = data.get('video_id')
+    if not isinstance(video_id, str) or not video_id:
+        return None
+    video = get_user_video(request.session['user_email'], video_id)
+    if not video or (in_progress and not video.get('upload_id')):
+        return None
+    return video
+
+@csrf_exempt
+def multipart_initiate(request):
+    if request.method != 'POST':
+        return JsonResponse({'error': 'POST method required'}, status=400)
+    if 'user_email' not in request.session:
+        return JsonResponse({'error': 'Unauthorized'}, status=403)
+
+    data = _json_body(request)
+    if data is None:
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    try:
+        file_size = int(data.get('size', 0))
+    except (TypeError, ValueError):
+        file_size = 0
+    if file_size <= 0 or file_size > s3_utils.MAX_OBJECT_SIZE:
+        return JsonResponse({'error': 'Invalid file size'}, status=400)
+    content_hash = data.get('content_hash')
+    if content_hash is not None and not (isinstance(content_hash, str) and CONTENT_HASH.fullmatch(content_hash)):
+        return JsonResponse({'error': 'content_hash must be 64 lowercase hex digits'}, status=400)
+
+    try:
+        user_email = request.session['user_email']
+        title = str(data.get('title') or 'Untitled')
+
+        # Uploaded this file before: a new video on the same media, nothing to upload or transcode
+        original = find_duplicate(user_email, content_hash) if content_hash else None
+        if original:
+            video_id = create_duplicate_entry(user_email, original, title, request.session['channel_name'])
+            return JsonResponse({'video_id': video_id, 'duplicate_of': original['video_id'], 'status': 'READY'})
+
+        file_type = data.get('file_type') or 'application/octet-stream'
+
+        clean_filename = re.sub(r'[^a-zA-Z0-9._-]', '_', str(data.get('filename') or 'video'))
+        unique_uuid = uuid.uuid4()
+        video_s3_key = f"{unique_uuid}_{clean_filename}"
+        thumb_s3_key = f"thumbnails/{unique_uuid}.jpg"
+
+        part_size = s3_utils.choose_part_size(file_size)
+        upload_id = s3_utils.create_multipart_upload(video_s3_key, file_type, settings.AWS_RAW_BUCKET)
+
+        # Stays UPLOADING (invisible to the transcoder) until complete
+        try:
+            extra = {'upload_id': upload_id, 'part_size': part_size, 'file_size': file_size}
+            if content_hash:
+                extra['content_hash'] = content_hash # Registered once the upload completes
+            video_id = create_video_entry(
+                user_email, title, video_s3_key, thumb_s3_key,
+                request.session['channel_name'],
+                status='UPLOADING',
+                extra=extra
+            )
+        except Exception:
+            # Nothing would ever point at this upload again: don't leave its parts billing in S3
+            s3_utils.abort_multipart_upload(video_s3_key, upload_id, settings.AWS_RAW_BUCKET)
+            raise
+
+        return JsonResponse({
+            'video_id': video_id,
+            'part_size': part_size,
+            'part_count': max(1, -(-file_size // part_size)),
+            'thumb_upload_url': generate_presigned_url(thumb_s3_key, 'image/jpeg', settings.AWS_PROCESSED_BUCKET)
+        })
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+@csrf_exempt
+def multipart_sign_parts(request):
+    if request.method != 'POST':
+        return JsonResponse({'error': 'POST method required'}, status=400)
+    if 'user_email' not in request.session:
+        return JsonResponse({'error': 'Unauthorized'}, status=403)
+
+    data = _json_body(request)
+    if data is None:
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    video = _multipart_video(request, data)
+    if not video:
+        return JsonResponse({'error': 'Upload not found'}, status=404)
+
+    part_numbers = _part_numbers(data.get('part_numbers', []))
+    if not part_numbers or len(part_numbers) > MAX_SIGN_BATCH or not all(1 <= n <= s3_utils.MAX_PARTS for n in part_numbers):
+        return JsonResponse({'error': f'Send 1-{MAX_SIGN_BATCH} part numbers between 1 and {s3_utils.MAX_PARTS}'}, status=400)
+
+    urls = s3_utils.presign_upload_parts(video['raw_s3_key'], video['upload_id'], part_numbers, settings.AWS_RAW_BUCKET)
+    return JsonResponse({'urls': {str(n): url for n, url in urls.items()}})
+
+@csrf_exempt
+def multipart_list_parts(request):
+    if request.method != 'POST':
+        return JsonResponse({'error': 'POST method required'}, status=400)
+    if 'user_email' not in request.session:
+        return JsonResponse({'error': 'Unauthorized'}, status=403)
+
+    data = _json_body(request)
+    if data is None:
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    video = _multipart_video(request, data)
+    if not video:
+        return JsonResponse({'error': 'Upload not found'}, status=404)
+
+    parts = s3_utils.list_uploaded_parts(video['raw_s3_key'], video['upload_id'], settings.AWS_RAW_BUCKET)
+    return JsonResponse({
+        'part_size': int(video['part_size']),
+        'parts': parts
+    })
+
+@csrf_exempt
+def multipart_complete(request):
+    if request.method != 'POST':
+        return JsonResponse({'error': 'POST method required'}, status=400)
+    if 'user_email' not in request.session:
+        return JsonResponse({'error': 'Unauthorized'}, status=403)
+
+    data = _json_body(request)
+    if data is None:
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    video = _multipart_video(request, data, in_progress=False)
+    if not video:
+        return JsonResponse({'error': 'Upload not found'}, status=404)
+    if not video.get('upload_id'):
+        # Already completed (retry after a lost response, double click): same answer again
+        return JsonResponse({'video_id': video['video_id'], 'status': video.get('status')})
+
+    parts = data.get('parts')
+    if not isinstance(parts, list) or not parts or not all(
+        isinstance(p, dict) and isinstance(p.get('ETag'), str) and _part_numbers([p.get('PartNumber')])
+        for p in parts
+    ):
+        return JsonResponse({'error': 'parts must be a list of {PartNumber, ETag}'}, status=400)
+
+    try:
+        s3_utils.complete_multipart_upload(video['raw_s3_key'], video['upload_id'], parts, settings.AWS_RAW_BUCKET)
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    # False means a concurrent request finished it first, which is just as done
+    finish_video_upload(request.session['user_email'], video['video_id'])
+    return JsonResponse({'video_id': video['video_id'], 'status': 'PROCESSING'})
+
+@csrf_exempt
+def multipart_abort(request):
+    if request.method != 'POST':
+        return JsonResponse({'error': 'POST method required'}, status=400)
+    if 'user_email' not in request.session:
+        return JsonResponse({'error': 'Unauthorized'}, status=403)
+
+    data = _json_body(request)
+    if data is None:
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    video = _multipart_video(request, data)
+    if not video:
+        return JsonResponse({'error': 'Upload not found'}, status=404)
+
+    s3_utils.abort_multipart_upload(video['raw_s3_key'], video['upload_id'], settings.AWS_RAW_BUCKET)
+    delete_video_entry(request.session['user_email'], video['video_id'])
+    return JsonResponse({'aborted': True})
+
+# The read-heavy views below are async: under ASGI (Cloudstream/asgi.py) the
+# blocking boto3 calls run on async_db_utils' thread pool, so one worker keeps
+# serving other requests while these wait on DynamoDB.
+
+async def watch_video(request, video_id):
     # 1. Fetch Video Metadata from DynamoDB
-    # We need to scan/query because we don't have the user's email in the URL
-    # (In a real app, you'd put the username in the URL too, but this works for now)
-    
-    table = get_table()
-    
-    # We use the GSI (Global Secondary Index) if you have one, 
-    # OR we scan. Since we don't have a GSI yet, we have to SCAN (Not efficient, but works for prototype)
-    response = table.scan(
-        FilterExpression=boto3.dynamodb.conditions.Attr('video_id').eq(video_id)
-    )
-    
-    items = response.get('Items', [])
-    if not items:
+    # We don't have the user's email in the URL, so look it up on the video_id GSI
+    # (a single Query, no matter how big the table gets)
+    video_data = await adb.get_video_by_id(video_id)
+    if not video_data:
         raise Http404("Video not found")
-        
-    video_data = items[0]
     
     # 2. Check if it's actually ready
     if video_data.get('status') != 'READY':
         return render(request, 'processing.html') # Optional: Make a "Still Processing" page
 
-    bucket_name = video_data['processed_bucket']
-    object_key = video_data['processed_s3_key']
+    # Buffered in memory, written out in batches (UserLogin/view_counts.py)
+    view_counts.record_view(video_data, view_counts.viewer_id(request))
 
-    import urllib.parse
-    safe_key = urllib.parse.quote(object_key)
-    video_url = f"https://{bucket_name}.s3.amazonaws.com/{safe_key}"
+    video_url = media_url(video_data['processed_bucket'], video_data['processed_s3_key'])
+    # Adaptive bitrate when the transcoder packaged HLS renditions; the MP4 stays the fallback
+    hls_url = reverse('hls_manifest', args=[video_id]) if video_data.get('hls_master_key') else None
 
     creator_email = video_data['PK'].split('#')[1]
     
-    sub_count = get_subscriber_count(creator_email)
+    # 3. Queue the per-viewer lookups and resolve them in one BatchGetItem
+    # (anything already in the cache doesn't even make it into the batch)
+    loader = ItemLoader()
+    profile = load_public_profile(loader, creator_email)
+    stats = load_video_stats(loader, video_data['PK'], video_data['SK']) # Summed over shards for hot videos
+    related = load_related_videos(loader, video_data['PK'], video_id) # Precomputed by build_related
 
-    user_is_subscribed = False
+    user_is_subscribed = user_reaction = None
     if 'user_email' in request.session:
-        user_is_subscribed = is_subscribed(request.session['user_email'], creator_email)
+        user_is_subscribed = load_is_subscribed(loader, request.session['user_email'], creator_email)
+        user_reaction = load_user_reaction(loader, request.session['user_email'], video_id)
+    await adb.dispatch(loader)
+
+    # Everything the page shows came from cached lookups (on a repeat visit,
+    # all of them hits): if none of it changed, skip the render
+    related_videos = related.get()
+    related_version = [video['video_id'] for video in related_videos]
+    tag = page_cache.etag(
+        'watch', video_id, request.session.get('user_email'), video_data.get('processed_at'),
+        video_data.get('hls_master_key'), int(video_data.get('views', 0)), stats.get(), profile.get(),
+        user_is_subscribed.get() if user_is_subscribed else None, user_reaction.get() if user_reaction else None,
+        related_version,
+    )
+    unchanged = page_cache.not_modified(request, tag)
+    if unchanged:
+        return unchanged
 
     context = {
         'video_url': video_url,
+        'hls_url': hls_url,
+        'video_id': video_id,
         'title': video_data.get('title', 'Unknown Video'),
         'description': video_data.get('description', ''),
-        'likes': video_data.get('likes', 0),
-        'dislikes': video_data.get('dislikes', 0),
-        'user_reaction': get_user_reaction, # 'LIKE', 'DISLIKE' or None
+        'views': int(video_data.get('views', 0)),
+        'likes': stats.get()['likes'],
+        'dislikes': stats.get()['dislikes'],
+        'user_reaction': user_reaction.get() if user_reaction else None, # 'LIKE', 'DISLIKE' or None
         'creator_email': creator_email, # Need this for the API call
-        'sub_count': int(sub_count),
-        'is_subscribed': user_is_subscribed
+        'sub_count': int((profile.get() or {}).get('subscribers', 0)),
+        'is_subscribed': user_is_subscribed.get() if user_is_subscribed else False,
+        'videos': related_videos,
+        # The sidebar is a shared fragment, per related list
+        'related_version': page_cache.etag(related_version),
+        'fragment_timeout': page_cache.fragment_timeout(),
+        'fragment_cache': settings.PAGE_CACHE['FRAGMENT_CACHE'],
     }
     
-    return render(request, 'watch.html', context)
-    
-    return render(request, 'watch.html', context)
-def Dashboard(request):
+    return page_cache.finish(render(request, 'watch.html', context), tag, private='user_email' in request.session)
+async def hls_manifest(request, video_id):
+    # Master playlist for hls.js / Safari. The renditions and segments it points
+    # at are fetched straight from S3; only this small file goes through Django.
+    video_data = await adb.get_video_by_id(video_id)
+    if not video_data or video_data.get('status') != 'READY' or not video_data.get('hls_master_key'):
+        raise Http404("No HLS renditions for this video")
+
+    playlist = await adb.public_master_playlist(video_data)
+    response = HttpResponse(playlist, content_type=PLAYLIST_TYPE)
+    # VOD playlists don't change, so browsers and CDNs may keep them for a while
+    patch_cache_control(response, public=True, max_age=settings.HLS['MANIFEST_MAX_AGE'])
+    return response
+
+async def Dashboard(request):
     if 'user_email' not in request.session:
         return redirect('login')
     
     user_email = request.session['user_email']
-    
+    channel_name = request.session.get('channel_name', 'My Channel')
+
+    # 0. Unchanged since the browser's copy? (both cached lookups: no Query)
+    (version, updated_at), sub_count = await asyncio.gather(
+        adb.get_page_version(page_cache.user_videos_scope(user_email)),
+        adb.get_subscriber_count(user_email),
+    )
+    tag = page_cache.etag('dashboard', user_email, channel_name, version, int(sub_count))
+    unchanged = page_cache.not_modified(request, tag, updated_at)
+    if unchanged:
+        return unchanged
+
     # 1. Fetch Videos from DB
-    my_videos = get_user_videos(user_email)
+    my_videos = await adb.get_user_videos(user_email)
     
     context = {
-        'channel_name': request.session.get('channel_name', 'My Channel'),
+        'channel_name': channel_name,
         'email': user_email,
-        'videos': my_videos # Pass the list to the HTML
+        'videos': my_videos, # Pass the list to the HTML
+        'sub_count': int(sub_count),
+        'content_hash_chunk': CONTENT_HASH_CHUNK,
     }
-    return render(request, 'dashboard.html', context)
+    return page_cache.finish(render(request, 'dashboard.html', context), tag, updated_at, private=True)
 
-def home_view(request):
-    # Fetch all content
-    all_videos = get_all_videos()
+async def home_view(request):
+    # Fetch the first page of the feed (one Query on the feed index)
+    # ?cursor= is the no-JS "Load more" fallback; infinite scroll uses feed_api
+    cursor = request.GET.get('cursor')
+    user_email = request.session.get('user_email')
+    # Same feed version, cursor and window as the browser's copy: 304, no Query.
+    # View counts on the cards move on with the window
+    version, updated_at = await adb.get_page_version(page_cache.FEED)
+    last_modified = max(updated_at, page_cache.window())
+    tag = page_cache.etag('home', user_email, version, cursor, page_cache.window())
+    unchanged = page_cache.not_modified(request, tag, last_modified)
+    if unchanged:
+        return unchanged
+
+    try:
+        videos, next_cursor = await adb.feed_page(cursor, version) # Cached per feed version
+    except ValueError:
+        return redirect('home') # Bad/expired cursor: start from the top
     
     context = {
-        'videos': all_videos,
+        'videos': videos,
+        'cursor': cursor, # Only the first page gets the "No videos yet" empty state
+        'next_cursor': next_cursor,
         # Check if user is logged in (to show "Login" vs "Logout" button)
-        'user_email': request.session.get('user_email') 
+        'user_email': user_email,
+        # The card grid is a shared fragment, per feed version
+        'feed_version': version,
+        'fragment_timeout': page_cache.fragment_timeout(),
+        'fragment_cache': settings.PAGE_CACHE['FRAGMENT_CACHE'],
+    }
+    return page_cache.finish(render(request, 'home.html', context), tag, last_modified, private=bool(user_email))
+
+async def subscriptions_view(request):
+    # Newest videos from the channels the user subscribes to (UserLogin/subscription_feed.py)
+    if 'user_email' not in request.session:
+        return redirect('login')
+    cursor = request.GET.get('cursor')
+    try:
+        videos, next_cursor = await adb.subscriptions_page(request.session['user_email'], cursor)
+    except ValueError:
+        return redirect('subscriptions') # Bad/expired cursor: start from the top
+
+    context = {
+        'videos': videos,
+        'cursor': cursor,
+        'next_cursor': next_cursor,
+        'user_email': request.session['user_email']
+    }
+    return render(request, 'subscriptions.html', context)
+
+async def search_view(request):
+    # Ranked matches from the in-process index (UserLogin/search_index.py);
+    # the page's items then come in one BatchGetItem
+    query = request.GET.get('q', '').strip()
+    try:
+        page = max(1, int(request.GET.get('page', 1)))
+    except ValueError:
+        page = 1
+
+    started = time.perf_counter()
+    docs, total = await adb.search(query, page) if query else ([], 0)
+    loader = ItemLoader()
+    pending = [loader.load({'PK': doc['PK'], 'SK': doc['SK']}) for doc in docs]
+    if pending:
+        await adb.dispatch(loader)
+    videos = []
+    for doc, item in zip(docs, pending):
+        video = item.get()
+        # The index may not have seen another process's delete or status change yet
+        if video is None:
+            search_index.video_removed(doc['video_id'])
+        elif video.get('status') != 'READY':
+            search_index.video_status_changed(doc['video_id'], video.get('status'))
+        else:
+            videos.append(video)
+
+    page_size = settings.SEARCH['PAGE_SIZE']
+    context = {
+        'query': query,
+        'videos': videos,
+        'total': total,
+        'page': page,
+        'previous_page': page - 1 if page > 1 else None,
+        'next_page': page + 1 if page * page_size < total else None,
+        'elapsed_ms': (time.perf_counter() - started) * 1000,
+        'user_email': request.session.get('user_email')
     }
-    return render(request, 'home.html', context)
+    return render(request, 'search.html', context)
+
+async def feed_api(request):
+    # JSON page for infinite scroll: the rendered cards + the cursor for the next page
+    version, _ = await adb.get_page_version(page_cache.FEED)
+    try:
+        videos, next_cursor = await adb.feed_page(request.GET.get('cursor'), version)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid cursor'}, status=400)
+
+    html = render_to_string('partials/video_card.html', {'videos': videos}, request=request)
+    return JsonResponse({
+        'html': html,
+        'next_cursor': next_cursor
+    })
 
 @csrf_exempt
-def subscribe_view(request):
+async def subscribe_view(request):
     if request.method == 'POST':
         if 'user_email' not in request.session:
             return JsonResponse({'error': 'Please login to subscribe'}, status=403)
@@ -164,10 +505,11 @@ def subscribe_view(request):
             return JsonResponse({'error': 'Cannot subscribe to yourself'}, status=400)
             
         # Run the toggle logic
-        now_subscribed = toggle_subscription(subscriber, creator)
-        
-        # Get new count to show on frontend
-        new_count = get_subscriber_count(creator)
+        # (also returns the new count to show on frontend, straight from the write)
+        try:
+            now_subscribed, new_count = await adb.toggle_subscription(subscriber, creator)
+        except LookupError:
+            return JsonResponse({'error': 'No such channel'}, status=404)
         
         return JsonResponse({
             'subscribed': now_subscribed,
@@ -176,16 +518,20 @@ def subscribe_view(request):
     return JsonResponse({'error': 'POST only'}, status=405)
 
 @csrf_exempt
-def reaction_view(request):
+async def reaction_view(request):
     if request.method == 'POST':
         if 'user_email' not in request.session:
             return JsonResponse({'error': 'Login required'}, status=403)
             
-        data = json.loads(request.body)
+        data = _json_body(request)
+        if data is None:
+            return JsonResponse({'error': 'Invalid JSON'}, status=400)
         user_email = request.session['user_email']
         
         video_id = data.get('video_id')
         action = data.get('action') # 'LIKE', 'DISLIKE', 'NONE'
+        if action not in REACTION_ACTIONS:
+            return JsonResponse({'error': f"action must be one of {', '.join(REACTION_ACTIONS)}"}, status=400)
         
         # We need the Video's PK/SK to update counters. 
         # For security/simplicity, we can pass the creator_email from frontend
@@ -194,11 +540,18 @@ def reaction_view(request):
         video_pk = f"USER#{creator_email}"
         video_sk = f"VIDEO#{video_id}"
         
-        # Update DB
-        update_reaction(user_email, video_pk, video_sk, video_id, action)
-        
-        # Return new stats
-        new_stats = get_video_stats(video_pk, video_sk)
+        # Update DB (returns the new stats straight from the write)
+        try:
+            new_stats = await adb.update_reaction(user_email, video_pk, video_sk, video_id, action)
+        except LookupError:
+            return JsonResponse({'error': 'Video not found'}, status=404)
         return JsonResponse(new_stats)
         
-    return JsonResponse({'error': 'POST only'}, status=400)
\ No newline at end of file
+    return JsonResponse({'error': 'POST only'}, status=400)
+
+# Prometheus scrape endpoint (UserLogin/metrics.py)
+def metrics_view(request):
+    token = settings.METRICS['TOKEN']
+    if token and not hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {token}"):
+        return HttpResponse(status=403)
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
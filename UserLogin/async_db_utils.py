@@ -0,0 +1,50 @@
+"""
+Async mirror of db_utils for the async views.
+
+boto3 is blocking, so each call runs on a dedicated thread pool (sized from
+settings.ASYNC_DB_THREADS) while the event loop keeps serving other requests.
+Independent lookups can then be awaited together with asyncio.gather().
+The functions keep the names and arguments of their db_utils counterparts, so
+they share the same cache entries and invalidation.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from . import db_utils, hls, page_cache, search_index, subscription_feed
+
+_executor = ThreadPoolExecutor(
+    max_workers=settings.ASYNC_DB_THREADS,
+    thread_name_prefix='dynamodb',
+)
+
+
+def _async(fn):
+    # thread_sensitive=False: boto3 has no thread affinity, so calls don't need
+    # to queue up behind each other on Django's single sync thread
+    return sync_to_async(fn, thread_sensitive=False, executor=_executor)
+
+
+get_video_by_id = _async(db_utils.get_video_by_id)
+get_videos_page = _async(db_utils.get_videos_page)
+get_user_videos = _async(db_utils.get_user_videos)
+get_public_profile = _async(db_utils.get_public_profile)
+get_subscriber_count = _async(db_utils.get_subscriber_count)
+is_subscribed = _async(db_utils.is_subscribed)
+get_user_reaction = _async(db_utils.get_user_reaction)
+get_video_stats = _async(db_utils.get_video_stats)
+toggle_subscription = _async(db_utils.toggle_subscription)
+update_reaction = _async(db_utils.update_reaction)
+create_user = _async(db_utils.create_user)
+verify_user = _async(db_utils.verify_user) # Waits on the hashing pool, off the event loop
+public_master_playlist = _async(hls.public_master_playlist)
+search = _async(search_index.search) # The first call in a process loads the index
+subscriptions_page = _async(subscription_feed.get_page)
+get_page_version = _async(page_cache.get_version)
+feed_page = _async(page_cache.feed_page)
+
+
+async def dispatch(loader):
+    """Resolve everything queued on an ItemLoader without blocking the loop."""
+    await _async(loader.dispatch)()
@@ -0,0 +1,197 @@
+"""
+Process-wide registry for boto3 sessions, clients and resources.
+
+Building a boto3 client means resolving credentials, loading the endpoint and
+service models and opening a brand-new connection pool, which easily costs
+more than the DynamoDB call it is used for. Everything in db_utils/s3_utils
+goes through here instead so a worker pays that once and then reuses warm
+keep-alive connections.
+
+Low-level clients are thread-safe and shared by every thread. boto3 resources
+(and the Table objects built from them) are not, so each thread gets its own.
+Both are rebuilt whenever the credentials change (see reload_credentials).
+
+Trade-off: a resource always owns its own low-level client, so every thread
+that touches DynamoDB through get_table() has a private connection pool. A
+thread only ever has one request in flight, so those per-thread resources are
+built with a tiny pool (AWS_RESOURCE_POOL_CONNECTIONS) instead of the full
+AWS_MAX_POOL_CONNECTIONS; the shared clients from get_client() keep the big one.
+Code that fans out across many threads at once (batch jobs, BatchGetItem in
+batch_loader) should prefer get_client()/get_resource() accordingly.
+"""
+import os
+import threading
+import time
+
+import boto3
+from botocore.config import Config
+from django.conf import settings
+from dotenv import dotenv_values
+
+from . import metrics
+
+_lock = threading.Lock()
+_local = threading.local()
+
+_state = {
+    'generation': 0,
+    'session': None,
+    'clients': {},
+    'env_mtime': None,
+    'checked_at': 0.0,
+}
+
+
+def _credentials():
+    return (
+        settings.AWS_ACCESS_KEY_ID,
+        settings.AWS_SECRET_ACCESS_KEY,
+        settings.AWS_SESSION_TOKEN,
+    )
+
+
+def _endpoint_url(service):
+    if service == 'dynamodb':
+        return settings.AWS_DYNAMODB_ENDPOINT_URL
+    if service == 's3':
+        return settings.AWS_S3_ENDPOINT_URL
+    return None
+
+
+def _client_config(pool_size=None):
+    return Config(
+        region_name=settings.AWS_REGION,
+        max_pool_connections=pool_size or settings.AWS_MAX_POOL_CONNECTIONS,
+        tcp_keepalive=settings.AWS_TCP_KEEPALIVE,
+        connect_timeout=settings.AWS_CONNECT_TIMEOUT,
+        read_timeout=settings.AWS_READ_TIMEOUT,
+        retries={
+            'max_attempts': settings.AWS_MAX_ATTEMPTS,
+            'mode': settings.AWS_RETRY_MODE,
+        },
+    )
+
+
+def _cred_env_path():
+    return os.path.join(settings.BASE_DIR, 'cred.env')
+
+
+def _env_mtime():
+    try:
+        return os.stat(_cred_env_path()).st_mtime
+    except OSError:
+        return None
+
+
+def _check_rotation():
+    # Rotated keys land in cred.env; a stat() every few seconds is cheap enough
+    # to notice that without anyone having to restart the worker.
+    now = time.monotonic()
+    if now - _state['checked_at'] < settings.AWS_CREDENTIALS_CHECK_INTERVAL:
+        return
+    _state['checked_at'] = now
+
+    mtime = _env_mtime()
+    if _state['env_mtime'] is None:
+        _state['env_mtime'] = mtime
+        return
+    if mtime != _state['env_mtime']:
+        _state['env_mtime'] = mtime
+        reload_credentials()
+
+
+def _get_session():
+    # Caller must hold _lock
+    if _state['session'] is None:
+        key_id, secret, token = _credentials()
+        _state['session'] = boto3.session.Session(
+            aws_access_key_id=key_id,
+            aws_secret_access_key=secret,
+            aws_session_token=token,
+            region_name=settings.AWS_REGION,
+        )
+        # Every client and resource built from the session inherits these
+        metrics.register_hooks(_state['session'].events)
+    return _state['session']
+
+
+def get_client(service):
+    """Shared low-level client for `service` ('dynamodb', 's3', ...)."""
+    _check_rotation()
+    client = _state['clients'].get(service)
+    if client is not None:
+        return client
+
+    with _lock:
+        client = _state['clients'].get(service)
+        if client is None:
+            client = _get_session().client(
+                service,
+                endpoint_url=_endpoint_url(service),
+                config=_client_config(),
+            )
+            _state['clients'][service] = client
+    return client
+
+
+def get_resource(service):
+    """boto3 resource for `service`, one per thread."""
+    _check_rotation()
+    cache = getattr(_local, 'resources', None)
+    if cache is None or _local.generation != _state['generation']:
+        cache = _local.resources = {}
+        _local.tables = {}
+        _local.generation = _state['generation']
+
+    resource = cache.get(service)
+    if resource is None:
+        with _lock:
+            resource = _get_session().resource(
+                service,
+                endpoint_url=_endpoint_url(service),
+                config=_client_config(settings.AWS_RESOURCE_POOL_CONNECTIONS),
+            )
+        cache[service] = resource
+    return resource
+
+
+def get_table(name=None):
+    name = name or settings.DYNAMO_TABLE
+    dynamodb = get_resource('dynamodb')
+    table = _local.tables.get(name)
+    if table is None:
+        table = _local.tables[name] = dynamodb.Table(name)
+    return table
+
+
+def generation():
+    """Bumped every time the clients are rebuilt. Useful as a cache-key part."""
+    return _state['generation']
+
+
+def reset_clients():
+    """Drop every cached session/client/resource; the next call rebuilds them."""
+    with _lock:
+        _state['session'] = None
+        _state['clients'] = {}
+        _state['generation'] += 1
+
+
+def reload_credentials():
+    """Re-read cred.env and rebuild the clients if the keys actually changed."""
+    values = dotenv_values(_cred_env_path())
+    if not values.get('aws_access_key_id'):
+        return False # No static keys in the file: boto3's own provider chain handles refresh
+    # The session token is taken as-is: rotating from temporary to long-lived
+    # keys drops it, and keeping the old one would break authentication
+    new_credentials = (
+        values.get('aws_access_key_id'),
+        values.get('aws_secret_access_key'),
+        values.get('aws_session_token') or None,
+    )
+    if new_credentials == _credentials():
+        return False
+
+    settings.AWS_ACCESS_KEY_ID, settings.AWS_SECRET_ACCESS_KEY, settings.AWS_SESSION_TOKEN = new_credentials
+    reset_clients()
+    return True
@@ -0,0 +1,139 @@
+"""
+DataLoader-style batching for DynamoDB GetItems.
+
+A view creates one ItemLoader per request, queues every key lookup it is going
+to need with load(), and then reads the results. The first .get() on any
+pending result sends *all* queued keys in as few BatchGetItem calls as possible
+(100 keys per call), so a page that used to do one GetItem after another costs
+one round-trip instead.
+
+    loader = ItemLoader()
+    profile = loader.load({'PK': 'USER#a@b.c', 'SK': 'PROFILE'})
+    sub = loader.load({'PK': 'USER#me', 'SK': 'SUB#a@b.c'}, transform=lambda item: item is not None)
+    profile.get(), sub.get()   # -> one BatchGetItem
+
+Lookups can be tied to a db_cache kind: dispatch() checks the cache first and
+only sends the misses to DynamoDB, then writes freshly fetched values back.
+load() itself does no I/O at all (not even a cache get, which may be a Redis
+round-trip), so async views can queue lookups on the event loop and run
+dispatch() on a worker thread (async_db_utils.dispatch).
+"""
+import random
+import time
+
+from django.conf import settings
+
+from . import aws_clients, metrics
+from .db_cache import cache_key as make_cache_key, get_backend, timeout, value_ttl
+
+BATCH_SIZE = 100 # BatchGetItem hard limit
+MAX_RETRIES = 8
+
+
+def _identity(item):
+    return item
+
+
+class Pending:
+    """Result of ItemLoader.load(); get() dispatches the loader if needed."""
+
+    def __init__(self, loader=None):
+        self._loader = loader
+        self._resolved = False
+        self._value = None
+
+    def _resolve(self, value):
+        self._value = value
+        self._resolved = True
+
+    def get(self):
+        if not self._resolved:
+            self._loader.dispatch()
+        return self._value
+
+
+class ItemLoader:
+    def __init__(self, table_name=None, consistent_read=False):
+        self.table_name = table_name or settings.DYNAMO_TABLE
+        self.consistent_read = consistent_read
+        # (PK, SK) -> list of (pending, transform, cache_key, ttl) waiting on that item
+        self._queue = {}
+        self.round_trips = 0
+
+    def load(self, key, transform=None, cache=None):
+        """
+        Queue a GetItem for `key` ({'PK': ..., 'SK': ...}).
+
+        transform(item_or_None) turns the raw item into the value callers get.
+        cache=(kind, key_parts) makes it a read-through lookup on db_cache.
+        Only queues: all I/O happens in dispatch().
+        """
+        transform = transform or _identity
+        pending = Pending(self)
+
+        cache_key = ttl = None
+        if cache is not None:
+            kind, key_parts = cache
+            ttl = timeout(kind)
+            if ttl:
+                cache_key = make_cache_key(kind, key_parts)
+
+        # Duplicate keys share a single slot in the batch
+        self._queue.setdefault((key['PK'], key['SK']), []).append((pending, transform, cache_key, ttl))
+        return pending
+
+    @metrics.labelled('ItemLoader.dispatch')
+    def dispatch(self):
+        queue, self._queue = self._queue, {}
+        if not queue:
+            return
+
+        backend = get_backend()
+        misses = {}
+        for dynamo_key, waiters in queue.items():
+            remaining = []
+            for waiter in waiters:
+                pending, transform, cache_key, ttl = waiter
+                hit = backend.get(cache_key) if cache_key else None
+                if hit is not None:
+                    pending._resolve(hit[0])
+                else:
+                    remaining.append(waiter)
+            if remaining:
+                misses[dynamo_key] = remaining
+
+        found = {}
+        keys = [{'PK': pk, 'SK': sk} for pk, sk in misses]
+        for start in range(0, len(keys), BATCH_SIZE):
+            for item in self._batch_get(keys[start:start + BATCH_SIZE]):
+                found[(item['PK'], item['SK'])] = item
+
+        for dynamo_key, waiters in misses.items():
+            item = found.get(dynamo_key)
+            for pending, transform, cache_key, ttl in waiters:
+                value = transform(item)
+                if cache_key:
+                    # add(), not set(): never overwrite a value a writer stored meanwhile
+                    backend.add(cache_key, (value,), value_ttl(ttl, value))
+                pending._resolve(value)
+
+    def _batch_get(self, keys):
+        dynamodb = aws_clients.get_resource('dynamodb')
+        request = {self.table_name: {'Keys': keys, 'ConsistentRead': self.consistent_read}}
+        items = []
+
+        for attempt in range(MAX_RETRIES + 1):
+            self.round_trips += 1
+            response = dynamodb.batch_get_item(RequestItems=request)
+            items.extend(response.get('Responses', {}).get(self.table_name, []))
+
+            request = response.get('UnprocessedKeys') or {}
+            if not request:
+                return items
+            if attempt < MAX_RETRIES:
+                # Exponential backoff with full jitter, as AWS recommends for UnprocessedKeys
+                time.sleep(random.uniform(0, min(2.0, 0.05 * (2 ** attempt))))
+
+        raise RuntimeError(
+            f"BatchGetItem still had unprocessed keys after {MAX_RETRIES} retries"
+        )
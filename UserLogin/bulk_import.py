@@ -0,0 +1,324 @@
+"""
+Bulk import of an existing catalogue (`manage.py import_videos`).
+
+The manifest is CSV (with a header row) or JSON Lines, one video per row:
+
+    email             the creator's account                                [required]
+    title                                                                  [required]
+    source            s3://bucket/key of the original video                [required]
+    processed_source  s3://bucket/key of a playable MP4: the video comes in READY.
+                      Without one it comes in PROCESSING and transcode_worker
+                      picks it up (behind fresh uploads: TRANSCODE_PRIORITY)
+    thumbnail         s3://bucket/key of a JPEG
+    description, channel_name (saves looking up the account), video_id,
+    created_at        epoch seconds or ISO 8601 (UTC unless it says otherwise)
+
+Rows are streamed, WORKERS at a time. A row's media is copied server-side into
+the raw/processed buckets (s3_utils.copy_object: objects past
+MULTIPART_COPY_THRESHOLD in parallel parts, on a pool shared by all rows), then
+its item joins a BatchWriteItem of 25, WRITE_THREADS calls in flight, with
+UnprocessedItems retried after a backoff. An item is only written once its
+media is in place.
+
+Importing a row twice writes the same keys: its video id is the video_id
+column, or derived from (email, source). That keeps checkpoints simple. The
+checkpoint file holds the row number below which every row is done (written or
+failed, with the errors), saved every CHECKPOINT_SECONDS; a resumed import
+starts after it and redoes the few rows that had finished beyond it.
+
+Imported videos are on their creators' Dashboards and (READY ones) in the feed
+right away. They aren't announced to inbox followers (they're old videos) and
+only show up in search and "Up next" lists after the next build_search_index
+and build_related.
+"""
+import csv
+import json
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+
+from django.conf import settings
+
+from . import aws_clients, db_utils, page_cache, s3_utils
+from .transcoding import MAIN_OUTPUT
+
+BATCH_SIZE = 25  # BatchWriteItem limit
+MAX_RETRIES = 8  # For UnprocessedItems
+NAMESPACE = uuid.UUID('3f0c6b9e-5d57-4f1a-9c1e-8a2d7b4e6f10') # Video ids derived from (email, source)
+
+
+class ManifestError(ValueError):
+    """A row that can't be imported as it is."""
+
+
+# --- Reading the manifest ---
+
+def read_manifest(path):
+    """(row number, row) for every row, numbered from 1. CSV by extension, JSON Lines otherwise."""
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        if path.lower().endswith('.csv'):
+            for number, row in enumerate(csv.DictReader(f), 1):
+                yield number, {k: v for k, v in row.items() if v not in (None, '')}
+            return
+        number = 0
+        for line in f:
+            if line.strip():
+                number += 1
+                yield number, json.loads(line)
+
+
+def parse_s3_uri(uri):
+    if not uri.startswith('s3://') or '/' not in uri[len('s3://'):]:
+        raise ManifestError(f"Not an s3://bucket/key URI: {uri!r}")
+    bucket, key = uri[len('s3://'):].split('/', 1)
+    return bucket, key
+
+
+def parse_created_at(value):
+    if value is None:
+        return int(time.time())
+    if isinstance(value, (int, float)) or str(value).isdigit():
+        return int(value)
+    try:
+        moment = datetime.fromisoformat(str(value))
+    except ValueError:
+        raise ManifestError(f"created_at is neither epoch seconds nor ISO 8601: {value!r}")
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return int(moment.timestamp())
+
+
+def _required(row, field):
+    value = row.get(field)
+    if not value:
+        raise ManifestError(f"Missing {field}")
+    return str(value)
+
+
+# --- Checkpoints ---
+
+class Checkpoint:
+    def __init__(self, path, manifest):
+        self.path = path
+        self.manifest = os.path.abspath(manifest)
+        self.done_through = 0 # Every row up to this one is written or failed
+        self.failed = {}      # row number (str) -> error
+        if os.path.exists(path):
+            with open(path) as f:
+                state = json.load(f)
+            if state['manifest'] != self.manifest:
+                raise ValueError(f"{path} is the checkpoint of {state['manifest']}, not of {self.manifest}")
+            self.done_through = state['done_through']
+            self.failed = state['failed']
+
+    def save(self):
+        # Write-then-rename: an interruption mid-save leaves the previous checkpoint
+        temporary = f"{self.path}.tmp"
+        with open(temporary, 'w') as f:
+            json.dump({'manifest': self.manifest, 'done_through': self.done_through, 'failed': self.failed}, f)
+        os.replace(temporary, self.path)
+
+
+# --- The import ---
+
+class Importer:
+    def __init__(self, manifest, checkpoint, workers=None, write_threads=None, copy_threads=None, progress=None):
+        options = settings.BULK_IMPORT
+        self.manifest = manifest
+        self.checkpoint = checkpoint
+        self.workers = workers or options['WORKERS']
+        self.write_threads = write_threads or options['WRITE_THREADS']
+        self.copy_threads = copy_threads or options['COPY_THREADS']
+        self.progress = progress
+        self.stats = {
+            'rows': 0, 'skipped': 0, 'imported': 0, 'ready': 0, 'processing': 0, 'failed': 0,
+            'objects_copied': 0, 'bytes_copied': 0, 'write_calls': 0, 'unprocessed_retries': 0,
+        }
+        self._lock = threading.Lock()
+        self._finished = set()
+        self._next = checkpoint.done_through + 1
+        self._channels = {}
+        self._creators = set()
+        self._parts = None
+
+    def run(self):
+        """Import every row past the checkpoint. Returns the stats, with 'seconds'."""
+        started = time.perf_counter()
+        saved_at = time.monotonic()
+        rows_in_flight, writes_in_flight, batch = set(), set(), []
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='import') as rows, \
+                ThreadPoolExecutor(max_workers=self.copy_threads, thread_name_prefix='import-copy') as parts, \
+                ThreadPoolExecutor(max_workers=self.write_threads, thread_name_prefix='import-write') as writes:
+            self._parts = parts
+
+            def collect(done):
+                for future in done:
+                    number, item, error = future.result()
+                    if error:
+                        self._fail([number], error)
+                        continue
+                    if any(entry[1]['SK'] == item['SK'] and entry[1]['PK'] == item['PK'] for entry in batch):
+                        flush() # BatchWriteItem rejects a batch with the same key twice
+                    batch.append((number, item))
+                    if len(batch) == BATCH_SIZE:
+                        flush()
+
+            def flush():
+                if len(writes_in_flight) >= self.write_threads * 2:
+                    writes_in_flight.difference_update(wait(writes_in_flight, return_when=FIRST_COMPLETED).done)
+                writes_in_flight.add(writes.submit(self._write_batch, list(batch)))
+                batch.clear()
+
+            for number, row in read_manifest(self.manifest):
+                if number <= self.checkpoint.done_through:
+                    self.stats['skipped'] += 1
+                    continue
+                self.stats['rows'] += 1
+                if len(rows_in_flight) >= self.workers * 2:
+                    done, rows_in_flight = wait(rows_in_flight, return_when=FIRST_COMPLETED)
+                    collect(done)
+                rows_in_flight.add(rows.submit(self._prepare, number, row))
+                if time.monotonic() - saved_at >= settings.BULK_IMPORT['CHECKPOINT_SECONDS']:
+                    self._save()
+                    saved_at = time.monotonic()
+
+            collect(wait(rows_in_flight).done)
+            if batch:
+                flush()
+            wait(writes_in_flight)
+
+        self._save()
+        # What the pages show changed: one bump per creator, not per video
+        scopes = [page_cache.user_videos_scope(email) for email in sorted(self._creators)]
+        if self.stats['ready']:
+            scopes.append(page_cache.FEED)
+        if scopes:
+            page_cache.bump(*scopes)
+        self.stats['seconds'] = time.perf_counter() - started
+        return self.stats
+
+    # --- One row ---
+
+    def _prepare(self, number, row):
+        # Runs on the row pool: (number, item, None), or (number, None, error)
+        try:
+            item, copies = self.build_item(row)
+            for source_bucket, source_key, bucket, key in copies:
+                size = s3_utils.copy_object(
+                    source_bucket, source_key, bucket, key,
+                    settings.BULK_IMPORT['MULTIPART_COPY_THRESHOLD'], settings.BULK_IMPORT['COPY_PART_SIZE'],
+                    executor=self._parts,
+                )
+                with self._lock:
+                    self.stats['objects_copied'] += 1
+                    self.stats['bytes_copied'] += size
+        except Exception as e:
+            return number, None, f"{type(e).__name__}: {e}"
+        return number, item, None
+
+    def build_item(self, row):
+        """The video item for a row, and the (source bucket, source key, bucket, key) copies it needs."""
+        email = _required(row, 'email')
+        title = _required(row, 'title')
+        source = _required(row, 'source')
+        source_bucket, source_key = parse_s3_uri(source)
+        video_id = str(row.get('video_id') or uuid.uuid5(NAMESPACE, f"{email}\n{source}"))
+        # Same naming as browser uploads (get_upload_url)
+        raw_key = f"{video_id}_{re.sub(r'[^a-zA-Z0-9._-]', '_', os.path.basename(source_key))}"
+
+        item = {
+            'PK': f"USER#{email}",
+            'SK': f"VIDEO#{video_id}",
+            'title': title,
+            'description': str(row.get('description', '')),
+            'raw_s3_key': raw_key,
+            'channel_name': str(row.get('channel_name') or self._channel_name(email)),
+            'status': 'PROCESSING',
+            'video_id': video_id,
+            'created_at': parse_created_at(row.get('created_at')),
+            'imported_at': int(time.time()),
+        }
+        copies = [(source_bucket, source_key, settings.AWS_RAW_BUCKET, raw_key)]
+
+        if row.get('processed_source'):
+            processed_key = f"{settings.TRANSCODE['OUTPUT_PREFIX']}{video_id}/{MAIN_OUTPUT}"
+            copies.append((*parse_s3_uri(row['processed_source']), settings.AWS_PROCESSED_BUCKET, processed_key))
+            item.update({
+                'status': 'READY',
+                'processed_bucket': settings.AWS_PROCESSED_BUCKET,
+                'processed_s3_key': processed_key,
+                'processed_at': item['imported_at'],
+                'creator_feed': item['PK'],
+            })
+        else:
+            item['priority'] = settings.BULK_IMPORT['TRANSCODE_PRIORITY']
+        if row.get('thumbnail'):
+            item['thumbnail_key'] = f"thumbnails/{video_id}.jpg"
+            copies.append((*parse_s3_uri(row['thumbnail']), settings.AWS_PROCESSED_BUCKET, item['thumbnail_key']))
+        return item, copies
+
+    def _channel_name(self, email):
+        if email not in self._channels:
+            profile = db_utils.get_user(email)
+            if profile is None:
+                raise ManifestError(f"No account for {email}")
+            self._channels[email] = profile.get('channel_name', '')
+        return self._channels[email]
+
+    # --- Writing ---
+
+    def _write_batch(self, entries):
+        # Runs on the write pool
+        dynamodb = aws_clients.get_resource('dynamodb')
+        request = {settings.DYNAMO_TABLE: [{'PutRequest': {'Item': item}} for _, item in entries]}
+        try:
+            for attempt in range(MAX_RETRIES + 1):
+                with self._lock:
+                    self.stats['write_calls'] += 1
+                request = dynamodb.batch_write_item(RequestItems=request).get('UnprocessedItems') or {}
+                if not request:
+                    break
+                if attempt < MAX_RETRIES:
+                    with self._lock:
+                        self.stats['unprocessed_retries'] += 1
+                    # Exponential backoff with full jitter, as AWS recommends for UnprocessedItems
+                    time.sleep(random.uniform(0, min(2.0, 0.05 * (2 ** attempt))))
+            else:
+                raise RuntimeError(f"BatchWriteItem still had unprocessed items after {MAX_RETRIES} retries")
+        except Exception as e:
+            self._fail([number for number, _ in entries], f"{type(e).__name__}: {e}")
+            return
+        with self._lock:
+            for number, item in entries:
+                self.stats['imported'] += 1
+                self.stats['ready' if item['status'] == 'READY' else 'processing'] += 1
+                self._creators.add(item['PK'][len('USER#'):])
+            self._finish([number for number, _ in entries])
+
+    def _fail(self, numbers, error):
+        with self._lock:
+            for number in numbers:
+                self.checkpoint.failed[str(number)] = error
+                self.stats['failed'] += 1
+            self._finish(numbers)
+
+    def _finish(self, numbers):
+        # Caller holds _lock. Moves the watermark past every row that is done
+        self._finished.update(numbers)
+        while self._next in self._finished:
+            self._finished.remove(self._next)
+            self._next += 1
+
+    def _save(self):
+        with self._lock:
+            self.checkpoint.done_through = self._next - 1
+            self.checkpoint.save()
+            stats = dict(self.stats)
+        if self.progress:
+            self.progress(stats)
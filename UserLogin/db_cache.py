@@ -0,0 +1,180 @@
+"""
+Read-through cache for the hot DynamoDB lookups in db_utils.
+
+    value = cached('profile', email, lambda: <GetItem>)
+
+Every cached lookup has a "kind" (profile, sub, reaction, video, stats) with
+its own TTL in settings.DB_CACHE['TIMEOUTS']. A lookup that found nothing is
+cached too (negative caching) for NEGATIVE_TIMEOUT seconds, so a hammered
+missing key doesn't reach DynamoDB every time either.
+
+Writers store() the value their write returned (UpdateItem with
+ReturnValues='ALL_NEW') instead of just dropping the key: a re-read right
+after the write could come from an eventually consistent replica and would
+then sit in the cache, stale, for the whole TTL. For the same reason a
+read-through fill never overwrites an entry that is already there, so a slow
+read that started before a write can't clobber the written value.
+With the per-process 'lru' backend this is only guaranteed inside one worker;
+run more than one worker with the 'django' backend (pointed at
+Redis/Memcached via CACHES) for shared state.
+
+Cached values are shared between requests: treat them as read-only.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+
+class LRUCache:
+    """Thread-safe in-process LRU with a per-entry TTL."""
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._set(key, value, ttl)
+
+    def add(self, key, value, ttl):
+        # set() unless the key already holds a live entry
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] >= time.monotonic():
+                return False
+            self._set(key, value, ttl)
+            return True
+
+    def _set(self, key, value, ttl):
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    def delete_many(self, keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class DjangoCache:
+    """Any backend from settings.CACHES (LocMem, Redis, Memcached, ...)."""
+
+    def __init__(self, alias='default'):
+        from django.core.cache import caches
+        self.cache = caches[alias]
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, value, ttl):
+        self.cache.set(key, value, ttl)
+
+    def add(self, key, value, ttl):
+        return self.cache.add(key, value, ttl)
+
+    def delete_many(self, keys):
+        self.cache.delete_many(list(keys))
+
+    def clear(self):
+        self.cache.clear()
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                config = settings.DB_CACHE
+                if config['BACKEND'] == 'django':
+                    _backend = DjangoCache(config.get('ALIAS', 'default'))
+                elif config['BACKEND'] == 'lru':
+                    _backend = LRUCache(config.get('MAX_ENTRIES', 10000))
+                else:
+                    raise ValueError(f"Unknown DB_CACHE backend: {config['BACKEND']}")
+    return _backend
+
+
+def make_key(kind, *parts):
+    return 'db:' + kind + ':' + '|'.join(str(p) for p in parts)
+
+
+def timeout(kind, ttl=None):
+    """Seconds to cache a `kind` of lookup; 0 means caching is off for it."""
+    if ttl is None:
+        ttl = settings.DB_CACHE['TIMEOUTS'].get(kind, 0)
+    return ttl
+
+
+def value_ttl(ttl, value):
+    # Negative hits ("not found") only live for NEGATIVE_TIMEOUT
+    if value is None:
+        return min(ttl, settings.DB_CACHE['NEGATIVE_TIMEOUT'])
+    return ttl
+
+
+def cache_key(kind, key_parts):
+    if not isinstance(key_parts, (list, tuple)):
+        key_parts = (key_parts,)
+    return make_key(kind, *key_parts)
+
+
+def cached(kind, key_parts, loader, ttl=None, cache_if=None):
+    """
+    Return the cached value for (kind, key_parts), calling loader() on a miss.
+    `ttl` overrides the per-kind timeout for this key; a timeout of 0 disables
+    caching for that kind altogether. When given, cache_if(value) decides
+    whether a freshly loaded value may be cached at all.
+    """
+    ttl = timeout(kind, ttl)
+    if not ttl:
+        return loader()
+
+    backend = get_backend()
+    key = cache_key(kind, key_parts)
+
+    # Values are stored wrapped in a 1-tuple so a cached None (negative hit)
+    # can be told apart from a cache miss
+    hit = backend.get(key)
+    if hit is not None:
+        return hit[0]
+
+    value = loader()
+    if cache_if is None or cache_if(value):
+        backend.add(key, (value,), value_ttl(ttl, value))
+    return value
+
+
+def store(kind, key_parts, value, ttl=None):
+    """Write-through: put a value the caller just wrote (or read consistently)."""
+    ttl = timeout(kind, ttl)
+    if ttl:
+        get_backend().set(cache_key(kind, key_parts), (value,), value_ttl(ttl, value))
+
+
+def invalidate(*keys):
+    """keys: (kind, key_parts) pairs, same shape as cached() takes."""
+    get_backend().delete_many([cache_key(kind, key_parts) for kind, key_parts in keys])
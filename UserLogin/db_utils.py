@@ -1,20 +1,90 @@
-import boto3
-from boto3.dynamodb.conditions import Attr # Needed for the scan filter
+from boto3.dynamodb.conditions import Attr, Key # Attr is needed for the scan filter
+from boto3.dynamodb.types import TypeDeserializer
 from django.conf import settings
-from django.contrib.auth.hashers import make_password, check_password
+from django.core import signing
 import uuid
+import random
 import time
 import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from . import aws_clients, metrics
+from .db_cache import cached, invalidate, store
+from .batch_loader import ItemLoader
+from . import page_cache, passwords, search_index, subscription_feed
+
+# Global secondary indexes the app relies on.
+# `manage.py ensure_indexes` creates any that are missing and backfills old rows.
+TABLE_INDEXES = [
+    {
+        # watch_video / get_video_by_id: video_id -> full video item
+        'IndexName': settings.DYNAMO_VIDEO_ID_INDEX,
+        'KeySchema': [{'AttributeName': 'video_id', 'KeyType': 'HASH'}],
+        'AttributeDefinitions': [{'AttributeName': 'video_id', 'AttributeType': 'S'}],
+        'Projection': {'ProjectionType': 'ALL'},
+    },
+    {
+        # Global feed: videos by status, newest first
+        'IndexName': settings.DYNAMO_FEED_INDEX,
+        'KeySchema': [
+            {'AttributeName': 'status', 'KeyType': 'HASH'},
+            {'AttributeName': 'created_at', 'KeyType': 'RANGE'},
+        ],
+        'AttributeDefinitions': [
+            {'AttributeName': 'status', 'AttributeType': 'S'},
+            {'AttributeName': 'created_at', 'AttributeType': 'N'},
+        ],
+        'Projection': {'ProjectionType': 'ALL'},
+    },
+    {
+        # Subscriptions feed: one creator's videos, newest first. Sparse: only
+        # READY videos carry creator_feed (= the creator's PK)
+        'IndexName': settings.DYNAMO_CREATOR_FEED_INDEX,
+        'KeySchema': [
+            {'AttributeName': 'creator_feed', 'KeyType': 'HASH'},
+            {'AttributeName': 'created_at', 'KeyType': 'RANGE'},
+        ],
+        'AttributeDefinitions': [
+            {'AttributeName': 'creator_feed', 'AttributeType': 'S'},
+            {'AttributeName': 'created_at', 'AttributeType': 'N'},
+        ],
+        'Projection': {'ProjectionType': 'ALL'},
+    },
+]
 
 def get_table():
-    dynamodb = boto3.resource(
-        'dynamodb',
-        aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-        aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-        aws_session_token=settings.AWS_SESSION_TOKEN,
-        region_name=settings.AWS_REGION
-    )
-    return dynamodb.Table(settings.DYNAMO_TABLE)
+    # Reuses the pooled, per-thread Table instead of building a new resource every call
+    return aws_clients.get_table(settings.DYNAMO_TABLE)
+
+def video_index_attributes(item):
+    """
+    Index attributes a VIDEO# item should carry but is missing
+    (rows written before the index existed). Used by the backfill.
+    """
+    missing = {}
+    if 'video_id' not in item:
+        missing['video_id'] = item['SK'].split('#', 1)[1]
+    if 'created_at' not in item:
+        missing['created_at'] = 0 # Unknown upload time: sorts to the end of the feed
+    if item.get('status') == 'READY' and 'creator_feed' not in item:
+        missing['creator_feed'] = item['PK']
+    return missing
+
+def encode_cursor(last_key, salt='feed'):
+    """Turn a LastEvaluatedKey into an opaque, tamper-proof ?cursor= value."""
+    if not last_key:
+        return None
+    plain = {k: int(v) if not isinstance(v, str) else v for k, v in last_key.items()}
+    return signing.dumps(plain, salt=salt, compress=True)
+
+def decode_cursor(cursor, salt='feed'):
+    """Inverse of encode_cursor. Raises ValueError for a bad/forged cursor."""
+    if not cursor:
+        return None
+    try:
+        return signing.loads(cursor, salt=salt)
+    except signing.BadSignature:
+        raise ValueError("Invalid cursor")
 
 def create_user(email, password, channel_name, logo_key=None):
     table = get_table()
@@ -23,7 +93,7 @@ def create_user(email, password, channel_name, logo_key=None):
     if 'Item' in response:
         return False, "User already exists"
 
-    hashed_password = make_password(password)
+    hashed_password = passwords.make(password) # On the hashing pool; raises passwords.Busy
 
     item = {
         'PK': f"USER#{email}",
@@ -35,6 +105,7 @@ def create_user(email, password, channel_name, logo_key=None):
         'subscribers': 0 # Initialize subscriber count
     }
     table.put_item(Item=item)
+    invalidate(('profile', email)) # May hold a negative hit from a login attempt
     return True, "User created successfully"
 
 # 2. VERIFY LOGIN CREDENTIALS
@@ -47,18 +118,42 @@ def verify_user(email, password):
     if not item:
         return False # User not found
     
-    # Check password against the hash
-    if check_password(password, item['password']):
-        return item # Return user data on success
-    
-    return False # Wrong password
+    # Check password against the hash (on the hashing pool; raises passwords.Busy)
+    valid, upgraded = passwords.check(password, item['password'])
+    if not valid:
+        return False # Wrong password
+
+    if upgraded:
+        # Made with an older hasher/cost: store the new hash, unless the password changed meanwhile
+        try:
+            table.update_item(
+                Key={'PK': f"USER#{email}", 'SK': 'PROFILE'},
+                UpdateExpression="SET password = :new",
+                ConditionExpression="password = :old",
+                ExpressionAttributeValues={':new': upgraded, ':old': item['password']},
+            )
+            item['password'] = upgraded
+        except table.meta.client.exceptions.ConditionalCheckFailedException:
+            pass
+    return item # Return user data on success
 
 def get_user(email):
     table = get_table()
     response = table.get_item(Key={'PK': f"USER#{email}", 'SK': 'PROFILE'})
     return response.get('Item')
 
-def create_video_entry(email, title, filename, thumbnail_key,channel, description=""): 
+def _public_profile(item):
+    # Profile for display purposes, without the password hash
+    # (so it never ends up in a shared cache)
+    if item is None:
+        return None
+    return {k: v for k, v in item.items() if k != 'password'}
+
+def get_public_profile(email):
+    return cached('profile', email, lambda: _public_profile(_with_counter_totals(get_user(email), PROFILE_COUNTERS)))
+
+def create_video_entry(email, title, filename, thumbnail_key,channel, description="", status='PROCESSING', extra=None): 
+    # status is 'UPLOADING' while a multipart upload is still in flight
     table = get_table()
     video_id = str(uuid.uuid4())
     
@@ -72,25 +167,255 @@ def create_video_entry(email, title, filename, thumbnail_key,channel, descriptio
         # NEW FIELD: The public location of the thumbnail
         'thumbnail_key': thumbnail_key, 
         
-        'status': 'PROCESSING',
+        'status': status,
         'video_id': video_id,
         'created_at': int(time.time())
     }
+    if extra:
+        item.update(extra)
+    if status == 'READY':
+        item['creator_feed'] = item['PK']
     table.put_item(Item=item)
+    search_index.video_changed(item)
+    if status == 'READY':
+        subscription_feed.publish(item)
+        page_cache.bump(page_cache.user_videos_scope(email), page_cache.FEED)
+    else:
+        page_cache.bump(page_cache.user_videos_scope(email))
     return video_id
 
-def get_video_by_id(video_id):
+def get_user_video(email, video_id):
+    # Direct (uncached) read of one of the user's own videos, e.g. for ownership checks
+    table = get_table()
+    response = table.get_item(Key={'PK': f"USER#{email}", 'SK': f"VIDEO#{video_id}"})
+    return response.get('Item')
+
+def finish_video_upload(email, video_id):
+    # Multipart upload completed: hand the video over to the transcoder.
+    # Returns False if it already was (a retried or double-clicked "complete").
+    table = get_table()
+    try:
+        response = table.update_item(
+            Key={'PK': f"USER#{email}", 'SK': f"VIDEO#{video_id}"},
+            UpdateExpression="SET #s = :processing REMOVE upload_id",
+            ConditionExpression="#s = :uploading",
+            ExpressionAttributeNames={'#s': 'status'},
+            ExpressionAttributeValues={':processing': 'PROCESSING', ':uploading': 'UPLOADING'},
+            ReturnValues='ALL_NEW'
+        )
+    except table.meta.client.exceptions.ConditionalCheckFailedException:
+        return False
+    if response['Attributes'].get('content_hash'):
+        register_content(email, response['Attributes']['content_hash'], video_id)
+    invalidate(('video', video_id))
+    search_index.video_status_changed(video_id, 'PROCESSING')
+    page_cache.bump(page_cache.user_videos_scope(email))
+    return True
+
+def delete_video_entry(email, video_id):
+    table = get_table()
+    key = {'PK': f"USER#{email}", 'SK': f"VIDEO#{video_id}"}
+    response = table.delete_item(Key=key, ReturnValues='ALL_OLD')
+    old = response.get('Attributes', {})
+    shards = int(old.get('counter_shards', 0))
+    # Its related videos list, view sketch and sharded counters (see set_counter_shards) go with the video
+    with table.batch_writer() as batch:
+        batch.delete_item(Key=related_videos_key(key['PK'], video_id))
+        batch.delete_item(Key=view_sketch_key(key['PK'], video_id))
+        for shard in range(shards):
+            batch.delete_item(Key=counter_shard_key(key, shard))
+        if shards:
+            batch.delete_item(Key=_counter_registry_key(key))
+    invalidate(('video', video_id))
+    invalidate(('related', video_id))
+    search_index.video_removed(video_id)
+    if old.get('status') == 'READY':
+        page_cache.bump(page_cache.user_videos_scope(email), page_cache.FEED)
+    elif old:
+        page_cache.bump(page_cache.user_videos_scope(email))
+
+# --- Content-hash deduplication ---
+# The browser sends the SHA-256 of a file it is about to upload (a tree hash,
+# see content_hash_chunk and dashboard.html). Once that upload is complete the
+# hash is registered on a CONTENT#<hash> item in the creator's partition; the
+# next upload of the same file by the same creator becomes a new video on the
+# processed media of the first one, with no upload and no transcode.
+#
+# Per creator on purpose: the server can't check a hash it is sent without the
+# bytes, so a hash must never give access to someone else's video. The item
+# names its video in target_video, not video_id, which would put it in the
+# video_id index. Deleting a video leaves its S3 objects alone, which is what
+# makes sharing them safe.
+
+CONTENT_HASH_CHUNK = 8 * 1024 * 1024 # Changing it changes every hash: registered ones stop matching
+
+# Media a duplicate shares with its original (the attributes transcoding sets, plus the upload's)
+MEDIA_FIELDS = (
+    'raw_s3_key', 'thumbnail_key', 'thumbnail_variants', 'file_size', 'content_hash',
+    'processed_bucket', 'processed_s3_key', 'hls_master_key',
+)
+
+def content_key(email, content_hash):
+    return {'PK': f"USER#{email}", 'SK': f"CONTENT#{content_hash}"}
+
+def register_content(email, content_hash, video_id):
+    get_table().put_item(Item=dict(content_key(email, content_hash), target_video=video_id, registered_at=int(time.time())))
+
+def find_duplicate(email, content_hash):
+    """The creator's READY video with this content, or None (never uploaded, deleted, not transcoded yet)."""
+    item = get_table().get_item(Key=content_key(email, content_hash)).get('Item')
+    if not item:
+        return None
+    video = get_user_video(email, item['target_video'])
+    return video if video and video.get('status') == 'READY' else None
+
+def create_duplicate_entry(email, original, title, channel, description=""):
+    """A new READY video on `original`'s media. Returns its id."""
+    extra = {field: original[field] for field in MEDIA_FIELDS if field in original}
+    extra.update(duplicate_of=original['video_id'], processed_at=int(time.time()))
+    return create_video_entry(
+        email, title, extra.pop('raw_s3_key'), extra.pop('thumbnail_key', None), channel, description,
+        status='READY', extra=extra,
+    )
+
+# --- Transcoding jobs ---
+# Every PROCESSING video is a job for `manage.py transcode_worker`. A worker
+# claims one with a conditional update that takes a time-limited lease
+# (lease_owner/lease_expires) and keeps extending it while it works; if the
+# worker dies the lease simply runs out and another worker claims the job.
+
+def find_transcode_jobs(limit=10):
+    """Claimable PROCESSING videos: highest `priority` first, then oldest."""
     table = get_table()
-    # Scans are slow in production, but fine for this prototype
-    response = table.scan(
-        FilterExpression=Attr('video_id').eq(video_id)
+    now = int(time.time())
+    query_kwargs = {
+        'IndexName': settings.DYNAMO_FEED_INDEX,
+        'KeyConditionExpression': Key('status').eq('PROCESSING'),
+        # Skip jobs someone holds a live lease on (or that are backing off after a failure)
+        'FilterExpression': Attr('lease_expires').not_exists() | Attr('lease_expires').lt(now),
+    }
+    jobs = []
+    # Oldest first; Limit applies before the filter, so page until there are enough
+    while len(jobs) < limit * 4:
+        response = table.query(**query_kwargs)
+        jobs.extend(response.get('Items', []))
+        if 'LastEvaluatedKey' not in response:
+            break
+        query_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    jobs.sort(key=lambda job: (-int(job.get('priority', 0)), job.get('created_at', 0)))
+    return jobs[:limit]
+
+def claim_transcode_job(video, worker_id, lease_seconds):
+    """Take the lease on a job. Returns the updated item, or None if another worker got it."""
+    table = get_table()
+    now = int(time.time())
+    try:
+        response = table.update_item(
+            Key={'PK': video['PK'], 'SK': video['SK']},
+            UpdateExpression="SET lease_owner = :me, lease_expires = :expires, attempts = if_not_exists(attempts, :zero) + :one",
+            ConditionExpression="#s = :processing AND (attribute_not_exists(lease_expires) OR lease_expires < :now)",
+            ExpressionAttributeNames={'#s': 'status'},
+            ExpressionAttributeValues={
+                ':me': worker_id, ':expires': now + lease_seconds, ':now': now,
+                ':processing': 'PROCESSING', ':zero': 0, ':one': 1,
+            },
+            ReturnValues='ALL_NEW'
+        )
+    except table.meta.client.exceptions.ConditionalCheckFailedException:
+        return None
+    return response['Attributes']
+
+def _update_own_job(video, worker_id, **update_kwargs):
+    # Every write after the claim is conditional on still holding the lease
+    table = get_table()
+    update_kwargs.setdefault('ExpressionAttributeNames', {})['#s'] = 'status'
+    update_kwargs.setdefault('ExpressionAttributeValues', {}).update({':me': worker_id, ':processing': 'PROCESSING'})
+    try:
+        table.update_item(
+            Key={'PK': video['PK'], 'SK': video['SK']},
+            ConditionExpression="lease_owner = :me AND #s = :processing",
+            **update_kwargs
+        )
+    except table.meta.client.exceptions.ConditionalCheckFailedException:
+        return False # Lease lost (expired and re-claimed, or the video was deleted)
+    return True
+
+def heartbeat_transcode_job(video, worker_id, lease_seconds):
+    return _update_own_job(
+        video, worker_id,
+        UpdateExpression="SET lease_expires = :expires",
+        ExpressionAttributeValues={':expires': int(time.time()) + lease_seconds}
     )
-    items = response.get('Items', [])
-    if items:
-        return items[0]
-    return None
 
-from boto3.dynamodb.conditions import Key
+def finish_transcode_job(video, worker_id, processed):
+    """processed: attributes to set, at least processed_bucket and processed_s3_key. Flips the video to READY."""
+    processed = dict(processed, creator_feed=video['PK']) # Into the creator's Subscriptions stream
+    names = {f"#p{i}": name for i, name in enumerate(processed)}
+    values = {f":p{i}": value for i, value in enumerate(processed.values())}
+    values.update({':ready': 'READY', ':now': int(time.time())})
+    done = _update_own_job(
+        video, worker_id,
+        UpdateExpression="SET #s = :ready, processed_at = :now, "
+                         + ", ".join(f"#p{i} = :p{i}" for i in range(len(processed)))
+                         + " REMOVE lease_owner, lease_expires, last_error",
+        ExpressionAttributeNames=names,
+        ExpressionAttributeValues=values
+    )
+    if done:
+        invalidate(('video', video['video_id']))
+        ready = dict(video, **processed, status='READY')
+        search_index.video_changed(ready)
+        subscription_feed.publish(ready)
+        page_cache.bump(page_cache.user_videos_scope(video['PK'].split('#', 1)[1]), page_cache.FEED)
+    return done
+
+def fail_transcode_job(video, worker_id, error, max_attempts):
+    """
+    Give the job back after a failed attempt. It is retried after a backoff
+    (the lease_expires of nobody) until `max_attempts`, then marked FAILED.
+    """
+    attempts = int(video.get('attempts', 1))
+    error = str(error)[-1000:]
+    if attempts >= max_attempts:
+        failed = _update_own_job(
+            video, worker_id,
+            UpdateExpression="SET #s = :failed, last_error = :error REMOVE lease_owner, lease_expires",
+            ExpressionAttributeValues={':failed': 'FAILED', ':error': error}
+        )
+        if failed:
+            search_index.video_status_changed(video['video_id'], 'FAILED')
+            page_cache.bump(page_cache.user_videos_scope(video['PK'].split('#', 1)[1]))
+        return failed
+    return _update_own_job(
+        video, worker_id,
+        UpdateExpression="SET lease_expires = :retry_at, last_error = :error REMOVE lease_owner",
+        ExpressionAttributeValues={
+            ':retry_at': int(time.time()) + min(3600, 30 * 2 ** attempts),
+            ':error': error,
+        }
+    )
+
+def _cacheable_video(item):
+    # Only READY videos are cached. A PROCESSING one is about to change status,
+    # and "not found" may just be the GSI lagging behind a fresh upload
+    # (GSI reads are always eventually consistent), so neither may stick around
+    return item is not None and item.get('status') == 'READY'
+
+def get_video_by_id(video_id):
+    def load():
+        table = get_table()
+        # One Query on the video_id GSI instead of a full-table Scan
+        # (the SK filter keeps any other item type that might carry a video_id out)
+        response = table.query(
+            IndexName=settings.DYNAMO_VIDEO_ID_INDEX,
+            KeyConditionExpression=Key('video_id').eq(video_id),
+            FilterExpression=Attr('SK').begins_with('VIDEO#')
+        )
+        items = response.get('Items', [])
+        if items:
+            return items[0]
+        return None
+    return cached('video', video_id, load, cache_if=_cacheable_video)
 
 # ... existing imports and functions ...
 
@@ -111,24 +436,270 @@ def get_user_videos(email):
 
 # core/db_utils.py
 
-def get_all_videos():
+def get_videos_page(limit=None, cursor=None, status='READY'):
+    """
+    One page of the global feed, newest first.
+    A single Query on the status/created_at GSI; returns (items, next_cursor).
+    next_cursor is None on the last page.
+    """
     table = get_table()
-    
-    # SCAN: "Look at everything in the table"
-    # Filter: Keep only items where SK starts with "VIDEO#" and Status is READY
-    response = table.scan(
-        FilterExpression=Attr('SK').begins_with('VIDEO#') & Attr('status').eq('READY')
+    query_kwargs = {
+        'IndexName': settings.DYNAMO_FEED_INDEX,
+        'KeyConditionExpression': Key('status').eq(status),
+        'ScanIndexForward': False, # Newest first
+        'Limit': limit or settings.FEED_PAGE_SIZE,
+    }
+    start_key = decode_cursor(cursor)
+    if start_key:
+        query_kwargs['ExclusiveStartKey'] = start_key
+
+    response = table.query(**query_kwargs)
+    return response.get('Items', []), encode_cursor(response.get('LastEvaluatedKey'))
+
+def parallel_scan(segments, **scan_kwargs):
+    """Every item of a Scan (of the table, or an index via IndexName), read as `segments` parallel segments."""
+    table = get_table()
+
+    def scan_segment(segment):
+        segment_kwargs = dict(scan_kwargs, Segment=segment, TotalSegments=segments)
+        items = []
+        while True:
+            response = table.scan(**segment_kwargs)
+            items.extend(response.get('Items', []))
+            if 'LastEvaluatedKey' not in response:
+                return items
+            segment_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    with ThreadPoolExecutor(max_workers=segments) as pool:
+        return [item for items in pool.map(metrics.bind(scan_segment), range(segments)) for item in items]
+
+# --- Related videos ---
+# `manage.py build_related` (UserLogin/related.py) stores each READY video's
+# "Up next" list on an item next to the video:
+#     PK = <video's PK>, SK = RELATED#<video_id>, videos = [<card fields>, ...]
+
+def related_videos_key(video_pk, video_id):
+    return {'PK': video_pk, 'SK': f"RELATED#{video_id}"}
+
+def view_sketch_key(video_pk, video_id):
+    # The unique-viewer sketch (view_counts.py): kept off the VIDEO# item, which every index copies
+    return {'PK': video_pk, 'SK': f"VIEWS#{video_id}"}
+
+def load_related_videos(loader, video_pk, video_id):
+    return loader.load(
+        related_videos_key(video_pk, video_id),
+        transform=lambda item: (item or {}).get('videos', []),
+        cache=('related', video_id)
     )
-    
-    items = response.get('Items', [])
-    
-    # Sort by creation time (Newest First)
-    items.sort(key=lambda x: x.get('created_at', 0), reverse=True)
-    
-    return items
 
-def toggle_subscription(subscriber_email, creator_email):
+# --- Sharded counters ---
+# Every like or subscribe is an update on one item: the video, or the creator's
+# PROFILE. For a viral video or a big creator that single key becomes a write
+# hot spot. Setting counter_shards = N on such an item (manage.py
+# shard_counters) spreads its counter updates over N shard items instead,
+# picked at random:
+#
+#     PK = <item's PK>, SK = COUNTER#<item's SK>#<0..N-1>
+#
+# A counter's value is then the item's own attribute plus the sum over its
+# shards. The count so far stays on the item, so turning sharding on copies
+# nothing, and an update that still lands on the item (a process that hasn't
+# seen the new N yet) is counted all the same. Readers that can live with
+# slightly old numbers use the counter_totals aggregate `manage.py
+# refresh_counters` keeps on the item instead of reading every shard
+# (settings.COUNTERS['AGGREGATE_MAX_AGE']).
+
+COUNTER_REGISTRY_PK = 'COUNTERS' # One item per sharded item, for refresh_counters
+VIDEO_COUNTERS = ('likes', 'dislikes')
+PROFILE_COUNTERS = ('subscribers',)
+
+def counter_names(key):
+    # Counters kept on an item, by item type
+    return PROFILE_COUNTERS if key['SK'] == 'PROFILE' else VIDEO_COUNTERS
+
+def counter_shard_key(key, shard):
+    return {'PK': key['PK'], 'SK': f"COUNTER#{key['SK']}#{shard}"}
+
+def _counter_registry_key(key):
+    return {'PK': COUNTER_REGISTRY_PK, 'SK': f"{key['PK']}|{key['SK']}"}
+
+def _counter_shards(key):
+    # Shard count of an item's counters (0: not sharded), cached. Going stale
+    # after shard_counters is harmless: reads always add item and shards up.
+    def load():
+        item = get_table().get_item(Key=key, ProjectionExpression='counter_shards').get('Item') or {}
+        return int(item.get('counter_shards', 0))
+    return cached('shards', (key['PK'], key['SK']), load)
+
+def sum_counter_shards(item, names, consistent=False):
+    """
+    `item` with each counter in `names` set to its total: the item's own value
+    plus its shards' (all shards in one BatchGetItem). Unsharded items come
+    back as they are.
+    """
+    shards = int((item or {}).get('counter_shards', 0))
+    if not shards:
+        return item
+    loader = ItemLoader(consistent_read=consistent)
+    pending = [loader.load(counter_shard_key(item, shard)) for shard in range(shards)]
+    totals = dict(item)
+    for name in names:
+        totals[name] = int(item.get(name, 0)) + sum(int((p.get() or {}).get(name, 0)) for p in pending)
+    return totals
+
+def _with_counter_totals(item, names):
+    # Read path: the refresh_counters aggregate while it is recent enough,
+    # the live sum over the shards otherwise
+    if not item or not int(item.get('counter_shards', 0)):
+        return item
+    max_age = settings.COUNTERS['AGGREGATE_MAX_AGE']
+    aggregate = item.get('counter_totals')
+    if aggregate and max_age and time.time() - int(item.get('counter_totals_at', 0)) <= max_age:
+        return dict(item, **{name: int(aggregate.get(name, 0)) for name in names})
+    return sum_counter_shards(item, names)
+
+def add_to_counters(key, changes):
+    """
+    Apply `changes` ({'likes': 1, 'dislikes': -1}) to an item's counters, on a
+    random shard if the item is sharded. Returns the whole item with the new
+    counter totals (for write-through). Raises LookupError if the item doesn't
+    exist.
+    """
+    changes = {name: delta for name, delta in changes.items() if delta}
     table = get_table()
+    update = {
+        'UpdateExpression': "ADD " + ", ".join(f"#c{i} :c{i}" for i in range(len(changes))),
+        'ExpressionAttributeNames': {f"#c{i}": name for i, name in enumerate(changes)},
+        'ExpressionAttributeValues': {f":c{i}": delta for i, delta in enumerate(changes.values())},
+    }
+    shards = _counter_shards(key)
+    if not shards:
+        try:
+            # No counter-only ghost row for a deleted item
+            return table.update_item(Key=key, ReturnValues='ALL_NEW', ConditionExpression="attribute_exists(PK)", **update)['Attributes']
+        except table.meta.client.exceptions.ConditionalCheckFailedException:
+            raise LookupError(f"No {key['PK']} {key['SK']}")
+
+    table.update_item(Key=counter_shard_key(key, random.randrange(shards)), **update)
+    return _read_counters(key)
+
+def _read_counters(key):
+    # The item, read consistently, with its counter totals (shards included)
+    item = get_table().get_item(Key=key, ConsistentRead=True).get('Item')
+    return sum_counter_shards(item, counter_names(key), consistent=True)
+
+def set_counter_shards(key, shards):
+    """
+    Spread an existing item's counters over `shards` shard items from now on;
+    returns the previous shard count. Shard counts only grow: a process still
+    using a larger cached count would otherwise update shards nobody reads.
+    """
+    table = get_table()
+    try:
+        response = table.update_item(
+            Key=key,
+            UpdateExpression="SET counter_shards = :n",
+            ConditionExpression="attribute_exists(PK) AND (attribute_not_exists(counter_shards) OR counter_shards <= :n)",
+            ExpressionAttributeValues={':n': shards},
+            ReturnValues='UPDATED_OLD'
+        )
+    except table.meta.client.exceptions.ConditionalCheckFailedException:
+        raise ValueError(f"{key['PK']} {key['SK']} doesn't exist or already has more than {shards} shards")
+    table.put_item(Item=dict(_counter_registry_key(key), item_pk=key['PK'], item_sk=key['SK']))
+    invalidate(('shards', (key['PK'], key['SK'])))
+    return int(response.get('Attributes', {}).get('counter_shards', 0))
+
+def sharded_counter_keys():
+    """Keys of every item set_counter_shards was run on."""
+    table = get_table()
+    query_kwargs = {'KeyConditionExpression': Key('PK').eq(COUNTER_REGISTRY_PK)}
+    keys = []
+    while True:
+        response = table.query(**query_kwargs)
+        keys += [{'PK': item['item_pk'], 'SK': item['item_sk']} for item in response.get('Items', [])]
+        if 'LastEvaluatedKey' not in response:
+            return keys
+        query_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+def refresh_counter_totals(key):
+    """Recompute the counter_totals aggregate on a sharded item. Returns the totals, or None if the item is gone."""
+    table = get_table()
+    item = table.get_item(Key=key, ConsistentRead=True).get('Item')
+    if item is None:
+        return None
+    names = counter_names(key)
+    item = sum_counter_shards(item, names, consistent=True)
+    totals = {name: int(item.get(name, 0)) for name in names}
+    try:
+        table.update_item(
+            Key=key,
+            UpdateExpression="SET counter_totals = :totals, counter_totals_at = :now",
+            ConditionExpression="attribute_exists(PK)", # Never resurrect a deleted item
+            ExpressionAttributeValues={':totals': totals, ':now': int(time.time())}
+        )
+    except table.meta.client.exceptions.ConditionalCheckFailedException:
+        return None
+    return totals
+
+# --- Transactional engagement writes ---
+# A vote or (un)subscribe is one TransactWriteItems: the REACTION#/SUB# item,
+# conditioned on the state we believe it is in, plus the counter update. The
+# belief is just the cached value, so there's no read ahead of the write; when
+# it is wrong the condition fails, DynamoDB returns the actual item
+# (ReturnValuesOnConditionCheckFailure) and the write is retried from that.
+# Either both halves happen or neither, so concurrent clicks can't double-count.
+# Transactions can't return the updated item, so the new counts are one
+# consistent GetItem after it: two round-trips per vote.
+
+ENGAGEMENT_RETRIES = 5
+_deserializer = TypeDeserializer()
+
+def _counter_op(key, changes):
+    # Counter half of the transaction: on the item itself, which must exist
+    # (no counter-only ghost row for a deleted video), or on a random shard
+    changes = {name: delta for name, delta in changes.items() if delta}
+    update = {
+        'TableName': settings.DYNAMO_TABLE,
+        'UpdateExpression': "ADD " + ", ".join(f"#c{i} :c{i}" for i in range(len(changes))),
+        'ExpressionAttributeNames': {f"#c{i}": name for i, name in enumerate(changes)},
+        'ExpressionAttributeValues': {f":c{i}": delta for i, delta in enumerate(changes.values())},
+    }
+    shards = _counter_shards(key)
+    if shards:
+        return {'Update': dict(update, Key=counter_shard_key(key, random.randrange(shards)))}
+    return {'Update': dict(update, Key=key, ConditionExpression="attribute_exists(PK)")}
+
+def _write_engagement(operation, changes, target):
+    """
+    Run `operation` ({'Put': ...} or {'Delete': ...} on a relationship item,
+    with a ConditionExpression on its expected state) together with the
+    counter `changes` on `target` in one transaction.
+
+    Returns (True, None) once written, or (False, actual item or None) when the
+    relationship item wasn't in the expected state. Raises LookupError if the
+    target item doesn't exist.
+    """
+    client = get_table().meta.client
+    (kind, params), = operation.items()
+    operation = {kind: dict(params, TableName=settings.DYNAMO_TABLE, ReturnValuesOnConditionCheckFailure='ALL_OLD')}
+    for attempt in range(ENGAGEMENT_RETRIES):
+        try:
+            client.transact_write_items(TransactItems=[operation, _counter_op(target, changes)])
+            return True, None
+        except client.exceptions.TransactionCanceledException as e:
+            codes = [reason.get('Code') for reason in e.response.get('CancellationReasons', [])]
+            if codes and codes[0] == 'ConditionalCheckFailed':
+                item = e.response['CancellationReasons'][0].get('Item') # Raw AttributeValues in errors
+                return False, {k: _deserializer.deserialize(v) for k, v in item.items()} if item else None
+            if 'ConditionalCheckFailed' in codes:
+                raise LookupError(f"No {target['PK']} {target['SK']}")
+            # TransactionConflict: a concurrent transaction on the same items. Full-jitter backoff
+            time.sleep(random.uniform(0, 0.05 * 2 ** attempt))
+    raise RuntimeError(f"Engagement write on {target['PK']} {target['SK']} still conflicting after {ENGAGEMENT_RETRIES} tries")
+
+def toggle_subscription(subscriber_email, creator_email):
+    if settings.WRITE_BEHIND['ENABLED']:
+        return _queue_subscription(subscriber_email, creator_email)
     
     # 1. Define the Relationship Key
     # PK = Subscriber, SK = Who they are subscribed to
@@ -136,137 +707,226 @@ def toggle_subscription(subscriber_email, creator_email):
         'PK': f"USER#{subscriber_email}",
         'SK': f"SUB#{creator_email}"
     }
+    profile_key = {'PK': f"USER#{creator_email}", 'SK': 'PROFILE'}
     
-    # 2. Check if subscription exists
-    response = table.get_item(Key=sub_key)
-    is_subscribed = 'Item' in response
-    
-    if is_subscribed:
-        # ACTION: UNSUBSCRIBE
-        # A. Remove the relationship
-        table.delete_item(Key=sub_key)
-        
-        # B. Decrement Creator's Count (Atomic Update)
-        table.update_item(
-            Key={'PK': f"USER#{creator_email}", 'SK': 'PROFILE'},
-            UpdateExpression="SET subscribers = subscribers - :val",
-            ExpressionAttributeValues={':val': 1}
-        )
-        return False # Now unsubscribed
-        
+    # 2. Flip whatever state the subscription is in. Start from the cached one:
+    # if it is stale the transaction's condition catches it
+    was_subscribed = is_subscribed(subscriber_email, creator_email)
+    for _ in range(ENGAGEMENT_RETRIES):
+        if was_subscribed:
+            # UNSUBSCRIBE: remove the relationship, decrement the creator's count
+            operation = {'Delete': {'Key': sub_key, 'ConditionExpression': "attribute_exists(PK)"}}
+        else:
+            # SUBSCRIBE: create the relationship, increment the count (ADD starts it at 0)
+            operation = {'Put': {
+                'Item': dict(sub_key, created_at=int(time.time())),
+                'ConditionExpression': "attribute_not_exists(PK)"
+            }}
+        done, _ = _write_engagement(operation, {'subscribers': -1 if was_subscribed else 1}, profile_key)
+        if done:
+            break
+        was_subscribed = not was_subscribed # It was in the other state
     else:
-        # ACTION: SUBSCRIBE
-        # A. Create the relationship
-        table.put_item(Item={
-            'PK': f"USER#{subscriber_email}",
-            'SK': f"SUB#{creator_email}",
-            'created_at': int(time.time())
-        })
-        
-        # B. Increment Creator's Count
-        # Note: We use 'SET subscribers = if_not_exists(subscribers, :zero) + :val'
-        # This initializes the counter to 0 if it doesn't exist yet.
-        table.update_item(
-            Key={'PK': f"USER#{creator_email}", 'SK': 'PROFILE'},
-            UpdateExpression="SET subscribers = if_not_exists(subscribers, :zero) + :val",
-            ExpressionAttributeValues={':val': 1, ':zero': 0}
-        )
-        return True # Now subscribed
+        raise RuntimeError(f"Subscription {subscriber_email} -> {creator_email} kept changing under us")
+    
+    subscription_feed.subscription_changed(subscriber_email, creator_email, not was_subscribed)
+    # 3. The count after the write (consistent, shards included)
+    return _store_subscription(subscriber_email, creator_email, not was_subscribed, _read_counters(profile_key))
+
+def _store_subscription(subscriber_email, creator_email, subscribed, profile):
+    # Write-through: cache what the write itself returned instead of
+    # re-reading (a re-read can be stale and would then stick for the TTL)
+    profile = _public_profile(profile)
+    store('sub', (subscriber_email, creator_email), subscribed)
+    store('profile', creator_email, profile) # Holds the subscriber count
+    # (now subscribed?, creator's new subscriber count)
+    return subscribed, int(profile.get('subscribers', 0))
+
+def _queue_subscription(subscriber_email, creator_email):
+    # Write-behind toggle_subscription: queue the new state, answer with an
+    # optimistic count (write_behind.py does the DynamoDB writes later)
+    from . import write_behind # write_behind imports this module
+    key = {'PK': f"USER#{subscriber_email}", 'SK': f"SUB#{creator_email}"}
+    queued, item = write_behind.pending(key)
+    subscribed = not (item is not None if queued else is_subscribed(subscriber_email, creator_email))
+    write_behind.enqueue(
+        'sub', key, dict(key, created_at=int(time.time())) if subscribed else None,
+        {'PK': f"USER#{creator_email}", 'SK': 'PROFILE'}
+    )
+
+    subscription_feed.subscription_queued(subscriber_email, creator_email, subscribed)
+
+    profile = get_public_profile(creator_email) or {}
+    count = max(0, int(profile.get('subscribers', 0)) + (1 if subscribed else -1))
+    store('sub', (subscriber_email, creator_email), subscribed)
+    if profile:
+        store('profile', creator_email, dict(profile, subscribers=count))
+    return subscribed, count
 
 def get_subscriber_count(creator_email):
-    table = get_table()
-    response = table.get_item(Key={'PK': f"USER#{creator_email}", 'SK': 'PROFILE'})
-    item = response.get('Item', {})
+    item = get_public_profile(creator_email) or {}
     return item.get('subscribers', 0)
 
 def is_subscribed(subscriber_email, creator_email):
-    table = get_table()
-    response = table.get_item(Key={
-        'PK': f"USER#{subscriber_email}",
-        'SK': f"SUB#{creator_email}"
-    })
-    return 'Item' in response
+    def load():
+        table = get_table()
+        response = table.get_item(Key={
+            'PK': f"USER#{subscriber_email}",
+            'SK': f"SUB#{creator_email}"
+        })
+        return 'Item' in response
+    return cached('sub', (subscriber_email, creator_email), load)
 
-def get_video_stats(video_pk, video_sk):
-    table = get_table()
-    response = table.get_item(Key={'PK': video_pk, 'SK': video_sk})
-    item = response.get('Item', {})
+def _video_stats(item):
+    item = item or {}
     return {
         'likes': int(item.get('likes', 0)),
         'dislikes': int(item.get('dislikes', 0))
     }
 
-def get_user_reaction(user_email, video_id):
+def get_video_stats(video_pk, video_sk):
+    def load():
+        table = get_table()
+        response = table.get_item(Key={'PK': video_pk, 'SK': video_sk})
+        return _video_stats(_with_counter_totals(response.get('Item'), VIDEO_COUNTERS))
+    return cached('stats', (video_pk, video_sk), load)
+
+def _reaction_type(item):
+    # Returns "LIKE", "DISLIKE", or None
+    return (item or {}).get('type')
+
+def _load_user_reaction(user_email, video_id, consistent=False):
     table = get_table()
     # Check if this user has reacted to this specific video ID
     response = table.get_item(Key={
         'PK': f"USER#{user_email}",
         'SK': f"REACTION#{video_id}"
-    })
-    # Returns "LIKE", "DISLIKE", or None
-    return response.get('Item', {}).get('type')
+    }, ConsistentRead=consistent)
+    return _reaction_type(response.get('Item'))
+
+def get_user_reaction(user_email, video_id):
+    return cached('reaction', (user_email, video_id), lambda: _load_user_reaction(user_email, video_id))
+
+# --- Batched variants ---
+# Same lookups (and cache entries) as the functions above, but queued on a
+# request-scoped ItemLoader so a view can resolve all of them in one BatchGetItem.
+
+def load_public_profile(loader, email):
+    return loader.load(
+        {'PK': f"USER#{email}", 'SK': 'PROFILE'},
+        transform=lambda item: _public_profile(_with_counter_totals(item, PROFILE_COUNTERS)),
+        cache=('profile', email)
+    )
+
+def load_is_subscribed(loader, subscriber_email, creator_email):
+    return loader.load(
+        {'PK': f"USER#{subscriber_email}", 'SK': f"SUB#{creator_email}"},
+        transform=lambda item: item is not None,
+        cache=('sub', (subscriber_email, creator_email))
+    )
+
+def load_user_reaction(loader, user_email, video_id):
+    return loader.load(
+        {'PK': f"USER#{user_email}", 'SK': f"REACTION#{video_id}"},
+        transform=_reaction_type,
+        cache=('reaction', (user_email, video_id))
+    )
+
+def load_video_stats(loader, video_pk, video_sk):
+    return loader.load(
+        {'PK': video_pk, 'SK': video_sk},
+        transform=lambda item: _video_stats(_with_counter_totals(item, VIDEO_COUNTERS)),
+        cache=('stats', (video_pk, video_sk))
+    )
 
 def update_reaction(user_email, video_pk, video_sk, video_id, new_action):
     """
     new_action can be: 'LIKE', 'DISLIKE', or 'NONE' (removing vote)
+    Returns the video's like/dislike counts after the change.
+    Raises LookupError if there is no such video.
     """
-    table = get_table()
+    if settings.WRITE_BEHIND['ENABLED']:
+        return _queue_reaction(user_email, video_pk, video_sk, video_id, new_action)
     reaction_key = {'PK': f"USER#{user_email}", 'SK': f"REACTION#{video_id}"}
+    video_key = {'PK': video_pk, 'SK': video_sk}
+    new_reaction = None if new_action == 'NONE' else new_action
     
-    # 1. Get current state (Did I already like it?)
+    # 1. Current state (Did I already like it?): the cached one is only a guess,
+    # the transaction below checks it
     current_reaction = get_user_reaction(user_email, video_id)
+    confirmed = False
+    for _ in range(ENGAGEMENT_RETRIES):
+        if current_reaction == new_reaction:
+            if not confirmed:
+                # Looks like a no-op: make sure before dropping the click
+                current_reaction = _load_user_reaction(user_email, video_id, consistent=True)
+                confirmed = True
+                continue
+            store('reaction', (user_email, video_id), current_reaction)
+            return get_video_stats(video_pk, video_sk) # No change needed
+
+        # 2. The Reaction Item, only if it is still in the state we think
+        if current_reaction is None:
+            condition = {'ConditionExpression': "attribute_not_exists(PK)"}
+        else:
+            condition = {
+                'ConditionExpression': "#t = :current",
+                'ExpressionAttributeNames': {'#t': 'type'},
+                'ExpressionAttributeValues': {':current': current_reaction},
+            }
+        if new_reaction is None:
+            operation = {'Delete': dict(condition, Key=reaction_key)}
+        else:
+            operation = {'Put': dict(condition, Item=dict(reaction_key, type=new_reaction))}
+
+        # 3. The Video Counters (The Math), in the same transaction
+        # e.g. If switching Like -> Dislike: likes -1, dislikes +1
+        changes = {
+            'likes': (new_reaction == 'LIKE') - (current_reaction == 'LIKE'),
+            'dislikes': (new_reaction == 'DISLIKE') - (current_reaction == 'DISLIKE'),
+        }
+        done, actual = _write_engagement(operation, changes, video_key)
+        if done:
+            break
+        current_reaction, confirmed = _reaction_type(actual), True # Someone else voted first: redo from theirs
+    else:
+        raise RuntimeError(f"Reaction {user_email} -> {video_id} kept changing under us")
+    store('reaction', (user_email, video_id), new_reaction)
+    video = _read_counters(video_key)
     
-    if current_reaction == new_action:
-        return # No change needed
-    
-    # 2. Update the User's "Memory" (The Reaction Item)
-    if new_action == 'NONE':
-        table.delete_item(Key=reaction_key)
+    # 4. Write the new counters through to the cache so the voter sees their
+    # own vote right away (a consistent read, so never older than the vote)
+    stats = _video_stats(video)
+    store('stats', (video_pk, video_sk), stats)
+    if _cacheable_video(video):
+        store('video', video_id, video) # The cached video item carries likes/dislikes too
     else:
-        table.put_item(Item={
-            'PK': f"USER#{user_email}", 
-            'SK': f"REACTION#{video_id}",
-            'type': new_action
-        })
+        invalidate(('video', video_id))
+    return stats
 
-    # 3. Update the Video Counters (The Math)
-    # We construct an update expression based on the change
-    # e.g. If switching Like -> Dislike: likes -1, dislikes +1
-    
-    update_exp = "SET "
-    exp_values = {}
-    exp_names = {}
-    
-    # Helper to build the math
-    # changes = {'likes': 1, 'dislikes': -1}
-    changes = {}
-    
-    # Remove old effect
-    if current_reaction == 'LIKE': changes['likes'] = -1
-    if current_reaction == 'DISLIKE': changes['dislikes'] = -1
-    
-    # Add new effect
-    if new_action == 'LIKE': changes['likes'] = changes.get('likes', 0) + 1
-    if new_action == 'DISLIKE': changes['dislikes'] = changes.get('dislikes', 0) + 1
-    
-    # If no changes (rare), exit
-    if not changes: return
-
-    # Build DynamoDB Expression
-    parts = []
-    for k, v in changes.items():
-        if v == 0: continue
-        sign = "+" if v > 0 else "-"
-        # "likes = if_not_exists(likes, 0) + 1"
-        parts.append(f"#{k} = if_not_exists(#{k}, :zero) {sign} :val_{k}")
-        exp_names[f"#{k}"] = k
-        exp_values[f":val_{k}"] = abs(v)
-    
-    exp_values[':zero'] = 0
-    
-    table.update_item(
-        Key={'PK': video_pk, 'SK': video_sk},
-        UpdateExpression="SET " + ", ".join(parts),
-        ExpressionAttributeNames=exp_names,
-        ExpressionAttributeValues=exp_values
-    )
\ No newline at end of file
+def _queue_reaction(user_email, video_pk, video_sk, video_id, new_action):
+    # Write-behind update_reaction: queue the new state, answer with optimistic
+    # counts (write_behind.py does the DynamoDB writes and the counter math later)
+    from . import write_behind # write_behind imports this module
+    key = {'PK': f"USER#{user_email}", 'SK': f"REACTION#{video_id}"}
+    queued, item = write_behind.pending(key)
+    current_reaction = _reaction_type(item) if queued else get_user_reaction(user_email, video_id)
+    new_reaction = None if new_action == 'NONE' else new_action
+
+    stats = dict(get_video_stats(video_pk, video_sk))
+    if current_reaction == new_reaction:
+        return stats
+    write_behind.enqueue(
+        'reaction', key, dict(key, type=new_reaction) if new_reaction else None,
+        {'PK': video_pk, 'SK': video_sk}
+    )
+
+    for reaction, counter in (('LIKE', 'likes'), ('DISLIKE', 'dislikes')):
+        stats[counter] += (new_reaction == reaction) - (current_reaction == reaction)
+        stats[counter] = max(0, stats[counter])
+    store('reaction', (user_email, video_id), new_reaction)
+    store('stats', (video_pk, video_sk), stats)
+    return stats
+
+# DynamoDB capacity is counted per db_utils function (metrics.py)
+metrics.instrument(sys.modules[__name__])
@@ -0,0 +1,13 @@
+from django.conf import settings
+from django.contrib.auth import hashers
+
+
+class PBKDF2PasswordHasher(hashers.PBKDF2PasswordHasher):
+    """
+    Django's PBKDF2-SHA256 with its cost from PASSWORD_HASHING['PBKDF2_ITERATIONS'].
+    Hashes made with another cost are rehashed at the next login (passwords.check).
+    """
+
+    @property
+    def iterations(self):
+        return settings.PASSWORD_HASHING['PBKDF2_ITERATIONS'] or hashers.PBKDF2PasswordHasher.iterations
@@ -0,0 +1,91 @@
+"""
+HLS (adaptive bitrate) packaging and playback.
+
+The transcoder writes the renditions next to the progressive MP4:
+
+    processed/<video_id>/video.mp4
+    processed/<video_id>/master.m3u8              <- video item's hls_master_key
+    processed/<video_id>/hls/720p/index.m3u8
+    processed/<video_id>/hls/720p/seg_00000.ts ...
+
+Every rendition is cut into SEGMENT_SECONDS-long segments with a keyframe at
+each boundary, so the player can switch bitrate at any segment. The master
+playlist on S3 uses relative URIs; the manifest view serves a copy with
+absolute ones (see public_master_playlist).
+
+With a private processed bucket only the master's rendition URIs get
+presigned; the segments those playlists list still need a public bucket (or
+CloudFront signed cookies) to play.
+"""
+import posixpath
+
+from django.conf import settings
+
+from . import aws_clients
+from .db_cache import cached
+from .presign import media_url
+
+MASTER_PLAYLIST = 'master.m3u8'
+PLAYLIST_TYPE = 'application/vnd.apple.mpegurl'
+SEGMENT_TYPE = 'video/mp2t'
+
+# Bitrates in kbit/s. Renditions taller than the source are skipped.
+RENDITIONS = [
+    {'name': '1080p', 'height': 1080, 'video_bitrate': 5000, 'audio_bitrate': 128},
+    {'name': '720p', 'height': 720, 'video_bitrate': 2800, 'audio_bitrate': 128},
+    {'name': '480p', 'height': 480, 'video_bitrate': 1400, 'audio_bitrate': 96},
+    {'name': '360p', 'height': 360, 'video_bitrate': 800, 'audio_bitrate': 96},
+]
+
+
+def ladder_for(source_height):
+    """Renditions worth producing for a source `source_height` pixels tall (never empty)."""
+    if not source_height:
+        return list(RENDITIONS)
+    fitting = [r for r in RENDITIONS if r['height'] <= source_height]
+    return fitting or [RENDITIONS[-1]]
+
+
+def rendition_playlist(rendition):
+    return f"hls/{rendition['name']}/index.m3u8"
+
+
+def master_playlist(renditions, aspect_ratio=16 / 9):
+    """Master playlist text for the renditions the transcoder produced."""
+    lines = ['#EXTM3U', '#EXT-X-VERSION:3', '#EXT-X-INDEPENDENT-SEGMENTS']
+    for rendition in renditions:
+        average = (rendition['video_bitrate'] + rendition['audio_bitrate']) * 1000
+        width = int(round(rendition['height'] * aspect_ratio / 2)) * 2
+        lines.append(
+            f"#EXT-X-STREAM-INF:BANDWIDTH={int(average * 1.1)},AVERAGE-BANDWIDTH={average},"
+            f"RESOLUTION={width}x{rendition['height']},CODECS=\"avc1.640028,mp4a.40.2\""
+        )
+        lines.append(rendition_playlist(rendition))
+    return '\n'.join(lines) + '\n'
+
+
+def _absolute_uris(playlist, bucket, base_key):
+    # Relative URI lines -> S3 URLs (resolved against the playlist's own key)
+    base_dir = posixpath.dirname(base_key)
+    lines = []
+    for line in playlist.splitlines():
+        if line and not line.startswith('#') and '://' not in line:
+            line = media_url(bucket, posixpath.normpath(posixpath.join(base_dir, line)))
+        lines.append(line)
+    return '\n'.join(lines) + '\n'
+
+
+def public_master_playlist(video):
+    """
+    The video's master playlist with every rendition URI made absolute, so it
+    can be served from our own domain. The S3 copy is cached (a VOD playlist
+    never changes); the URIs are filled in per request since they may be
+    presigned (presign.media_url).
+    """
+    bucket = video['processed_bucket']
+    key = video['hls_master_key']
+
+    def load():
+        return aws_clients.get_client('s3').get_object(Bucket=bucket, Key=key)['Body'].read().decode('utf-8')
+
+    return _absolute_uris(cached('manifest', (bucket, key), load), bucket, key)
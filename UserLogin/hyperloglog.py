@@ -0,0 +1,66 @@
+"""
+HyperLogLog: approximate count of distinct values in a fixed amount of memory.
+
+    sketch = HyperLogLog()
+    sketch.add('viewer@example.com')
+    sketch.merge(other_sketch)          # union, e.g. with the copy stored in DynamoDB
+    len(sketch)                         # ~distinct values added
+    sketch.to_bytes()                   # 2**precision bytes, one register per byte
+
+With the default precision of 12 a sketch is 4 KiB and the estimate is
+typically within ~1.6% (1.04 / sqrt(4096)) of the true count.
+"""
+import hashlib
+import math
+
+
+class HyperLogLog:
+    def __init__(self, precision=12, registers=None):
+        if not 4 <= precision <= 16:
+            raise ValueError("precision must be between 4 and 16")
+        self.precision = precision
+        self.size = 1 << precision
+        self.registers = bytearray(registers) if registers is not None else bytearray(self.size)
+        if len(self.registers) != self.size:
+            raise ValueError(f"Expected {self.size} registers, got {len(self.registers)}")
+
+    @classmethod
+    def from_bytes(cls, data):
+        return cls(int(math.log2(len(data))), data)
+
+    def to_bytes(self):
+        return bytes(self.registers)
+
+    def add(self, value):
+        if isinstance(value, str):
+            value = value.encode('utf-8')
+        hashed = int.from_bytes(hashlib.blake2b(value, digest_size=8).digest(), 'big')
+        # First `precision` bits pick the register, the rest give the rank
+        # (position of the first 1 bit)
+        bits = 64 - self.precision
+        index = hashed >> bits
+        rest = hashed & ((1 << bits) - 1)
+        rank = bits - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        """Union with `other` in place. Returns True if any register changed."""
+        if other.precision != self.precision:
+            raise ValueError("Can't merge sketches of different precision")
+        changed = False
+        for index, rank in enumerate(other.registers):
+            if rank > self.registers[index]:
+                self.registers[index] = rank
+                changed = True
+        return changed
+
+    def __len__(self):
+        m = self.size
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -rank for rank in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # Small range: linear counting is more accurate
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
@@ -0,0 +1,372 @@
+"""
+Request and AWS instrumentation, exposed at /metrics in the Prometheus text
+format.
+
+Three layers feed it:
+
+    MetricsMiddleware  times every request and labels what happened during
+                       it with the view name (request.resolver_match)
+    botocore hooks     registered on the boto3 session (aws_clients), so every
+                       client and resource gets them: one before-call /
+                       after-call pair per API call (retries included) for
+                       the latency histogram, and ReturnConsumedCapacity=TOTAL
+                       on DynamoDB calls for the capacity counters
+    instrument()       wraps db_utils' public functions (and labelled() other
+                       entry points, like ItemLoader.dispatch) so the capacity
+                       a call consumes is counted against the function that
+                       made it (the outermost one)
+
+Per request, the calls are also tallied in a RequestStats object held in a
+contextvar. sync_to_async copies the context into async_db_utils' threads;
+code that fans out on its own thread pool passes its work through bind().
+Requests slower than METRICS['SLOW_REQUEST_MS'] are logged with that tally.
+
+Metrics are per process: with several workers, scrape each of them (or put
+them behind one that aggregates).
+"""
+import bisect
+import contextvars
+import functools
+import inspect
+import logging
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+logger = logging.getLogger('cloudstream.metrics')
+
+CAPACITY_OPERATIONS = {
+    'GetItem', 'BatchGetItem', 'Query', 'Scan', 'TransactGetItems',
+    'PutItem', 'UpdateItem', 'DeleteItem', 'BatchWriteItem', 'TransactWriteItems',
+}
+READ_OPERATIONS = {'GetItem', 'BatchGetItem', 'Query', 'Scan', 'TransactGetItems'}
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+AWS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+PRESIGN_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01)
+NO_VIEW = '-' # Calls made outside a request (workers, background threads)
+
+
+# --- A minimal registry (counters and histograms, text exposition) ---
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labels):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._lock = threading.Lock()
+        self._values = {}
+        _registry.append(self)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def _label_text(self, values, extra=()):
+        pairs = list(zip(self.labels, values)) + list(extra)
+        if not pairs:
+            return ''
+        escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+        return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            lines.extend(self._samples(labels, value))
+        return lines
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, labels=()):
+        return self._values.get(labels, 0)
+
+    def _samples(self, labels, value):
+        return [f"{self.name}{self._label_text(labels)} {_number(value)}"]
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels, buckets):
+        super().__init__(name, help_text, labels)
+        self.buckets = buckets
+
+    def observe(self, labels, value):
+        slot = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                counts = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[slot] += 1
+            counts[-1] += value
+
+    def count(self, labels=()):
+        counts = self._values.get(labels)
+        return sum(counts[:-1]) if counts else 0
+
+    def _samples(self, labels, counts):
+        lines, total = [], 0
+        for bound, n in zip(self.buckets + (float('inf'),), counts):
+            total += n
+            le = '+Inf' if bound == float('inf') else _number(bound)
+            lines.append(f"{self.name}_bucket{self._label_text(labels, [('le', le)])} {total}")
+        lines.append(f"{self.name}_sum{self._label_text(labels)} {_number(counts[-1])}")
+        lines.append(f"{self.name}_count{self._label_text(labels)} {total}")
+        return lines
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+_registry = []
+
+requests_total = Counter(
+    'cloudstream_http_requests_total', "HTTP requests by view, method and status.", ('view', 'method', 'status'))
+request_seconds = Histogram(
+    'cloudstream_http_request_duration_seconds', "Time spent serving a request, by view.", ('view',), REQUEST_BUCKETS)
+aws_calls_total = Counter(
+    'cloudstream_aws_calls_total', "AWS API calls, by the view that made them.", ('view', 'service', 'operation'))
+aws_call_seconds = Histogram(
+    'cloudstream_aws_call_duration_seconds', "AWS API call latency, retries included.", ('service', 'operation'),
+    AWS_BUCKETS)
+aws_errors_total = Counter(
+    'cloudstream_aws_call_errors_total', "AWS API calls that failed, by error code.", ('service', 'operation', 'code'))
+capacity_total = Counter(
+    'cloudstream_dynamodb_consumed_capacity_units_total',
+    "DynamoDB capacity units consumed, by db_utils function, operation and read/write.",
+    ('function', 'operation', 'kind'))
+presign_seconds = Histogram(
+    'cloudstream_s3_presign_duration_seconds', "Time spent signing an S3 URL (no network).", ('operation',),
+    PRESIGN_BUCKETS)
+
+
+def render():
+    """Every metric, in the Prometheus text format."""
+    return '\n'.join(line for metric in _registry for line in metric.render()) + '\n'
+
+
+def reset():
+    """Zero every metric (tests)."""
+    for metric in _registry:
+        metric.clear()
+
+
+# --- Per request ---
+
+class RequestStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = {} # (service, operation) -> [count, seconds, read units, write units]
+
+    def add(self, service, operation, seconds, read=0.0, write=0.0):
+        with self._lock:
+            tally = self.calls.setdefault((service, operation), [0, 0.0, 0.0, 0.0])
+            tally[0] += 1
+            tally[1] += seconds
+            tally[2] += read
+            tally[3] += write
+
+    def breakdown(self):
+        # "dynamodb.Query x2 40.1ms 3.5RCU, s3.presign x1 0.2ms"
+        parts = []
+        for (service, operation), (count, seconds, read, write) in sorted(self.calls.items(), key=lambda kv: -kv[1][1]):
+            part = f"{service}.{operation} x{count} {seconds * 1000:.1f}ms"
+            if read:
+                part += f" {read:g}RCU"
+            if write:
+                part += f" {write:g}WCU"
+            parts.append(part)
+        return ', '.join(parts) or 'no AWS calls'
+
+
+_request = contextvars.ContextVar('metrics_request', default=None)
+_function = contextvars.ContextVar('metrics_function', default=None)
+
+
+def bind(fn):
+    """`fn`, run with the caller's request and db_utils function (for work handed to a thread pool)."""
+    stats, function = _request.get(), _function.get()
+    if stats is None and function is None:
+        return fn
+
+    @functools.wraps(fn)
+    def run(*args, **kwargs):
+        request_token, function_token = _request.set(stats), _function.set(function)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _function.reset(function_token)
+            _request.reset(request_token)
+    return run
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self._acall(request)
+        if not settings.METRICS['ENABLED']:
+            return self.get_response(request)
+        stats, token, started = self._start()
+        try:
+            response = self.get_response(request)
+        finally:
+            _request.reset(token)
+        self._finish(request, response, stats, started)
+        return response
+
+    async def _acall(self, request):
+        if not settings.METRICS['ENABLED']:
+            return await self.get_response(request)
+        stats, token, started = self._start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request.reset(token)
+        self._finish(request, response, stats, started)
+        return response
+
+    def _start(self):
+        stats = RequestStats()
+        return stats, _request.set(stats), time.perf_counter()
+
+    def _finish(self, request, response, stats, started):
+        seconds = time.perf_counter() - started
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else 'unmatched'
+        requests_total.inc((view, request.method, str(response.status_code)))
+        request_seconds.observe((view,), seconds)
+        for (service, operation), tally in stats.calls.items():
+            aws_calls_total.inc((view, service, operation), tally[0])
+
+        slow_ms = settings.METRICS['SLOW_REQUEST_MS']
+        if slow_ms is not None and seconds * 1000 >= slow_ms:
+            logger.warning(
+                "Slow request: %s %s (%s) %d in %.0f ms; %s",
+                request.method, request.get_full_path(), view, response.status_code, seconds * 1000, stats.breakdown(),
+            )
+
+
+# --- botocore hooks (aws_clients registers them on its session) ---
+
+def register_hooks(events):
+    if not settings.METRICS['ENABLED']:
+        return
+    if settings.METRICS['CONSUMED_CAPACITY']:
+        events.register('before-parameter-build.dynamodb', _ask_for_capacity)
+    events.register('before-call', _before_call)
+    events.register('after-call', _after_call)
+    events.register('after-call-error', _after_call_error)
+
+
+def _ask_for_capacity(params, model, **kwargs):
+    if model.name in CAPACITY_OPERATIONS:
+        params.setdefault('ReturnConsumedCapacity', 'TOTAL')
+
+
+def _before_call(model, context, **kwargs):
+    context['metrics'] = (model.service_model.service_name, model.name, time.perf_counter())
+
+
+def _after_call(http_response, parsed, model, context, **kwargs):
+    service, operation, started = context.pop('metrics', (None, None, None))
+    if started is None:
+        return
+    seconds = time.perf_counter() - started
+    aws_call_seconds.observe((service, operation), seconds)
+    error = parsed.get('Error', {}).get('Code') if http_response.status_code >= 400 else None
+    if error:
+        aws_errors_total.inc((service, operation, error))
+
+    read = write = 0.0
+    consumed = parsed.get('ConsumedCapacity') or []
+    for entry in [consumed] if isinstance(consumed, dict) else consumed:
+        if 'ReadCapacityUnits' in entry or 'WriteCapacityUnits' in entry:
+            read += entry.get('ReadCapacityUnits', 0)
+            write += entry.get('WriteCapacityUnits', 0)
+        elif operation in READ_OPERATIONS:
+            read += entry.get('CapacityUnits', 0)
+        else:
+            write += entry.get('CapacityUnits', 0)
+    function = _function.get() or 'other'
+    if read:
+        capacity_total.inc((function, operation, 'read'), read)
+    if write:
+        capacity_total.inc((function, operation, 'write'), write)
+    _tally(service, operation, seconds, read, write)
+
+
+def _after_call_error(exception, context, **kwargs):
+    # Connection errors and the like: no HTTP response to parse
+    service, operation, started = context.pop('metrics', (None, None, None))
+    if started is None:
+        return
+    seconds = time.perf_counter() - started
+    aws_call_seconds.observe((service, operation), seconds)
+    aws_errors_total.inc((service, operation, type(exception).__name__))
+    _tally(service, operation, seconds)
+
+
+def _tally(service, operation, seconds, read=0.0, write=0.0):
+    stats = _request.get()
+    if stats is not None:
+        stats.add(service, operation, seconds, read, write)
+    else:
+        aws_calls_total.inc((NO_VIEW, service, operation))
+
+
+def presigned(operation, started):
+    """Record an S3 URL signed since `started` (time.perf_counter())."""
+    if not settings.METRICS['ENABLED']:
+        return
+    seconds = time.perf_counter() - started
+    presign_seconds.observe((operation,), seconds)
+    stats = _request.get()
+    if stats is not None:
+        stats.add('s3', f"presign.{operation}", seconds)
+
+
+# --- db_utils functions ---
+
+def instrument(module):
+    """Wrap the module's public functions so DynamoDB capacity is counted against them."""
+    for name, fn in list(vars(module).items()):
+        if name.startswith('_') or not inspect.isfunction(fn) or fn.__module__ != module.__name__:
+            continue
+        setattr(module, name, labelled(name)(fn))
+
+
+def labelled(name):
+    """Decorator: DynamoDB capacity used inside the function is counted against `name`."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def call(*args, **kwargs):
+            if _function.get() is not None:
+                return fn(*args, **kwargs) # Counted against the outermost labelled function
+            token = _function.set(name)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                _function.reset(token)
+        return call
+    return decorator
@@ -0,0 +1,114 @@
+"""
+Conditional GET (ETag / Last-Modified / 304) and fragment caching for the
+feed, Dashboard and watch pages.
+
+Every page works out a version key before doing its real work, from values
+that are cheap to get:
+
+    home       the feed version + cursor + the current window
+    Dashboard  the user's video version + subscriber count (cached lookup)
+    watch      the values the page shows, all from cached lookups (see
+               watch_video): the video's counters, the viewer's own state, ...
+
+A version is a counter item, PK = VERSION, SK = <scope>, bumped by db_utils
+whenever a video enters or leaves the feed ('feed') or one of a creator's
+videos changes status ('videos#<email>'). Reading one is a cached GetItem
+(DB_CACHE TIMEOUTS['version']), so other processes see a bump within that.
+
+If the browser already has that version (If-None-Match / If-Modified-Since)
+the answer is an empty 304. Otherwise the page renders, and the shared parts
+(the feed grid, the watch page's related videos) come from the fragment cache
+(Django's {% cache %} tag on settings.PAGE_CACHE['FRAGMENT_CACHE']), keyed by
+version. Anything per user (the navbar, subscribe/like state, the Dashboard)
+never goes into a fragment.
+
+View counts change without a version bump: they may lag by up to
+PAGE_CACHE['WINDOW_SECONDS'], the fragment timeout and the step in which
+home's ETag and Last-Modified move on by themselves.
+"""
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+from .db_cache import cached, invalidate
+
+VERSION_PK = 'VERSION'
+FEED = 'feed'
+
+
+def user_videos_scope(email):
+    return f"videos#{email}"
+
+
+def _table():
+    from . import db_utils # db_utils imports this module
+    return db_utils.get_table()
+
+
+def get_version(scope):
+    """(version, updated_at) of a scope; (0, 0) before its first bump."""
+    def load():
+        item = _table().get_item(Key={'PK': VERSION_PK, 'SK': scope}).get('Item') or {}
+        return int(item.get('v', 0)), int(item.get('updated_at', 0))
+    return cached('version', scope, load)
+
+
+def bump(*scopes):
+    """Something the scopes' pages show changed."""
+    table = _table()
+    now = int(time.time())
+    for scope in scopes:
+        table.update_item(
+            Key={'PK': VERSION_PK, 'SK': scope},
+            UpdateExpression="ADD v :one SET updated_at = :now",
+            ExpressionAttributeValues={':one': 1, ':now': now},
+        )
+        invalidate(('version', scope))
+
+
+def feed_page(cursor, version):
+    """db_utils.get_videos_page(cursor=cursor), cached per feed version."""
+    from . import db_utils # db_utils imports this module
+    return cached('feed_page', (version, cursor or ''), lambda: db_utils.get_videos_page(cursor=cursor))
+
+
+def window():
+    """Start of the current window: pages with view counts on them change at least this often."""
+    seconds = settings.PAGE_CACHE['WINDOW_SECONDS']
+    return int(time.time() // seconds * seconds)
+
+
+def fragment_timeout():
+    return settings.PAGE_CACHE['WINDOW_SECONDS'] if settings.PAGE_CACHE['ENABLED'] else 0
+
+
+def etag(*parts):
+    # Weak: the same version renders to the same page, not necessarily the same bytes
+    digest = hashlib.blake2b(json.dumps(parts, default=str).encode('utf-8'), digest_size=16).hexdigest()
+    return f'W/"{digest}"'
+
+
+def not_modified(request, tag, last_modified=None):
+    """A 304 if the browser's copy is current, else None (render the page)."""
+    if not settings.PAGE_CACHE['ENABLED']:
+        return None
+    response = get_conditional_response(request, etag=tag, last_modified=last_modified or None)
+    return finish(response, tag, last_modified, private='user_email' in request.session) if response else None
+
+
+def finish(response, tag, last_modified=None, private=False):
+    """Validators on a page (200 or 304). Browsers revalidate every time; shared caches skip per-user pages."""
+    if not settings.PAGE_CACHE['ENABLED']:
+        return response
+    response.headers['ETag'] = tag
+    if last_modified:
+        response.headers['Last-Modified'] = http_date(last_modified)
+    if private:
+        patch_cache_control(response, private=True, no_cache=True)
+    else:
+        patch_cache_control(response, public=True, no_cache=True)
+    return response
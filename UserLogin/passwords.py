@@ -0,0 +1,142 @@
+"""
+Password hashing off the request thread.
+
+PBKDF2 costs a few hundred milliseconds of CPU per hash, by design. Inline in
+a view that ties up the worker, and a burst of logins starves every other
+request. Hashes run on a process pool instead (PASSWORD_HASHING['WORKERS']
+processes: every core, and never this process's GIL); the caller only waits
+for the result. WORKERS = 0 hashes on the calling thread (tests, local runs).
+
+Admission control: at most MAX_PENDING hashes are queued or running. A caller
+that can't get a slot within QUEUE_WAIT_SECONDS gets Busy (the login and
+signup views answer 503 with Retry-After) instead of joining an ever longer
+queue.
+
+check() also upgrades hashes: if the stored one isn't made with the preferred
+hasher and cost (settings.PASSWORD_HASHERS[0]; for PBKDF2 the iterations in
+PASSWORD_HASHING), it returns a fresh hash of the password for db_utils to
+write back.
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+import django
+from django.conf import settings
+from django.contrib.auth.hashers import check_password, make_password
+
+_lock = threading.Lock()
+_pool = None
+_slots = (None, None) # (MAX_PENDING, semaphore)
+
+
+class Busy(Exception):
+    """Too many hashes in flight: try again in a moment."""
+
+
+# --- Run in the pool's processes ---
+
+def _init_worker():
+    # Spawned processes start blank: load the settings and apps like manage.py does
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Cloudstream.settings')
+    django.setup()
+
+
+def _pid(_):
+    return os.getpid()
+
+
+def _make(password):
+    return make_password(password)
+
+
+def _check(password, encoded):
+    upgraded = []
+    valid = check_password(password, encoded, setter=lambda raw: upgraded.append(make_password(raw)))
+    return valid, (upgraded[0] if upgraded else None)
+
+
+# --- The pool ---
+
+def _get_pool():
+    global _pool
+    with _lock:
+        if _pool is None:
+            # spawn, not fork: this process has threads (thread pools, boto3) that a fork would copy mid-flight
+            _pool = ProcessPoolExecutor(
+                max_workers=_workers(),
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+            )
+        return _pool
+
+
+def _workers():
+    return settings.PASSWORD_HASHING['WORKERS'] or os.cpu_count()
+
+
+def _discard_pool():
+    global _pool
+    with _lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _get_slots():
+    global _slots
+    limit = settings.PASSWORD_HASHING['MAX_PENDING']
+    with _lock:
+        if _slots[0] != limit:
+            _slots = (limit, threading.BoundedSemaphore(limit))
+        return _slots[1]
+
+
+def _run(fn, *args):
+    config = settings.PASSWORD_HASHING
+    slots = _get_slots()
+    if not slots.acquire(timeout=config['QUEUE_WAIT_SECONDS']):
+        raise Busy()
+    if config['WORKERS'] == 0:
+        try:
+            return fn(*args)
+        finally:
+            slots.release()
+
+    try:
+        future = _get_pool().submit(fn, *args)
+    except BaseException:
+        slots.release()
+        raise
+    future.add_done_callback(lambda _: slots.release()) # Held until the hash is done, even if we stop waiting
+    try:
+        return future.result(timeout=config['TIMEOUT_SECONDS'])
+    except FutureTimeout:
+        raise Busy()
+    except BrokenProcessPool:
+        _discard_pool() # A worker died: the next call starts a fresh pool
+        raise
+
+
+def warm_up():
+    """Start the pool's processes now rather than on the first login."""
+    if settings.PASSWORD_HASHING['WORKERS'] != 0:
+        list(_get_pool().map(_pid, range(_workers())))
+
+
+def shutdown():
+    _discard_pool()
+
+
+# --- API ---
+
+def make(password):
+    """A hash of `password` for storing. Raises Busy."""
+    return _run(_make, password)
+
+
+def check(password, encoded):
+    """(valid, upgraded hash to store or None). Raises Busy."""
+    return _run(_check, password, encoded)
@@ -0,0 +1,74 @@
+"""
+Memoized S3 presigned URLs.
+
+Signing a URL is an HMAC chain per call, and a feed page with a private
+processed bucket needs one per thumbnail. URLs are instead signed once per
+time window and reused:
+
+    url = presigned_url(bucket, key)                          # GET
+    url = presigned_url(bucket, key, 'put_object', 'image/jpeg')
+
+Every URL signed during a window [start, start + WINDOW_SECONDS) expires at
+the same moment, start + WINDOW_SECONDS + MIN_REMAINING_SECONDS. So whatever
+instant a cached URL is handed out, it stays valid for at least
+MIN_REMAINING_SECONDS, and browsers see the same URL all window long (which
+lets them cache the image).
+
+A URL can't outlive the credentials that signed it: with temporary
+credentials (aws_session_token) it dies when the session does. Rotating
+credentials (aws_clients.reload_credentials) starts a fresh set of URLs.
+"""
+import time
+
+from django.conf import settings
+
+from . import aws_clients, metrics
+from .db_cache import LRUCache
+
+_cache = None
+
+
+def _get_cache():
+    global _cache
+    if _cache is None:
+        _cache = LRUCache(settings.PRESIGN['MAX_ENTRIES'])
+    return _cache
+
+
+def _window(now):
+    window = settings.PRESIGN['WINDOW_SECONDS']
+    start = int(now // window) * window
+    return start, start + window
+
+
+def presigned_url(bucket, key, method='get_object', content_type=None):
+    """Presigned URL for `method` ('get_object' or 'put_object') on bucket/key, memoized per window."""
+    now = time.time()
+    start, end = _window(now)
+    cache_key = (bucket, key, method, content_type, start, aws_clients.generation())
+
+    cache = _get_cache()
+    url = cache.get(cache_key)
+    if url is None:
+        params = {'Bucket': bucket, 'Key': key}
+        if content_type:
+            params['ContentType'] = content_type
+        expires_at = end + settings.PRESIGN['MIN_REMAINING_SECONDS']
+        started = time.perf_counter()
+        url = aws_clients.get_client('s3').generate_presigned_url(
+            method, Params=params, ExpiresIn=int(expires_at - now)
+        )
+        metrics.presigned(method, started)
+        # Entries die with their window; the next window signs fresh URLs
+        cache.set(cache_key, url, end - now)
+    return url
+
+
+def media_url(bucket, key):
+    """GET URL for a processed-bucket object: plain if the bucket is public, presigned otherwise."""
+    if not key:
+        return ''
+    if settings.AWS_PROCESSED_BUCKET_PUBLIC:
+        from .s3_utils import public_object_url # s3_utils imports this module
+        return public_object_url(bucket, key)
+    return presigned_url(bucket, key)
@@ -0,0 +1,249 @@
+"""
+Related videos for the watch page's "Up next" sidebar, precomputed.
+
+`manage.py build_related` reads the videos and the engagement data in one
+parallel Scan and scores every pair of READY videos that have something in
+common:
+
+    likes          liked by the same users: cosine similarity of the videos'
+                   columns in the user x video like matrix
+    subscriptions  creators with overlapping audiences: cosine over the user x
+                   creator subscription matrix (a creator's own videos count as
+                   fully overlapping), spread over the creators' videos
+    title          shared title words, tf-idf weighted, cosine again
+
+score = sum of RELATED['WEIGHTS'][signal] * similarity, and the TOP_K best
+per video are stored, with the fields the sidebar card shows, on one item next
+to the video (db_utils.related_videos_key). watch_video reads it in the
+BatchGetItem it makes anyway: nothing is computed per request.
+
+The matrices stay sparse: (row, column, weight) arrays. X^T X is computed by
+expanding every row into all pairs of its entries and summing equal pairs,
+vectorized with numpy, so no users x videos matrix is ever built. Rows with
+more than MAX_ROW_ITEMS entries (a user who likes everything, a word in every
+title) say little and would cost the square of their size, so they are skipped.
+
+Refreshes are incremental on the write side: every run still reads everything
+(a Scan can't show what a removed like used to be), but only the lists whose
+content changed are rewritten (each carries a digest of itself), and lists of
+videos that are gone or no longer READY are deleted.
+"""
+import hashlib
+import json
+import math
+import time
+
+import numpy as np
+from boto3.dynamodb.conditions import Attr
+from django.conf import settings
+
+from . import db_utils
+from .db_cache import invalidate
+from .search_index import tokenize
+
+CARD_FIELDS = ('video_id', 'title', 'thumbnail_key', 'thumbnail_variants', 'processed_bucket', 'created_at')
+SCANNED_PREFIXES = ('VIDEO#', 'REACTION#', 'SUB#', 'RELATED#')
+
+
+# --- Sparse matrix helpers ---
+
+def _runs(keys):
+    # Start and length of every run of equal values in sorted `keys`
+    if not len(keys):
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    return starts, np.diff(np.r_[starts, len(keys)])
+
+
+def _block_pairs(left_start, left_count, right_start, right_count):
+    # For every block b: all (left_start[b] + x, right_start[b] + y) with
+    # x < left_count[b], y < right_count[b]. Returns (left, right, b) arrays.
+    sizes = left_count * right_count
+    block = np.repeat(np.arange(len(sizes)), sizes)
+    k = np.arange(sizes.sum()) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+    return left_start[block] + k // right_count[block], right_start[block] + k % right_count[block], block
+
+
+def _sum_pairs(i, j, values, n):
+    # Merge repeated (i, j) pairs, adding up their values
+    unique, inverse = np.unique(i * n + j, return_inverse=True)
+    return unique // n, unique % n, np.bincount(inverse, weights=values, minlength=len(unique))
+
+
+def cosine_pairs(rows, cols, weights, n_cols, max_row_items):
+    """
+    Cosine similarity between the columns of a sparse matrix given as
+    (rows, cols, weights) entries, for every pair of distinct columns that
+    share a row. Returns (i, j, similarity) arrays, both orders of each pair.
+    """
+    rows, cols, weights = (np.asarray(a) for a in (rows, cols, weights))
+    order = np.argsort(rows, kind='stable')
+    rows, cols, weights = rows[order], cols[order].astype(np.int64), weights[order].astype(float)
+    starts, counts = _runs(rows)
+    kept = np.repeat(counts <= max_row_items, counts)
+    rows, cols, weights = rows[kept], cols[kept], weights[kept]
+    starts, counts = _runs(rows)
+
+    norms = np.bincount(cols, weights=weights ** 2, minlength=n_cols)
+    left, right, _ = _block_pairs(starts, counts, starts, counts)
+    distinct = cols[left] != cols[right]
+    left, right = left[distinct], right[distinct]
+    i, j, dot = _sum_pairs(cols[left], cols[right], weights[left] * weights[right], n_cols)
+    return i, j, dot / np.sqrt(norms[i] * norms[j])
+
+
+def top_k(i, j, scores, k, tiebreak=None):
+    """The k highest scoring (i, j) per i; ties go to the higher tiebreak[j]."""
+    keys = (-scores, i) if tiebreak is None else (-tiebreak[j], -scores, i)
+    order = np.lexsort(keys)
+    i, j, scores = i[order], j[order], scores[order]
+    starts, counts = _runs(i)
+    rank = np.arange(len(i)) - np.repeat(starts, counts)
+    kept = rank < k
+    return i[kept], j[kept], scores[kept]
+
+
+# --- Signals ---
+
+def _likes(videos, reactions):
+    index = {video['video_id']: n for n, video in enumerate(videos)}
+    users, rows, cols = {}, [], []
+    for item in reactions:
+        video = index.get(item['SK'][len('REACTION#'):])
+        if item.get('type') == 'LIKE' and video is not None:
+            rows.append(users.setdefault(item['PK'], len(users)))
+            cols.append(video)
+    return cosine_pairs(rows, cols, np.ones(len(cols)), len(videos), settings.RELATED['MAX_ROW_ITEMS'])
+
+
+def _titles(videos):
+    documents = [set(tokenize(video.get('title'))) for video in videos]
+    frequency = {}
+    for words in documents:
+        for word in words:
+            frequency[word] = frequency.get(word, 0) + 1
+    words, rows, cols, weights = {}, [], [], []
+    for video, document in enumerate(documents):
+        for word in document:
+            # A word in one title pairs with nothing; one in every title tells nothing
+            if 1 < frequency[word] < len(videos):
+                rows.append(words.setdefault(word, len(words)))
+                cols.append(video)
+                weights.append(math.log(len(videos) / frequency[word]))
+    return cosine_pairs(rows, cols, weights, len(videos), settings.RELATED['MAX_ROW_ITEMS'])
+
+
+def _subscriptions(videos, subscriptions):
+    config = settings.RELATED
+    creators = {}
+    video_creator = np.array([creators.setdefault(video['PK'], len(creators)) for video in videos], dtype=np.int64)
+    users, rows, cols = {}, [], []
+    for item in subscriptions:
+        creator = creators.get('USER#' + item['SK'][len('SUB#'):])
+        if creator is not None:
+            rows.append(users.setdefault(item['PK'], len(users)))
+            cols.append(creator)
+    ci, cj, similarity = cosine_pairs(rows, cols, np.ones(len(cols)), len(creators), config['MAX_ROW_ITEMS'])
+    # Every creator is fully related to themselves
+    own = np.arange(len(creators))
+    ci, cj, similarity = top_k(
+        np.r_[own, ci], np.r_[own, cj], np.r_[np.ones(len(creators)), similarity], config['RELATED_CREATORS']
+    )
+
+    # Creator pairs -> video pairs: every video of creator i with the newest
+    # CREATOR_VIDEOS of creator j
+    created = np.array([int(video.get('created_at', 0)) for video in videos])
+    by_creator = np.lexsort((-created, video_creator))
+    starts, counts = _runs(video_creator[by_creator])
+    left, right, block = _block_pairs(
+        starts[ci], counts[ci], starts[cj], np.minimum(counts[cj], config['CREATOR_VIDEOS'])
+    )
+    vi, vj = by_creator[left], by_creator[right]
+    distinct = vi != vj
+    return vi[distinct], vj[distinct], similarity[block][distinct]
+
+
+def related_lists(videos, reactions, subscriptions):
+    """{video_id: [related video items, best first]} for the READY `videos`."""
+    if not videos:
+        return {}
+    weights = settings.RELATED['WEIGHTS']
+    signals = {
+        'likes': lambda: _likes(videos, reactions),
+        'subscriptions': lambda: _subscriptions(videos, subscriptions),
+        'title': lambda: _titles(videos),
+    }
+    parts = []
+    for name, compute in signals.items():
+        if weights.get(name):
+            i, j, similarity = compute()
+            parts.append((i, j, weights[name] * similarity))
+    if not parts:
+        return {}
+    i, j, scores = _sum_pairs(*(np.concatenate(arrays) for arrays in zip(*parts)), len(videos))
+    created = np.array([int(video.get('created_at', 0)) for video in videos])
+    i, j, _ = top_k(i, j, scores, settings.RELATED['TOP_K'], tiebreak=created)
+
+    lists = {}
+    for a, b in zip(i.tolist(), j.tolist()):
+        lists.setdefault(videos[a]['video_id'], []).append(videos[b])
+    return lists
+
+
+# --- The batch job ---
+
+def _card(video):
+    return {field: video[field] for field in CARD_FIELDS if field in video}
+
+
+def _digest(cards):
+    return hashlib.sha1(json.dumps(cards, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def _scan(segments):
+    condition = Attr('SK').begins_with(SCANNED_PREFIXES[0])
+    for prefix in SCANNED_PREFIXES[1:]:
+        condition = condition | Attr('SK').begins_with(prefix)
+    fields = ('PK', 'SK', 'type', 'status', 'digest') + CARD_FIELDS
+    return db_utils.parallel_scan(
+        segments,
+        FilterExpression=condition,
+        ProjectionExpression=', '.join(f"#f{n}" for n in range(len(fields))),
+        ExpressionAttributeNames={f"#f{n}": field for n, field in enumerate(fields)},
+    )
+
+
+def refresh(segments=None):
+    """
+    Recompute every READY video's related list and write the ones that
+    changed. Returns counts: videos, written, unchanged, deleted, seconds.
+    """
+    started = time.perf_counter()
+    groups = {prefix: [] for prefix in SCANNED_PREFIXES}
+    for item in _scan(segments or settings.RELATED['SCAN_SEGMENTS']):
+        groups[next(p for p in SCANNED_PREFIXES if item['SK'].startswith(p))].append(item)
+    videos = [item for item in groups['VIDEO#'] if item.get('status') == 'READY' and item.get('video_id')]
+    stored = {(item['PK'], item['SK']): item.get('digest') for item in groups['RELATED#']}
+
+    lists = related_lists(videos, groups['REACTION#'], groups['SUB#'])
+    stats = {'videos': len(videos), 'written': 0, 'unchanged': 0, 'deleted': 0}
+    with db_utils.get_table().batch_writer() as batch:
+        for video in videos:
+            key = db_utils.related_videos_key(video['PK'], video['video_id'])
+            cards = [_card(other) for other in lists.get(video['video_id'], [])]
+            if not cards:
+                continue # Deleted below if it had a list
+            digest = _digest(cards)
+            if stored.pop((key['PK'], key['SK']), None) == digest:
+                stats['unchanged'] += 1
+                continue
+            batch.put_item(Item=dict(key, videos=cards, digest=digest, computed_at=int(time.time())))
+            invalidate(('related', video['video_id']))
+            stats['written'] += 1
+        # What's left belongs to videos that are gone, not READY, or related to nothing anymore
+        for pk, sk in stored:
+            batch.delete_item(Key={'PK': pk, 'SK': sk})
+            invalidate(('related', sk[len('RELATED#'):]))
+            stats['deleted'] += 1
+    stats['seconds'] = time.perf_counter() - started
+    return stats
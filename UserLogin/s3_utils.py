@@ -1,23 +1,150 @@
-import boto3
+import time
+import urllib.parse
+
 from django.conf import settings
+from . import aws_clients, metrics
+from .presign import presigned_url
+
+def get_s3_client():
+    # Shared across threads (low-level clients are thread-safe)
+    return aws_clients.get_client('s3')
+
+def public_object_url(bucket_name, key):
+    # Only for public-read buckets (settings.AWS_PROCESSED_BUCKET_PUBLIC); see presign.media_url
+    return f"https://{bucket_name}.s3.amazonaws.com/{urllib.parse.quote(key)}"
 
 # CHANGED: Added bucket_name parameter
 def generate_presigned_url(filename, file_type, bucket_name):
-    s3 = boto3.client(
-        's3',
-        aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-        aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-        aws_session_token=settings.AWS_SESSION_TOKEN,
-        region_name=settings.AWS_REGION
+    # Memoized per time window (presign.py); valid for at least PRESIGN['MIN_REMAINING_SECONDS']
+    return presigned_url(bucket_name, filename, 'put_object', file_type)
+
+# --- Multipart uploads (large videos) ---
+# The browser uploads parts straight to S3 through presigned URLs, several in
+# parallel; the server only starts/finishes the upload and signs part URLs.
+#
+# Uploads that are never completed or aborted (tab closed for good) keep their
+# parts, and S3 bills for them. Give the raw bucket a lifecycle rule that
+# cleans them up, e.g. with `aws s3api put-bucket-lifecycle-configuration`:
+#   {"Rules": [{"ID": "abort-incomplete-uploads", "Status": "Enabled",
+#               "Filter": {}, "AbortIncompleteMultipartUpload": {"DaysAfterInitiation": 7}}]}
+
+MAX_PARTS = 10000                 # S3 limit per upload
+MIN_PART_SIZE = 5 * 1024 * 1024   # S3 limit for every part but the last
+MAX_OBJECT_SIZE = 5 * 1024 ** 4   # S3 limit per object (5 TiB)
+
+def choose_part_size(file_size, part_size=None):
+    # Use the configured part size unless the file is so big it would need more than 10,000 parts
+    part_size = max(part_size or settings.MULTIPART_PART_SIZE, MIN_PART_SIZE)
+    if file_size > part_size * MAX_PARTS:
+        mb = 1024 * 1024
+        part_size = -(-file_size // MAX_PARTS) # ceil
+        part_size = -(-part_size // mb) * mb   # round up to whole MB
+    return part_size
+
+def create_multipart_upload(filename, file_type, bucket_name):
+    response = get_s3_client().create_multipart_upload(
+        Bucket=bucket_name,
+        Key=filename,
+        ContentType=file_type
     )
-    
-    presigned_url = s3.generate_presigned_url(
-        'put_object',
-        Params={
-            'Bucket': bucket_name, # CHANGED: Uses the passed bucket variable
-            'Key': filename,
-            'ContentType': file_type
-        },
-        ExpiresIn=3600
+    return response['UploadId']
+
+def presign_upload_parts(filename, upload_id, part_numbers, bucket_name):
+    # Returns {part_number: url}
+    s3 = get_s3_client()
+    urls = {}
+    for part_number in part_numbers:
+        started = time.perf_counter()
+        urls[part_number] = s3.generate_presigned_url(
+            'upload_part',
+            Params={
+                'Bucket': bucket_name,
+                'Key': filename,
+                'UploadId': upload_id,
+                'PartNumber': part_number
+            },
+            ExpiresIn=3600
+        )
+        metrics.presigned('upload_part', started)
+    return urls
+
+def list_uploaded_parts(filename, upload_id, bucket_name):
+    # Parts S3 already has, so an interrupted upload can resume where it stopped
+    s3 = get_s3_client()
+    parts = []
+    kwargs = {'Bucket': bucket_name, 'Key': filename, 'UploadId': upload_id}
+    while True:
+        response = s3.list_parts(**kwargs)
+        for part in response.get('Parts', []):
+            parts.append({
+                'PartNumber': part['PartNumber'],
+                'ETag': part['ETag'],
+                'Size': part['Size']
+            })
+        if not response.get('IsTruncated'):
+            return parts
+        kwargs['PartNumberMarker'] = response['NextPartNumberMarker']
+
+def complete_multipart_upload(filename, upload_id, parts, bucket_name):
+    # parts: [{'PartNumber': 1, 'ETag': '"..."'}, ...]
+    parts = sorted(
+        ({'PartNumber': int(p['PartNumber']), 'ETag': p['ETag']} for p in parts),
+        key=lambda p: p['PartNumber']
     )
-    return presigned_url
\ No newline at end of file
+    get_s3_client().complete_multipart_upload(
+        Bucket=bucket_name,
+        Key=filename,
+        UploadId=upload_id,
+        MultipartUpload={'Parts': parts}
+    )
+
+def abort_multipart_upload(filename, upload_id, bucket_name):
+    get_s3_client().abort_multipart_upload(
+        Bucket=bucket_name,
+        Key=filename,
+        UploadId=upload_id
+    )
+
+# --- Server-side copies (bulk imports) ---
+# CopyObject takes objects up to 5 GB in one call; anything above `threshold`
+# is copied as a multipart upload whose parts are UploadPartCopy calls, run in
+# parallel on `executor`. No bytes pass through this process either way.
+
+MAX_COPY_OBJECT_SIZE = 5 * 1024 ** 3 # S3 limit for a single CopyObject
+
+def copy_object(source_bucket, source_key, bucket_name, key, threshold, part_size, executor=None):
+    """Copy an object between buckets. Returns its size in bytes."""
+    s3 = get_s3_client()
+    head = s3.head_object(Bucket=source_bucket, Key=source_key)
+    size = head['ContentLength']
+    source = {'Bucket': source_bucket, 'Key': source_key}
+    if size <= min(threshold, MAX_COPY_OBJECT_SIZE):
+        s3.copy_object(Bucket=bucket_name, Key=key, CopySource=source)
+        return size
+
+    part_size = choose_part_size(size, part_size)
+    upload_id = s3.create_multipart_upload(
+        Bucket=bucket_name, Key=key,
+        ContentType=head.get('ContentType', 'binary/octet-stream'), Metadata=head.get('Metadata', {}),
+    )['UploadId']
+
+    def copy_part(part_number):
+        start = (part_number - 1) * part_size
+        end = min(start + part_size, size) - 1
+        response = s3.upload_part_copy(
+            Bucket=bucket_name, Key=key, UploadId=upload_id, PartNumber=part_number,
+            CopySource=source, CopySourceRange=f"bytes={start}-{end}",
+        )
+        return {'PartNumber': part_number, 'ETag': response['CopyPartResult']['ETag']}
+
+    part_numbers = range(1, -(-size // part_size) + 1)
+    try:
+        if executor is None:
+            parts = [copy_part(n) for n in part_numbers]
+        else:
+            parts = [future.result() for future in [executor.submit(copy_part, n) for n in part_numbers]]
+        complete_multipart_upload(key, upload_id, parts, bucket_name)
+    except Exception:
+        abort_multipart_upload(key, upload_id, bucket_name) # Don't leave billed parts behind
+        raise
+    return size
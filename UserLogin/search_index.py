@@ -0,0 +1,332 @@
+"""
+In-process search over video titles, descriptions and channel names.
+
+A DynamoDB Scan with contains() reads the whole table for every query, so
+search runs on an inverted index held in memory instead:
+
+    postings    term -> {video_id: weight}   (title 3, channel name 2, description 1 per occurrence)
+    vocabulary  every term, sorted: a prefix is a bisect away ("clou" -> cloud, cloudstream)
+    trigrams    trigram -> terms containing it, for typos ("clowd" -> cloud)
+
+Every query word must match some term of a video (exactly, as a prefix, or
+fuzzily, in that order of preference); results are ranked by tf-idf, newest
+first on ties.
+
+Keeping it current:
+    * the first search in a process loads the index from the snapshot file
+      (settings.SEARCH['SNAPSHOT_PATH']) and catches up with a Query for the
+      videos that went READY since; without a snapshot it does a parallel Scan
+      of the feed index (`manage.py build_search_index` does the same and
+      writes a fresh snapshot)
+    * db_utils calls video_changed()/video_removed() on create, status changes
+      and delete, so this process sees its own writes right away
+    * every REFRESH_SECONDS a background thread repeats the catch-up, for videos
+      other processes (the transcode worker) made READY
+A video deleted by another process stays in the index until a search returns
+it: the search view drops results whose item is gone (video_removed()).
+"""
+import bisect
+import json
+import math
+import os
+import re
+import threading
+import time
+import unicodedata
+
+from boto3.dynamodb.conditions import Attr, Key
+from django.conf import settings
+
+FIELD_WEIGHTS = {'title': 3, 'channel_name': 2, 'description': 1}
+DOC_FIELDS = ('video_id', 'PK', 'SK', 'status', 'created_at') + tuple(FIELD_WEIGHTS)
+PREFIX_WEIGHT = 0.7          # "clou" finding "cloud" counts for less than "cloud" itself
+FUZZY_WEIGHT = 0.4           # ...and "clowd" less still
+FUZZY_MIN_SIMILARITY = 0.3   # Trigram Jaccard similarity (pg_trgm's default threshold)
+MAX_EXPANSIONS = 50          # Terms one query word may expand to
+SNAPSHOT_VERSION = 1
+
+_word = re.compile(r'\w+')
+
+
+def tokenize(text):
+    """Lowercased words with accents stripped: 'Café Déjà-vu' -> ['cafe', 'deja', 'vu']."""
+    text = unicodedata.normalize('NFKD', str(text or '').lower())
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return _word.findall(text)
+
+
+def trigrams(term):
+    padded = f"  {term} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SearchIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.docs = {}        # video_id -> DOC_FIELDS of the video
+        self.postings = {}    # term -> {video_id: weight}
+        self.doc_terms = {}   # video_id -> terms it was indexed under (for removal)
+        self.vocabulary = []  # sorted terms
+        self.trigrams = {}    # trigram -> set of terms
+        self.watermark = 0    # Videos created before this (minus CATCHUP_SECONDS) are in
+
+    def __len__(self):
+        return len(self.docs)
+
+    def add(self, video):
+        """Index (or re-index) a video item."""
+        doc = {field: video.get(field) for field in DOC_FIELDS}
+        doc['created_at'] = int(doc['created_at'] or 0)
+        weights = {}
+        for field, weight in FIELD_WEIGHTS.items():
+            for term in tokenize(doc[field]):
+                weights[term] = weights.get(term, 0) + weight
+        with self._lock:
+            self._remove_terms(doc['video_id'])
+            self.docs[doc['video_id']] = doc
+            self.doc_terms[doc['video_id']] = list(weights)
+            for term, weight in weights.items():
+                if term not in self.postings:
+                    self.postings[term] = {}
+                    bisect.insort(self.vocabulary, term)
+                    for gram in trigrams(term):
+                        self.trigrams.setdefault(gram, set()).add(term)
+                self.postings[term][doc['video_id']] = weight
+
+    def remove(self, video_id):
+        with self._lock:
+            self._remove_terms(video_id)
+            self.docs.pop(video_id, None)
+
+    def set_status(self, video_id, status):
+        with self._lock:
+            if video_id in self.docs:
+                self.docs[video_id]['status'] = status
+
+    def _remove_terms(self, video_id):
+        for term in self.doc_terms.pop(video_id, ()):
+            posting = self.postings[term]
+            posting.pop(video_id, None)
+            if not posting:
+                del self.postings[term]
+                del self.vocabulary[bisect.bisect_left(self.vocabulary, term)]
+                for gram in trigrams(term):
+                    self.trigrams[gram].discard(term)
+                    if not self.trigrams[gram]:
+                        del self.trigrams[gram]
+
+    def _expand(self, token):
+        # Terms a query word matches, with how well: exact 1, prefix 0.7, fuzzy <= 0.4
+        matches = {}
+        if token in self.postings:
+            matches[token] = 1.0
+        start = bisect.bisect_left(self.vocabulary, token)
+        for term in self.vocabulary[start:start + MAX_EXPANSIONS + 1]:
+            if not term.startswith(token):
+                break
+            matches.setdefault(term, PREFIX_WEIGHT)
+        if len(token) >= 3 and len(matches) < MAX_EXPANSIONS:
+            grams = trigrams(token)
+            shared = {}
+            for gram in grams:
+                for term in self.trigrams.get(gram, ()):
+                    shared[term] = shared.get(term, 0) + 1
+            for term, count in sorted(shared.items(), key=lambda kv: -kv[1]):
+                if len(matches) >= MAX_EXPANSIONS:
+                    break
+                similarity = count / (len(grams) + len(trigrams(term)) - count)
+                if similarity >= FUZZY_MIN_SIMILARITY:
+                    matches.setdefault(term, FUZZY_WEIGHT * similarity)
+        return matches
+
+    def search(self, query, offset=0, limit=20, status='READY'):
+        """(indexed docs for one page, total hits). Every query word has to match."""
+        tokens = list(dict.fromkeys(tokenize(query)))
+        if not tokens:
+            return [], 0
+        with self._lock:
+            total_docs = len(self.docs) or 1
+            scores = None
+            for token in tokens:
+                token_scores = {}
+                for term, quality in self._expand(token).items():
+                    posting = self.postings[term]
+                    idf = math.log(1 + total_docs / len(posting))
+                    for video_id, weight in posting.items():
+                        score = quality * idf * (1 + math.log(weight))
+                        if score > token_scores.get(video_id, 0):
+                            token_scores[video_id] = score # A word counts once, via its best term
+                if scores is None:
+                    scores = token_scores
+                else:
+                    scores = {video_id: score + token_scores[video_id]
+                              for video_id, score in scores.items() if video_id in token_scores}
+                if not scores:
+                    return [], 0
+            hits = [(score, self.docs[video_id]) for video_id, score in scores.items()
+                    if self.docs[video_id]['status'] == status]
+        hits.sort(key=lambda hit: (-hit[0], -hit[1]['created_at']))
+        return [dict(doc) for _, doc in hits[offset:offset + limit]], len(hits)
+
+    # --- Persistence ---
+
+    def save(self, path):
+        """Write the indexed videos to `path` atomically (the index is rebuilt from them on load)."""
+        with self._lock:
+            data = {'version': SNAPSHOT_VERSION, 'watermark': self.watermark, 'docs': list(self.docs.values())}
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(data, f, default=int)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        """The index saved at `path`, or None if there is no usable snapshot."""
+        try:
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get('version') != SNAPSHOT_VERSION:
+            return None
+        index = cls()
+        for doc in data['docs']:
+            index.add(doc)
+        index.watermark = data['watermark']
+        return index
+
+
+# --- Loading from DynamoDB ---
+
+def _indexable(item):
+    return {field: item.get(field) for field in DOC_FIELDS}
+
+
+def _projection():
+    return {
+        'ProjectionExpression': ', '.join(f"#f{i}" for i in range(len(DOC_FIELDS))),
+        'ExpressionAttributeNames': {f"#f{i}": field for i, field in enumerate(DOC_FIELDS)},
+    }
+
+
+def build(segments=None):
+    """A new index of every READY video: a parallel Scan of the feed index, `segments` at once."""
+    from . import db_utils # db_utils imports this module
+
+    index = SearchIndex()
+    started = int(time.time())
+    items = db_utils.parallel_scan(
+        segments or settings.SEARCH['LOAD_SEGMENTS'],
+        IndexName=settings.DYNAMO_FEED_INDEX,
+        FilterExpression=Attr('status').eq('READY'),
+        **_projection()
+    )
+    for item in items:
+        index.add(_indexable(item))
+    index.watermark = started
+    return index
+
+
+def catch_up(index):
+    """Add the videos that went READY since the index's watermark. Returns how many were (re)indexed."""
+    from . import db_utils # db_utils imports this module
+
+    table = db_utils.get_table()
+    started = int(time.time())
+    # Transcoding takes a while: a video created a bit before the watermark may
+    # only have gone READY after it
+    since = index.watermark - settings.SEARCH['CATCHUP_SECONDS']
+    query_kwargs = dict(
+        _projection(),
+        IndexName=settings.DYNAMO_FEED_INDEX,
+        KeyConditionExpression=Key('status').eq('READY') & Key('created_at').gte(since),
+    )
+    count = 0
+    while True:
+        response = table.query(**query_kwargs)
+        for item in response.get('Items', []):
+            index.add(_indexable(item))
+            count += 1
+        if 'LastEvaluatedKey' not in response:
+            break
+        query_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    index.watermark = started
+    return count
+
+
+# --- The process-wide index ---
+
+_index = None
+_load_lock = threading.Lock()
+_refreshing = threading.Lock()
+_refreshed_at = 0
+
+
+def get_index():
+    """This process's index, loaded on first use (snapshot + catch-up, else a full build)."""
+    global _index, _refreshed_at
+    if _index is None:
+        with _load_lock:
+            if _index is None:
+                path = settings.SEARCH['SNAPSHOT_PATH']
+                index = SearchIndex.load(path) if path else None
+                if index is not None:
+                    catch_up(index)
+                else:
+                    index = build()
+                    if path:
+                        index.save(path)
+                _index, _refreshed_at = index, time.monotonic()
+    elif time.monotonic() - _refreshed_at > settings.SEARCH['REFRESH_SECONDS']:
+        _refresh_in_background()
+    return _index
+
+
+def _refresh_in_background():
+    if not _refreshing.acquire(blocking=False):
+        return # Already running
+    threading.Thread(target=_refresh, name='search-refresh', daemon=True).start()
+
+
+def _refresh():
+    global _refreshed_at
+    try:
+        if catch_up(_index) and settings.SEARCH['SNAPSHOT_PATH']:
+            _index.save(settings.SEARCH['SNAPSHOT_PATH'])
+    except Exception:
+        pass # Searches keep using what is indexed; next round
+    finally:
+        _refreshed_at = time.monotonic()
+        _refreshing.release()
+
+
+def search(query, page=1):
+    """(docs, total) for one page of results, settings.SEARCH['PAGE_SIZE'] per page."""
+    size = settings.SEARCH['PAGE_SIZE']
+    return get_index().search(query, offset=(page - 1) * size, limit=size)
+
+
+def reset():
+    """Forget the loaded index (tests, or after rebuilding the snapshot)."""
+    global _index
+    with _load_lock:
+        _index = None
+
+
+# Hooks for db_utils. They only touch an index that is already loaded: an
+# upload shouldn't pay for loading one.
+
+def video_changed(video):
+    if _index is not None and video.get('video_id'):
+        _index.add(video)
+
+
+def video_status_changed(video_id, status):
+    if _index is not None:
+        _index.set_status(video_id, status)
+
+
+def video_removed(video_id):
+    if _index is not None:
+        _index.remove(video_id)
+
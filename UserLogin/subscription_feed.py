@@ -0,0 +1,322 @@
+"""
+The Subscriptions feed: the newest READY videos of every creator a user
+subscribes to, newest first.
+
+Pull (the default). One Query per creator on the creator feed index
+(settings.DYNAMO_CREATOR_FEED_INDEX: creator_feed = the creator's PK, then
+created_at), run on a bounded thread pool, and a lazy k-way merge of those
+streams (heapq.merge). Each Query only asks for the creator's share of a page,
+and a stream is read further only if the merge actually gets to its end, so a
+first page costs one Query for the subscription list plus one per creator.
+
+Inbox (fan-out on write), for users following at least
+SUBSCRIPTION_FEED['INBOX_THRESHOLD'] creators, where a Query per creator per
+page adds up. enable_inbox() registers the user on each creator they follow
+(PK = USER#<creator>, SK = FOLLOWER#<user>) and copies each creator's recent
+videos into the user's partition:
+
+    PK = USER#<user>, SK = INBOX#<created_at, zero-padded>#<video_id>
+
+From then on publish() (a video going READY) adds it to every follower's
+inbox, and a page is one Query on the inbox plus one BatchGetItem for the
+videos themselves, however many channels the user follows. Entries of deleted
+videos are dropped when a page comes across them.
+
+Both modes page with the same signed cursor: the (created_at, video_id) of the
+last video shown.
+"""
+import heapq
+import itertools
+import math
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from boto3.dynamodb.conditions import Attr, Key
+from django.conf import settings
+
+from . import metrics
+from .batch_loader import ItemLoader
+from .db_cache import cached, invalidate, store
+
+CURSOR_SALT = 'subscriptions'
+
+_executor = ThreadPoolExecutor(
+    max_workers=settings.SUBSCRIPTION_FEED['CONCURRENCY'],
+    thread_name_prefix='subscriptions',
+)
+_switcher = ThreadPoolExecutor(max_workers=1, thread_name_prefix='subscriptions-inbox') # enable_inbox() uses _executor itself
+_switching = {} # email -> Future of a pending enable_inbox()
+_switching_lock = threading.Lock()
+
+
+def _table():
+    from . import db_utils # db_utils imports this module
+    return db_utils.get_table()
+
+
+def _position(item):
+    # Feed order is by this, descending. The id is the last part of the SK, for
+    # videos (VIDEO#<id>) and inbox entries (INBOX#<created_at>#<id>) alike
+    return int(item.get('created_at', 0)), item['SK'].rsplit('#', 1)[1]
+
+
+def _encode(video):
+    from . import db_utils # db_utils imports this module
+    created_at, video_id = _position(video)
+    return db_utils.encode_cursor({'created_at': created_at, 'video_id': video_id}, salt=CURSOR_SALT)
+
+
+def _decode(cursor):
+    from . import db_utils # db_utils imports this module
+    position = db_utils.decode_cursor(cursor, salt=CURSOR_SALT)
+    if position is None:
+        return None
+    try:
+        return int(position['created_at']), str(position['video_id'])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError("Invalid cursor")
+
+
+def _paginate(videos, size):
+    # `videos` holds up to size + 1: the extra one only says there is a next page
+    if len(videos) > size:
+        return videos[:size], _encode(videos[size - 1])
+    return videos, None
+
+
+def subscribed_creators(email):
+    """Emails of the creators `email` subscribes to."""
+    def load():
+        query_kwargs = {
+            'KeyConditionExpression': Key('PK').eq(f"USER#{email}") & Key('SK').begins_with('SUB#'),
+            'ProjectionExpression': 'SK',
+        }
+        creators = []
+        while True:
+            response = _table().query(**query_kwargs)
+            creators.extend(item['SK'][len('SUB#'):] for item in response.get('Items', []))
+            if 'LastEvaluatedKey' not in response:
+                return creators
+            query_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    return cached('subscriptions', email, load)
+
+
+def inbox_enabled(email):
+    def load():
+        item = _table().get_item(
+            Key={'PK': f"USER#{email}", 'SK': 'PROFILE'}, ProjectionExpression='feed_inbox'
+        ).get('Item')
+        return bool((item or {}).get('feed_inbox'))
+    return cached('feed_mode', email, load)
+
+
+def get_page(email, cursor=None):
+    """One page of `email`'s Subscriptions feed: (videos, next_cursor). Raises ValueError for a bad cursor."""
+    position = _decode(cursor)
+    if inbox_enabled(email):
+        return _inbox_page(email, position, settings.FEED_PAGE_SIZE)
+    return _pull_page(email, position, settings.FEED_PAGE_SIZE)
+
+
+# --- Pull: merge the creators' streams ---
+
+def _creator_query(creator, position, limit):
+    condition = Key('creator_feed').eq(f"USER#{creator}")
+    if position is not None:
+        condition &= Key('created_at').lte(position[0])
+    return {
+        'IndexName': settings.DYNAMO_CREATOR_FEED_INDEX,
+        'KeyConditionExpression': condition,
+        'ScanIndexForward': False, # Newest first
+        'Limit': limit,
+    }
+
+
+def _creator_stream(query_kwargs, response, position):
+    # One creator's videos after `position`, starting from the prefetched first
+    # response; the next Query only runs if the merge asks for more
+    while True:
+        for item in sorted(response.get('Items', []), key=_position, reverse=True):
+            if position is None or _position(item) < position:
+                yield item
+        if 'LastEvaluatedKey' not in response:
+            return
+        query_kwargs = dict(query_kwargs, ExclusiveStartKey=response['LastEvaluatedKey'])
+        response = _table().query(**query_kwargs)
+
+
+def _pull_page(email, position, size):
+    config = settings.SUBSCRIPTION_FEED
+    creators = subscribed_creators(email)
+    if not creators:
+        return [], None
+    if len(creators) >= config['INBOX_THRESHOLD']:
+        switch_to_inbox(email) # In the background; this page is still pulled
+
+    # Enough from each creator for twice its share of the page (+1 to see if
+    # there's a next one), never less than MIN_CHUNK
+    limit = min(size + 1, max(config['MIN_CHUNK'], math.ceil(2 * size / len(creators))))
+    queries = [_creator_query(creator, position, limit) for creator in creators]
+    # The first Query of every stream at once, CONCURRENCY at a time
+    first = _executor.map(metrics.bind(lambda query_kwargs: _table().query(**query_kwargs)), queries)
+    streams = [_creator_stream(q, response, position) for q, response in zip(queries, first)]
+    merged = heapq.merge(*streams, key=_position, reverse=True)
+    return _paginate(list(itertools.islice(merged, size + 1)), size)
+
+
+# --- Inbox: fan-out on write ---
+
+def _inbox_sk(created_at, video_id):
+    return f"INBOX#{int(created_at):012d}#{video_id}"
+
+
+def _inbox_entry(subscriber, video):
+    return {
+        'PK': f"USER#{subscriber}",
+        'SK': _inbox_sk(video.get('created_at', 0), video['video_id']),
+        'video_pk': video['PK'],
+        'video_sk': video['SK'], # No video_id: that would put every copy in the video_id index
+        'created_at': int(video.get('created_at', 0)),
+    }
+
+
+def _inbox_page(email, position, size):
+    table = _table()
+    condition = Key('PK').eq(f"USER#{email}")
+    if position is None:
+        condition &= Key('SK').begins_with('INBOX#')
+    else:
+        condition &= Key('SK').between('INBOX#', _inbox_sk(*position)) # Inclusive: the cursor's own entry is dropped below
+    response = table.query(KeyConditionExpression=condition, ScanIndexForward=False, Limit=size + 2)
+    entries = [e for e in response.get('Items', []) if position is None or _position(e) < position]
+    more = len(entries) > size or 'LastEvaluatedKey' in response
+    entries = entries[:size]
+
+    loader = ItemLoader()
+    pending = [loader.load({'PK': e['video_pk'], 'SK': e['video_sk']}) for e in entries]
+    videos = []
+    for entry, item in zip(entries, pending):
+        video = item.get()
+        if video is None or video.get('status') != 'READY':
+            table.delete_item(Key={'PK': entry['PK'], 'SK': entry['SK']}) # Deleted since
+        else:
+            videos.append(video)
+    return videos, (_encode(entries[-1]) if more and entries else None)
+
+
+def _recent_videos(creator):
+    response = _table().query(**_creator_query(creator, None, settings.SUBSCRIPTION_FEED['INBOX_BACKFILL']))
+    return response.get('Items', [])
+
+
+def _follow(subscriber, creators):
+    # Register on each creator first, then backfill: a video published in
+    # between is in the inbox either way (the puts are idempotent)
+    with _table().batch_writer(overwrite_by_pkeys=['PK', 'SK']) as batch:
+        for creator in creators:
+            batch.put_item(Item={'PK': f"USER#{creator}", 'SK': f"FOLLOWER#{subscriber}"})
+    recent = _executor.map(_recent_videos, creators)
+    with _table().batch_writer(overwrite_by_pkeys=['PK', 'SK']) as batch:
+        for video in itertools.chain.from_iterable(recent):
+            batch.put_item(Item=_inbox_entry(subscriber, video))
+
+
+def _inbox_entries(subscriber, video_pk=None):
+    query_kwargs = {
+        'KeyConditionExpression': Key('PK').eq(f"USER#{subscriber}") & Key('SK').begins_with('INBOX#'),
+        'ProjectionExpression': 'PK, SK',
+    }
+    if video_pk is not None:
+        query_kwargs['FilterExpression'] = Attr('video_pk').eq(video_pk)
+    while True:
+        response = _table().query(**query_kwargs)
+        yield from response.get('Items', [])
+        if 'LastEvaluatedKey' not in response:
+            return
+        query_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def enable_inbox(email):
+    """Switch `email` to inbox mode (see the module docstring). Raises LookupError for an unknown user."""
+    table = _table()
+    _follow(email, subscribed_creators(email))
+    try:
+        table.update_item(
+            Key={'PK': f"USER#{email}", 'SK': 'PROFILE'},
+            UpdateExpression="SET feed_inbox = :on",
+            ConditionExpression="attribute_exists(PK)",
+            ExpressionAttributeValues={':on': True},
+        )
+    except table.meta.client.exceptions.ConditionalCheckFailedException:
+        raise LookupError(f"No user {email}")
+    store('feed_mode', email, True)
+
+
+def disable_inbox(email):
+    """Back to pull mode: the FOLLOWER# registrations and the inbox are deleted."""
+    table = _table()
+    try:
+        table.update_item(
+            Key={'PK': f"USER#{email}", 'SK': 'PROFILE'},
+            UpdateExpression="REMOVE feed_inbox",
+            ConditionExpression="attribute_exists(PK)",
+        )
+    except table.meta.client.exceptions.ConditionalCheckFailedException:
+        raise LookupError(f"No user {email}")
+    store('feed_mode', email, False)
+    with table.batch_writer(overwrite_by_pkeys=['PK', 'SK']) as batch:
+        for creator in subscribed_creators(email):
+            batch.delete_item(Key={'PK': f"USER#{creator}", 'SK': f"FOLLOWER#{email}"})
+        for entry in _inbox_entries(email):
+            batch.delete_item(Key=entry)
+
+
+def switch_to_inbox(email):
+    """enable_inbox() on the feed's thread pool, once. Returns its Future."""
+    with _switching_lock:
+        future = _switching.get(email)
+        if future is None:
+            future = _switching[email] = _switcher.submit(enable_inbox, email)
+            future.add_done_callback(lambda _: _switching.pop(email, None))
+        return future
+
+
+# Hooks for db_utils
+
+def subscription_changed(subscriber, creator, subscribed):
+    invalidate(('subscriptions', subscriber))
+    if not inbox_enabled(subscriber):
+        return
+    table = _table()
+    if subscribed:
+        _follow(subscriber, [creator])
+        return
+    table.delete_item(Key={'PK': f"USER#{creator}", 'SK': f"FOLLOWER#{subscriber}"})
+    with table.batch_writer(overwrite_by_pkeys=['PK', 'SK']) as batch:
+        for entry in _inbox_entries(subscriber, video_pk=f"USER#{creator}"):
+            batch.delete_item(Key=entry)
+
+
+def subscription_queued(subscriber, creator, subscribed):
+    # Write-behind: the SUB# item is only written by write_behind.flush(), which
+    # calls subscription_changed() then. Until that the subscriber's own list is
+    # patched in the cache, the way the counts are
+    creators = [c for c in subscribed_creators(subscriber) if c != creator]
+    store('subscriptions', subscriber, creators + [creator] if subscribed else creators)
+
+
+def publish(video):
+    """Fan a video that just went READY out to its creator's inbox followers."""
+    table = _table()
+    query_kwargs = {
+        'KeyConditionExpression': Key('PK').eq(video['PK']) & Key('SK').begins_with('FOLLOWER#'),
+        'ProjectionExpression': 'SK',
+    }
+    with table.batch_writer(overwrite_by_pkeys=['PK', 'SK']) as batch:
+        while True:
+            response = table.query(**query_kwargs)
+            for follower in response.get('Items', []):
+                batch.put_item(Item=_inbox_entry(follower['SK'][len('FOLLOWER#'):], video))
+            if 'LastEvaluatedKey' not in response:
+                return
+            query_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
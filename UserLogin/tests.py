@@ -1,3 +1,1256 @@
-from django.test import TestCase
+import datetime
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
 
-# Create your tests here.
+import numpy as np
+from django.conf import settings
+from django.core.cache import caches
+from django.test import SimpleTestCase, override_settings
+from django.urls import reverse
+from boto3.dynamodb.conditions import Attr, Key
+from moto import mock_aws
+
+from UserLogin import aws_clients, db_cache, db_utils, hls, page_cache, passwords, presign, related, search_index, subscription_feed, thumbnails, view_counts, write_behind
+from UserLogin.hyperloglog import HyperLogLog
+from UserLogin.batch_loader import BATCH_SIZE, MAX_RETRIES, ItemLoader
+from UserLogin.search_index import SearchIndex
+
+
+@override_settings(
+    AWS_DYNAMODB_ENDPOINT_URL=None,
+    AWS_S3_ENDPOINT_URL=None,
+    AWS_ACCESS_KEY_ID='testing',
+    AWS_SECRET_ACCESS_KEY='testing',
+    AWS_SESSION_TOKEN=None,
+    VIEW_COUNTS=dict(settings.VIEW_COUNTS, FLUSH_SECONDS=0), # Tests flush by hand
+    SEARCH=dict(settings.SEARCH, SNAPSHOT_PATH=None),
+    PASSWORD_HASHING=dict(settings.PASSWORD_HASHING, WORKERS=0, PBKDF2_ITERATIONS=1000), # Fast, inline hashing
+)
+class DynamoTestCase(SimpleTestCase):
+    """
+    Runs against moto's in-memory DynamoDB/S3: a fresh table (with every GSI
+    in db_utils.TABLE_INDEXES), fresh pooled clients, an empty db_cache and fragment cache per test.
+    """
+
+    def setUp(self):
+        from Dashboard.management.commands._standin import ensure_buckets, ensure_table
+
+        mock = mock_aws()
+        mock.start()
+        self.addCleanup(mock.stop)
+
+        aws_clients.reset_clients()
+        self.addCleanup(aws_clients.reset_clients)
+        db_cache.get_backend().clear()
+        self.addCleanup(db_cache.get_backend().clear)
+        self.addCleanup(lambda: view_counts._pending.clear())
+        search_index.reset()
+        self.addCleanup(search_index.reset)
+        caches[settings.PAGE_CACHE['FRAGMENT_CACHE']].clear() # Fragment keys repeat: versions start at 0 per test
+
+        ensure_table()
+        ensure_buckets()
+        self.table = db_utils.get_table()
+
+    def create_video(self, email='creator@test.local', status='READY', created_at=None, **extra):
+        video_id = db_utils.create_video_entry(email, 'A video', 'raw/a.mp4', 'thumbnails/a.jpg', 'Channel')
+        attributes = dict(extra, status=status)
+        if status == 'READY':
+            attributes['creator_feed'] = f"USER#{email}" # As finish_transcode_job sets it
+        if created_at is not None:
+            attributes['created_at'] = created_at
+        names = {f"#a{i}": name for i, name in enumerate(attributes)}
+        values = {f":v{i}": value for i, value in enumerate(attributes.values())}
+        self.table.update_item(
+            Key={'PK': f"USER#{email}", 'SK': f"VIDEO#{video_id}"},
+            UpdateExpression="SET " + ", ".join(f"#a{i} = :v{i}" for i in range(len(attributes))),
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues=values,
+        )
+        if status == 'READY':
+            page_cache.bump(page_cache.FEED) # As finish_transcode_job does
+        return video_id
+
+    def count_items(self):
+        # Everything but page_cache's version counters
+        return self.table.scan(FilterExpression=Attr('PK').ne(page_cache.VERSION_PK))['Count']
+
+
+class CursorTests(SimpleTestCase):
+    def test_round_trip(self):
+        last_key = {'PK': 'USER#a@b.c', 'SK': 'VIDEO#1', 'status': 'READY', 'created_at': 1700000000}
+        cursor = db_utils.encode_cursor(last_key)
+        self.assertIsInstance(cursor, str)
+        self.assertEqual(db_utils.decode_cursor(cursor), last_key)
+
+    def test_empty_key_means_no_more_pages(self):
+        self.assertIsNone(db_utils.encode_cursor(None))
+        self.assertIsNone(db_utils.encode_cursor({}))
+        self.assertIsNone(db_utils.decode_cursor(''))
+
+    def test_forged_cursor_is_rejected(self):
+        cursor = db_utils.encode_cursor({'PK': 'USER#a@b.c', 'SK': 'VIDEO#1'})
+        with self.assertRaises(ValueError):
+            db_utils.decode_cursor(cursor[:-2] + ('A' if cursor[-2] != 'A' else 'B') + cursor[-1])
+        with self.assertRaises(ValueError):
+            db_utils.decode_cursor('not-a-cursor')
+
+    def test_cursor_is_bound_to_its_salt(self):
+        cursor = db_utils.encode_cursor({'PK': 'USER#a@b.c', 'SK': 'VIDEO#1'}, salt='feed')
+        with self.assertRaises(ValueError):
+            db_utils.decode_cursor(cursor, salt='other')
+
+
+class FeedPageTests(DynamoTestCase):
+    def test_pages_are_newest_first_and_complete(self):
+        created = [self.create_video(created_at=1000 + i) for i in range(7)]
+        self.create_video(status='PROCESSING', created_at=5000) # Never in the READY feed
+
+        seen, cursor = [], None
+        while True:
+            page, cursor = db_utils.get_videos_page(limit=3, cursor=cursor)
+            self.assertLessEqual(len(page), 3)
+            seen.extend(video['video_id'] for video in page)
+            if not cursor:
+                break
+
+        self.assertEqual(seen, list(reversed(created)))
+
+    def test_bad_cursor_raises(self):
+        with self.assertRaises(ValueError):
+            db_utils.get_videos_page(cursor='garbage')
+
+
+class LRUCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch('UserLogin.db_cache.time.monotonic', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_entries_expire_after_their_ttl(self):
+        cache = db_cache.LRUCache()
+        cache.set('a', 1, ttl=10)
+        self.now += 9
+        self.assertEqual(cache.get('a'), 1)
+        self.now += 2
+        self.assertIsNone(cache.get('a'))
+
+    def test_least_recently_used_is_evicted(self):
+        cache = db_cache.LRUCache(max_entries=2)
+        cache.set('a', 1, ttl=60)
+        cache.set('b', 2, ttl=60)
+        cache.get('a') # 'b' is now the least recently used
+        cache.set('c', 3, ttl=60)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+
+    def test_add_keeps_a_live_entry(self):
+        cache = db_cache.LRUCache()
+        cache.set('a', 'written', ttl=10)
+        self.assertFalse(cache.add('a', 'read', ttl=10))
+        self.assertEqual(cache.get('a'), 'written')
+        self.now += 11
+        self.assertTrue(cache.add('a', 'read', ttl=10))
+        self.assertEqual(cache.get('a'), 'read')
+
+
+@override_settings(DB_CACHE=dict(settings.DB_CACHE, NEGATIVE_TIMEOUT=5, TIMEOUTS={'thing': 60}))
+class CachedTests(SimpleTestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch('UserLogin.db_cache.time.monotonic', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        db_cache.get_backend().clear()
+        self.addCleanup(db_cache.get_backend().clear)
+
+    def test_read_through(self):
+        loader = mock.Mock(return_value={'n': 1})
+        self.assertEqual(db_cache.cached('thing', 'k', loader), {'n': 1})
+        self.assertEqual(db_cache.cached('thing', 'k', loader), {'n': 1})
+        self.assertEqual(loader.call_count, 1)
+
+    def test_negative_hits_are_cached_briefly(self):
+        loader = mock.Mock(return_value=None)
+        self.assertIsNone(db_cache.cached('thing', 'k', loader))
+        self.assertIsNone(db_cache.cached('thing', 'k', loader))
+        self.assertEqual(loader.call_count, 1)
+        self.now += 6 # Past NEGATIVE_TIMEOUT, well inside the kind's 60s
+        db_cache.cached('thing', 'k', loader)
+        self.assertEqual(loader.call_count, 2)
+
+    def test_cache_if_and_disabled_kinds(self):
+        loader = mock.Mock(return_value='PROCESSING')
+        db_cache.cached('thing', 'k', loader, cache_if=lambda value: value == 'READY')
+        db_cache.cached('thing', 'k', loader, cache_if=lambda value: value == 'READY')
+        self.assertEqual(loader.call_count, 2)
+
+        loader = mock.Mock(return_value='x')
+        db_cache.cached('other', 'k', loader) # No timeout configured: never cached
+        db_cache.cached('other', 'k', loader)
+        self.assertEqual(loader.call_count, 2)
+
+    def test_store_wins_over_a_racing_read(self):
+        db_cache.store('thing', 'k', 'written')
+        self.assertEqual(db_cache.cached('thing', 'k', lambda: 'stale read'), 'written')
+        db_cache.invalidate(('thing', 'k'))
+        self.assertEqual(db_cache.cached('thing', 'k', lambda: 'fresh read'), 'fresh read')
+
+
+class WriteThroughTests(DynamoTestCase):
+    creator = 'creator@test.local'
+    viewer = 'viewer@test.local'
+
+    def stale_reads(self):
+        # Any read that would refill the cache now fails the test
+        return mock.patch.object(db_utils, 'get_table', side_effect=AssertionError("unexpected re-read"))
+
+    def test_toggle_subscription_writes_through(self):
+        db_utils.create_user(self.creator, 'pw', 'Creator')
+        self.assertEqual(db_utils.get_subscriber_count(self.creator), 0) # Warm the cache
+        self.assertFalse(db_utils.is_subscribed(self.viewer, self.creator))
+
+        self.assertEqual(db_utils.toggle_subscription(self.viewer, self.creator), (True, 1))
+        with self.stale_reads():
+            self.assertEqual(db_utils.get_subscriber_count(self.creator), 1)
+            self.assertTrue(db_utils.is_subscribed(self.viewer, self.creator))
+            self.assertNotIn('password', db_utils.get_public_profile(self.creator))
+
+        self.assertEqual(db_utils.toggle_subscription(self.viewer, self.creator), (False, 0))
+        with self.stale_reads():
+            self.assertEqual(db_utils.get_subscriber_count(self.creator), 0)
+            self.assertFalse(db_utils.is_subscribed(self.viewer, self.creator))
+
+    def test_update_reaction_writes_through(self):
+        video_id = self.create_video(self.creator)
+        video_pk, video_sk = f"USER#{self.creator}", f"VIDEO#{video_id}"
+        self.assertNotIn('likes', db_utils.get_video_by_id(video_id)) # Cached before the vote
+
+        stats = db_utils.update_reaction(self.viewer, video_pk, video_sk, video_id, 'LIKE')
+        self.assertEqual(stats, {'likes': 1, 'dislikes': 0})
+        with self.stale_reads():
+            self.assertEqual(db_utils.get_user_reaction(self.viewer, video_id), 'LIKE')
+            self.assertEqual(db_utils.get_video_stats(video_pk, video_sk), stats)
+            self.assertEqual(db_utils.get_video_by_id(video_id)['likes'], 1)
+
+        stats = db_utils.update_reaction(self.viewer, video_pk, video_sk, video_id, 'DISLIKE')
+        self.assertEqual(stats, {'likes': 0, 'dislikes': 1})
+        stats = db_utils.update_reaction(self.viewer, video_pk, video_sk, video_id, 'NONE')
+        self.assertEqual(stats, {'likes': 0, 'dislikes': 0})
+        with self.stale_reads():
+            self.assertIsNone(db_utils.get_user_reaction(self.viewer, video_id))
+
+    def test_repeated_reaction_is_not_double_counted(self):
+        video_id = self.create_video(self.creator)
+        video_pk, video_sk = f"USER#{self.creator}", f"VIDEO#{video_id}"
+        db_utils.update_reaction(self.viewer, video_pk, video_sk, video_id, 'LIKE')
+        stats = db_utils.update_reaction(self.viewer, video_pk, video_sk, video_id, 'LIKE')
+        self.assertEqual(stats, {'likes': 1, 'dislikes': 0})
+
+    def test_only_ready_videos_are_cached(self):
+        self.assertIsNone(db_utils.get_video_by_id('not-there-yet')) # e.g. GSI lag
+        video_id = self.create_video(self.creator, status='PROCESSING')
+        self.assertEqual(db_utils.get_video_by_id(video_id)['status'], 'PROCESSING')
+
+        self.table.update_item(
+            Key={'PK': f"USER#{self.creator}", 'SK': f"VIDEO#{video_id}"},
+            UpdateExpression="SET #s = :ready",
+            ExpressionAttributeNames={'#s': 'status'},
+            ExpressionAttributeValues={':ready': 'READY'},
+        )
+        self.assertEqual(db_utils.get_video_by_id(video_id)['status'], 'READY')
+        with self.stale_reads():
+            self.assertEqual(db_utils.get_video_by_id(video_id)['status'], 'READY')
+
+
+class TransactionalEngagementTests(DynamoTestCase):
+    creator = 'creator@test.local'
+    viewer = 'viewer@test.local'
+
+    def setUp(self):
+        super().setUp()
+        self.video_id = self.create_video(self.creator)
+        self.video_key = (f"USER#{self.creator}", f"VIDEO#{self.video_id}")
+
+    def vote(self, action, voter=None):
+        return db_utils.update_reaction(voter or self.viewer, *self.video_key, self.video_id, action)
+
+    def test_one_transaction_and_one_read_per_vote(self):
+        self.assertIsNone(db_utils.get_user_reaction(self.viewer, self.video_id)) # Watch page warmed the cache
+        client = db_utils.get_table().meta.client
+        with mock.patch.object(client, 'transact_write_items', wraps=client.transact_write_items) as transact, \
+                mock.patch.object(db_utils, '_read_counters', wraps=db_utils._read_counters) as read_counters:
+            self.assertEqual(self.vote('LIKE'), {'likes': 1, 'dislikes': 0})
+        self.assertEqual(transact.call_count, 1)
+        self.assertEqual(read_counters.call_count, 1)
+
+    def test_stale_guess_is_corrected_by_the_condition(self):
+        self.assertEqual(self.vote('LIKE'), {'likes': 1, 'dislikes': 0})
+        # Another box (with its own cache) switched this user's vote meanwhile
+        db_cache.store('reaction', (self.viewer, self.video_id), None)
+        self.table.put_item(Item={'PK': f"USER#{self.viewer}", 'SK': f"REACTION#{self.video_id}", 'type': 'DISLIKE'})
+        self.table.update_item(
+            Key={'PK': self.video_key[0], 'SK': self.video_key[1]},
+            UpdateExpression="ADD likes :minus, dislikes :one", ExpressionAttributeValues={':minus': -1, ':one': 1}
+        )
+
+        # Cache says "no vote": without the condition this LIKE would count twice
+        self.assertEqual(self.vote('LIKE'), {'likes': 1, 'dislikes': 0})
+        self.assertEqual(db_utils.get_user_reaction(self.viewer, self.video_id), 'LIKE')
+
+    def test_stale_no_op_is_double_checked(self):
+        db_cache.store('reaction', (self.viewer, self.video_id), 'LIKE') # Never actually written
+        self.assertEqual(self.vote('LIKE'), {'likes': 1, 'dislikes': 0})
+
+    def test_missing_video(self):
+        db_utils.delete_video_entry(self.creator, self.video_id)
+        with self.assertRaises(LookupError):
+            self.vote('LIKE')
+        # Neither half of the transaction happened: no REACTION# item, no ghost video row
+        self.assertEqual(self.count_items(), 0)
+
+    def test_stale_subscription_guess(self):
+        db_utils.create_user(self.creator, 'pw', 'Creator')
+        self.assertEqual(db_utils.toggle_subscription(self.viewer, self.creator), (True, 1))
+        db_cache.store('sub', (self.viewer, self.creator), False) # Stale: says not subscribed
+        self.assertEqual(db_utils.toggle_subscription(self.viewer, self.creator), (False, 0))
+        self.assertEqual(db_utils.toggle_subscription(self.viewer, self.creator), (True, 1))
+
+
+class ShardedCounterTests(DynamoTestCase):
+    creator = 'creator@test.local'
+
+    def vote(self, video_id, voter, action):
+        return db_utils.update_reaction(voter, f"USER#{self.creator}", f"VIDEO#{video_id}", video_id, action)
+
+    def test_existing_counts_carry_over(self):
+        video_id = self.create_video(self.creator, likes=5, dislikes=2)
+        key = {'PK': f"USER#{self.creator}", 'SK': f"VIDEO#{video_id}"}
+        self.assertEqual(db_utils.set_counter_shards(key, 4), 0)
+
+        for i in range(12):
+            stats = self.vote(video_id, f"fan{i}@test.local", 'LIKE')
+        self.vote(video_id, 'fan0@test.local', 'DISLIKE')
+        self.assertEqual(stats, {'likes': 17, 'dislikes': 2})
+
+        db_cache.get_backend().clear()
+        self.assertEqual(db_utils.get_video_stats(key['PK'], key['SK']), {'likes': 16, 'dislikes': 3})
+        loader = ItemLoader()
+        self.assertEqual(db_utils.load_video_stats(loader, key['PK'], key['SK']).get(), {'likes': 16, 'dislikes': 3})
+        # The item itself was never written to: every vote went to a shard
+        self.assertEqual(self.table.get_item(Key=key)['Item']['likes'], 5)
+
+    def test_subscriber_count(self):
+        db_utils.create_user(self.creator, 'pw', 'Creator')
+        db_utils.set_counter_shards({'PK': f"USER#{self.creator}", 'SK': 'PROFILE'}, 3)
+        for i in range(5):
+            db_utils.toggle_subscription(f"fan{i}@test.local", self.creator)
+        self.assertEqual(db_utils.toggle_subscription('fan0@test.local', self.creator), (False, 4))
+        db_cache.get_backend().clear()
+        self.assertEqual(db_utils.get_subscriber_count(self.creator), 4)
+
+    def test_shard_counts_only_grow(self):
+        video_id = self.create_video(self.creator)
+        key = {'PK': f"USER#{self.creator}", 'SK': f"VIDEO#{video_id}"}
+        db_utils.set_counter_shards(key, 4)
+        with self.assertRaises(ValueError):
+            db_utils.set_counter_shards(key, 2)
+        with self.assertRaises(ValueError):
+            db_utils.set_counter_shards({'PK': 'USER#nobody', 'SK': 'PROFILE'}, 2)
+        self.assertEqual(db_utils.set_counter_shards(key, 8), 4)
+        self.assertEqual(db_utils.sharded_counter_keys(), [key])
+
+    @override_settings(COUNTERS=dict(settings.COUNTERS, AGGREGATE_MAX_AGE=60))
+    def test_reads_use_a_fresh_aggregate(self):
+        video_id = self.create_video(self.creator, likes=1)
+        key = {'PK': f"USER#{self.creator}", 'SK': f"VIDEO#{video_id}"}
+        db_utils.set_counter_shards(key, 2)
+        self.vote(video_id, 'fan@test.local', 'LIKE')
+        self.assertEqual(db_utils.refresh_counter_totals(key), {'likes': 2, 'dislikes': 0})
+        self.vote(video_id, 'fan2@test.local', 'LIKE')
+
+        db_cache.get_backend().clear()
+        with mock.patch.object(db_utils, 'sum_counter_shards', side_effect=AssertionError("read the shards")):
+            self.assertEqual(db_utils.get_video_stats(key['PK'], key['SK']), {'likes': 2, 'dislikes': 0})
+
+    def test_deleting_the_video_deletes_its_shards(self):
+        video_id = self.create_video(self.creator)
+        key = {'PK': f"USER#{self.creator}", 'SK': f"VIDEO#{video_id}"}
+        db_utils.set_counter_shards(key, 2)
+        self.vote(video_id, 'fan@test.local', 'LIKE')
+        db_utils.delete_video_entry(self.creator, video_id)
+        self.assertEqual(db_utils.sharded_counter_keys(), [])
+        self.assertEqual(self.count_items(), 1) # Just the fan's REACTION#
+
+
+class WriteBehindTests(DynamoTestCase):
+    creator = 'creator@test.local'
+
+    def setUp(self):
+        super().setUp()
+        workdir = tempfile.TemporaryDirectory()
+        self.addCleanup(workdir.cleanup)
+        config = dict(settings.WRITE_BEHIND, ENABLED=True, PATH=os.path.join(workdir.name, 'queue.sqlite3'))
+        patcher = override_settings(WRITE_BEHIND=config)
+        patcher.enable()
+        self.addCleanup(patcher.disable)
+        self.video_id = self.create_video(self.creator, likes=3)
+        self.video_key = (f"USER#{self.creator}", f"VIDEO#{self.video_id}")
+
+    def vote(self, voter, action):
+        return db_utils.update_reaction(voter, *self.video_key, self.video_id, action)
+
+    def stored_stats(self):
+        db_cache.get_backend().clear()
+        return db_utils.get_video_stats(*self.video_key)
+
+    def test_clicks_coalesce_and_flush(self):
+        self.assertEqual(self.vote('a@test.local', 'LIKE'), {'likes': 4, 'dislikes': 0})
+        self.assertEqual(self.vote('a@test.local', 'DISLIKE'), {'likes': 3, 'dislikes': 1})
+        self.assertEqual(self.vote('b@test.local', 'LIKE'), {'likes': 4, 'dislikes': 1})
+        self.assertEqual(self.vote('c@test.local', 'LIKE'), {'likes': 5, 'dislikes': 1})
+        self.assertEqual(self.vote('c@test.local', 'NONE'), {'likes': 4, 'dislikes': 1})
+        self.assertEqual(write_behind.backlog(), 3) # One row per (user, video)
+        self.assertEqual(self.stored_stats(), {'likes': 3, 'dislikes': 0}) # Nothing written yet
+
+        with mock.patch.object(db_utils, 'add_to_counters', wraps=db_utils.add_to_counters) as add_to_counters:
+            self.assertEqual(write_behind.flush(), (3, 1))
+        add_to_counters.assert_called_once_with(
+            {'PK': self.video_key[0], 'SK': self.video_key[1]}, {'likes': 1, 'dislikes': 1}
+        )
+        self.assertEqual(self.stored_stats(), {'likes': 4, 'dislikes': 1})
+        self.assertEqual(db_utils.get_user_reaction('a@test.local', self.video_id), 'DISLIKE')
+        self.assertIsNone(db_utils.get_user_reaction('c@test.local', self.video_id))
+
+        # Undoing a flushed vote counts against what DynamoDB has
+        self.vote('a@test.local', 'NONE')
+        write_behind.flush()
+        self.assertEqual(self.stored_stats(), {'likes': 4, 'dislikes': 0})
+        self.assertEqual(write_behind.flush(), (0, 0))
+
+    def test_interrupted_flush_resumes_without_double_counting(self):
+        self.vote('a@test.local', 'LIKE')
+        self.vote('b@test.local', 'LIKE')
+        with mock.patch.object(db_utils, 'add_to_counters', side_effect=RuntimeError("killed")):
+            with self.assertRaises(RuntimeError):
+                write_behind.flush()
+        self.vote('c@test.local', 'LIKE') # Queued while the batch is stuck
+        write_behind.flush()
+        write_behind.flush()
+        self.assertEqual(self.stored_stats(), {'likes': 6, 'dislikes': 0})
+        self.assertEqual(write_behind.backlog(), 0)
+
+    def test_subscriptions(self):
+        db_utils.create_user(self.creator, 'pw', 'Creator')
+        self.assertEqual(db_utils.toggle_subscription('a@test.local', self.creator), (True, 1))
+        self.assertEqual(db_utils.toggle_subscription('b@test.local', self.creator), (True, 2))
+        self.assertEqual(db_utils.toggle_subscription('a@test.local', self.creator), (False, 1))
+        self.assertEqual(write_behind.flush(), (2, 1))
+        db_cache.get_backend().clear()
+        self.assertEqual(db_utils.get_subscriber_count(self.creator), 1)
+        self.assertTrue(db_utils.is_subscribed('b@test.local', self.creator))
+        self.assertFalse(db_utils.is_subscribed('a@test.local', self.creator))
+
+    def test_deltas_for_a_deleted_video_are_dropped(self):
+        self.vote('a@test.local', 'LIKE')
+        db_utils.delete_video_entry(self.creator, self.video_id)
+        self.assertEqual(write_behind.flush(), (1, 1))
+        self.assertNotIn('Item', self.table.get_item(Key={'PK': self.video_key[0], 'SK': self.video_key[1]}))
+        self.assertEqual(write_behind.backlog(), 0)
+
+    def test_feed_hook_runs_once_the_subscription_is_written(self):
+        db_utils.create_user(self.creator, 'pw', 'Creator')
+        db_utils.create_user('viewer@test.local', 'pw', 'Viewer')
+        subscription_feed.enable_inbox('viewer@test.local')
+        written = []
+
+        def hook(subscriber, creator, subscribed):
+            written.append(db_utils.get_table().get_item(Key={'PK': f"USER#{subscriber}", 'SK': f"SUB#{creator}"}).get('Item') is not None)
+            return changed(subscriber, creator, subscribed)
+
+        changed = subscription_feed.subscription_changed
+        with mock.patch.object(subscription_feed, 'subscription_changed', side_effect=hook):
+            db_utils.toggle_subscription('viewer@test.local', self.creator)
+            self.assertEqual(subscription_feed.subscribed_creators('viewer@test.local'), [self.creator]) # Optimistic
+            self.assertEqual(written, [])
+            write_behind.flush()
+        self.assertEqual(written, [True])
+
+        db_cache.get_backend().clear()
+        self.assertEqual(subscription_feed.subscribed_creators('viewer@test.local'), [self.creator])
+        self.assertEqual([v['video_id'] for v in subscription_feed.get_page('viewer@test.local')[0]], [self.video_id]) # Backfilled
+
+
+class HyperLogLogTests(SimpleTestCase):
+    def test_estimate_and_merge(self):
+        first, second = HyperLogLog(), HyperLogLog()
+        for i in range(20000):
+            first.add(f"viewer{i}")
+        for i in range(10000, 30000):
+            second.add(f"viewer{i}")
+        self.assertAlmostEqual(len(first), 20000, delta=20000 * 0.05)
+        self.assertFalse(first.merge(HyperLogLog.from_bytes(first.to_bytes()))) # Same viewers: nothing new
+        self.assertTrue(first.merge(second))
+        self.assertAlmostEqual(len(first), 30000, delta=30000 * 0.05)
+
+    def test_small_counts_are_exact_enough(self):
+        sketch = HyperLogLog()
+        for viewer in ['a', 'b', 'c', 'a', 'b']:
+            sketch.add(viewer)
+        self.assertEqual(len(sketch), 3)
+
+
+class ViewCountTests(DynamoTestCase):
+    def test_views_are_buffered_then_flushed_once_per_video(self):
+        video = db_utils.get_video_by_id(self.create_video())
+        other = db_utils.get_video_by_id(self.create_video())
+        for viewer in ['a', 'b', 'a', 'c', 'a']:
+            view_counts.record_view(video, viewer)
+        view_counts.record_view(other, 'a')
+        self.assertNotIn('views', db_utils.get_user_video('creator@test.local', video['video_id']))
+
+        client = db_utils.get_table().meta.client
+        with mock.patch.object(client, 'transact_write_items', wraps=client.transact_write_items) as transact:
+            self.assertEqual(view_counts.flush(), 2)
+        self.assertEqual(transact.call_count, 2)
+        item = db_utils.get_user_video('creator@test.local', video['video_id'])
+        self.assertEqual((item['views'], item['unique_viewers']), (5, 3))
+        self.assertNotIn('viewers_hll', item) # On its own item, out of every index
+
+        # A second window adds to the total; known viewers don't grow the sketch
+        view_counts.record_view(video, 'b')
+        view_counts.record_view(video, 'd')
+        view_counts.flush()
+        item = db_utils.get_user_video('creator@test.local', video['video_id'])
+        self.assertEqual((item['views'], item['unique_viewers'], self.sketch(video)['hll_version']), (7, 4, 2))
+        view_counts.record_view(video, 'a')
+        with mock.patch.object(client, 'transact_write_items') as transact:
+            view_counts.flush()
+        transact.assert_not_called() # Nothing new for the sketch: just the views
+        item = db_utils.get_user_video('creator@test.local', video['video_id'])
+        self.assertEqual((item['views'], self.sketch(video)['hll_version']), (8, 2))
+
+    def sketch(self, video):
+        return self.table.get_item(Key=db_utils.view_sketch_key(video['PK'], video['video_id']))['Item']
+
+    def test_concurrent_flush_merges_instead_of_overwriting(self):
+        video = db_utils.get_video_by_id(self.create_video())
+        view_counts.record_view(video, 'a')
+        view_counts.flush()
+        stale = self.sketch(video)
+
+        # Another process flushes 'b' in between our read and our write
+        view_counts.record_view(video, 'b')
+        view_counts.flush()
+        self.assertEqual(view_counts._apply((video['PK'], video['SK']), 1, {'c'}, stale), 1)
+        item = db_utils.get_user_video('creator@test.local', video['video_id'])
+        self.assertEqual((item['views'], item['unique_viewers']), (3, 3))
+
+    def test_sketch_on_the_video_item_is_moved(self):
+        video = db_utils.get_video_by_id(self.create_video())
+        view_counts.record_view(video, 'a')
+        view_counts.record_view(video, 'b')
+        view_counts.flush()
+        legacy = self.sketch(video)
+        self.table.delete_item(Key=db_utils.view_sketch_key(video['PK'], video['video_id']))
+        self.table.update_item(Key={'PK': video['PK'], 'SK': video['SK']}, UpdateExpression="SET viewers_hll = :s, hll_version = :v",
+                               ExpressionAttributeValues={':s': legacy['viewers_hll'], ':v': 1})
+
+        view_counts.record_view(video, 'c')
+        view_counts.flush()
+        item = db_utils.get_user_video('creator@test.local', video['video_id'])
+        self.assertEqual((item['views'], item['unique_viewers']), (3, 3))
+        self.assertFalse({'viewers_hll', 'hll_version'} & set(item))
+        self.assertEqual(self.sketch(video)['hll_version'], 1)
+
+    def test_failed_flush_keeps_the_window(self):
+        video = db_utils.get_video_by_id(self.create_video())
+        view_counts.record_view(video, 'a')
+        with mock.patch.object(view_counts, '_apply', side_effect=RuntimeError("throttled")):
+            self.assertEqual(view_counts.flush(), 0)
+        self.assertEqual(view_counts.flush(), 1)
+        self.assertEqual(db_utils.get_user_video('creator@test.local', video['video_id'])['views'], 1)
+
+    def test_deleted_video_is_skipped(self):
+        video = db_utils.get_video_by_id(self.create_video())
+        view_counts.record_view(video, 'a')
+        db_utils.delete_video_entry('creator@test.local', video['video_id'])
+        self.assertEqual(view_counts.flush(), 0)
+        self.assertEqual(self.count_items(), 0)
+
+
+class SearchIndexTests(SimpleTestCase):
+    def setUp(self):
+        self.index = SearchIndex()
+        self.index.add({'video_id': 'cats', 'title': 'Funny cats compilation', 'channel_name': 'Pets',
+                        'description': 'Cats being cats', 'status': 'READY', 'created_at': 100})
+        self.index.add({'video_id': 'cloud', 'title': 'Cloud computing 101', 'channel_name': 'CloudStream',
+                        'description': 'Intro to the cloud', 'status': 'READY', 'created_at': 200})
+        self.index.add({'video_id': 'cafe', 'title': 'Café music', 'channel_name': 'Lo-fi Beats',
+                        'description': '', 'status': 'READY', 'created_at': 300})
+
+    def ids(self, query, **kwargs):
+        return [doc['video_id'] for doc in self.index.search(query, **kwargs)[0]]
+
+    def test_tokenize(self):
+        self.assertEqual(search_index.tokenize("Café Déjà-vu, 2024!"), ['cafe', 'deja', 'vu', '2024'])
+
+    def test_exact_prefix_and_fuzzy(self):
+        self.assertEqual(self.ids('cats'), ['cats'])
+        self.assertEqual(self.ids('CAFE'), ['cafe']) # Case and accents don't matter
+        self.assertEqual(self.ids('comp'), ['cloud', 'cats']) # computing, compilation
+        self.assertEqual(self.ids('clowd'), ['cloud']) # Typo
+
+    def test_every_word_has_to_match(self):
+        self.assertEqual(self.ids('cloud music'), [])
+        self.assertEqual(self.ids('cloud intro'), ['cloud'])
+
+    def test_ranking(self):
+        self.index.add({'video_id': 'dog-title', 'title': 'Dogs', 'status': 'READY', 'created_at': 1})
+        self.index.add({'video_id': 'dog-desc', 'title': 'Pets', 'description': 'dogs',
+                        'status': 'READY', 'created_at': 999})
+        self.index.add({'video_id': 'cat', 'title': 'Cat', 'status': 'READY', 'created_at': 1})
+        # Title beats description, an exact word beats a prefix
+        self.assertEqual(self.ids('dogs'), ['dog-title', 'dog-desc'])
+        self.assertEqual(self.ids('cat'), ['cat', 'cats'])
+
+    def test_paging_and_status(self):
+        for i in range(5):
+            self.index.add({'video_id': f"v{i}", 'title': 'Same title', 'status': 'READY', 'created_at': i})
+        docs, total = self.index.search('same', offset=2, limit=2)
+        self.assertEqual(total, 5)
+        self.assertEqual([doc['video_id'] for doc in docs], ['v2', 'v1']) # Ties: newest first
+
+        self.index.set_status('v4', 'FAILED')
+        self.assertEqual(self.index.search('same')[1], 4)
+
+    def test_reindex_and_remove(self):
+        self.index.add({'video_id': 'cats', 'title': 'Dogs only', 'status': 'READY', 'created_at': 100})
+        self.assertEqual(self.ids('funny'), [])
+        self.assertEqual(self.ids('dogs'), ['cats'])
+
+        self.index.remove('cats')
+        self.assertEqual(self.ids('dogs'), [])
+        self.assertNotIn('dogs', self.index.vocabulary)
+        self.assertNotIn('dogs', self.index.postings)
+
+    def test_snapshot_round_trip(self):
+        self.index.watermark = 1234
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'index.json')
+            self.index.save(path)
+            loaded = SearchIndex.load(path)
+            self.assertIsNone(SearchIndex.load(os.path.join(tmp, 'missing.json')))
+        self.assertEqual(loaded.watermark, 1234)
+        self.assertEqual(loaded.docs, self.index.docs)
+        self.assertEqual(loaded.postings, self.index.postings)
+        self.assertEqual(self.ids('clowd'), ['cloud'])
+
+
+class SearchLoadingTests(DynamoTestCase):
+    def test_build_only_indexes_ready_videos(self):
+        ready = self.create_video()
+        self.create_video(status='PROCESSING')
+        index = search_index.build(segments=3)
+        self.assertEqual(list(index.docs), [ready])
+        self.assertEqual(index.docs[ready]['title'], 'A video')
+
+    def test_snapshot_then_catch_up(self):
+        old = self.create_video(created_at=1000)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'index.json')
+            search_index.build().save(path)
+            new = self.create_video() # Went READY in another process after the snapshot
+            with override_settings(SEARCH=dict(settings.SEARCH, SNAPSHOT_PATH=path)):
+                docs, total = search_index.search('video')
+        self.assertEqual({doc['video_id'] for doc in docs}, {old, new})
+
+    def test_hooks_keep_a_loaded_index_current(self):
+        index = search_index.get_index()
+        video_id = db_utils.create_video_entry('a@test.local', 'Fresh upload', 'raw/b.mp4', None, 'Chan')
+        self.assertEqual(index.docs[video_id]['status'], 'PROCESSING')
+        self.assertEqual(index.search('fresh')[1], 0) # Not READY yet
+
+        video = db_utils.claim_transcode_job(db_utils.get_user_video('a@test.local', video_id), 'w1', 60)
+        db_utils.finish_transcode_job(video, 'w1', {'processed_bucket': 'b', 'processed_s3_key': 'k'})
+        self.assertEqual(index.search('fresh')[1], 1)
+
+        db_utils.delete_video_entry('a@test.local', video_id)
+        self.assertNotIn(video_id, index.docs)
+
+
+class SparseSimilarityTests(SimpleTestCase):
+    def test_cosine_pairs_match_dense_math(self):
+        rng = np.random.default_rng(7)
+        dense = rng.random((6, 5)) * (rng.random((6, 5)) < 0.5)
+        rows, cols = np.nonzero(dense)
+        i, j, similarity = related.cosine_pairs(rows, cols, dense[rows, cols], 5, max_row_items=10)
+
+        norms = np.linalg.norm(dense, axis=0)
+        expected = dense.T @ dense / np.outer(norms, norms)
+        for a, b, value in zip(i, j, similarity):
+            self.assertAlmostEqual(value, expected[a, b])
+        pairs = {(a, b) for a, b in zip(i.tolist(), j.tolist())}
+        self.assertEqual(pairs, {(a, b) for a in range(5) for b in range(5) if a != b and expected[a, b] > 0})
+
+    def test_big_rows_are_skipped(self):
+        # Row 0 is on every column; only row 1's pair is left
+        i, j, _ = related.cosine_pairs([0, 0, 0, 1, 1], [0, 1, 2, 1, 2], np.ones(5), 3, max_row_items=2)
+        self.assertEqual(sorted(zip(i.tolist(), j.tolist())), [(1, 2), (2, 1)])
+
+    def test_top_k(self):
+        i, j, scores = np.array([0, 0, 0, 1]), np.array([1, 2, 3, 0]), np.array([0.5, 0.9, 0.5, 0.1])
+        i, j, scores = related.top_k(i, j, scores, 2, tiebreak=np.array([0, 0, 0, 5]))
+        self.assertEqual(list(zip(i.tolist(), j.tolist())), [(0, 2), (0, 3), (1, 0)])
+
+
+class RelatedVideosTests(DynamoTestCase):
+    def like(self, user, video_id):
+        self.table.put_item(Item={'PK': f"USER#{user}", 'SK': f"REACTION#{video_id}", 'type': 'LIKE'})
+
+    def related_ids(self, video_id, creator='creator@test.local'):
+        item = self.table.get_item(Key=db_utils.related_videos_key(f"USER#{creator}", video_id)).get('Item')
+        return [video['video_id'] for video in item['videos']] if item else None
+
+    def test_refresh(self):
+        guitar = self.create_video(title='Guitar lesson one', created_at=1)
+        chords = self.create_video(title='Guitar chords', created_at=2)
+        cooking = self.create_video(title='Cooking pasta', created_at=3)
+        other = self.create_video('other@test.local', title='Pasta sauce', created_at=4)
+        self.create_video(title='Guitar solo', status='PROCESSING')
+        for user in ('a', 'b'):
+            self.like(user, guitar)
+            self.like(user, cooking)
+
+        with override_settings(RELATED=dict(settings.RELATED, TOP_K=2)):
+            stats = related.refresh(segments=2)
+            self.assertEqual((stats['videos'], stats['written']), (4, 4))
+            # Likes first, then same creator / shared title words, newest first on ties
+            self.assertEqual(self.related_ids(guitar), [cooking, chords])
+            self.assertEqual(self.related_ids(other, 'other@test.local'), [cooking])
+
+            self.assertEqual(related.refresh()['unchanged'], 4) # Nothing changed: nothing written
+
+            db_utils.delete_video_entry('creator@test.local', cooking)
+            stats = related.refresh()
+            self.assertIsNone(self.related_ids(cooking))
+            self.assertEqual(self.related_ids(guitar), [chords])
+            self.assertEqual(stats['deleted'], 1) # The only one related to "Pasta sauce" is gone
+
+    def test_subscribers_link_creators(self):
+        a = self.create_video('a@test.local', title='One')
+        b = self.create_video('b@test.local', title='Two')
+        self.create_video('c@test.local', title='Three')
+        for user in ('x', 'y'):
+            for creator in ('a', 'b'):
+                self.table.put_item(Item={'PK': f"USER#{user}@test.local", 'SK': f"SUB#{creator}@test.local"})
+        related.refresh()
+        self.assertEqual(self.related_ids(a, 'a@test.local'), [b])
+
+
+@override_settings(FEED_PAGE_SIZE=3)
+class SubscriptionFeedTests(DynamoTestCase):
+    viewer = 'viewer@test.local'
+
+    def setUp(self):
+        super().setUp()
+        db_utils.create_user(self.viewer, 'pw', 'Viewer')
+        self.videos = {}
+        for creator, times in (('a', [10, 40, 70]), ('b', [20, 50]), ('c', [30, 60])):
+            db_utils.create_user(f"{creator}@test.local", 'pw', creator)
+            self.videos[creator] = [self.create_video(f"{creator}@test.local", created_at=t) for t in times]
+        db_utils.toggle_subscription(self.viewer, 'a@test.local')
+        db_utils.toggle_subscription(self.viewer, 'b@test.local')
+        # Newest first, c not subscribed to
+        self.expected = [self.videos['a'][2], self.videos['b'][1], self.videos['a'][1],
+                         self.videos['b'][0], self.videos['a'][0]]
+
+    def read_all(self):
+        ids, cursor = [], None
+        while True:
+            videos, cursor = subscription_feed.get_page(self.viewer, cursor)
+            ids.extend(video['video_id'] for video in videos)
+            if cursor is None:
+                return ids
+
+    def count_calls(self):
+        from botocore.client import BaseClient
+        patcher = mock.patch.object(BaseClient, '_make_api_call', autospec=True, side_effect=BaseClient._make_api_call)
+        calls = patcher.start()
+        self.addCleanup(patcher.stop)
+        return lambda: sorted(call.args[1] for call in calls.call_args_list)
+
+    def test_pull_merges_creator_streams(self):
+        calls = self.count_calls()
+        videos, cursor = subscription_feed.get_page(self.viewer)
+        self.assertEqual([v['video_id'] for v in videos], self.expected[:3])
+        self.assertEqual(calls(), ['Query'] * 3) # The subscription list + one per creator
+        self.assertEqual(self.read_all(), self.expected)
+
+        db_utils.toggle_subscription(self.viewer, 'a@test.local')
+        self.assertEqual(self.read_all(), self.videos['b'][::-1])
+
+    def test_bad_cursor(self):
+        with self.assertRaises(ValueError):
+            subscription_feed.get_page(self.viewer, 'forged')
+
+    def test_inbox_mode(self):
+        subscription_feed.enable_inbox(self.viewer)
+        self.assertTrue(subscription_feed.inbox_enabled(self.viewer))
+        calls = self.count_calls()
+        self.assertEqual([v['video_id'] for v in subscription_feed.get_page(self.viewer)[0]], self.expected[:3])
+        self.assertEqual(calls(), ['BatchGetItem', 'Query']) # However many creators
+        self.assertEqual(self.read_all(), self.expected)
+
+        # New uploads fan out to the inbox; subscribing backfills; unsubscribing clears
+        fresh = db_utils.create_video_entry('b@test.local', 'New', 'raw/n.mp4', None, 'b', status='READY')
+        self.assertEqual(self.read_all()[0], fresh)
+        db_utils.toggle_subscription(self.viewer, 'c@test.local')
+        db_utils.toggle_subscription(self.viewer, 'a@test.local')
+        self.assertEqual(self.read_all(), [fresh, self.videos['c'][1], self.videos['b'][1],
+                                           self.videos['c'][0], self.videos['b'][0]])
+
+        # Deleted videos drop out
+        db_utils.delete_video_entry('b@test.local', fresh)
+        self.assertNotIn(fresh, self.read_all())
+
+        subscription_feed.disable_inbox(self.viewer)
+        self.assertFalse(subscription_feed.inbox_enabled(self.viewer))
+        self.assertEqual(self.read_all()[0], self.videos['c'][1])
+        self.assertFalse(self.table.query(
+            KeyConditionExpression=Key('PK').eq('USER#c@test.local') & Key('SK').begins_with('FOLLOWER#'))['Items'])
+
+    def test_inbox_entries_stay_out_of_the_video_id_index(self):
+        followers = [f"follower{i}@test.local" for i in range(50)]
+        with self.table.batch_writer() as batch:
+            for follower in followers:
+                batch.put_item(Item={'PK': 'USER#b@test.local', 'SK': f"FOLLOWER#{follower}"})
+        fresh = db_utils.create_video_entry('b@test.local', 'New', 'raw/n.mp4', None, 'b', status='READY')
+        self.assertEqual(len(self.table.query(
+            KeyConditionExpression=Key('PK').eq(f"USER#{followers[-1]}") & Key('SK').begins_with('INBOX#'))['Items']), 1)
+
+        index = self.table.query(IndexName=settings.DYNAMO_VIDEO_ID_INDEX, KeyConditionExpression=Key('video_id').eq(fresh))
+        self.assertEqual([item['SK'] for item in index['Items']], [f"VIDEO#{fresh}"])
+        self.assertEqual(db_utils.get_video_by_id(fresh)['title'], 'New')
+
+    @override_settings(SUBSCRIPTION_FEED=dict(settings.SUBSCRIPTION_FEED, INBOX_THRESHOLD=2))
+    def test_many_subscriptions_switch_to_inbox(self):
+        self.assertEqual([v['video_id'] for v in subscription_feed.get_page(self.viewer)[0]], self.expected[:3])
+        subscription_feed.switch_to_inbox(self.viewer).result()
+        self.assertTrue(subscription_feed.inbox_enabled(self.viewer))
+        self.assertEqual(self.read_all(), self.expected)
+
+
+class ItemLoaderTests(DynamoTestCase):
+    def setUp(self):
+        super().setUp()
+        for i in range(3):
+            self.table.put_item(Item={'PK': f"USER#u{i}", 'SK': 'PROFILE', 'subscribers': i})
+
+    def test_duplicate_keys_share_one_batch(self):
+        loader = ItemLoader()
+        first = loader.load({'PK': 'USER#u1', 'SK': 'PROFILE'})
+        again = loader.load({'PK': 'USER#u1', 'SK': 'PROFILE'}, transform=lambda item: item['subscribers'])
+        other = loader.load({'PK': 'USER#u2', 'SK': 'PROFILE'})
+        missing = loader.load({'PK': 'USER#nobody', 'SK': 'PROFILE'})
+
+        with mock.patch.object(loader, '_batch_get', wraps=loader._batch_get) as batch_get:
+            self.assertEqual(first.get()['subscribers'], 1)
+            self.assertEqual(again.get(), 1)
+            self.assertEqual(other.get()['subscribers'], 2)
+            self.assertIsNone(missing.get())
+        self.assertEqual(batch_get.call_count, 1)
+        self.assertEqual(len(batch_get.call_args.args[0]), 3) # u1 only once
+        self.assertEqual(loader.round_trips, 1)
+
+    def test_splits_at_the_batch_size(self):
+        loader = ItemLoader()
+        pending = [loader.load({'PK': f"USER#u{i % 3}", 'SK': f"X#{i}"}) for i in range(BATCH_SIZE + 1)]
+        loader.dispatch()
+        self.assertEqual(loader.round_trips, 2)
+        self.assertTrue(all(p.get() is None for p in pending))
+
+    def test_cache_hits_skip_dynamodb_and_load_does_no_io(self):
+        db_cache.store('profile', 'u0', {'cached': True})
+        loader = ItemLoader()
+        with mock.patch('UserLogin.batch_loader.get_backend', side_effect=AssertionError("I/O in load()")):
+            cached = db_utils.load_public_profile(loader, 'u0')
+            fetched = db_utils.load_public_profile(loader, 'u1')
+        loader.dispatch()
+
+        self.assertEqual(cached.get(), {'cached': True})
+        self.assertEqual(fetched.get()['subscribers'], 1)
+        self.assertEqual(loader.round_trips, 1)
+
+        # Fetched values were written back: a second request costs no round-trip
+        loader = ItemLoader()
+        self.assertEqual(db_utils.load_public_profile(loader, 'u1').get()['subscribers'], 1)
+        self.assertEqual(loader.round_trips, 0)
+
+    def test_unprocessed_keys_are_retried(self):
+        real = aws_clients.get_resource('dynamodb')
+        table_name = settings.DYNAMO_TABLE
+        calls = []
+
+        def batch_get_item(RequestItems):
+            calls.append(RequestItems)
+            keys = RequestItems[table_name]['Keys']
+            # Throttle: only the first key of each request gets processed
+            response = real.batch_get_item(RequestItems={table_name: dict(RequestItems[table_name], Keys=keys[:1])})
+            if len(keys) > 1:
+                response['UnprocessedKeys'] = {table_name: dict(RequestItems[table_name], Keys=keys[1:])}
+            return response
+
+        loader = ItemLoader()
+        pending = [loader.load({'PK': f"USER#u{i}", 'SK': 'PROFILE'}) for i in range(3)]
+        fake = mock.Mock(batch_get_item=batch_get_item)
+        with mock.patch.object(aws_clients, 'get_resource', return_value=fake), \
+                mock.patch('UserLogin.batch_loader.time.sleep') as sleep:
+            loader.dispatch()
+
+        self.assertEqual([p.get()['subscribers'] for p in pending], [0, 1, 2])
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(sleep.call_count, 2)
+
+    def test_gives_up_after_max_retries(self):
+        def batch_get_item(RequestItems):
+            return {'Responses': {}, 'UnprocessedKeys': RequestItems}
+
+        loader = ItemLoader()
+        pending = loader.load({'PK': 'USER#u0', 'SK': 'PROFILE'})
+        fake = mock.Mock(batch_get_item=batch_get_item)
+        with mock.patch.object(aws_clients, 'get_resource', return_value=fake), \
+                mock.patch('UserLogin.batch_loader.time.sleep'):
+            with self.assertRaises(RuntimeError):
+                pending.get()
+        self.assertEqual(loader.round_trips, MAX_RETRIES + 1)
+
+
+class TranscodeJobTests(DynamoTestCase):
+    creator = 'creator@test.local'
+
+    def job(self, video_id):
+        return db_utils.get_user_video(self.creator, video_id)
+
+    def test_only_one_worker_gets_a_job(self):
+        video_id = self.create_video(self.creator, status='PROCESSING')
+        job = db_utils.find_transcode_jobs()[0]
+        self.assertIsNotNone(db_utils.claim_transcode_job(job, 'a', 300))
+        self.assertIsNone(db_utils.claim_transcode_job(job, 'b', 300))
+        self.assertEqual(db_utils.find_transcode_jobs(), []) # Leased jobs aren't offered
+        self.assertEqual(self.job(video_id)['lease_owner'], 'a')
+
+    def test_expired_lease_is_reclaimed(self):
+        # The worker holding it died: nobody heartbeats, the lease runs out
+        video_id = self.create_video(self.creator, status='PROCESSING')
+        job = db_utils.claim_transcode_job(db_utils.find_transcode_jobs()[0], 'dead', -1)
+        self.assertFalse(db_utils.heartbeat_transcode_job(job, 'alive', 300))
+
+        claimed = db_utils.claim_transcode_job(db_utils.find_transcode_jobs()[0], 'alive', 300)
+        self.assertEqual(claimed['attempts'], 2)
+        self.assertFalse(db_utils.finish_transcode_job(job, 'dead', {'processed_s3_key': 'x'}))
+        self.assertTrue(db_utils.finish_transcode_job(claimed, 'alive', {
+            'processed_bucket': 'b', 'processed_s3_key': 'processed/x/video.mp4',
+        }))
+        video = self.job(video_id)
+        self.assertEqual(video['status'], 'READY')
+        self.assertNotIn('lease_owner', video)
+
+    def test_priority_then_oldest_first(self):
+        old = self.create_video(self.creator, status='PROCESSING', created_at=100)
+        new = self.create_video(self.creator, status='PROCESSING', created_at=200)
+        urgent = self.create_video(self.creator, status='PROCESSING', created_at=300, priority=10)
+        self.create_video(self.creator, status='READY', created_at=50)
+        self.assertEqual([job['video_id'] for job in db_utils.find_transcode_jobs()], [urgent, old, new])
+
+    def test_failures_back_off_then_give_up(self):
+        video_id = self.create_video(self.creator, status='PROCESSING')
+        job = db_utils.claim_transcode_job(db_utils.find_transcode_jobs()[0], 'w', 300)
+        self.assertTrue(db_utils.fail_transcode_job(job, 'w', 'boom', max_attempts=2))
+        video = self.job(video_id)
+        self.assertEqual(video['status'], 'PROCESSING')
+        self.assertEqual(video['last_error'], 'boom')
+        self.assertEqual(db_utils.find_transcode_jobs(), []) # Backing off
+
+        self.table.update_item( # Fast-forward past the backoff
+            Key={'PK': video['PK'], 'SK': video['SK']},
+            UpdateExpression="SET lease_expires = :past", ExpressionAttributeValues={':past': 0},
+        )
+        job = db_utils.claim_transcode_job(db_utils.find_transcode_jobs()[0], 'w', 300)
+        self.assertTrue(db_utils.fail_transcode_job(job, 'w', 'boom again', max_attempts=2))
+        self.assertEqual(self.job(video_id)['status'], 'FAILED')
+
+
+class HLSPlaylistTests(SimpleTestCase):
+    def test_ladder_never_upscales(self):
+        self.assertEqual([r['name'] for r in hls.ladder_for(720)], ['720p', '480p', '360p'])
+        self.assertEqual([r['name'] for r in hls.ladder_for(240)], ['360p'])
+        self.assertEqual(len(hls.ladder_for(None)), len(hls.RENDITIONS))
+
+    def test_master_playlist(self):
+        playlist = hls.master_playlist(hls.ladder_for(480), aspect_ratio=16 / 9)
+        lines = playlist.splitlines()
+        self.assertEqual(lines[0], '#EXTM3U')
+        self.assertIn('RESOLUTION=854x480', lines[3])
+        self.assertIn('AVERAGE-BANDWIDTH=1496000', lines[3])
+        self.assertEqual(lines[4], 'hls/480p/index.m3u8')
+        self.assertEqual(lines[6], 'hls/360p/index.m3u8')
+
+    def test_relative_uris_become_absolute(self):
+        playlist = "#EXTM3U\n#EXT-X-STREAM-INF:BANDWIDTH=1\nhls/360p/index.m3u8\n"
+        self.assertEqual(
+            hls._absolute_uris(playlist, 'bucket', 'processed/v1/master.m3u8').splitlines()[2],
+            'https://bucket.s3.amazonaws.com/processed/v1/hls/360p/index.m3u8'
+        )
+
+
+@override_settings(THUMBNAILS={'ENABLED': True, 'WIDTHS': [640, 160, 320]}, AWS_PROCESSED_BUCKET_PUBLIC=True)
+class ThumbnailTests(SimpleTestCase):
+    def test_widths_never_upscale(self):
+        self.assertEqual(thumbnails.widths_for(500), [160, 320])
+        self.assertEqual(thumbnails.widths_for(100), [160])
+        self.assertEqual(thumbnails.widths_for(None), [160, 320, 640])
+
+    def test_variants_from_backend_files(self):
+        files = {'video.mp4': 'video/mp4', 'thumbs/320.jpg': 'image/jpeg', 'thumbs/160.webp': 'image/webp',
+                 'thumbs/160.jpg': 'image/jpeg', 'poster.jpg': 'image/jpeg'}
+        self.assertEqual(thumbnails.variants_from(files, 'processed/v1/'), [
+            {'width': 160, 'format': 'webp', 'key': 'processed/v1/thumbs/160.webp'},
+            {'width': 160, 'format': 'jpeg', 'key': 'processed/v1/thumbs/160.jpg'},
+            {'width': 320, 'format': 'jpeg', 'key': 'processed/v1/thumbs/320.jpg'},
+        ])
+
+    def test_srcsets_and_fallback(self):
+        video = {
+            'processed_bucket': 'bucket', 'thumbnail_key': 'thumbnails/v1.jpg',
+            'thumbnail_variants': thumbnails.variants_from(
+                ['thumbs/160.webp', 'thumbs/320.webp', 'thumbs/160.jpg', 'thumbs/320.jpg'], 'p/'
+            ),
+        }
+        self.assertEqual(thumbnails.srcsets(video), {
+            'webp': 'https://bucket.s3.amazonaws.com/p/thumbs/160.webp 160w, https://bucket.s3.amazonaws.com/p/thumbs/320.webp 320w',
+            'jpeg': 'https://bucket.s3.amazonaws.com/p/thumbs/160.jpg 160w, https://bucket.s3.amazonaws.com/p/thumbs/320.jpg 320w',
+        })
+        # No JPEG is FALLBACK_WIDTH wide: the widest one
+        self.assertEqual(thumbnails.fallback_url(video), 'https://bucket.s3.amazonaws.com/p/thumbs/320.jpg')
+        legacy = {'thumbnail_key': 'thumbnails/v1.jpg'}
+        self.assertEqual(thumbnails.srcsets(legacy), {})
+        self.assertEqual(thumbnails.fallback_url(legacy), f"https://{settings.AWS_PROCESSED_BUCKET}.s3.amazonaws.com/thumbnails/v1.jpg")
+
+
+class CredentialRotationTests(SimpleTestCase):
+    def setUp(self):
+        workdir = tempfile.TemporaryDirectory()
+        self.addCleanup(workdir.cleanup)
+        patcher = override_settings(
+            BASE_DIR=workdir.name, AWS_CREDENTIALS_CHECK_INTERVAL=0,
+            AWS_ACCESS_KEY_ID='old-key', AWS_SECRET_ACCESS_KEY='old-secret', AWS_SESSION_TOKEN='old-token',
+            AWS_DYNAMODB_ENDPOINT_URL=None, AWS_S3_ENDPOINT_URL=None,
+        )
+        patcher.enable()
+        self.addCleanup(patcher.disable) # Also undoes what reload_credentials() writes to settings
+        state = mock.patch.dict(aws_clients._state, env_mtime=None, checked_at=0.0)
+        state.start()
+        self.addCleanup(state.stop)
+        aws_clients.reset_clients()
+        self.addCleanup(aws_clients.reset_clients)
+        self.path = os.path.join(workdir.name, 'cred.env')
+        self.write('old-key', 'old-secret', 'old-token', mtime=1_000_000)
+
+    def write(self, key, secret, token=None, mtime=None):
+        with open(self.path, 'w') as f:
+            f.write(f"aws_access_key_id={key}\naws_secret_access_key={secret}\n")
+            if token:
+                f.write(f"aws_session_token={token}\n")
+        if mtime is not None:
+            os.utime(self.path, (mtime, mtime))
+
+    def test_rotated_keys_rebuild_clients_and_resources(self):
+        client = aws_clients.get_client('dynamodb') # Remembers cred.env's mtime
+        table = aws_clients.get_table('videos')
+        resource = aws_clients.get_resource('s3')
+        other_thread = ThreadPoolExecutor(max_workers=1)
+        self.addCleanup(other_thread.shutdown)
+        elsewhere = other_thread.submit(aws_clients.get_resource, 'dynamodb').result()
+        generation = aws_clients.generation()
+
+        # Same mtime: not even read, though the keys in it changed
+        self.write('new-key', 'new-secret', mtime=1_000_000)
+        self.assertIs(aws_clients.get_client('dynamodb'), client)
+        self.assertIs(aws_clients.get_table('videos'), table)
+        self.assertEqual(aws_clients.generation(), generation)
+
+        # Touched, but the same keys: read, nothing rebuilt
+        self.write('old-key', 'old-secret', 'old-token', mtime=1_000_010)
+        self.assertIs(aws_clients.get_client('dynamodb'), client)
+        self.assertEqual(aws_clients.generation(), generation)
+
+        # Rotated (from temporary to long-lived keys: the token goes)
+        self.write('new-key', 'new-secret', mtime=1_000_020)
+        rotated = aws_clients.get_client('dynamodb')
+        self.assertIsNot(rotated, client)
+        self.assertEqual(aws_clients.generation(), generation + 1)
+        self.assertEqual(
+            (settings.AWS_ACCESS_KEY_ID, settings.AWS_SECRET_ACCESS_KEY, settings.AWS_SESSION_TOKEN),
+            ('new-key', 'new-secret', None),
+        )
+        credentials = rotated._request_signer._credentials
+        self.assertEqual((credentials.access_key, credentials.token), ('new-key', None))
+        self.assertIsNot(aws_clients.get_table('videos'), table)
+        self.assertIsNot(aws_clients.get_resource('s3'), resource)
+        self.assertEqual(aws_clients.get_table('videos').meta.client._request_signer._credentials.access_key, 'new-key')
+        # Other threads' resources too
+        rebuilt = other_thread.submit(aws_clients.get_resource, 'dynamodb').result()
+        self.assertIsNot(rebuilt, elsewhere)
+        self.assertEqual(rebuilt.meta.client._request_signer._credentials.access_key, 'new-key')
+        self.assertIs(aws_clients.get_client('dynamodb'), rotated)
+
+    def test_file_without_static_keys_is_ignored(self):
+        aws_clients.get_client('s3')
+        with open(self.path, 'w') as f:
+            f.write("aws_region=eu-west-1\n")
+        self.assertFalse(aws_clients.reload_credentials())
+        self.assertEqual(settings.AWS_ACCESS_KEY_ID, 'old-key')
+
+
+@override_settings(
+    AWS_ACCESS_KEY_ID='testing', AWS_SECRET_ACCESS_KEY='testing', AWS_SESSION_TOKEN=None, AWS_S3_ENDPOINT_URL=None,
+    PRESIGN={'WINDOW_SECONDS': 3600, 'MIN_REMAINING_SECONDS': 900, 'MAX_ENTRIES': 100},
+)
+class PresignTests(SimpleTestCase):
+    def setUp(self):
+        self.now = 1_700_000_000.0 # Inside a window starting at 1_699_999_200
+        self.clock = mock.patch('UserLogin.presign.time.time', lambda: self.now)
+        self.clock.start()
+        self.addCleanup(self.clock.stop)
+        aws_clients.reset_clients()
+        presign._cache = None
+        self.addCleanup(setattr, presign, '_cache', None)
+
+    def sign(self, *args):
+        with mock.patch('botocore.auth.datetime') as fake_datetime:
+            # Sign "at" the patched clock, like a real request at that moment would
+            fake_datetime.datetime.utcnow.return_value = datetime.datetime.utcfromtimestamp(self.now)
+            fake_datetime.datetime.now.return_value = datetime.datetime.fromtimestamp(self.now, datetime.timezone.utc)
+            return presign.presigned_url(*args)
+
+    def expires_at(self, url):
+        query = parse_qs(urlparse(url).query)
+        if 'Expires' in query: # SigV2: absolute expiry
+            return int(query['Expires'][0])
+        signed_at = datetime.datetime.strptime(query['X-Amz-Date'][0], '%Y%m%dT%H%M%SZ').replace(tzinfo=datetime.timezone.utc)
+        return signed_at.timestamp() + int(query['X-Amz-Expires'][0])
+
+    def test_same_url_all_window_long(self):
+        first = self.sign('bucket', 'thumbnails/a.jpg')
+        with mock.patch.object(aws_clients, 'get_client', side_effect=AssertionError("signed again")):
+            self.now += 1000
+            self.assertEqual(presign.presigned_url('bucket', 'thumbnails/a.jpg'), first)
+        self.assertNotEqual(self.sign('bucket', 'thumbnails/b.jpg'), first)
+
+    def test_guaranteed_remaining_lifetime(self):
+        window_end = 1_699_999_200 + 3600
+        for offset in (0, 1800, 3599):
+            self.now = 1_699_999_200 + offset
+            presign._cache = None
+            url = self.sign('bucket', 'k')
+            # Same expiry whenever in the window it was signed, so at least 900s left on hand-out
+            self.assertEqual(self.expires_at(url), window_end + 900)
+            self.assertGreaterEqual(self.expires_at(url) - self.now, 900)
+
+    def test_next_window_signs_a_fresh_url(self):
+        first = self.sign('bucket', 'k')
+        self.now += 3600
+        self.assertNotEqual(self.sign('bucket', 'k'), first)
+
+    def test_put_urls_are_keyed_by_content_type(self):
+        jpeg = self.sign('bucket', 'k', 'put_object', 'image/jpeg')
+        webp = self.sign('bucket', 'k', 'put_object', 'image/webp')
+        self.assertNotEqual(jpeg, webp)
+        self.assertNotEqual(jpeg, self.sign('bucket', 'k'))
+
+    def test_rotated_credentials_start_over(self):
+        first = self.sign('bucket', 'k')
+        aws_clients.reset_clients()
+        with mock.patch.object(aws_clients, 'get_client', wraps=aws_clients.get_client) as get_client:
+            self.sign('bucket', 'k')
+        self.assertEqual(get_client.call_count, 1)
+
+    @override_settings(AWS_PROCESSED_BUCKET_PUBLIC=True)
+    def test_public_bucket_is_not_signed(self):
+        self.assertEqual(presign.media_url('bucket', 'thumbnails/a b.jpg'), 'https://bucket.s3.amazonaws.com/thumbnails/a%20b.jpg')
+        self.assertEqual(presign.media_url('bucket', None), '')
+
+    @override_settings(AWS_PROCESSED_BUCKET_PUBLIC=False)
+    def test_private_bucket_is_signed(self):
+        self.assertIn('Signature=', presign.media_url('bucket', 'thumbnails/a.jpg'))
+
+
+class PasswordTests(DynamoTestCase):
+    email = 'user@test.local'
+
+    def setUp(self):
+        super().setUp()
+        db_utils.create_user(self.email, 'secret-pw', 'Channel')
+
+    def stored_hash(self):
+        return db_utils.get_user(self.email)['password']
+
+    def login(self, password):
+        return self.client.post(reverse('login'), {'email': self.email, 'password': password})
+
+    def test_login(self):
+        response = self.login('secret-pw')
+        self.assertRedirects(response, reverse('home'), fetch_redirect_response=False)
+        self.assertEqual(self.client.session['user_email'], self.email)
+        self.assertEqual(self.login('wrong').status_code, 200)
+
+    def test_login_upgrades_the_hash(self):
+        self.assertTrue(self.stored_hash().startswith('pbkdf2_sha256$1000$'))
+        with override_settings(PASSWORD_HASHING=dict(settings.PASSWORD_HASHING, PBKDF2_ITERATIONS=2000)):
+            self.login('wrong')
+            self.assertTrue(self.stored_hash().startswith('pbkdf2_sha256$1000$')) # Only a valid login upgrades
+            self.login('secret-pw')
+            self.assertTrue(self.stored_hash().startswith('pbkdf2_sha256$2000$'))
+            self.assertTrue(db_utils.verify_user(self.email, 'secret-pw'))
+
+    def test_overload_is_a_503(self):
+        with mock.patch.object(passwords, 'check', side_effect=passwords.Busy):
+            response = self.login('secret-pw')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertNotIn('user_email', self.client.session)
+
+    @override_settings(PASSWORD_HASHING=dict(settings.PASSWORD_HASHING, WORKERS=0, MAX_PENDING=1, QUEUE_WAIT_SECONDS=0))
+    def test_admission_control(self):
+        started, release = threading.Event(), threading.Event()
+
+        def slow_make(password):
+            started.set()
+            release.wait(5)
+            return 'hash'
+
+        with mock.patch.object(passwords, '_make', slow_make):
+            first = threading.Thread(target=passwords.make, args=['a'])
+            first.start()
+            started.wait(5)
+            with self.assertRaises(passwords.Busy):
+                passwords.make('b')
+            release.set()
+            first.join()
+        self.assertTrue(passwords.make('c').startswith('pbkdf2_sha256$')) # The slot is free again
+
+
+class PasswordPoolTests(SimpleTestCase):
+    @override_settings(PASSWORD_HASHING=dict(settings.PASSWORD_HASHING, WORKERS=1))
+    def test_hashes_on_the_process_pool(self):
+        self.addCleanup(passwords.shutdown)
+        encoded = passwords.make('secret-pw')
+        self.assertEqual(passwords.check('secret-pw', encoded), (True, None))
+        self.assertEqual(passwords.check('wrong', encoded), (False, None))
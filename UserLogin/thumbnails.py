@@ -0,0 +1,75 @@
+"""
+Responsive thumbnails.
+
+The upload page stores one full-size image per video at thumbnail_key (a
+canvas grab of the video, or the uploader's own picture). The transcoder turns
+it into smaller copies next to the video, in WebP and JPEG:
+
+    processed/<video_id>/thumbs/320.webp
+    processed/<video_id>/thumbs/320.jpg ...
+
+and records them on the item as thumbnail_variants:
+
+    [{'width': 320, 'format': 'webp', 'key': 'processed/<video_id>/thumbs/320.webp'}, ...]
+
+The {% thumbnail %} tag (Dashboard/templatetags/custom_filters.py) turns those
+into srcset/sizes, so a 300px card downloads a ~300px image instead of the
+full-resolution grab. Videos transcoded before this keep the single image.
+"""
+import posixpath
+
+from django.conf import settings
+
+from .presign import media_url
+
+# Browsers pick the first <source> they support, so the better format goes first
+FORMATS = {
+    'webp': {'extension': 'webp', 'content_type': 'image/webp'},
+    'jpeg': {'extension': 'jpg', 'content_type': 'image/jpeg'},
+}
+FALLBACK_FORMAT = 'jpeg' # What <img src> points at; every browser decodes it
+FALLBACK_WIDTH = 480
+
+
+def widths_for(source_width):
+    """Variant widths worth producing for a `source_width` pixels wide image (never empty, never upscaled)."""
+    widths = sorted(settings.THUMBNAILS['WIDTHS'])
+    if not source_width:
+        return widths
+    return [w for w in widths if w <= source_width] or widths[:1]
+
+
+def variant_path(width, image_format):
+    return f"thumbs/{width}.{FORMATS[image_format]['extension']}"
+
+
+def variants_from(files, prefix):
+    """thumbnail_variants for the thumbs/ entries of a backend's output files (see transcoding.py)."""
+    by_extension = {spec['extension']: name for name, spec in FORMATS.items()}
+    variants = []
+    for path in files:
+        directory, name = posixpath.split(path)
+        width, _, extension = name.partition('.')
+        if directory == 'thumbs' and width.isdigit() and extension in by_extension:
+            variants.append({'width': int(width), 'format': by_extension[extension], 'key': prefix + path})
+    return sorted(variants, key=lambda v: (list(FORMATS).index(v['format']), v['width']))
+
+
+def srcsets(video):
+    """{format: 'url 320w, url 640w, ...'} for a video's thumbnail variants ({} if it has none)."""
+    bucket = video.get('processed_bucket') or settings.AWS_PROCESSED_BUCKET
+    candidates = {}
+    for variant in video.get('thumbnail_variants') or []:
+        url = media_url(bucket, variant['key'])
+        candidates.setdefault(variant['format'], []).append(f"{url} {int(variant['width'])}w")
+    return {image_format: ', '.join(urls) for image_format, urls in candidates.items()}
+
+
+def fallback_url(video):
+    """The JPEG variant for <img src> (browsers without srcset): the first one at least FALLBACK_WIDTH wide."""
+    variants = [v for v in video.get('thumbnail_variants') or [] if v['format'] == FALLBACK_FORMAT]
+    if not variants:
+        return media_url(settings.AWS_PROCESSED_BUCKET, video.get('thumbnail_key'))
+    variants.sort(key=lambda v: int(v['width']))
+    chosen = next((v for v in variants if int(v['width']) >= FALLBACK_WIDTH), variants[-1])
+    return media_url(video.get('processed_bucket') or settings.AWS_PROCESSED_BUCKET, chosen['key'])
@@ -0,0 +1,280 @@
+"""
+Transcoding backends, plus the per-job work `manage.py transcode_worker` runs
+in its process pool.
+
+A backend turns one local source file into the files of a processed video,
+written into an output directory:
+
+    files = backend.transcode('/tmp/source.mov', '/tmp/out')
+    # -> {'video.mp4': 'video/mp4', 'master.m3u8': ..., 'hls/720p/seg_00000.ts': ...}
+    #    (path relative to out -> Content-Type)
+
+Besides the progressive MP4, backends package HLS renditions (see hls.py)
+unless settings.HLS['ENABLED'] is off, and cut the uploaded thumbnail into
+responsive variants (see thumbnails.py):
+
+    files = backend.thumbnails('/tmp/thumbnail', '/tmp/source.mov', '/tmp/out')
+    # -> {'thumbs/320.webp': 'image/webp', 'thumbs/320.jpg': 'image/jpeg', ...}
+
+process_job() wraps that with the S3 download/upload and returns the
+attributes the worker writes onto the video item when it flips it to READY.
+"""
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from . import aws_clients, hls, thumbnails
+
+MAIN_OUTPUT = 'video.mp4' # Progressive MP4, what processed_s3_key points at
+UPLOAD_THREADS = 8 # A long video has hundreds of HLS segments
+
+
+class TranscodeError(Exception):
+    pass
+
+
+class StubBackend:
+    """Copies the upload as-is. For tests and local runs without ffmpeg."""
+
+    def transcode(self, source, output_dir):
+        shutil.copyfile(source, os.path.join(output_dir, MAIN_OUTPUT))
+        files = {MAIN_OUTPUT: 'video/mp4'}
+        if settings.HLS['ENABLED']:
+            # One rendition with the upload as its single "segment"
+            rendition = hls.RENDITIONS[-1]
+            segment = f"hls/{rendition['name']}/seg_00000.ts"
+            os.makedirs(os.path.join(output_dir, os.path.dirname(segment)))
+            shutil.copyfile(source, os.path.join(output_dir, segment))
+            _write(output_dir, hls.rendition_playlist(rendition), (
+                "#EXTM3U\n#EXT-X-VERSION:3\n#EXT-X-PLAYLIST-TYPE:VOD\n#EXT-X-TARGETDURATION:6\n"
+                "#EXTINF:6.0,\nseg_00000.ts\n#EXT-X-ENDLIST\n"
+            ))
+            _write(output_dir, hls.MASTER_PLAYLIST, hls.master_playlist([rendition]))
+            files.update({
+                segment: hls.SEGMENT_TYPE,
+                hls.rendition_playlist(rendition): hls.PLAYLIST_TYPE,
+                hls.MASTER_PLAYLIST: hls.PLAYLIST_TYPE,
+            })
+        return files
+
+    def thumbnails(self, image, source, output_dir):
+        # Every variant is the uploaded image as-is; nothing to cut without one
+        if image is None:
+            return {}
+        os.makedirs(os.path.join(output_dir, 'thumbs'))
+        files = {}
+        for width in thumbnails.widths_for(None):
+            for image_format, spec in thumbnails.FORMATS.items():
+                path = thumbnails.variant_path(width, image_format)
+                shutil.copyfile(image, os.path.join(output_dir, path))
+                files[path] = spec['content_type']
+        return files
+
+
+class FFmpegBackend:
+    """H.264/AAC MP4 with the moov atom up front, so playback starts before the download ends."""
+
+    # Encoder arguments per thumbnails.FORMATS entry
+    THUMBNAIL_CODECS = {
+        'webp': ['-c:v', 'libwebp', '-quality', '75'],
+        'jpeg': ['-q:v', '4'],
+    }
+
+    def __init__(self, binary=None, preset='veryfast', crf=23, timeout=6 * 3600):
+        self.binary = binary or settings.TRANSCODE['FFMPEG_BINARY']
+        self.probe_binary = settings.TRANSCODE['FFPROBE_BINARY']
+        self.preset = preset
+        self.crf = crf
+        self.timeout = timeout
+
+    def _exec(self, command):
+        try:
+            result = subprocess.run(command, capture_output=True, text=True, timeout=self.timeout)
+        except FileNotFoundError:
+            raise TranscodeError(f"{command[0]} not found")
+        except subprocess.TimeoutExpired:
+            raise TranscodeError(f"{command[0]} timed out after {self.timeout}s")
+        if result.returncode != 0:
+            raise TranscodeError(result.stderr.strip()[-1000:] or f"{command[0]} exited with {result.returncode}")
+        return result.stdout
+
+    def run(self, args):
+        return self._exec([self.binary, '-hide_banner', '-loglevel', 'error', '-y', *args])
+
+    def probe(self, source):
+        # (width, height) of the first video stream; (None, None) if ffprobe can't tell
+        try:
+            output = self._exec([
+                self.probe_binary, '-v', 'error', '-select_streams', 'v:0',
+                '-show_entries', 'stream=width,height', '-of', 'json', source,
+            ])
+            stream = json.loads(output)['streams'][0]
+            return int(stream['width']), int(stream['height'])
+        except (TranscodeError, ValueError, KeyError, IndexError):
+            return None, None
+
+    def transcode(self, source, output_dir):
+        self.run([
+            '-i', source,
+            '-c:v', 'libx264', '-preset', self.preset, '-crf', str(self.crf), '-pix_fmt', 'yuv420p',
+            '-c:a', 'aac', '-b:a', '128k',
+            '-movflags', '+faststart',
+            os.path.join(output_dir, MAIN_OUTPUT),
+        ])
+        files = {MAIN_OUTPUT: 'video/mp4'}
+        if settings.HLS['ENABLED']:
+            files.update(self.package_hls(source, output_dir))
+        return files
+
+    def package_hls(self, source, output_dir):
+        width, height = self.probe(source)
+        renditions = hls.ladder_for(height)
+        seconds = settings.HLS['SEGMENT_SECONDS']
+
+        for rendition in renditions:
+            rendition_dir = os.path.join(output_dir, os.path.dirname(hls.rendition_playlist(rendition)))
+            os.makedirs(rendition_dir)
+            bitrate = rendition['video_bitrate']
+            self.run([
+                '-i', source,
+                '-map', '0:v:0', '-map', '0:a:0?',
+                '-vf', f"scale=-2:{rendition['height']}",
+                '-c:v', 'libx264', '-preset', self.preset, '-pix_fmt', 'yuv420p', '-profile:v', 'high',
+                '-b:v', f"{bitrate}k", '-maxrate', f"{int(bitrate * 1.07)}k", '-bufsize', f"{bitrate * 2}k",
+                # A keyframe at every segment boundary, so renditions can be switched between segments
+                '-force_key_frames', f"expr:gte(t,n_forced*{seconds})", '-sc_threshold', '0',
+                '-c:a', 'aac', '-b:a', f"{rendition['audio_bitrate']}k", '-ac', '2',
+                '-f', 'hls', '-hls_time', str(seconds), '-hls_playlist_type', 'vod',
+                '-hls_segment_filename', os.path.join(rendition_dir, 'seg_%05d.ts'),
+                os.path.join(rendition_dir, 'index.m3u8'),
+            ])
+
+        aspect_ratio = width / height if width and height else 16 / 9
+        _write(output_dir, hls.MASTER_PLAYLIST, hls.master_playlist(renditions, aspect_ratio))
+
+        files = {hls.MASTER_PLAYLIST: hls.PLAYLIST_TYPE}
+        for directory, _, names in os.walk(os.path.join(output_dir, 'hls')):
+            for name in names:
+                relative_path = os.path.relpath(os.path.join(directory, name), output_dir).replace(os.sep, '/')
+                files[relative_path] = hls.PLAYLIST_TYPE if name.endswith('.m3u8') else hls.SEGMENT_TYPE
+        return files
+
+    def thumbnails(self, image, source, output_dir):
+        if image is None:
+            # Nothing uploaded: grab a frame a second in (the first one is often black)
+            image = os.path.join(output_dir, 'poster.jpg')
+            self.run(['-ss', '1', '-i', source, '-frames:v', '1', '-q:v', '2', image])
+
+        width, _ = self.probe(image)
+        os.makedirs(os.path.join(output_dir, 'thumbs'))
+        # One ffmpeg run for every variant: the source image is decoded once
+        args = ['-i', image]
+        files = {}
+        for variant_width in thumbnails.widths_for(width):
+            for image_format, spec in thumbnails.FORMATS.items():
+                path = thumbnails.variant_path(variant_width, image_format)
+                args += [
+                    '-map', '0:v:0', '-vf', f"scale={variant_width}:-2", '-frames:v', '1',
+                    *self.THUMBNAIL_CODECS[image_format], os.path.join(output_dir, path),
+                ]
+                files[path] = spec['content_type']
+        self.run(args)
+        return files
+
+
+BACKENDS = {
+    'ffmpeg': FFmpegBackend,
+    'stub': StubBackend,
+}
+
+
+def get_backend(name=None):
+    name = name or settings.TRANSCODE['BACKEND']
+    backend_class = BACKENDS[name] if name in BACKENDS else import_string(name)
+    return backend_class()
+
+
+def output_prefix(video):
+    return f"{settings.TRANSCODE['OUTPUT_PREFIX']}{video['video_id']}/"
+
+
+def _write(output_dir, relative_path, text):
+    with open(os.path.join(output_dir, relative_path), 'w') as f:
+        f.write(text)
+
+
+def _thumbnails(backend, s3, video, source, workdir, output_dir):
+    # A thumbnail failure doesn't fail the job: cards fall back to the original image
+    image = None
+    if video.get('thumbnail_key'):
+        image = os.path.join(workdir, 'thumbnail')
+        try:
+            s3.download_file(settings.AWS_PROCESSED_BUCKET, video['thumbnail_key'], image)
+        except ClientError:
+            image = None # Never uploaded (the upload page couldn't grab a frame)
+    try:
+        return backend.thumbnails(image, source, output_dir)
+    except TranscodeError:
+        return {}
+
+
+def init_worker_process():
+    # Pool processes are forked from the worker: don't share its connection pools
+    aws_clients.reset_clients()
+
+
+def process_job(video, backend_name=None):
+    """
+    Download the raw upload, transcode it and upload every output next to each
+    other under output_prefix(video). Runs inside a pool process.
+    """
+    backend = get_backend(backend_name)
+    s3 = aws_clients.get_client('s3')
+    prefix = output_prefix(video)
+
+    with tempfile.TemporaryDirectory(prefix='transcode-') as workdir:
+        extension = os.path.splitext(video['raw_s3_key'])[1][:10]
+        source = os.path.join(workdir, 'source' + extension)
+        s3.download_file(settings.AWS_RAW_BUCKET, video['raw_s3_key'], source)
+
+        output_dir = os.path.join(workdir, 'out')
+        os.makedirs(output_dir)
+        files = backend.transcode(source, output_dir)
+        if MAIN_OUTPUT not in files:
+            raise TranscodeError(f"Backend produced no {MAIN_OUTPUT}")
+        if settings.THUMBNAILS['ENABLED']:
+            files.update(_thumbnails(backend, s3, video, source, workdir, output_dir))
+
+        def upload(relative_path):
+            s3.upload_file(
+                os.path.join(output_dir, relative_path),
+                settings.AWS_PROCESSED_BUCKET,
+                prefix + relative_path,
+                ExtraArgs={'ContentType': files[relative_path]}
+            )
+
+        # Playlists last: a master playlist never points at segments that aren't there yet
+        media = [path for path in files if not path.endswith('.m3u8')]
+        playlists = sorted((path for path in files if path.endswith('.m3u8')), key=lambda path: path == hls.MASTER_PLAYLIST)
+        with ThreadPoolExecutor(max_workers=UPLOAD_THREADS) as uploader:
+            list(uploader.map(upload, media))
+        for path in playlists:
+            upload(path)
+
+    processed = {
+        'processed_bucket': settings.AWS_PROCESSED_BUCKET,
+        'processed_s3_key': prefix + MAIN_OUTPUT,
+    }
+    if hls.MASTER_PLAYLIST in files:
+        processed['hls_master_key'] = prefix + hls.MASTER_PLAYLIST
+    variants = thumbnails.variants_from(files, prefix)
+    if variants:
+        processed['thumbnail_variants'] = variants
+    return processed
@@ -0,0 +1,204 @@
+"""
+View counting.
+
+watch_video calls record_view() on every hit. That only touches an in-process
+buffer: per video, the number of views and the set of viewers seen in the
+current window. A background thread flushes the buffer every
+VIEW_COUNTS['FLUSH_SECONDS'] (or sooner once MAX_PENDING_VIDEOS videos are
+waiting):
+
+    1. one BatchGetItem for the current HyperLogLog sketch of every video in the window
+    2. per video, one TransactWriteItems:
+           the sketch item: <stored sketch merged with the window's viewers>
+           the video:       ADD views :window_views  SET unique_viewers = <its estimate>
+
+So a video watched a thousand times in a window costs one write, not a
+thousand. The 4 KiB sketch lives on its own item next to the video
+(db_utils.view_sketch_key), not on the VIDEO# item: every index projects all
+of a video's attributes, so there it would be read by every feed page, video
+lookup and cached copy. Sketches merge by register-wise max, which DynamoDB
+can't do in an update expression: the sketch's put is conditioned on
+hll_version, and a flush that lost the race to another process re-reads and
+merges again. A window that adds no new viewer is just the views update.
+
+Views buffered in a process that dies before its next flush are lost (at
+most one window's worth); a failed flush puts its window back into the buffer.
+"""
+import atexit
+import hashlib
+import os
+import threading
+
+from boto3.dynamodb.types import Binary
+from django.conf import settings
+
+from . import db_utils
+from .batch_loader import ItemLoader
+from .hyperloglog import HyperLogLog
+
+FLUSH_RETRIES = 5
+
+_lock = threading.Lock()
+_pending = {} # (PK, SK) of the video -> [views, set of viewer ids]
+_wake = threading.Event()
+_flusher_pid = None
+
+
+def viewer_id(request):
+    """Who is watching, for unique-viewer counts: the account, else a hash of address + browser."""
+    if 'user_email' in request.session:
+        return request.session['user_email']
+    fingerprint = f"{request.META.get('REMOTE_ADDR', '')}|{request.META.get('HTTP_USER_AGENT', '')}"
+    return 'anon:' + hashlib.blake2b(fingerprint.encode('utf-8'), digest_size=12).hexdigest()
+
+
+def record_view(video, viewer):
+    """Count one view of `video` (an item with PK/SK) by `viewer`. No I/O."""
+    config = settings.VIEW_COUNTS
+    if not config['ENABLED']:
+        return
+    key = (video['PK'], video['SK'])
+    with _lock:
+        window = _pending.setdefault(key, [0, set()])
+        window[0] += 1
+        window[1].add(viewer)
+        full = len(_pending) >= config['MAX_PENDING_VIDEOS']
+    _ensure_flusher()
+    if full:
+        _wake.set()
+
+
+def _ensure_flusher():
+    # One flusher thread per process (started after a fork too)
+    global _flusher_pid
+    if not settings.VIEW_COUNTS['FLUSH_SECONDS'] or _flusher_pid == os.getpid():
+        return
+    with _lock:
+        if _flusher_pid == os.getpid():
+            return
+        _flusher_pid = os.getpid()
+    threading.Thread(target=_run_flusher, name='view-counts', daemon=True).start()
+
+
+def _run_flusher():
+    while True:
+        _wake.wait(settings.VIEW_COUNTS['FLUSH_SECONDS'])
+        _wake.clear()
+        try:
+            flush()
+        except Exception:
+            pass # The window went back into the buffer: next round
+
+
+def _put_back(key, views, viewers):
+    with _lock:
+        window = _pending.setdefault(key, [0, set()])
+        window[0] += views
+        window[1] |= viewers
+
+
+def flush():
+    """Write out the buffered views. Returns how many videos were updated."""
+    global _pending
+    with _lock:
+        batch, _pending = _pending, {}
+    if not batch:
+        return 0
+
+    loader = ItemLoader(consistent_read=True)
+    current = {key: loader.load(_sketch_key(key)) for key in batch}
+    try:
+        loader.dispatch()
+    except Exception:
+        for key, (views, viewers) in batch.items():
+            _put_back(key, views, viewers)
+        raise
+
+    updated = 0
+    for key, (views, viewers) in batch.items():
+        try:
+            updated += _apply(key, views, viewers, current[key].get())
+        except Exception:
+            _put_back(key, views, viewers)
+    return updated
+
+
+def _sketch_key(key):
+    return db_utils.view_sketch_key(key[0], key[1].split('#', 1)[1])
+
+
+def _load_sketch(item, precision):
+    stored = item.get('viewers_hll') if item else None
+    if isinstance(stored, Binary):
+        stored = stored.value
+    sketch = HyperLogLog.from_bytes(stored) if stored else HyperLogLog(precision)
+    if sketch.precision != precision:
+        sketch = HyperLogLog(precision) # HLL_PRECISION changed: start over
+    return sketch
+
+
+def _apply(key, views, viewers, stored):
+    """Add a window to the video at `key`. `stored` is its sketch item as last read (None: there is none yet)."""
+    table = db_utils.get_table()
+    client = table.meta.client
+    precision = settings.VIEW_COUNTS['HLL_PRECISION']
+    window = HyperLogLog(precision)
+    for viewer in viewers:
+        window.add(viewer)
+    video_key = {'PK': key[0], 'SK': key[1]}
+
+    for _ in range(FLUSH_RETRIES):
+        origin = stored
+        if origin is None:
+            # Sketches used to be kept on the video itself: start from that one
+            origin = table.get_item(Key=video_key, ProjectionExpression='PK, viewers_hll', ConsistentRead=True).get('Item')
+            if origin is None:
+                return 0 # Video deleted since: nothing to count on
+        sketch = _load_sketch(origin, precision)
+
+        update = {
+            'Key': video_key,
+            'UpdateExpression': "ADD #views :views",
+            'ConditionExpression': "attribute_exists(PK)", # No counter-only row for a deleted video
+            'ExpressionAttributeNames': {'#views': 'views'},
+            'ExpressionAttributeValues': {':views': views},
+        }
+        if not sketch.merge(window):
+            try:
+                table.update_item(**update)
+                return 1
+            except client.exceptions.ConditionalCheckFailedException:
+                return 0
+
+        version = int(stored.get('hll_version', 0)) if stored else 0
+        put = {
+            'TableName': settings.DYNAMO_TABLE,
+            'Item': dict(_sketch_key(key), viewers_hll=Binary(sketch.to_bytes()), hll_version=version + 1),
+        }
+        if stored is None:
+            put['ConditionExpression'] = "attribute_not_exists(PK)"
+        else:
+            put['ConditionExpression'] = "hll_version = :version"
+            put['ExpressionAttributeValues'] = {':version': version}
+        update['UpdateExpression'] = "SET unique_viewers = :unique REMOVE viewers_hll, hll_version " + update['UpdateExpression']
+        update['ExpressionAttributeValues'][':unique'] = len(sketch)
+        try:
+            client.transact_write_items(TransactItems=[
+                {'Put': put}, {'Update': dict(update, TableName=settings.DYNAMO_TABLE)},
+            ])
+            return 1
+        except client.exceptions.TransactionCanceledException as e:
+            codes = [reason.get('Code') for reason in e.response.get('CancellationReasons', [])]
+            if codes[1:2] == ['ConditionalCheckFailed']:
+                return 0 # Video deleted since
+        # Another process merged its window first: re-read and merge again
+        stored = table.get_item(Key=_sketch_key(key), ConsistentRead=True).get('Item')
+    raise RuntimeError(f"View counts for {key[1]} kept conflicting")
+
+
+@atexit.register
+def _flush_at_exit():
+    try:
+        flush()
+    except Exception:
+        pass
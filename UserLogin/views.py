@@ -5,15 +5,28 @@ from django.http import JsonResponse, Http404
 from django.views.decorators.csrf import csrf_exempt
 from django.conf import settings
 from django.contrib import messages
-from .db_utils import create_user,verify_user
+from . import async_db_utils as adb
+from .passwords import Busy
 
-def signup_view(request):
+# Hashing runs on a process pool (passwords.py): these views only wait for it.
+# When too many hashes are already queued they answer 503 rather than queue more.
+
+def _busy(request, template):
+    messages.error(request, "Too many sign-ins right now. Please try again in a moment.")
+    response = render(request, template, status=503)
+    response['Retry-After'] = '1'
+    return response
+
+async def signup_view(request):
     if request.method == 'POST':
         email = request.POST['email']
         password = request.POST['password']
         channel_name = request.POST['channel_name']
         
-        success, message = create_user(email, password, channel_name)
+        try:
+            success, message = await adb.create_user(email, password, channel_name)
+        except Busy:
+            return _busy(request, 'signup.html')
         
         if success:
             messages.success(request, "Account created! Please login.")
@@ -23,12 +36,15 @@ def signup_view(request):
             
     return render(request, 'signup.html')
 
-def login_view(request):
+async def login_view(request):
     if request.method == 'POST':
         email = request.POST['email']
         password = request.POST['password']
         
-        user = verify_user(email, password)
+        try:
+            user = await adb.verify_user(email, password)
+        except Busy:
+            return _busy(request, 'login.html')
         
         if user:
             # CREATE SESSION (This logs them in)
@@ -0,0 +1,270 @@
+"""
+Boot-time warm-up and the readiness probe.
+
+A fresh worker's first requests pay for everything that is done once per
+process: importing the views (and boto3 with them, most of the import time),
+compiling templates, building the boto3 clients (credentials, endpoint and
+service models), the TLS handshakes to DynamoDB and S3, the per-thread Table
+resources of the async views, the password hashing processes. Nothing of that
+is in the way of accepting connections, so none of it happens on the boot path:
+DashboardConfig.ready() calls start(), which does it all on a background thread
+(the steps in parallel) while the server comes up.
+
+ReadinessMiddleware answers settings.WARMUP['READY_PATH'] before anything else
+runs, so the probe needs neither the URLconf nor the views: 503 while steps are
+pending or failed, 200 once every step has passed, a JSON body with each step's
+state and time either way. Point the load balancer's readiness check there and
+a worker only gets traffic once it's warm. A failed step (AWS unreachable,
+...) is retried every RETRY_SECONDS; one that passes stays passed.
+
+Processes that never start the warm-up (tests, other manage.py commands,
+WARMUP['ENABLED'] off) report ready straight away.
+"""
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import HttpResponse
+
+logger = logging.getLogger('cloudstream.warmup')
+
+_lock = threading.Lock()
+_server = False
+_thread = None
+_started_at = None
+_steps = {} # name -> {'status': 'pending' | 'ok' | 'failed', 'seconds': ..., 'error': ...}
+
+# Key of the GetItem that opens DynamoDB connections; never written
+PROBE_KEY = {'PK': 'WARMUP', 'SK': 'PROBE'}
+
+
+# --- The steps ---
+
+def warm_views():
+    """Import the URLconf (the views, db_utils, boto3) and compile the templates."""
+    from django.template.loader import get_template
+    from django.urls import get_resolver
+    get_resolver().url_patterns
+    for name in settings.WARMUP['TEMPLATES']:
+        get_template(name)
+
+
+def warm_dynamodb():
+    """
+    Build the shared client and open CONNECTIONS connections on it, then do the
+    same for the async views' threads: each builds its own Table (aws_clients
+    keeps resources per thread) and opens its connection.
+    """
+    from . import async_db_utils, aws_clients # aws_clients imports boto3
+
+    client = aws_clients.get_client('dynamodb')
+    key = {'PK': {'S': PROBE_KEY['PK']}, 'SK': {'S': PROBE_KEY['SK']}}
+    _concurrently(settings.WARMUP['CONNECTIONS'], lambda: client.get_item(TableName=settings.DYNAMO_TABLE, Key=key))
+    threads = min(settings.WARMUP['CONNECTIONS'], settings.ASYNC_DB_THREADS)
+    _on_each_thread(async_db_utils._executor, threads, lambda: aws_clients.get_table().get_item(Key=PROBE_KEY))
+
+
+def warm_s3():
+    """Build the S3 client and open a connection (presigning itself needs none, uploads and the pipeline do)."""
+    from botocore.exceptions import ClientError
+
+    from . import aws_clients
+
+    client = aws_clients.get_client('s3')
+    try:
+        client.head_object(Bucket=settings.AWS_PROCESSED_BUCKET, Key='warmup-probe')
+    except ClientError:
+        pass # 404 (or 403 without ListBucket): the connection is open either way
+
+
+def warm_passwords():
+    from . import passwords
+    passwords.warm_up()
+
+
+def warm_search():
+    from . import search_index
+    search_index.get_index()
+
+
+STEPS = {
+    'views': warm_views,
+    'dynamodb': warm_dynamodb,
+    's3': warm_s3,
+    'passwords': warm_passwords,
+    'search': warm_search,
+}
+
+
+def _concurrently(n, fn):
+    with ThreadPoolExecutor(max_workers=n, thread_name_prefix='warmup') as pool:
+        for future in [pool.submit(fn) for _ in range(n)]:
+            future.result()
+
+
+def _on_each_thread(executor, n, fn):
+    # Tasks wait for each other at the barrier, so the executor has to start
+    # n distinct threads to run them
+    barrier = threading.Barrier(n)
+
+    def task():
+        fn()
+        barrier.wait(timeout=settings.AWS_READ_TIMEOUT)
+
+    for future in [executor.submit(task) for _ in range(n)]:
+        future.result()
+
+
+# --- Running them ---
+
+def enabled_steps():
+    options = settings.WARMUP
+    skip = set()
+    if not options['PASSWORD_POOL'] or settings.PASSWORD_HASHING['WORKERS'] == 0:
+        skip.add('passwords')
+    if not options['SEARCH_INDEX']:
+        skip.add('search')
+    return [name for name in STEPS if name not in skip]
+
+
+def _run_step(name):
+    started = time.perf_counter()
+    try:
+        STEPS[name]()
+    except Exception as e:
+        logger.warning("Warm-up step %s failed: %s", name, e)
+        state = {'status': 'failed', 'error': f"{type(e).__name__}: {e}"}
+    else:
+        state = {'status': 'ok'}
+    state['seconds'] = round(time.perf_counter() - started, 4)
+    _steps[name] = state
+    return state['status'] == 'ok'
+
+
+def _register(steps):
+    global _started_at
+    pending = list(steps or enabled_steps())
+    _started_at = _started_at or time.time()
+    for name in pending:
+        _steps[name] = {'status': 'pending'}
+    return pending
+
+
+def _run(pending):
+    while True:
+        with ThreadPoolExecutor(max_workers=len(pending), thread_name_prefix='warmup') as pool:
+            results = dict(zip(pending, pool.map(_run_step, pending)))
+        pending = [name for name, ok in results.items() if not ok]
+        if not pending:
+            logger.info("Warm-up done in %.2fs", time.time() - _started_at)
+            return
+        time.sleep(settings.WARMUP['RETRY_SECONDS'])
+        if not threading.main_thread().is_alive():
+            return # The process is exiting
+
+
+def run(steps=None):
+    """
+    Run the steps (all enabled ones by default) in parallel, retrying failed
+    ones every RETRY_SECONDS until all have passed. Blocks; start() runs it
+    on a background thread.
+    """
+    with _lock:
+        pending = _register(steps)
+    _run(pending)
+
+
+def start(steps=None):
+    """Warm up on a background thread (once per process). Returns the thread."""
+    global _thread
+    with _lock:
+        if _thread is None:
+            # Registered before the thread starts, so the probe never sees an empty (ready) list
+            _thread = threading.Thread(target=_run, args=(_register(steps),), name='warmup', daemon=True)
+            _thread.start()
+    return _thread
+
+
+def mark_server():
+    """Called by Cloudstream/asgi.py and wsgi.py before Django is set up."""
+    global _server
+    _server = True
+
+
+def serving():
+    """
+    Whether this process is going to serve requests: one started through
+    Cloudstream/asgi.py or wsgi.py (see mark_server), or the child process of
+    `manage.py runserver` (not the autoreloader watching it). Other manage.py
+    commands and scripts, the tests and the password hashing processes aren't.
+    """
+    if multiprocessing.parent_process() is not None:
+        return False
+    if _server:
+        return True
+    if os.path.basename(sys.argv[0]) != 'manage.py' or sys.argv[1:2] != ['runserver']:
+        return False
+    return '--noreload' in sys.argv or os.environ.get('RUN_MAIN') == 'true'
+
+
+def is_ready():
+    return all(step['status'] == 'ok' for step in list(_steps.values()))
+
+
+def status():
+    steps = dict(_steps)
+    return {
+        'ready': is_ready(),
+        'started_at': _started_at,
+        'uptime': round(time.time() - _started_at, 3) if _started_at else None,
+        'steps': steps,
+    }
+
+
+def reset():
+    """Forget every step (tests)."""
+    global _thread, _started_at
+    with _lock:
+        _thread = _started_at = None
+        _steps.clear()
+
+
+# --- The probe ---
+
+class ReadinessMiddleware:
+    """First in MIDDLEWARE: the probe is answered before sessions, ALLOWED_HOSTS or the URLconf."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.path = settings.WARMUP['READY_PATH']
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self._acall(request)
+        if request.path == self.path:
+            return readiness_response()
+        return self.get_response(request)
+
+    async def _acall(self, request):
+        if request.path == self.path:
+            return readiness_response()
+        return await self.get_response(request)
+
+
+def readiness_response():
+    state = status()
+    response = HttpResponse(json.dumps(state), content_type='application/json', status=200 if state['ready'] else 503)
+    response.headers['Cache-Control'] = 'no-store'
+    return response
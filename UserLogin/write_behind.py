@@ -0,0 +1,200 @@
+"""
+Write-behind queue for engagement writes (likes/dislikes, subscriptions).
+
+With settings.WRITE_BEHIND['ENABLED'], update_reaction and toggle_subscription
+don't touch DynamoDB: they append the new state of the relationship item
+(REACTION#/SUB#) to a local SQLite queue and answer with optimistic counts.
+`manage.py flush_engagement` drains the queue in the background:
+
+    queue     (PK, SK) -> item to put, or NULL to delete. One row per
+              relationship, so repeated clicks coalesce and the last one wins.
+    inflight  the batch being flushed, claimed from the queue in one transaction
+    deltas    counter changes per target item, merged across the batch
+
+A flush reads the batch's current items from DynamoDB (one BatchGetItem per
+100), turns old state -> new state into counter deltas, writes the items with
+BatchWriteItem, runs the Subscriptions feed hooks for the SUB# items among them
+and then applies one counter update per target (shard-aware, see
+db_utils.add_to_counters; a target deleted in the meantime is skipped). Each
+step is recorded in SQLite before the next one runs, so a flusher killed
+midway picks up where it left off. The one exception is a counter update that
+reached DynamoDB right before the crash: it is applied again.
+
+The queue is local to a box: run one flusher per queue file, and keep a user's
+requests on one box (sticky sessions) so their clicks are queued in order.
+"""
+import json
+import sqlite3
+import threading
+import time
+
+from django.conf import settings
+
+from .batch_loader import ItemLoader
+
+_local = threading.local()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS queue (
+    pk TEXT NOT NULL, sk TEXT NOT NULL, kind TEXT NOT NULL, item TEXT,
+    target_pk TEXT NOT NULL, target_sk TEXT NOT NULL, queued_at REAL NOT NULL,
+    PRIMARY KEY (pk, sk)
+);
+CREATE TABLE IF NOT EXISTS inflight (
+    pk TEXT NOT NULL, sk TEXT NOT NULL, kind TEXT NOT NULL, item TEXT,
+    target_pk TEXT NOT NULL, target_sk TEXT NOT NULL, counted INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (pk, sk)
+);
+CREATE TABLE IF NOT EXISTS deltas (
+    target_pk TEXT NOT NULL, target_sk TEXT NOT NULL, name TEXT NOT NULL, delta INTEGER NOT NULL,
+    PRIMARY KEY (target_pk, target_sk, name)
+);
+"""
+
+
+def _effect(kind, item):
+    # What a relationship item adds to its target's counters while it exists
+    if item is None:
+        return {}
+    if kind == 'reaction':
+        return {'LIKE': {'likes': 1}, 'DISLIKE': {'dislikes': 1}}.get(item.get('type'), {})
+    return {'subscribers': 1}
+
+
+def _connection():
+    # One connection per thread (views run on a thread pool); sqlite3 objects can't be shared
+    path = str(settings.WRITE_BEHIND['PATH'])
+    conn = getattr(_local, 'conn', None)
+    if conn is None or getattr(_local, 'path', None) != path:
+        conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL") # Request threads append while the flusher reads
+        conn.execute("PRAGMA synchronous=FULL") # A queued click survives a power cut
+        conn.executescript(SCHEMA)
+        _local.conn, _local.path = conn, path
+    return conn
+
+
+def enqueue(kind, key, item, target):
+    """
+    Queue the new state of relationship item `key` ({'PK', 'SK'}): `item` to
+    put, or None to delete it. `target` is the key of the item whose counters
+    it feeds; kind is 'reaction' or 'sub'.
+    """
+    _connection().execute(
+        "INSERT INTO queue (pk, sk, kind, item, target_pk, target_sk, queued_at) VALUES (?, ?, ?, ?, ?, ?, ?) "
+        "ON CONFLICT (pk, sk) DO UPDATE SET item = excluded.item, queued_at = excluded.queued_at",
+        (key['PK'], key['SK'], kind, None if item is None else json.dumps(item),
+         target['PK'], target['SK'], time.time())
+    )
+
+
+def pending(key):
+    """(True, item_or_None) if a state for `key` is still waiting to be flushed, else (False, None)."""
+    conn = _connection()
+    for table in ('queue', 'inflight'): # The queue holds the newer state
+        row = conn.execute(f"SELECT item FROM {table} WHERE pk = ? AND sk = ?", (key['PK'], key['SK'])).fetchone()
+        if row is not None:
+            return True, None if row[0] is None else json.loads(row[0])
+    return False, None
+
+
+def backlog():
+    """Events waiting to be flushed."""
+    conn = _connection()
+    return sum(conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] for table in ('queue', 'inflight'))
+
+
+def _claim(conn, batch_size):
+    # queue -> inflight, unless a crashed flush left a batch to finish first
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if conn.execute("SELECT COUNT(*) FROM inflight").fetchone()[0] == 0:
+            conn.execute(
+                "INSERT INTO inflight (pk, sk, kind, item, target_pk, target_sk) "
+                "SELECT pk, sk, kind, item, target_pk, target_sk FROM queue ORDER BY queued_at LIMIT ?",
+                (batch_size,)
+            )
+            conn.execute("DELETE FROM queue WHERE (pk, sk) IN (SELECT pk, sk FROM inflight)")
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def _count(conn, rows):
+    # Counter deltas for the rows not counted yet: new state minus what DynamoDB has now
+    rows = [row for row in rows if not row['counted']]
+    if not rows:
+        return
+    loader = ItemLoader(consistent_read=True)
+    current = [loader.load({'PK': row['pk'], 'SK': row['sk']}) for row in rows]
+    deltas = {}
+    for row, old in zip(rows, current):
+        target = (row['target_pk'], row['target_sk'])
+        for name, value in _effect(row['kind'], old.get()).items():
+            deltas[target + (name,)] = deltas.get(target + (name,), 0) - value
+        for name, value in _effect(row['kind'], row['item']).items():
+            deltas[target + (name,)] = deltas.get(target + (name,), 0) + value
+
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.executemany(
+            "INSERT INTO deltas (target_pk, target_sk, name, delta) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (target_pk, target_sk, name) DO UPDATE SET delta = delta + excluded.delta",
+            [key + (delta,) for key, delta in deltas.items() if delta]
+        )
+        conn.executemany("UPDATE inflight SET counted = 1 WHERE pk = ? AND sk = ?", [(row['pk'], row['sk']) for row in rows])
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def _apply_deltas(conn):
+    from . import db_utils # db_utils imports this module
+
+    targets = {}
+    for target_pk, target_sk, name, delta in conn.execute("SELECT target_pk, target_sk, name, delta FROM deltas"):
+        targets.setdefault((target_pk, target_sk), {})[name] = delta
+    for (target_pk, target_sk), changes in targets.items():
+        if any(changes.values()):
+            try:
+                db_utils.add_to_counters({'PK': target_pk, 'SK': target_sk}, changes)
+            except LookupError:
+                pass # Deleted since the click: its counters went with it
+        conn.execute("DELETE FROM deltas WHERE target_pk = ? AND target_sk = ?", (target_pk, target_sk))
+    return len(targets)
+
+
+def flush(batch_size=None):
+    """
+    Write one batch of queued events to DynamoDB. Returns (events written,
+    counter items updated). Run from one flusher per queue file at a time.
+    """
+    from . import db_utils, subscription_feed # db_utils imports this module
+
+    conn = _connection()
+    _claim(conn, batch_size or settings.WRITE_BEHIND['BATCH_SIZE'])
+
+    conn.row_factory = sqlite3.Row
+    try:
+        rows = [dict(row) for row in conn.execute("SELECT * FROM inflight")]
+    finally:
+        conn.row_factory = None
+    for row in rows:
+        row['item'] = None if row['item'] is None else json.loads(row['item'])
+
+    _count(conn, rows)
+    # BatchWriteItem, 25 items per call, unprocessed items resent by the batch writer
+    with db_utils.get_table().batch_writer(overwrite_by_pkeys=['PK', 'SK']) as batch:
+        for row in rows:
+            if row['item'] is None:
+                batch.delete_item(Key={'PK': row['pk'], 'SK': row['sk']})
+            else:
+                batch.put_item(Item=row['item'])
+    # Now that the SUB# items are what they say (idempotent: a resumed batch runs them again)
+    for row in rows:
+        if row['kind'] == 'sub':
+            subscription_feed.subscription_changed(row['pk'][len('USER#'):], row['sk'][len('SUB#'):], row['item'] is not None)
+    conn.execute("DELETE FROM inflight")
+    return len(rows), _apply_deltas(conn)